@@ -142,6 +142,38 @@ class Interpolator(object):
         return y
 
 
+def _interp_rows(x, xp, fp):
+    """Row-wise version of `numpy.interp`.  Evaluate the piecewise-linear
+    function defined by each row of ``xp`` and ``fp`` at the
+    corresponding element of ``x``.
+
+    Parameters
+    ----------
+    x : `~numpy.ndarray`
+        Array of N evaluation points or a scalar.
+
+    xp : `~numpy.ndarray`
+        N x M array of increasing abscissa values.
+
+    fp : `~numpy.ndarray`
+        N x M array of function values.
+    """
+    x = np.broadcast_to(np.asarray(x, dtype=float), xp.shape[:1])
+    rows = np.arange(xp.shape[0])
+    idx = np.sum(xp <= x[:, None], axis=1) - 1
+    idx = np.clip(idx, 0, xp.shape[1] - 2)
+    x0 = xp[rows, idx]
+    x1 = xp[rows, idx + 1]
+    f0 = fp[rows, idx]
+    f1 = fp[rows, idx + 1]
+    dx = x1 - x0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        y = np.where(dx > 0, f0 + (x - x0) * (f1 - f0) / dx, f0)
+    y = np.where(x < xp[:, 0], fp[:, 0], y)
+    y = np.where(x >= xp[:, -1], fp[:, -1], y)
+    return y
+
+
 class LnLFn(object):
     """Helper class for interpolating a 1-D log-likelihood function from a
     set of tabulated values.
@@ -618,17 +650,27 @@ class CastroData_Base(object):
 
         self._norm_vals = norm_vals
         self._nll_vals = nll_vals
-        self._loglikes = []
-        self._nll_null = 0.0
+        self._loglikes = [None] * norm_vals.shape[0]
         self._norm_type = norm_type
         self._nx = self._norm_vals.shape[0]
         self._ny = self._norm_vals.shape[1]
-
-        for i, (normv, nllv) in enumerate(zip(self._norm_vals,
-                                              self._nll_vals)):
-            nllfunc = self.build_lnl_fn(normv, nllv)
-            self._nll_null += self._nll_vals[i][0]
-            self._loglikes.append(nllfunc)
+        self._nll_null = np.sum(self._nll_vals[:, 0])
+        self._mles = None
+
+        # Contiguous arrays with the finite points of the likelihood
+        # profile of each bin.  Profiles with fewer finite points are
+        # padded with inf such that the padding is never selected as
+        # an interpolation node.
+        msk = np.isfinite(self._nll_vals)
+        self._nvalid = np.sum(msk, axis=1)
+        idx = np.argsort(~msk, axis=1, kind='mergesort')
+        rows = np.arange(self._nx)[:, None]
+        pad = np.arange(self._ny)[None, :] >= self._nvalid[:, None]
+        self._interp_x = np.where(pad, np.inf, self._norm_vals[rows, idx])
+        self._interp_y = np.where(pad, np.inf, self._nll_vals[rows, idx])
+        self._interp_xmin = self._interp_x[:, 0]
+        self._interp_xmax = self._interp_x[np.arange(self._nx),
+                                           self._nvalid - 1]
 
     @property
     def nx(self):
@@ -653,8 +695,51 @@ class CastroData_Base(object):
     def __getitem__(self, i):
         """ return the LnLFn object for the ith energy bin
         """
+        if self._loglikes[i] is None:
+            self._loglikes[i] = self.build_lnl_fn(self._norm_vals[i],
+                                                  self._nll_vals[i])
         return self._loglikes[i]
 
+    def _interp(self, x, der=0):
+        """Evaluate the piecewise-linear interpolation of the
+        likelihood profiles of all bins.  Values outside the range of
+        each profile are linearly extrapolated using the slope at the
+        endpoint.
+
+        Parameters
+        ----------
+        x : `~numpy.ndarray`
+           Array of evaluation points.  The first dimension runs over
+           the bins.
+
+        der : int
+           Order of the derivative.
+
+        Returns
+        -------
+        vals : `~numpy.ndarray`
+           Array of interpolated values with the same shape as ``x``.
+        """
+        x = np.asarray(x, dtype=float)
+        shape = x.shape
+        x = x.reshape((self._nx, -1))
+        idx = np.sum(self._interp_x[:, None, :] <= x[:, :, None], axis=2)
+        idx = np.clip(idx - 1, 0, self._nvalid[:, None] - 2)
+        rows = np.arange(self._nx)[:, None]
+        x0 = self._interp_x[rows, idx]
+        x1 = self._interp_x[rows, idx + 1]
+        y0 = self._interp_y[rows, idx]
+        y1 = self._interp_y[rows, idx + 1]
+        slope = (y1 - y0) / (x1 - x0)
+
+        if der == 0:
+            vals = y0 + (x - x0) * slope
+        elif der == 1:
+            vals = slope
+        else:
+            vals = np.zeros(x.shape)
+        return vals.reshape(shape)
+
     def __call__(self, x):
         """Return the negative log-likelihood for an array of values,
         summed over the energy bins
@@ -669,17 +754,13 @@ class CastroData_Base(object):
         nll_val : `~numpy.ndarray`
            Array of negative log-likelihood values.
         """
-        if len(x.shape) == 1:
-            nll_val = np.zeros((1))
-        else:
-            nll_val = np.zeros((x.shape[1:]))
         # crude hack to force the fitter away from unphysical values
         if (x < 0).any():
             return 1000.
 
-        for i, xv in enumerate(x):
-            nll_val += self._loglikes[i].interp(xv)
-
+        nll_val = np.sum(self._interp(x), axis=0)
+        if len(x.shape) == 1:
+            nll_val = np.array(nll_val, ndmin=1)
         return nll_val
 
     def build_lnl_fn(self, normv, nllv):
@@ -690,16 +771,13 @@ class CastroData_Base(object):
     def norm_derivative(self, spec, norm):
         """
         """
+        spec = np.asarray(spec)
+        sv = spec.reshape(spec.shape + (1,) * np.ndim(norm))
+        der_val = np.sum(self._interp(norm * sv, der=1) * sv, axis=0)
         if isinstance(norm, float):
-            der_val = 0.
+            return float(der_val)
         elif len(norm.shape) == 1:
-            der_val = np.zeros((1))
-        else:
-            der_val = np.zeros((norm.shape[1:]))
-
-        for i, sv in enumerate(spec):
-            der_val += self._loglikes[
-                i].interp.derivative(norm * sv, der=1) * sv
+            return np.array(der_val, ndmin=1)
         return der_val
 
     def derivative(self, x, der=1):
@@ -719,22 +797,20 @@ class CastroData_Base(object):
         der_val : `~numpy.ndarray`
            Array of negative log-likelihood values.
         """
+        der_val = np.sum(self._interp(x, der=der), axis=0)
         if len(x.shape) == 1:
-            der_val = np.zeros((1))
-        else:
-            der_val = np.zeros((x.shape[1:]))
-
-        for i, xv in enumerate(x):
-            der_val += self._loglikes[i].interp.derivative(xv, der=der)
+            der_val = np.array(der_val, ndmin=1)
         return der_val
 
     def mles(self):
         """ return the maximum likelihood estimates for each of the energy bins
         """
-        mle_vals = np.ndarray((self._nx))
-        for i in range(self._nx):
-            mle_vals[i] = self._loglikes[i].mle()
-        return mle_vals
+        # The minimum of a piecewise-linear function is located at
+        # one of the nodes
+        if self._mles is None:
+            idx = np.argmin(self._interp_y, axis=1)
+            self._mles = self._interp_x[np.arange(self._nx), idx]
+        return self._mles.copy()
 
     def fn_mles(self):
         """returns the summed likelihood at the maximum likelihood estimate
@@ -748,11 +824,8 @@ class CastroData_Base(object):
     def ts_vals(self):
         """ returns test statistic values for each energy bin
         """
-        ts_vals = np.ndarray((self._nx))
-        for i in range(self._nx):
-            ts_vals[i] = self._loglikes[i].TS()
-
-        return ts_vals
+        return 2. * (self._interp(np.zeros(self._nx)) -
+                     self._interp(self.mles()))
 
     def chi2_vals(self, x):
         """Compute the difference in the log-likelihood between the
@@ -771,16 +844,34 @@ class CastroData_Base(object):
         chi2_vals : `~numpy.ndarray`
             An array of chi2 values for each energy bin.        
         """
+        nll0 = self._interp(self.mles())
+        nll1 = self._interp(np.asarray(x, dtype=float).reshape(self._nx))
+        return 2.0 * np.abs(nll0 - nll1)
+
+    def _get_delta_loglike(self, dlnl, upper=True):
+        """Find the point in each bin at which the log-likelihood
+        changes by a given value with respect to its value at the
+        MLE.  This is a vectorized version of
+        `~fermipy.castro.LnLFn.getDeltaLogLike`."""
 
-        chi2_vals = np.ndarray((self._nx))
-        for i in range(self._nx):
+        mle = self.mles()
+        lnl_max = self._interp(mle)
+        t = np.linspace(0.0, 1.0, 100)[None, :]
 
-            mle = self._loglikes[i].mle()
-            nll0 = self._loglikes[i].interp(mle)
-            nll1 = self._loglikes[i].interp(x[i])
-            chi2_vals[i] = 2.0 * np.abs(nll0 - nll1)
+        if upper:
+            # A little bit of paranoia to avoid zeros
+            mle_val = np.where(mle <= 0., self._interp_xmin, mle)
+            mle_val = np.where(mle_val <= 0., self._interp_x[:, 1], mle_val)
+            log_mle = np.log10(mle_val)[:, None]
+            log_xmax = np.log10(self._interp_xmax)[:, None]
+            x = 10**(log_mle + t * (log_xmax - log_mle))
+            vals = self._interp(x) - lnl_max[:, None]
+        else:
+            xmin = self._interp_xmin[:, None]
+            x = (xmin + t * (mle[:, None] - xmin))[:, ::-1]
+            vals = self._interp(x) - lnl_max[:, None]
 
-        return chi2_vals
+        return _interp_rows(dlnl, vals, x)
 
     def getLimits(self, alpha, upper=True):
         """ Evaluate the limits corresponding to a C.L. of (1-alpha)%.
@@ -794,12 +885,8 @@ class CastroData_Base(object):
 
         returns an array of values, one for each energy bin
         """
-        limit_vals = np.ndarray((self._nx))
-
-        for i in range(self._nx):
-            limit_vals[i] = self._loglikes[i].getLimit(alpha, upper)
-
-        return limit_vals
+        dlnl = onesided_cl_to_dlnl(1.0 - alpha)
+        return self._get_delta_loglike(dlnl, upper=upper)
 
     def getIntervals(self, alpha):
         """ Evaluate the two-sided intervals corresponding to a C.L. of
@@ -818,14 +905,9 @@ class CastroData_Base(object):
         limit_vals_lo : `~numpy.ndarray`
             An array of upper limit values.
         """
-        limit_vals_lo = np.ndarray((self._nx))
-        limit_vals_hi = np.ndarray((self._nx))
-
-        for i in range(self._nx):
-            lo_lim, hi_lim = self._loglikes[i].getInterval(alpha)
-            limit_vals_lo[i] = lo_lim
-            limit_vals_hi[i] = hi_lim
-
+        dlnl = twosided_cl_to_dlnl(1.0 - alpha)
+        limit_vals_lo = self._get_delta_loglike(dlnl, upper=False)
+        limit_vals_hi = self._get_delta_loglike(dlnl, upper=True)
         return limit_vals_lo, limit_vals_hi
 
     def fitNormalization(self, specVals, xlims):
@@ -972,19 +1054,31 @@ class CastroData_Base(object):
         return tab
 
     @staticmethod
-    def stack_nll(shape, components, ylims, weights=None):
+    def stack_nll(shape, components, ylims, weights=None, chunk_size=100):
         """Combine the log-likelihoods from a number of components.
 
+        The likelihood grids of the components are evaluated on a
+        common normalization grid in chunks of ``chunk_size``
+        components with a single vectorized interpolation per chunk.
+
         Parameters
         ----------
         shape    :  tuple
            The shape of the return array
 
-        components : `~fermipy.castro.CastroData_Base`
-           The components to be stacked
+        components : list or `~numpy.ndarray` or str
+           The components to be stacked.  This can be a list of
+           `~fermipy.castro.CastroData_Base` objects, an array of
+           likelihood grids with shape (NCOMP, 2, N, M) as created by
+           `~fermipy.castro.write_castro_stack`, or the path to a
+           file created by that function.  Files are memory-mapped
+           and read one chunk at a time.
 
         weights : array-like
 
+        chunk_size : int
+           Number of components evaluated in a single pass.
+
         Returns
         -------
         norm_vals : 'numpy.ndarray'
@@ -996,29 +1090,73 @@ class CastroData_Base(object):
         n_bins = shape[0]
         n_vals = shape[1]
 
+        if isinstance(components, str):
+            components = load_castro_stack(components)
+
         if weights is None:
             weights = np.ones((len(components)))
+        weights = np.asarray(weights, dtype=float)
 
         norm_vals = np.zeros(shape)
+        log_min = np.log10(ylims[0])
+        log_max = np.log10(ylims[1])
+        norm_vals[:, 1:] = np.logspace(log_min, log_max, n_vals - 1)
         nll_vals = np.zeros(shape)
-        for i in range(n_bins):
-            log_min = np.log10(ylims[0])
-            log_max = np.log10(ylims[1])
-            norm_vals[i, 1:] = np.logspace(log_min, log_max, n_vals - 1)
-            check = 0
-            for c, w in zip(components, weights):
-                check += w * c[i].interp(norm_vals[i, -1])
-                nll_vals[i] += w * c[i].interp(norm_vals[i])
-                pass
-            # reset the zeros
-            nll_obj = LnLFn(norm_vals[i], nll_vals[i])
-            nll_min = nll_obj.fn_mle()
-            nll_vals[i] -= nll_min
-            pass
 
+        for i in range(0, len(components), chunk_size):
+            grids = _get_castro_grids(components[i:i + chunk_size])
+            ncomp = grids.shape[0]
+            cd = CastroData_Base(grids[:, 0].reshape(ncomp * n_bins, -1),
+                                 grids[:, 1].reshape(ncomp * n_bins, -1),
+                                 'norm')
+            vals = cd._interp(np.tile(norm_vals, (ncomp, 1)))
+            nll_vals += np.tensordot(weights[i:i + ncomp],
+                                     vals.reshape(ncomp, n_bins, n_vals),
+                                     axes=1)
+
+        # reset the zeros.  The minimum of the piecewise-linear
+        # interpolation is located at one of the nodes.
+        nll_vals -= np.min(nll_vals, axis=1)[:, np.newaxis]
         return norm_vals, nll_vals
 
 
+def _get_castro_grids(components):
+    """Return the likelihood grids of a sequence of castro objects as
+    a (NCOMP, 2, N, M) array.  Grids with fewer scan points are padded
+    with NaN."""
+    if isinstance(components, np.ndarray):
+        return np.asarray(components, dtype=float)
+
+    ny = max([c._norm_vals.shape[1] for c in components])
+    grids = np.full((len(components), 2, components[0].nx, ny), np.nan)
+    for i, c in enumerate(components):
+        grids[i, 0, :, :c.ny] = c._norm_vals
+        grids[i, 1, :, :c.ny] = c._nll_vals
+    return grids
+
+
+def write_castro_stack(filename, components):
+    """Write the likelihood grids of a list of castro objects to a
+    .npy file that can be memory-mapped by
+    `~fermipy.castro.CastroData_Base.stack_nll`.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the output file.
+
+    components : [~fermipy.castro.CastroData_Base]
+        The components to be written.
+    """
+    np.save(filename, _get_castro_grids(components))
+
+
+def load_castro_stack(filename):
+    """Load a file created by `~fermipy.castro.write_castro_stack` as a
+    read-only memory-mapped array."""
+    return np.load(filename, mmap_mode='r')
+
+
 class CastroData(CastroData_Base):
     """ This class wraps the data needed to make a "Castro" plot,
     namely the log-likelihood as a function of normalization for a
@@ -1245,7 +1383,8 @@ class CastroData(CastroData_Base):
         return cls(norm_vals, nll_vals, spec_data, norm_type)
 
     @classmethod
-    def create_from_stack(cls, shape, components, ylims, weights=None):
+    def create_from_stack(cls, shape, components, ylims, weights=None,
+                          refSpec=None, norm_type=None, chunk_size=100):
         """  Combine the log-likelihoods from a number of components.
 
         Parameters
@@ -1254,21 +1393,34 @@ class CastroData(CastroData_Base):
            The shape of the return array
 
         components : [~fermipy.castro.CastroData_Base]
-           The components to be stacked
+           The components to be stacked.  This can also be an array
+           or file of likelihood grids (see
+           `~fermipy.castro.CastroData_Base.stack_nll`) in which case
+           ``refSpec`` and ``norm_type`` must be provided.
 
         weights : array-like
 
+        refSpec : `~fermipy.castro.ReferenceSpec`
+           Reference spectrum.  Defaults to that of the first component.
+
+        norm_type : str
+           Normalization type.  Defaults to that of the first component.
+
         Returns
         -------
         castro : `~fermipy.castro.CastroData`
         """
+        if isinstance(components, str):
+            components = load_castro_stack(components)
         if len(components) == 0:
             return None
+        if refSpec is None:
+            refSpec = components[0].refSpec
+        if norm_type is None:
+            norm_type = components[0].norm_type
         norm_vals, nll_vals = CastroData_Base.stack_nll(
-            shape, components, ylims, weights)
-        return cls(norm_vals, nll_vals,
-                   components[0].refSpec,
-                   components[0].norm_type)
+            shape, components, ylims, weights, chunk_size=chunk_size)
+        return cls(norm_vals, nll_vals, refSpec, norm_type)
 
     def spectrum_loglike(self, specType, params, scale=1E3):
         """ return the log-likelihood for a particular spectrum
@@ -1327,6 +1479,91 @@ class CastroData(CastroData_Base):
 
         return retDict
 
+    def dm_scan(self, dm_table, jfactor, sigmav_lims=(1E-28, 1E-20),
+                nsigmav=161, alpha=0.05):
+        """Scan the likelihood of a DM annihilation signal as a
+        function of cross section for every mass and channel of a
+        `~fermipy.spectrum.DMChannelTable` and compute the MLE, TS
+        and upper limit on the cross section.  All masses and
+        channels are evaluated with array operations.
+
+        Parameters
+        ----------
+        dm_table : `~fermipy.spectrum.DMChannelTable`
+            Table of the integrated DM spectra in the energy bins of
+            this object.  An exception is raised if the energy bins
+            of the table do not match.
+
+        jfactor : float
+            J-factor of the target.
+
+        sigmav_lims : tuple
+            Range of the cross section scan in cm^3 s^-1.
+
+        nsigmav : int
+            Number of points in the cross section scan.
+
+        alpha : float
+            Confidence level of the upper limit is 1-alpha.
+
+        Returns
+        -------
+        tab : `~astropy.table.Table`
+            Table with one row per channel and mass containing the
+            MLE (``sigmav``), TS, upper limit (``sigmav_ul``) and the
+            likelihood profile (``sigmav_scan``, ``dloglike_scan``).
+        """
+        if dm_table.func_type != self.norm_type:
+            raise Exception('Normalization type of DM table (%s) does not '
+                            'match this object (%s)' % (dm_table.func_type,
+                                                        self.norm_type))
+
+        if (dm_table.emin.shape != self.refSpec.emin.shape or
+                not np.allclose(dm_table.emin, self.refSpec.emin, rtol=1E-3) or
+                not np.allclose(dm_table.emax, self.refSpec.emax, rtol=1E-3)):
+            raise Exception('Energy bins of DM table do not match the '
+                            'energy bins of this object')
+
+        sigmav = np.zeros(nsigmav)
+        sigmav[1:] = np.logspace(np.log10(sigmav_lims[0]),
+                                 np.log10(sigmav_lims[1]), nsigmav - 1)
+
+        # Channel x Mass x Energy x Sigmav
+        vals = dm_table(sigmav, jfactor)
+        nchan, nmass = vals.shape[:2]
+        x = np.moveaxis(vals, 2, 0).reshape(self.nx, -1)
+        nll = np.sum(self._interp(x), axis=0).reshape(nchan * nmass, nsigmav)
+
+        scan = CastroData_Base(np.tile(sigmav, (nchan * nmass, 1)),
+                               nll, 'norm')
+        nll_min = np.min(nll, axis=1)
+        mles = scan.mles()
+
+        # Refine the MLE on a finer grid spanning the neighboring
+        # points of the scan
+        dlogv = np.log10(sigmav[2] / sigmav[1])
+        sigmav_fine = (np.where(mles > 0, mles, sigmav[1])[:, np.newaxis] *
+                       10**np.linspace(-dlogv, dlogv, 21)[np.newaxis, :])
+        t = dm_table.table.reshape(nchan * nmass, 1, self.nx)
+        x = np.moveaxis(t * sigmav_fine[:, :, np.newaxis] * jfactor, 2, 0)
+        nll_fine = np.sum(self._interp(x.reshape(self.nx, -1)), axis=0)
+        nll_fine = nll_fine.reshape(sigmav_fine.shape)
+        ifine = np.argmin(nll_fine, axis=1)
+        nll_fine = nll_fine[np.arange(len(ifine)), ifine]
+        m = (mles > 0) & (nll_fine < nll_min)
+        mles[m] = sigmav_fine[m, ifine[m]]
+        nll_min[m] = nll_fine[m]
+
+        tab = Table()
+        tab['channel'] = np.repeat(dm_table.channels, nmass)
+        tab['mass'] = Column(np.tile(dm_table.masses, nchan), unit='GeV')
+        tab['sigmav'] = Column(mles, unit='cm3 / s')
+        tab['ts'] = 2. * (nll[:, 0] - nll_min)
+        tab['sigmav_ul'] = Column(scan.getLimits(alpha), unit='cm3 / s')
+        tab['sigmav_scan'] = Column(scan._norm_vals, unit='cm3 / s')
+        tab['dloglike_scan'] = -(nll - nll_min[:, np.newaxis])
+        return tab
+
     def create_functor(self, specType, initPars=None, scale=1E3):
         """Create a functor object that computes normalizations in a
         sequence of energy bins for a given spectral model.
@@ -1372,6 +1609,300 @@ class CastroData(CastroData_Base):
         return fn
 
 
+# Parameters of each spectral model that are fit in log10 space by
+# `~fermipy.castro.TSCube.fit_spectra_all`
+SPEC_LOG_PARS = {
+    "PowerLaw": [True, False],
+    "LogParabola": [True, False, False],
+    "PLExpCutoff": [True, False, True],
+}
+
+
+def _eval_spectra_nll(cd, fn, tpars, islog):
+    """Evaluate the summed negative log-likelihood of a set of pixels
+    for a stack of spectral parameter vectors.
+
+    Parameters
+    ----------
+    cd : `~fermipy.castro.CastroData_Base`
+        Castro data with one row per pixel and energy bin.
+
+    fn : `~fermipy.spectrum.SEDFunctor`
+        Functor for the spectral model.
+
+    tpars : `~numpy.ndarray`
+        NPAR x NPIX x K array of transformed parameter values.
+
+    islog : `~numpy.ndarray`
+        Boolean array flagging parameters that are in log10 space.
+
+    Returns
+    -------
+    nll : `~numpy.ndarray`
+        NPIX x K array of negative log-likelihood values.
+    """
+    npar, npix, k = tpars.shape
+    ne = cd.nx // npix
+    pars = [10**t if l else t for t, l in zip(tpars, islog)]
+    spec = fn([p.reshape(1, -1) for p in pars])
+    spec = np.reshape(spec, (ne, npix, k)).transpose(1, 0, 2)
+    nll = cd._interp(spec.reshape(npix * ne, k))
+    return np.sum(nll.reshape(npix, ne, k), axis=1)
+
+
+def _fit_spectra_derivs(cd, fn, tpars, islog, step):
+    """Compute the negative log-likelihood and its finite-difference
+    gradient and hessian at a set of transformed parameter vectors.
+    All stencil points are evaluated in a single call."""
+    npar, npix = tpars.shape
+    offsets = [np.zeros(npar)]
+    for i in range(npar):
+        for s in [1., -1.]:
+            d = np.zeros(npar)
+            d[i] = s * step[i]
+            offsets += [d]
+    pairs = []
+    for i in range(npar):
+        for j in range(i + 1, npar):
+            pairs += [(i, j)]
+            for si, sj in [(1., 1.), (1., -1.), (-1., 1.), (-1., -1.)]:
+                d = np.zeros(npar)
+                d[i] = si * step[i]
+                d[j] = sj * step[j]
+                offsets += [d]
+
+    offsets = np.array(offsets).T
+    f = _eval_spectra_nll(cd, fn, tpars[:, :, None] + offsets[:, None, :],
+                          islog)
+    f0 = f[:, 0]
+    grad = np.zeros((npix, npar))
+    hess = np.zeros((npix, npar, npar))
+    for i in range(npar):
+        fp, fm = f[:, 1 + 2 * i], f[:, 2 + 2 * i]
+        grad[:, i] = (fp - fm) / (2. * step[i])
+        hess[:, i, i] = (fp - 2. * f0 + fm) / step[i]**2
+    for k, (i, j) in enumerate(pairs):
+        fpp, fpm, fmp, fmm = f[:, 1 + 2 * npar + 4 * k:5 + 2 * npar + 4 * k].T
+        hess[:, i, j] = (fpp - fpm - fmp + fmm) / (4. * step[i] * step[j])
+        hess[:, j, i] = hess[:, i, j]
+    return f0, grad, hess
+
+
+def _fit_spectra_simplex(cd, fn, norm_vals, nll_vals, norm_type, t, islog,
+                         size=0.05, max_iter=None, xtol=1E-4, ftol=1E-4):
+    """Vectorized Nelder-Mead minimization of the negative
+    log-likelihood of a set of pixels.  This follows the algorithm of
+    `scipy.optimize.fmin` with every pixel advanced simultaneously
+    and is used to refine the solution on the piecewise-linear
+    likelihood surface."""
+    npar, npix = t.shape
+    ne = cd.nx // npix
+    ny = norm_vals.shape[-1]
+
+    if max_iter is None:
+        max_iter = 200 * npar
+
+    sim = np.tile(t.T[:, None, :], (1, npar + 1, 1))
+    for i in range(npar):
+        sim[:, i + 1, i] += size
+    fsim = _eval_spectra_nll(cd, fn, np.transpose(sim, (2, 0, 1)), islog)
+    active = np.ones(npix, dtype=bool)
+    ipix = np.arange(npix)[:, None]
+
+    for it in range(max_iter):
+
+        isort = np.argsort(fsim, axis=1)
+        sim = sim[ipix, isort]
+        fsim = fsim[ipix, isort]
+
+        active &= ~((np.max(np.abs(sim[:, 1:] - sim[:, :1]), axis=(1, 2))
+                     <= xtol) &
+                    (np.max(np.abs(fsim[:, 1:] - fsim[:, :1]), axis=1)
+                     <= ftol))
+        idx = np.where(active)[0]
+        if len(idx) == 0:
+            break
+
+        cdi = cd if len(idx) == npix else CastroData_Base(
+            norm_vals[idx].reshape(len(idx) * ne, ny),
+            nll_vals[idx].reshape(len(idx) * ne, ny), norm_type)
+        s, f = sim[idx], fsim[idx]
+        xbar = np.mean(s[:, :-1], axis=1)
+        xw = s[:, -1]
+        # Reflection, expansion, outside and inside contraction
+        coeff = np.array([1., 2., 0.5, -0.5])
+        xt = xbar[:, None, :] + coeff[None, :, None] * (xbar - xw)[:, None, :]
+        ft = _eval_spectra_nll(cdi, fn, np.transpose(xt, (2, 0, 1)), islog)
+        fr, fe, fc, fcc = ft.T
+
+        inew = np.full(len(idx), -1)
+        m_exp = (fr < f[:, 0]) & (fe < fr)
+        m_ref = ((fr < f[:, 0]) & ~m_exp) | ((fr >= f[:, 0]) &
+                                             (fr < f[:, -2]))
+        m_oc = (fr >= f[:, -2]) & (fr < f[:, -1]) & (fc <= fr)
+        m_ic = (fr >= f[:, -2]) & (fr >= f[:, -1]) & (fcc < f[:, -1])
+        inew[m_ref] = 0
+        inew[m_exp] = 1
+        inew[m_oc] = 2
+        inew[m_ic] = 3
+
+        m = inew >= 0
+        rows = np.arange(len(idx))[m]
+        s[rows, -1] = xt[rows, inew[m]]
+        f[rows, -1] = ft[rows, inew[m]]
+
+        # Shrink the simplex towards the best vertex
+        shrink = np.where(~m)[0]
+        if len(shrink):
+            s[shrink, 1:] = s[shrink, :1] + 0.5 * (s[shrink, 1:] -
+                                                    s[shrink, :1])
+            cds = CastroData_Base(
+                norm_vals[idx[shrink]].reshape(len(shrink) * ne, ny),
+                nll_vals[idx[shrink]].reshape(len(shrink) * ne, ny),
+                norm_type)
+            f[shrink, 1:] = _eval_spectra_nll(
+                cds, fn, np.transpose(s[shrink, 1:], (2, 0, 1)), islog)
+
+        sim[idx], fsim[idx] = s, f
+
+    ibest = np.argmin(fsim, axis=1)
+    return sim[np.arange(npix), ibest].T, ~active
+
+
+def _fit_spectra_lm(norm_vals, nll_vals, spec_type, norm_type, emin, emax,
+                    init_pars, scale=1E3, max_iter=50, tol=1E-4):
+    """Fit a spectral model to the likelihood profiles of a set of
+    pixels with a vectorized Levenberg-Marquardt algorithm.  The
+    gradient and hessian are evaluated with finite differences in a
+    parameter space where the normalization and cutoff parameters are
+    in log10.  At each iteration a ladder of damping values is tried
+    simultaneously and the step with the lowest likelihood is
+    accepted.  The solution is then refined with
+    `~fermipy.castro._fit_spectra_simplex`.
+
+    Parameters
+    ----------
+    norm_vals : `~numpy.ndarray`
+        NPIX x NEBINS x N array of normalization values.
+
+    nll_vals : `~numpy.ndarray`
+        NPIX x NEBINS x N array of negative log-likelihood values.
+
+    spec_type : str
+        Name of the spectral model.
+
+    init_pars : `~numpy.ndarray`
+        Initial parameter values.  The normalization is refined
+        for each pixel with a coarse scan before the fit.
+
+    Returns
+    -------
+    o : dict
+        Dictionary with the best-fit parameters (NPAR x NPIX), their
+        errors, the negative log-likelihood, TS and fit status of
+        each pixel.
+    """
+    npix, ne, ny = norm_vals.shape
+    cd = CastroData_Base(norm_vals.reshape(npix * ne, ny),
+                         nll_vals.reshape(npix * ne, ny), norm_type)
+    fn = SpectralFunction.create_functor(spec_type, norm_type, emin, emax,
+                                         scale=scale)
+    islog = np.array(SPEC_LOG_PARS[spec_type])
+    npar = len(islog)
+    tinit = np.array([np.log10(p) if l else p
+                      for p, l in zip(init_pars, islog)], dtype=float)
+
+    # Coarse scan of the normalization
+    tpars = np.tile(tinit[:, None, None], (1, npix, 41))
+    tpars[0] += np.linspace(-5., 5., 41)[None, :]
+    f = _eval_spectra_nll(cd, fn, tpars, islog)
+    t = tpars[:, np.arange(npix), np.argmin(f, axis=1)]
+
+    ladder = 10**np.arange(-2., 4.)
+    niter = np.zeros(npix, dtype=int)
+
+    # The interpolated likelihood surface is piecewise linear.  The
+    # fit is first run with a coarse finite-difference step which
+    # smooths over the kinks of the surface and then refined with
+    # progressively smaller steps.
+    for h in [0.1, 0.03, 0.01]:
+
+        step = np.full(npar, h)
+        lam = np.full(npix, 1E-3)
+        nsmall = np.zeros(npix, dtype=int)
+        active = np.ones(npix, dtype=bool)
+
+        for i in range(max_iter):
+
+            idx = np.where(active)[0]
+            if len(idx) == 0:
+                break
+
+            cdi = cd if len(idx) == npix else CastroData_Base(
+                norm_vals[idx].reshape(len(idx) * ne, ny),
+                nll_vals[idx].reshape(len(idx) * ne, ny), norm_type)
+            f0, grad, hess = _fit_spectra_derivs(cdi, fn, t[:, idx], islog,
+                                                 step)
+            niter[idx] += 1
+
+            diag = np.abs(np.diagonal(hess, axis1=1, axis2=2)) + 1E-8
+            lams = lam[idx, None] * ladder[None, :]
+            a = (hess[:, None, :, :] +
+                 lams[:, :, None, None] * (diag[:, None, :, None] *
+                                           np.eye(npar)[None, None]))
+            with np.errstate(all='ignore'):
+                try:
+                    dt = -np.linalg.solve(a, grad[:, None, :, None])[..., 0]
+                except np.linalg.LinAlgError:
+                    dt = -grad[:, None, :] / (lams[:, :, None] *
+                                              diag[:, None, :])
+            dt[~np.isfinite(dt)] = 0.0
+            # Limit the step size to avoid jumping across the scan range
+            dt = np.clip(dt, -1., 1.)
+
+            ttrial = t[:, idx, None] + np.transpose(dt, (2, 0, 1))
+            ftrial = _eval_spectra_nll(cdi, fn, ttrial, islog)
+            ibest = np.argmin(ftrial, axis=1)
+            fbest = ftrial[np.arange(len(idx)), ibest]
+
+            improved = fbest < f0
+            ii = idx[improved]
+            t[:, ii] = ttrial[:, np.where(improved)[0], ibest[improved]]
+            lam[ii] = np.maximum(lams[improved, ibest[improved]] * 0.1, 1E-6)
+            lam[idx[~improved]] *= 10**len(ladder)
+
+            # Require several consecutive iterations with a small
+            # improvement since heavily damped steps can stall
+            small = ~improved | (f0 - fbest < tol)
+            nsmall[idx] = np.where(small, nsmall[idx] + 1, 0)
+            converged = (nsmall[idx] >= 3) | (lam[idx] > 1E12)
+            active[idx[converged]] = False
+
+    t, success = _fit_spectra_simplex(cd, fn, norm_vals, nll_vals, norm_type,
+                                      t, islog, ftol=tol)
+
+    # Errors are evaluated from the curvature on the scale of the
+    # coarsest step to average over the kinks of the surface
+    f0 = _eval_spectra_nll(cd, fn, t[:, :, None], islog)[:, 0]
+    _, grad, hess = _fit_spectra_derivs(cd, fn, t, islog,
+                                        np.full(npar, 0.1))
+    with np.errstate(all='ignore'):
+        cov = np.linalg.pinv(hess)
+        terr = np.sqrt(np.diagonal(cov, axis1=1, axis2=2)).T
+
+    pars = np.array([10**x if l else x for x, l in zip(t, islog)])
+    errs = np.array([np.log(10.) * p * e if l else e
+                     for p, e, l in zip(pars, terr, islog)])
+    nll_null = np.sum(nll_vals[:, :, 0], axis=1)
+    return dict(params=pars, errors=errs, nll=f0,
+                ts=2. * (nll_null - f0),
+                fit_success=success, niter=niter)
+
+
+def _fit_spectra_chunk(args):
+    return _fit_spectra_lm(*args[:-1], **args[-1])
+
+
 class TSCube(object):
     """A class wrapping a TSCube, which is a collection of CastroData
     objects for a set of directions.
@@ -1640,6 +2171,103 @@ class TSCube(object):
         test_dict = castro.test_spectra(spec_types)
         return (castro, test_dict)
 
+    def fit_spectra_all(self, spec_type='PowerLaw', init_pars=None,
+                        scale=1E3, mask=None, chunk_size=1000,
+                        nthread=None, max_iter=50, tol=1E-4):
+        """Fit a spectral model to the likelihood profiles of every
+        pixel in this TSCube.  Pixels are fit simultaneously with a
+        vectorized Levenberg-Marquardt algorithm in chunks of
+        ``chunk_size`` pixels which can optionally be distributed over
+        a pool of processes.
+
+        Parameters
+        ----------
+        spec_type : str
+            Spectral model.  One of PowerLaw, LogParabola or PLExpCutoff.
+
+        init_pars : `~numpy.ndarray`
+            Initial parameter values.  If None the defaults of
+            spectral model are used.
+
+        scale : float
+            The 'pivot energy' of the spectral model.
+
+        mask : `~numpy.ndarray`
+            Boolean array with the shape of the TS map selecting the
+            pixels to fit.  If None all pixels are fit.
+
+        chunk_size : int
+            Maximum number of pixels fit in a single vectorized
+            evaluation.  Bounds the memory footprint of the fit.
+
+        nthread : int
+            Number of processes.  If None or 1 the chunks are fit
+            in the current process.
+
+        max_iter : int
+            Maximum number of Levenberg-Marquardt iterations.
+
+        tol : float
+            Convergence tolerance on the negative log-likelihood.
+
+        Returns
+        -------
+        fit_maps : dict
+            Dictionary of maps with the TS (``ts``), negative
+            log-likelihood (``nll``) and fit status (``fit_success``)
+            of each pixel as well as the best-fit value and error of
+            each parameter keyed by the names in
+            `~fermipy.castro.PAR_NAMES`.  Pixels that were not fit
+            are set to NaN.
+        """
+        if spec_type not in SPEC_LOG_PARS:
+            raise Exception('Unsupported spectral type: %s' % spec_type)
+
+        if init_pars is None:
+            init_pars = SpectralFunction.create_functor(
+                spec_type, self._norm_type, self._refSpec.emin,
+                self._refSpec.emax, scale=scale).params
+
+        shape = self._tsmap.data.shape
+        if mask is None:
+            ipix = np.arange(self.nvals)
+        else:
+            ipix = np.where(np.ravel(mask))[0]
+
+        kw = dict(scale=scale, max_iter=max_iter, tol=tol)
+        chunks = [ipix[i:i + chunk_size]
+                  for i in range(0, len(ipix), chunk_size)]
+        args = [(self._norm_vals[c], self._nll_vals[c], spec_type,
+                 self._norm_type, self._refSpec.emin, self._refSpec.emax,
+                 init_pars, kw) for c in chunks]
+
+        if nthread is not None and nthread > 1 and len(chunks) > 1:
+            from multiprocessing import Pool
+            pool = Pool(processes=min(nthread, len(chunks)))
+            results = pool.map(_fit_spectra_chunk, args, chunksize=1)
+            pool.close()
+            pool.join()
+        else:
+            results = [_fit_spectra_chunk(a) for a in args]
+
+        par_names = PAR_NAMES[spec_type]
+        o = {}
+        for k in ['ts', 'nll', 'fit_success']:
+            o[k] = np.full(self.nvals, np.nan)
+        for k in par_names:
+            o[k] = np.full(self.nvals, np.nan)
+            o[k + '_err'] = np.full(self.nvals, np.nan)
+
+        for c, r in zip(chunks, results):
+            for k in ['ts', 'nll', 'fit_success']:
+                o[k][c] = r[k]
+            for i, k in enumerate(par_names):
+                o[k][c] = r['params'][i]
+                o[k + '_err'][c] = r['errors'][i]
+
+        return {k: WcsNDMap(self._tsmap.geom, v.reshape(shape))
+                for k, v in o.items()}
+
     def find_sources(self, threshold,
                      min_separation=1.0,
                      use_cumul=False,
@@ -163,6 +163,15 @@ gtlike = {
     'use_external_srcmap': (False, 'Use an external precomputed source map file.', bool),
     'use_scaled_srcmap': (False, 'Generate source map by scaling an external srcmap file.', bool),
     'wmap': (None, 'Likelihood weights map.', str),
+    'srcmap_library': (None, 'Path to a directory containing a library of precomputed source map templates.  '
+                       'When defined the templates used to generate source maps during position scans are '
+                       'loaded from this directory and any missing templates are added to it.', str),
+    'use_kernel_bank': (False, 'Generate the source maps of radially symmetric sources from a bank of '
+                        'PSF-convolved kernels that are cached in memory and shared between sources with the '
+                        'same spatial model, width and subpixel position.  The source maps agree with the '
+                        'direct calculation to within the accuracy of the kernel tabulation.', bool),
+    'kernel_bank': (None, 'Path to a directory in which the kernels of the kernel bank are stored.  When defined '
+                    'the kernel bank is enabled and kernels are loaded from and added to this directory.', str),
     'llscan_npts': (20, 'Number of evaluation points to use when performing a likelihood scan.', int),
     'src_expscale': (None, 'Dictionary of exposure corrections for individual sources keyed to source name.  The exposure '
                      'for a given source will be scaled by this value.  A value of 1.0 corresponds to the nominal exposure.', dict),
@@ -218,6 +227,10 @@ fileio = {
                      'This option only takes effect when ``usescratch`` is True.', list),
     'usescratch': (
         False, 'Run analysis in a temporary working directory under ``scratchdir``.', bool),
+    'irf_cachedir': (None, 'Path to a directory used to cache exposure-weighted IRF products (PSF, '
+                     'energy dispersion and exposure).  If None then IRF products are not cached.', str),
+    'irf_cache_size': (1024., 'Maximum size in MB of the IRF cache in ``irf_cachedir``.  When this size is '
+                       'exceeded the least recently used entries are removed.', float),
 }
 
 logging = {
@@ -237,7 +250,12 @@ optimizer = {
                     'when using the NEWTON fitter.  A value of zero disables damping.', float),
     'retries': (3, 'Set the number of times to retry the fit when the fit quality is less than ``min_fit_quality``.', int),
     'min_fit_quality': (2, 'Set the minimum fit quality.', int),
-    'verbosity': (0, '', int)
+    'verbosity': (0, '', int),
+    'norm_backend':
+        ('pylike', 'Likelihood backend used by the NEWTON fitter.  With ``pylike`` the fit '
+         'is performed with the pyLikelihood fit cache.  With ``numpy`` the model counts '
+         'maps of the sources with free normalizations are computed once and the fit is '
+         'performed with NumPy.  Fits with parameter priors always use ``pylike``.', str),
 }
 
 fit_output = {
@@ -270,9 +288,25 @@ roiopt = {
          'that will be fit in the third optimization step.', float),
     'max_free_sources':
         (5, 'Maximum number of sources that will be fit simultaneously in '
-         'the first optimization step.', int),
+         'the first optimization step and in each block of the second '
+         'optimization step.', int),
     'skip':
-        (None, 'List of str source names to skip while optimizing.', list)
+        (None, 'List of str source names to skip while optimizing.', list),
+    'norm_fit':
+        ('source', 'Method used to fit the normalizations of the sources in the second '
+         'optimization step.  With ``source`` each source is fit individually.  With '
+         '``block`` sources are grouped into blocks of spatially coupled sources and the '
+         'normalizations of each block are fit jointly.  Blocks are limited to '
+         '``max_free_sources`` sources in order of decreasing npred.  With ``sweep`` all normalizations '
+         'are fit with coordinate-descent sweeps over cached model counts maps.', str),
+    'block_psf_scale':
+        (1.0, 'Sources are placed in the same block when their separation is smaller than '
+         'this multiple of the PSF 68% containment radius plus their extensions.', float),
+    'block_radius':
+        (None, 'Coupling radius in deg used to build blocks of sources.  If None the radius '
+         'is set from ``block_psf_scale``.', float),
+    'nsweep':
+        (10, 'Maximum number of coordinate-descent sweeps when ``norm_fit`` is ``sweep``.', int),
 }
 
 roiopt_output = {
@@ -280,6 +314,9 @@ roiopt_output = {
     'loglike1': (None, 'Post-optimization log-likelihood value.', float),
     'dloglike': (None, 'Improvement in log-likehood value.', float),
     'config': (None, 'Copy of input configuration to this method.', dict),
+    'blocks': (None, 'List of the blocks of source names whose normalizations were fit '
+               'jointly in the second optimization step.', list),
+    'timing': (None, 'Execution time in seconds of each optimization step.', dict),
 }
 
 # Residual Maps
@@ -290,6 +327,10 @@ residmap = {
     'loge_bounds': common['loge_bounds'],
     'make_plots': common['make_plots'],
     'use_weights': common['use_weights'],
+    'multithread': (False, 'Convolve the energy planes of each component in parallel with '
+                    'the number of threads set by nthread option.', bool),
+    'nthread': (None, 'Number of threads to create when multithread is True.  If None then one '
+                'thread is created for each available core.', int),
     'write_fits': common['write_fits'],
     'write_npy': common['write_npy'],
 }
@@ -301,9 +342,15 @@ tsmap = {
                 'computing the TS map.', list),
     'multithread': common['multithread'],
     'nthread': common['nthread'],
+    'tile_size': (None, 'Side length in pixels of the spatial tiles that are distributed to each process '
+                  'when multithread is True.  If None the tile size is chosen such that there are '
+                  'approximately four tiles per process.', int),
     'max_kernel_radius': (3.0, 'Set the maximum radius of the test source kernel.  Using a '
                           'smaller value will speed up the TS calculation at the loss of '
                           'accuracy.', float),
+    'method': ('newton', 'Set the algorithm used to fit the test source amplitude.  Valid options '
+               'are newton or fft.  With fft the first iteration of the fit is evaluated for all '
+               'pixels with FFT correlations and pixels with no positive excess are skipped.', str),
     'loge_bounds': common['loge_bounds'],
     'make_plots': common['make_plots'],
     'write_fits': common['write_fits'],
@@ -384,6 +431,8 @@ lightcurve = {
     'multithread': common['multithread'],
     'nthread': common['nthread'],
     'systematic': (0.02, 'Systematic correction factor for TS:subscript:`var`. See Sect. 3.6 in 2FGL for details.', float),
+    'resume': (False, 'Resume a previous light curve analysis.  Time bins for which a successful fit result with '
+               'the same configuration is found in the output directory are not recomputed.', bool),
 }
 
 # Output for lightcurve Analysis
@@ -555,6 +604,14 @@ localize = {
               'determined from the TS map peak fit.  The total number of '
               'sampling points will be nstep**2.', int),
     'dtheta_max': (0.5, 'Half-width of the search region in degrees used for the first pass of the localization search.', float),
+    'scan_method': ('cache', 'Method used to compute the likelihood at each point of the position scan.  '
+                    '``cache`` fits the normalizations of the source and the free background components '
+                    'to model counts maps generated in one batch from the source map cache.  ``fit`` '
+                    'performs a likelihood fit at each point with the source moved to that position.  '
+                    '``fit`` is used instead of ``cache`` when any parameter other than a normalization '
+                    'is free.', str),
+    'nrefine': (0, 'Number of refinement steps of the position scan.  Each step recenters the scan grid '
+                'on the peak of the previous step and halves its pixel size.', int),
     'free_background': common['free_background'],
     'fix_shape': common['fix_shape'],
     'free_radius': common['free_radius'],
@@ -10,9 +10,6 @@ import sys
 import argparse
 import yaml
 
-from astropy.io import fits
-from fermipy.skymap import HpxMap
-
 from fermipy.utils import load_yaml
 
 from fermipy.jobs.scatter_gather import ConfigMaker, build_sg_from_link
@@ -23,6 +20,7 @@ from fermipy.diffuse.binning import Component
 from fermipy.diffuse.name_policy import NameFactory
 from fermipy.diffuse import defaults as diffuse_defaults
 from fermipy.diffuse.model_manager import make_library
+from fermipy.diffuse import srcmap_assembly
 
 NAME_FACTORY = NameFactory()
 
@@ -74,8 +72,9 @@ class GtAssembleModel(Link):
     This is useful for re-merging after parallelizing source map creation.
     """
     default_options = dict(input=(None, 'Input yaml file', str),
-                           compname=(None, 'Component name.', str),
-                           hpx_order=diffuse_defaults.diffuse['hpx_order_fitting'])
+                           compname=(None, 'Component name.  If None all components are assembled.', str),
+                           hpx_order=diffuse_defaults.diffuse['hpx_order_fitting'],
+                           nthread=(None, 'Number of processes used to assemble components.', int))
 
     def __init__(self, **kwargs):
         """C'tor
@@ -90,86 +89,6 @@ class GtAssembleModel(Link):
                       **kwargs)
 
  
-    @staticmethod
-    def copy_ccube(ccube, outsrcmap, hpx_order):
-        """Copy a counts cube into outsrcmap file
-        reducing the HEALPix order to hpx_order if needed.
-        """
-        sys.stdout.write ("  Copying counts cube from %s to %s\n" % (ccube, outsrcmap))
-        try:
-            hdulist_in = fits.open(ccube)
-        except IOError:
-            hdulist_in = fits.open("%s.gz" % ccube)
-
-        hpx_order_in = hdulist_in[1].header['ORDER']
-
-        if hpx_order_in > hpx_order:
-            hpxmap = HpxMap.create_from_hdulist(hdulist_in)
-            hpxmap_out = hpxmap.ud_grade(hpx_order, preserve_counts=True)
-            hpxlist_out = hdulist_in
-            #hpxlist_out['SKYMAP'] = hpxmap_out.create_image_hdu()
-            hpxlist_out[1] = hpxmap_out.create_image_hdu()
-            hpxlist_out[1].name = 'SKYMAP'
-            hpxlist_out.writeto(outsrcmap)
-            return hpx_order
-        else:
-            os.system('cp %s %s' % (ccube, outsrcmap))
-            #os.system('cp %s.gz %s.gz' % (ccube, outsrcmap))
-            #os.system('gunzip -f %s.gz' % (outsrcmap))
-        return None
-
-    @staticmethod
-    def open_outsrcmap(outsrcmap):
-        """Open and return the outsrcmap file in append mode """
-        outhdulist = fits.open(outsrcmap, 'append')
-        return outhdulist
-
-    @staticmethod
-    def append_hdus(hdulist, srcmap_file, source_names, hpx_order):
-        """Append HEALPix maps to a list
-
-        Parameters
-        ----------
-
-        hdulist : list
-            The list being appended to
-        srcmap_file : str
-            Path to the file containing the HDUs
-        source_names : list of str
-            Names of the sources to extract from srcmap_file
-        hpx_order : int
-            Maximum order for maps
-        """
-        sys.stdout.write("  Extracting %i sources from %s" % (len(source_names), srcmap_file))
-        try:
-            hdulist_in = fits.open(srcmap_file)
-        except IOError:
-            try:
-                hdulist_in = fits.open('%s.gz' % srcmap_file)
-            except IOError:
-                 sys.stdout.write("  Missing file %s\n" % srcmap_file)
-                 return
-
-        for source_name in source_names:
-            sys.stdout.write('.')
-            sys.stdout.flush()
-            if hpx_order is None:
-                hdulist.append(hdulist_in[source_name])
-            else:
-                try:
-                    hpxmap = HpxMap.create_from_hdulist(hdulist_in, hdu=source_name)
-                except IndexError:
-                    print("  Index error on source %s in file %s" % (source_name, srcmap_file))
-                    continue
-                except KeyError:
-                    print("  Key error on source %s in file %s" % (source_name, srcmap_file))
-                    continue
-                hpxmap_out = hpxmap.ud_grade(hpx_order, preserve_counts=True)
-                hdulist.append(hpxmap_out.create_image_hdu(name=source_name))
-        sys.stdout.write("\n")
-        hdulist.flush()
-        hdulist_in.close()
-
     @staticmethod
     def assemble_component(compname, compinfo, hpx_order):
         """Assemble the source map file for one binning component
@@ -185,32 +104,20 @@ class GtAssembleModel(Link):
             Maximum order for maps
 
         """
-        sys.stdout.write ("Working on component %s\n" % compname)
-        ccube = compinfo['ccube']
-        outsrcmap = compinfo['outsrcmap']
-        source_dict = compinfo['source_dict']
-
-        hpx_order = GtAssembleModel.copy_ccube(ccube, outsrcmap, hpx_order)
-        hdulist = GtAssembleModel.open_outsrcmap(outsrcmap)
-
-        for comp_name in sorted(source_dict.keys()):
-            source_info = source_dict[comp_name]
-            source_names = source_info['source_names']
-            srcmap_file = source_info['srcmap_file']
-            GtAssembleModel.append_hdus(hdulist, srcmap_file,
-                                        source_names, hpx_order)
-        sys.stdout.write("Done!\n")
+        srcmap_assembly.assemble_component(compname, compinfo, hpx_order)
 
     def run_analysis(self, argv):
-        """Assemble the source map file for one binning component
-        FIXME
+        """Assemble the source map files for one or all binning components
         """
         args = self._parser.parse_args(argv)
         manifest = yaml.safe_load(open(args.input))
 
-        compname = args.compname
-        value = manifest[compname]
-        GtAssembleModel.assemble_component(compname, value, args.hpx_order)
+        if args.compname is None:
+            compnames = None
+        else:
+            compnames = [args.compname]
+        srcmap_assembly.assemble_components(manifest, compnames,
+                                            args.hpx_order, args.nthread)
 
 
 class ConfigMaker_AssembleModel(ConfigMaker):
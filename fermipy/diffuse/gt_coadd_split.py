@@ -27,6 +27,7 @@ class CoaddSplit(Chain):
                            data=diffuse_defaults.diffuse['data'],
                            do_ltsum=(False, 'Sum livetime cube files', bool),
                            nfiles=(96, 'Number of input files', int),                                    
+                           nthread=(4, 'Number of threads used to read the input files', int),
                            dry_run=(False, 'Print commands but do not run them', bool))
 
     def __init__(self, linkname, **kwargs):
@@ -100,7 +101,8 @@ class CoaddSplit(Chain):
                         link = Link('coadd_%s' % key,
                                     appname='fermipy-coadd',
                                     options=dict(args=([], "List of input files", list),
-                                                 output=(None, "Output file", str)),
+                                                 output=(None, "Output file", str),
+                                                 nthread=(4, "Number of I/O threads", int)),
                                     mapping={'args': argkey,
                                              'output': binkey},
                                     file_args=dict(args=FileFlags.input_mask,
@@ -9,9 +9,6 @@ import sys
 
 import argparse
 
-import BinnedAnalysis as BinnedAnalysis
-import pyLikelihood as pyLike
-
 from fermipy.jobs.file_archive import FileFlags
 from fermipy.jobs.chain import add_argument, Link
 from fermipy.jobs.scatter_gather import ConfigMaker, build_sg_from_link
@@ -20,6 +17,7 @@ from fermipy.diffuse.name_policy import NameFactory
 from fermipy.diffuse.binning import Component
 from fermipy.diffuse.catalog_src_manager import make_catalog_comp_dict
 from fermipy.diffuse import defaults as diffuse_defaults
+from fermipy.diffuse.srcmap_assembly import merge_srcmaps
 
 NAME_FACTORY = NameFactory()
 
@@ -27,9 +25,11 @@ NAME_FACTORY = NameFactory()
 class GtMergeSourceMaps(object):
     """Small class to merge source maps for composite sources.
 
-    This is useful for parallelizing source map creation.
+    This is useful for parallelizing source map creation.  The maps
+    of the nested sources are summed directly from the input file
+    weighted by their spectra; the irfs, expcube and bexpmap options
+    are not needed for this and are kept for compatibility.
     """
-    NULL_MODEL = 'srcmdls/null.xml'
 
     default_options = dict(irfs=diffuse_defaults.gtopts['irfs'],
                            expcube=diffuse_defaults.gtopts['expcube'],
@@ -78,51 +78,12 @@ class GtMergeSourceMaps(object):
         args = self.parser.parse_args(argv)
 
         print("srcmaps = %s"%(args.srcmaps))
-        obs = BinnedAnalysis.BinnedObs(irfs=args.irfs,
-                                       expCube=args.expcube,
-                                       srcMaps=args.srcmaps,
-                                       binnedExpMap=args.bexpmap)
-
-        like = BinnedAnalysis.BinnedAnalysis(obs,
-                                             optimizer='MINUIT',
-                                             srcModel=GtMergeSourceMaps.NULL_MODEL,
-                                             wmap=None)
-
-        like.logLike.set_use_single_fixed_map(False)
-
         print("Reading xml model from %s" % args.srcmdl)
-        source_factory = pyLike.SourceFactory(obs.observation)
-        source_factory.readXml(args.srcmdl, BinnedAnalysis._funcFactory, False, True, True)
-        strv = pyLike.StringVector()
-        source_factory.fetchSrcNames(strv)
-        source_names = [strv[i] for i in range(strv.size())]
-
-        missing_sources = []
-        srcs_to_merge = []
-        for source_name in source_names:
-            try:
-                source = source_factory.releaseSource(source_name)
-                # EAC, add the source directly to the model
-                like.logLike.addSource(source)
-                srcs_to_merge.append(source_name)
-            except KeyError:
-                missing_sources.append(source_name)
-
-        comp = like.mergeSources(args.merged, source_names, 'ConstantValue')
-        like.logLike.getSourceMap(comp.getName())
-
-        print("Merged %i sources into %s"%(len(srcs_to_merge), comp.getName()))
-        if len(missing_sources) > 0:
-            print("Missed sources: ", missing_sources)
-
-        print("Writing output source map file %s" % args.outfile)
-        like.logLike.saveSourceMaps(args.outfile, False, False)
+        merge_srcmaps(args.srcmaps, args.srcmdl, args.merged,
+                      args.outfile, args.outxml)
         if args.gzip:
             os.system("gzip -9 %s" % args.outfile)
 
-        print("Writing output xml file %s" % args.outxml)
-        like.writeXml(args.outxml)
-
 
 class ConfigMaker_MergeSrcmaps(ConfigMaker):
     """Small class to generate configurations for this script
@@ -0,0 +1,428 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""
+Native assembly and merging of HEALPix source map files.
+
+The functions in this module copy, ud_grade and sum source maps
+directly on the FITS data arrays.  Input files are opened with
+memory-mapping and each output file is written once, so building the
+source map files of an all-sky model does not require setting up a
+likelihood object.
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import sys
+import copy
+import tempfile
+from collections import OrderedDict
+from multiprocessing import Pool
+import xml.etree.cElementTree as ElementTree
+
+import numpy as np
+import healpy as hp
+from astropy.io import fits
+
+from fermipy import utils
+from fermipy import spectrum
+from fermipy.hpx_utils import HPX, HPX_FITS_CONVENTIONS
+from fermipy.roi_model import Source, CompositeSource, get_true_params_dict
+from fermipy.merge_utils import make_accumulator
+
+
+def open_fits(path):
+    """Open a FITS file with memory-mapping, falling back to the
+    gzipped version of the file if it does not exist.  Returns None if
+    neither file exists."""
+    for fname in [path, '%s.gz' % path]:
+        try:
+            return fits.open(fname, memmap=True)
+        except IOError:
+            continue
+    return None
+
+
+def write_hdulist(hdulist, outfile):
+    """Write an HDU list to a temporary file next to ``outfile`` and
+    move it into place once it is complete."""
+    outdir = os.path.dirname(os.path.abspath(outfile))
+    fd, tmpfile = tempfile.mkstemp(suffix='.fits', prefix='.tmp', dir=outdir)
+    os.close(fd)
+    fits.HDUList(hdulist).writeto(tmpfile, overwrite=True)
+    os.rename(tmpfile, outfile)
+
+
+def ud_grade_hpx(hpx, data, order):
+    """Change the order of an all-sky HEALPix cube while preserving
+    counts.  All energy planes are regridded in a single operation.
+
+    Parameters
+    ----------
+    hpx : `~fermipy.hpx_utils.HPX`
+        Input pixelization.
+
+    data : `~numpy.ndarray`
+        Input data with shape (nebin, npix).
+
+    order : int
+        Output HEALPix order.
+
+    Returns
+    -------
+    hpx_out : `~fermipy.hpx_utils.HPX`
+
+    data_out : `~numpy.ndarray`
+    """
+    hpx_out = hpx.ud_graded_hpx(order)
+    nside_in, nside_out = hpx.nside, hpx_out.nside
+    if nside_in == nside_out:
+        return hpx_out, data
+
+    data = np.atleast_2d(data)
+    if not hpx.nest:
+        data = data[:, hp.nest2ring(nside_in, np.arange(data.shape[1]))]
+
+    if nside_out < nside_in:
+        nsub = (nside_in // nside_out)**2
+        data = data.reshape(data.shape[0], -1, nsub).sum(axis=2)
+    else:
+        nsub = (nside_out // nside_in)**2
+        data = np.repeat(data / nsub, nsub, axis=1)
+
+    if not hpx.nest:
+        data_out = np.empty_like(data)
+        data_out[:, hp.nest2ring(nside_out, np.arange(data.shape[1]))] = data
+        data = data_out
+    return hpx_out, data
+
+
+def read_hpx_hdu(hdu):
+    """Read a dense HEALPix source map HDU.
+
+    Returns
+    -------
+    hpx : `~fermipy.hpx_utils.HPX`
+
+    data : `~numpy.ndarray`
+        Array with shape (nebin, npix).
+    """
+    hpx = HPX.create_from_header(hdu.header)
+    if hpx.conv.convname == 'FGST_SRCMAP_SPARSE':
+        nebin = hdu.header.get('NBRBINS', None)
+        chans = hdu.data.field('CHANNEL')
+        if nebin is None:
+            nebin = int(np.max(chans)) + 1
+        data = np.zeros((nebin, hpx.npix))
+        data[chans, hdu.data.field('PIX')] = hdu.data.field('VALUE')
+        return hpx, data
+
+    cnames = [c for c in hdu.columns.names
+              if c.find(hpx.conv.colstring) == 0]
+    return hpx, np.vstack([hdu.data.field(c) for c in cnames])
+
+
+def accumulate_srcmap(out, hdu, weights):
+    """Add a source map HDU multiplied by a weight per energy plane
+    to an accumulator array.  Image HDUs and dense or sparse HEALPix
+    HDUs are supported.  Sparse maps are added without being
+    expanded."""
+    if hdu.is_image:
+        out += weights.reshape((-1,) + (1,) * (out.ndim - 1)) * hdu.data
+        return
+
+    conv = HPX_FITS_CONVENTIONS[HPX.identify_HPX_convention(hdu.header)]
+    if conv.convname == 'FGST_SRCMAP_SPARSE':
+        chans = np.asarray(hdu.data.field('CHANNEL'), dtype=int)
+        pixs = np.asarray(hdu.data.field('PIX'), dtype=int)
+        np.add.at(out, (chans, pixs),
+                  weights[chans] * hdu.data.field('VALUE'))
+        return
+
+    cnames = [c for c in hdu.columns.names if c.find(conv.colstring) == 0]
+    for i, cname in enumerate(cnames):
+        out[i] += weights[i] * hdu.data.field(cname)
+
+
+def _eval_pylike_dnde(src, energies):
+    """Evaluate the differential flux of a source model with the
+    pyLikelihood function factory.  This supports every spectral
+    model known to the Science Tools."""
+    import pyLikelihood as pyLike
+    from fermipy import gtutils
+
+    spectrum_type = str(src['SpectrumType'])
+    fn = pyLike.SourceFactory_funcFactory().create(spectrum_type)
+    if spectrum_type == 'FileFunction':
+        filename = os.path.expandvars(src['Spectrum_Filename'])
+        pyLike.FileFunction_cast(fn).readFunction(str(filename))
+    fn = gtutils.create_spectrum_from_dict(spectrum_type,
+                                           copy.deepcopy(src.spectral_pars),
+                                           fn=fn)
+    return np.array([fn(pyLike.dArg(float(egy))) for egy in energies])
+
+
+def eval_source_dnde(src, energies):
+    """Evaluate the differential flux of a source model at a set of
+    energies in MeV.  Common spectral models are evaluated natively,
+    all other models are evaluated with pyLikelihood."""
+    spectrum_type = src['SpectrumType']
+    p = {k: v['value'] for k, v in
+         get_true_params_dict(src.spectral_pars).items()}
+
+    if spectrum_type == 'ConstantValue':
+        return p['Value'] * np.ones_like(energies)
+    elif spectrum_type == 'PowerLaw':
+        fn = spectrum.PowerLaw([p['Prefactor'], p['Index']],
+                               scale=p['Scale'])
+    elif spectrum_type == 'LogParabola':
+        fn = spectrum.LogParabola([p['norm'], -p['alpha'], p['beta']],
+                                  scale=p['Eb'])
+    elif spectrum_type == 'PLSuperExpCutoff':
+        fn = spectrum.PLSuperExpCutoff([p['Prefactor'], p['Index1'],
+                                        p['Cutoff'], p['Index2']],
+                                       scale=p['Scale'])
+    else:
+        return _eval_pylike_dnde(src, energies)
+
+    return fn.dnde(energies)
+
+
+def load_sources_xml(xmlfile):
+    """Load the list of sources defined in an XML model file."""
+    root = ElementTree.ElementTree(file=xmlfile).getroot()
+    return [Source.create_from_xml(node) for node in root.findall('source')]
+
+
+def copy_ccube(ccube, outsrcmap, hpx_order):
+    """Copy a counts cube into outsrcmap file reducing the HEALPix
+    order to hpx_order if needed.
+
+    Returns
+    -------
+    hpx_order : int
+        The order to which the source maps have to be regridded or
+        None if the source maps can be copied unchanged.
+    """
+    sys.stdout.write("  Copying counts cube from %s to %s\n" %
+                     (ccube, outsrcmap))
+    hdulist_in = open_fits(ccube)
+    if hdulist_in is None:
+        raise IOError('Missing counts cube %s' % ccube)
+
+    with hdulist_in:
+        hpx_order_in = hdulist_in[1].header['ORDER']
+        hdulist_out = [hdu.copy() for hdu in hdulist_in]
+        if hpx_order_in > hpx_order:
+            hpx, data = read_hpx_hdu(hdulist_in[1])
+            hpx_out, data = ud_grade_hpx(hpx, data, hpx_order)
+            hdulist_out[1] = hpx_out.make_hdu(data, extname='SKYMAP')
+        else:
+            hpx_order = None
+        write_hdulist(hdulist_out, outsrcmap)
+    return hpx_order
+
+
+def plan_component(compinfo):
+    """Plan the HDU copies needed to assemble the source map file of
+    one binning component.  Sources are grouped by the file that
+    contains them such that every input file is only opened once.
+
+    Returns
+    -------
+    plan : `~collections.OrderedDict`
+        Dictionary of the source names to be extracted keyed by
+        source map file.
+    """
+    plan = OrderedDict()
+    source_dict = compinfo['source_dict']
+    for comp_name in sorted(source_dict.keys()):
+        source_info = source_dict[comp_name]
+        names = plan.setdefault(source_info['srcmap_file'], [])
+        names += [name for name in source_info['source_names']
+                  if name not in names]
+    return plan
+
+
+def assemble_component(compname, compinfo, hpx_order):
+    """Assemble the source map file for one binning component.
+
+    Parameters
+    ----------
+    compname : str
+        The key for this component (e.g., E0_PSF3)
+
+    compinfo : dict
+        Information about this component
+
+    hpx_order : int
+        Maximum order for maps
+    """
+    sys.stdout.write("Working on component %s\n" % compname)
+    outsrcmap = compinfo['outsrcmap']
+    hpx_order = copy_ccube(compinfo['ccube'], outsrcmap, hpx_order)
+
+    hdulist_out = fits.open(outsrcmap, memmap=True)
+    hdus = [hdu for hdu in hdulist_out]
+    inputs = [hdulist_out]
+
+    for srcmap_file, source_names in plan_component(compinfo).items():
+        sys.stdout.write("  Extracting %i sources from %s" %
+                         (len(source_names), srcmap_file))
+        hdulist_in = open_fits(srcmap_file)
+        if hdulist_in is None:
+            sys.stdout.write("  Missing file %s\n" % srcmap_file)
+            continue
+        inputs += [hdulist_in]
+
+        for source_name in source_names:
+            sys.stdout.write('.')
+            sys.stdout.flush()
+            if source_name not in hdulist_in:
+                print("  Key error on source %s in file %s" %
+                      (source_name, srcmap_file))
+                continue
+            hdu = hdulist_in[source_name]
+            if hpx_order is not None and hdu.header['ORDER'] != hpx_order:
+                hpx, data = read_hpx_hdu(hdu)
+                hpx_out, data = ud_grade_hpx(hpx, data, hpx_order)
+                hdu = hpx_out.make_hdu(data, extname=source_name)
+            hdus += [hdu]
+        sys.stdout.write("\n")
+
+    # The input files are only read while the output is written
+    write_hdulist(hdus, outsrcmap)
+    for hdulist in inputs:
+        hdulist.close()
+    sys.stdout.write("Done!\n")
+
+
+def _assemble_component(args):
+    return assemble_component(*args)
+
+
+def assemble_components(manifest, compnames=None, hpx_order=None,
+                        nthread=None):
+    """Assemble the source map files of several binning components.
+
+    Parameters
+    ----------
+    manifest : dict
+        Source map manifest keyed by component name.
+
+    compnames : list
+        Components to assemble.  If None all the components in the
+        manifest are assembled.
+
+    nthread : int
+        Number of processes used to assemble the components in
+        parallel.
+    """
+    if compnames is None:
+        compnames = sorted(manifest.keys())
+    tasks = [(compname, manifest[compname], hpx_order)
+             for compname in compnames]
+
+    if nthread is not None and nthread > 1 and len(tasks) > 1:
+        pool = Pool(processes=min(nthread, len(tasks)))
+        try:
+            pool.map(_assemble_component, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for task in tasks:
+            _assemble_component(task)
+
+
+def merge_srcmaps(srcmaps, srcmdl, merged, outfile, outxml=None,
+                  tmpdir=None):
+    """Merge the source maps of a set of sources into the source map
+    of a composite source.  The merged map is the sum of the maps of
+    the nested sources weighted by their differential flux at each
+    energy plane.
+
+    Parameters
+    ----------
+    srcmaps : str
+        Source map file with the maps of the nested sources.
+
+    srcmdl : str
+        XML model file defining the nested sources.
+
+    merged : str
+        Name of the composite source.
+
+    outfile : str
+        Output source map file.
+
+    outxml : str
+        Output XML file with the definition of the composite source.
+
+    tmpdir : str
+        Directory of the temporary file that backs the accumulator.
+
+    Returns
+    -------
+    missing_sources : list
+        Names of the sources without a map in the input file.
+    """
+    sources = load_sources_xml(srcmdl)
+    hdulist = open_fits(srcmaps)
+    if hdulist is None:
+        raise IOError('Missing source map file %s' % srcmaps)
+
+    energies = np.asarray(hdulist['ENERGIES'].data.field(0), dtype=float)
+    source_names = set([src.name.upper() for src in sources])
+    hdus = [hdu for hdu in hdulist if hdu.name.upper() not in source_names]
+
+    out = None
+    template = None
+    merged_sources = []
+    missing_sources = []
+    for src in sources:
+        if src.name not in hdulist:
+            missing_sources += [src.name]
+            continue
+        hdu = hdulist[src.name]
+        if out is None:
+            template = hdu
+            if hdu.is_image:
+                shape = hdu.data.shape
+            else:
+                hpx = HPX.create_from_header(hdu.header)
+                shape = (len(energies), hpx.npix)
+            out = make_accumulator(shape, float, tmpdir)
+        accumulate_srcmap(out, hdu, eval_source_dnde(src, energies))
+        merged_sources += [src]
+
+    if out is None:
+        raise ValueError('No source maps found for %s' % merged)
+
+    if template.is_image:
+        hdu_out = fits.ImageHDU(out, header=template.header, name=merged)
+    else:
+        hpx = HPX.create_from_header(template.header)
+        if hpx.conv.convname == 'FGST_SRCMAP_SPARSE':
+            hpx = HPX.create_hpx(hpx.nside, hpx.nest, hpx.coordsys, -1,
+                                 None, hpx.region,
+                                 HPX_FITS_CONVENTIONS['FGST_SRCMAP'])
+        hdu_out = hpx.make_hdu(out, extname=merged)
+
+    print("Merged %i sources into %s" % (len(merged_sources), merged))
+    if len(missing_sources) > 0:
+        print("Missed sources: ", missing_sources)
+
+    print("Writing output source map file %s" % outfile)
+    write_hdulist(hdus + [hdu_out], outfile)
+    hdulist.close()
+
+    if outxml is not None:
+        print("Writing output xml file %s" % outxml)
+        composite = CompositeSource(merged, {'nested_sources':
+                                             merged_sources})
+        root = ElementTree.Element('source_library')
+        root.set('title', 'source_library')
+        composite.write_xml(root)
+        with open(outxml, 'w') as f:
+            f.write(utils.prettify_xml(root))
+
+    return missing_sources
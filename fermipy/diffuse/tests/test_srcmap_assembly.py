@@ -0,0 +1,121 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+from numpy.testing import assert_allclose
+from astropy.io import fits
+
+from fermipy.hpx_utils import HPX, HPX_FITS_CONVENTIONS
+from fermipy.diffuse import srcmap_assembly
+
+
+def test_ud_grade_hpx():
+
+    for nest in [True, False]:
+        hpx = HPX.create_hpx(-1, nest, 'GAL', order=2)
+        data = np.random.uniform(size=(3, hpx.npix))
+
+        hpx_out, data_out = srcmap_assembly.ud_grade_hpx(hpx, data, 1)
+        assert data_out.shape == (3, hpx_out.npix)
+        assert_allclose(data_out.sum(axis=1), data.sum(axis=1))
+
+        hpx_up, data_up = srcmap_assembly.ud_grade_hpx(hpx_out, data_out, 2)
+        assert data_up.shape == data.shape
+        assert_allclose(data_up.sum(axis=1), data.sum(axis=1))
+
+
+def test_accumulate_srcmap():
+
+    weights = np.array([1.0, 2.0, 3.0])
+    data = np.random.uniform(size=(3, 4, 5))
+    out = np.zeros(data.shape)
+    srcmap_assembly.accumulate_srcmap(out, fits.ImageHDU(data), weights)
+    assert_allclose(out, weights[:, None, None] * data)
+
+    hpx = HPX.create_hpx(-1, True, 'GAL', order=1,
+                         conv=HPX_FITS_CONVENTIONS['FGST_SRCMAP'])
+    data = np.random.uniform(size=(3, hpx.npix))
+    out = np.zeros(data.shape)
+    srcmap_assembly.accumulate_srcmap(out, hpx.make_hdu(data), weights)
+    assert_allclose(out, weights[:, None] * data, rtol=1E-6)
+
+    data[:, ::2] = 0.0
+    hpx_sparse = HPX.create_hpx(-1, True, 'GAL', order=1,
+                                conv=HPX_FITS_CONVENTIONS['FGST_SRCMAP_SPARSE'])
+    out = np.zeros(data.shape)
+    srcmap_assembly.accumulate_srcmap(out, hpx_sparse.make_hdu(data),
+                                      weights)
+    assert_allclose(out, weights[:, None] * data, rtol=1E-6)
+
+
+def test_plan_component():
+
+    compinfo = dict(source_dict={
+        'a': dict(srcmap_file='f1.fits', source_names=['s1', 's2']),
+        'b': dict(srcmap_file='f2.fits', source_names=['s3']),
+        'c': dict(srcmap_file='f1.fits', source_names=['s2', 's4'])})
+    plan = srcmap_assembly.plan_component(compinfo)
+    assert list(plan.keys()) == ['f1.fits', 'f2.fits']
+    assert plan['f1.fits'] == ['s1', 's2', 's4']
+    assert plan['f2.fits'] == ['s3']
+
+
+SRCMDL_XML = """<source_library title="source_library">
+<source name="src_a" type="PointSource">
+  <spectrum type="PowerLaw">
+    <parameter free="1" max="1000" min="0.001" name="Prefactor" scale="1e-12" value="2.0"/>
+    <parameter free="1" max="0" min="-5" name="Index" scale="1.0" value="-2.1"/>
+    <parameter free="0" max="10000" min="10" name="Scale" scale="1.0" value="1000"/>
+  </spectrum>
+  <spatialModel type="SkyDirFunction">
+    <parameter free="0" max="360" min="-360" name="RA" scale="1.0" value="10.0"/>
+    <parameter free="0" max="90" min="-90" name="DEC" scale="1.0" value="20.0"/>
+  </spatialModel>
+</source>
+<source name="src_b" type="PointSource">
+  <spectrum type="LogParabola">
+    <parameter free="1" max="1000" min="0.001" name="norm" scale="1e-11" value="3.0"/>
+    <parameter free="1" max="5" min="0" name="alpha" scale="1.0" value="1.8"/>
+    <parameter free="1" max="1" min="0" name="beta" scale="1.0" value="0.1"/>
+    <parameter free="0" max="10000" min="10" name="Eb" scale="1.0" value="500"/>
+  </spectrum>
+  <spatialModel type="SkyDirFunction">
+    <parameter free="0" max="360" min="-360" name="RA" scale="1.0" value="11.0"/>
+    <parameter free="0" max="90" min="-90" name="DEC" scale="1.0" value="21.0"/>
+  </spatialModel>
+</source>
+</source_library>
+"""
+
+
+def test_merge_srcmaps(tmpdir):
+
+    energies = np.logspace(2.0, 4.0, 4)
+    data = {'src_a': np.random.uniform(size=(4, 10, 10)),
+            'src_b': np.random.uniform(size=(4, 10, 10))}
+
+    srcmaps = str(tmpdir / 'srcmaps.fits')
+    hdus = [fits.PrimaryHDU(np.zeros((4, 10, 10)))]
+    hdus += [fits.ImageHDU(v, name=k) for k, v in data.items()]
+    hdus += [fits.BinTableHDU.from_columns(
+        [fits.Column('Energy', 'D', array=energies)], name='ENERGIES')]
+    fits.HDUList(hdus).writeto(srcmaps)
+
+    srcmdl = str(tmpdir / 'srcmdl.xml')
+    with open(srcmdl, 'w') as f:
+        f.write(SRCMDL_XML)
+
+    outfile = str(tmpdir / 'merged.fits')
+    missing = srcmap_assembly.merge_srcmaps(srcmaps, srcmdl, 'merged',
+                                            outfile)
+    assert missing == []
+
+    dnde_a = 2E-12 * (energies / 1000.)**-2.1
+    x = energies / 500.
+    dnde_b = 3E-11 * x**(-1.8 - 0.1 * np.log(x))
+    expected = (dnde_a[:, None, None] * data['src_a'] +
+                dnde_b[:, None, None] * data['src_b'])
+
+    with fits.open(outfile) as hdulist:
+        assert 'SRC_A' not in hdulist
+        assert_allclose(hdulist['MERGED'].data, expected, rtol=1E-6)
@@ -499,6 +499,7 @@ class ExtensionFit(object):
         src = self.roi.copy_source(name)
 
         self._fitcache = None
+        self._normlike = None
 
         spatial_pars = {'ra': skydir.ra.deg, 'dec': skydir.dec.deg}
 
@@ -20,6 +20,7 @@ import fermipy.wcs_utils as wcs_utils
 import fermipy.fits_utils as fits_utils
 import fermipy.gtutils as gtutils
 import fermipy.srcmap_utils as srcmap_utils
+import fermipy.optimize_utils as optimize_utils
 import fermipy.skymap as skymap
 import fermipy.plotting as plotting
 import fermipy.irfs as irfs
@@ -40,6 +41,7 @@ from fermipy.config import ConfigSchema
 from fermipy.timing import Timer
 from fermipy.docstring_utils import DocstringMeta
 from fermipy.fitcache import FitCache
+from fermipy.normlike import BinnedNormLikelihood
 from fermipy.data_struct import MutableNamedTuple
 # pylikelihood
 import GtApp
@@ -324,6 +326,7 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
                                         logging=self.config['logging'])
 
         self._like = None
+        self._residmap_cache = {}
         self._components = []
         configs = self._create_component_configs()
 
@@ -606,10 +609,11 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
 
         if self._fitcache is not None:
             self._fitcache.update_source(name)
+        self._normlike = None
 
-    def _create_srcmap_cache(self, name, src):
+    def _create_srcmap_cache(self, name, src, **kwargs):
         for c in self.components:
-            c._create_srcmap_cache(name, src)
+            c._create_srcmap_cache(name, src, **kwargs)
 
     def _clear_srcmap_cache(self):
         for c in self.components:
@@ -1031,7 +1035,8 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
 
         # Run setup for each component
         for i, c in enumerate(self.components):
-            c.setup(overwrite=overwrite)
+            c.setup(overwrite=overwrite,
+                    sc_tables=kwargs.get('sc_tables', None))
 
         # Create likelihood
         self._create_likelihood()
@@ -1064,6 +1069,7 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
 
         self.like.model = self.like.components[0].model
         self._fitcache = None
+        self._normlike = None
         self._init_roi_model()
 
     def _init_roi_model(self):
@@ -1354,6 +1360,7 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
 
         if self._fitcache is not None:
             self._fitcache.update_source(name)
+        self._normlike = None
 
     def add_sources_from_roi(self, names, roi, free=False, **kwargs):
         """Add multiple sources to the current ROI model copied from another ROI model.
@@ -2170,10 +2177,12 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
           simultaneous fit of the normalization parameters of these
           components.
 
-        * Individually fit the normalizations of all sources that were
-          not included in the first step in order of their npred
-          values.  Skip any sources that have NPred <
-          ``npred_threshold``.
+        * Fit the normalizations of all sources that were not
+          included in the first step.  Skip any sources that have
+          NPred < ``npred_threshold``.  Depending on ``norm_fit`` the
+          sources are fit individually in order of their npred
+          values, in blocks of spatially coupled sources, or with
+          coordinate-descent sweeps over their model counts maps.
 
         * Individually fit the shape and normalization parameters of
           all sources with TS > ``shape_ts_threshold`` where TS is
@@ -2202,11 +2211,16 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
 
         max_free_sources : int
             Maximum number of sources that will be fit simultaneously
-            in the first optimization step.
+            in the first optimization step and in each block of the
+            second optimization step.
 
         skip : list
             List of str source names to skip while optimizing.
 
+        norm_fit : str
+            Method used to fit the normalizations in the second
+            optimization step (``source``, ``block`` or ``sweep``).
+
         optimizer : dict
             Dictionary that overrides the default optimizer settings.
 
@@ -2214,6 +2228,7 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
 
         loglevel = kwargs.pop('loglevel', self.loglevel)
         timer = Timer.create(start=True)
+        timer_step = Timer.create(start=True)
         self.logger.log(loglevel, 'Starting')
 
         loglike0 = -self.like()
@@ -2231,10 +2246,15 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
         shape_ts_threshold = config['shape_ts_threshold']
         max_free_sources = config['max_free_sources']
         skip = copy.deepcopy(config['skip'])
+        if config['norm_fit'] not in ['source', 'block', 'sweep']:
+            raise ValueError('Unrecognized norm_fit method: %s' %
+                             config['norm_fit'])
 
         o = defaults.make_default_dict(defaults.roiopt_output)
         o['config'] = config
         o['loglike0'] = loglike0
+        o['blocks'] = []
+        o['timing'] = {}
 
         # preserve free parameters
         free = self.get_free_param_vector()
@@ -2280,9 +2300,13 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
         print ("Joint fit ", joint_norm_fit)
         self.fit(loglevel=logging.DEBUG, **config['optimizer'])
         self.free_sources(free=False, loglevel=logging.DEBUG)
+        o['timing']['joint'] = timer_step.elapsed_time
+        timer_step.clear()
+        timer_step.start()
 
-        # Step through remaining sources and re-fit normalizations
+        # Select the remaining sources and re-fit normalizations
         # FIXME, EAC, use npred_wt here
+        norm_fit = []
         for s in sorted(self.roi.sources, key=lambda t: t[npred_str],
                         reverse=True):
 
@@ -2294,13 +2318,35 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
                     'Skipping %s with npred %10.3f', s.name, s[npred_str])
                 continue
 
-            self.logger.debug('Fitting %s npred: %10.3f TS: %10.3f',
-                              s.name, s[npred_str], s['ts'])
-            self.free_norm(s.name, loglevel=logging.DEBUG)
-            self.fit(loglevel=logging.DEBUG, **config['optimizer'])
-            self.logger.debug('Post-fit Results npred: %10.3f TS: %10.3f',
-                              s[npred_str], s['ts'])
-            self.free_norm(s.name, free=False, loglevel=logging.DEBUG)
+            norm_fit.append(s.name)
+
+        if config['norm_fit'] == 'source':
+            blocks = [[name] for name in norm_fit]
+        else:
+            blocks = self._find_source_blocks(norm_fit,
+                                              config['block_psf_scale'],
+                                              config['block_radius'],
+                                              max_free_sources)
+
+        o['blocks'] = blocks
+        self.logger.debug('Fitting %i sources in %i blocks',
+                          len(norm_fit), len(blocks))
+
+        if config['norm_fit'] == 'sweep':
+            self._fit_norms_sweep(norm_fit, nsweep=config['nsweep'],
+                                  tol=config['optimizer']['tol'])
+        else:
+            for block in blocks:
+                self.logger.debug('Fitting %s', block)
+                for name in block:
+                    self.free_norm(name, loglevel=logging.DEBUG)
+                self.fit(loglevel=logging.DEBUG, **config['optimizer'])
+                for name in block:
+                    self.free_norm(name, free=False, loglevel=logging.DEBUG)
+
+        o['timing']['norm'] = timer_step.elapsed_time
+        timer_step.clear()
+        timer_step.start()
 
         # Refit spectral shape parameters for sources with TS >
         # shape_ts_threshold
@@ -2320,6 +2366,9 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
             self.fit(loglevel=logging.DEBUG, **config['optimizer'])
             self.free_source(s.name, free=False, loglevel=logging.DEBUG)
 
+        o['timing']['shape'] = timer_step.elapsed_time
+        o['timing']['total'] = timer.elapsed_time
+
         self.set_free_param_vector(free)
 
         loglike1 = -self.like()
@@ -2330,9 +2379,116 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
         self.logger.log(loglevel, 'Finished')
         self.logger.log(loglevel, 'LogLike: %f Delta-LogLike: %f',
                         loglike1, loglike1 - loglike0)
+        self.logger.log(loglevel, 'Step execution times: joint %.2f s '
+                        'norm %.2f s shape %.2f s', o['timing']['joint'],
+                        o['timing']['norm'], o['timing']['shape'])
         self.logger.log(loglevel, 'Execution time: %.2f s', timer.elapsed_time)
         return o
 
+    def _find_source_blocks(self, names, psf_scale=1.0, radius=None,
+                            max_size=None):
+        """Group a list of sources into blocks of spatially coupled
+        sources.  Two point sources are coupled when their separation
+        is smaller than twice the coupling radius plus their
+        extensions.  Diffuse sources are placed in their own blocks.
+
+        Parameters
+        ----------
+        names : list
+            Source names.
+
+        psf_scale : float
+            Coupling radius in units of the counts-weighted PSF 68%
+            containment radius.
+
+        radius : float
+            Coupling radius in deg.  Overrides ``psf_scale``.
+
+        max_size : int
+            Maximum number of sources in a block.  Larger blocks are
+            split in the order of ``names``.
+
+        Returns
+        -------
+        blocks : list
+            List of lists of source names.
+        """
+        if radius is None:
+            r68 = []
+            for c, crd in zip(self.components, self._roi_data['components']):
+                r = c._psf.containment_angle_bin(c.energies)
+                w = crd['counts']
+                r68 += [np.sum(r * w) / np.sum(w) if np.sum(w) > 0
+                        else np.max(r)]
+            radius = psf_scale * max(r68)
+
+        if radius < 0:
+            raise ValueError('Coupling radius must be non-negative: %s' %
+                             radius)
+
+        srcs = [self.roi.get_source_by_name(name) for name in names]
+        pts = [s for s in srcs if not s.diffuse]
+        blocks = [[s.name] for s in srcs if s.diffuse]
+        if not pts:
+            return blocks
+
+        radec = np.array([s.radec for s in pts])
+        ext = np.array([s['SpatialWidth'] if s.extended and
+                        s['SpatialWidth'] is not None else 0.0
+                        for s in pts])
+        for idx in optimize_utils.find_source_blocks(radec[:, 0], radec[:, 1],
+                                                     radius + ext,
+                                                     max_size=max_size):
+            blocks += [[pts[i].name for i in idx]]
+        return blocks
+
+    def _fit_norms_sweep(self, names, nsweep=10, tol=1E-3):
+        """Fit the normalizations of a set of sources with
+        coordinate-descent sweeps.  The model counts maps of every
+        source are computed once and the sweeps are performed on these
+        cached maps without evaluating the likelihood."""
+
+        srcs = [self.roi.get_source_by_name(name) for name in names]
+        names = [s.name for s in srcs
+                 if self.like.normPar(s.name).getValue() > 0]
+        if not names:
+            return
+
+        counts, weights, model = [], [], []
+        templates = [[] for name in names]
+        offset = 0
+        for c in self.components:
+            esl = self._get_component_ebin_slice(c)
+            counts += [np.ravel(c.counts_map().data[esl])]
+            weights += [np.ravel(c.weight_map().data[esl])]
+            model += [np.ravel(c.model_counts_map().data[esl])]
+            for i, name in enumerate(names):
+                t = np.ravel(c.model_counts_map(name).data[esl])
+                idx = np.flatnonzero(t > 0)
+                templates[i] += [(idx + offset, t[idx])]
+            offset += counts[-1].size
+
+        templates = [(np.concatenate([t[0] for t in tt]),
+                      np.concatenate([t[1] for t in tt]))
+                     for tt in templates]
+
+        norm_vals = np.array([self.like.normPar(name).getValue()
+                              for name in names])
+        norm_bounds = np.array([self.like.normPar(name).getBounds()
+                                for name in names]) / norm_vals[:, None]
+
+        scale, ts, loglike = optimize_utils.fit_norms_sweep(
+            np.concatenate(counts), templates, np.concatenate(model),
+            np.concatenate(weights), nsweep=nsweep, tol=tol,
+            norm_bounds=norm_bounds)
+
+        for name, val in zip(names, scale * norm_vals):
+            self.set_norm(name, val, update_source=False)
+
+        for name in names:
+            self.update_source(name)
+        self._update_roi()
+
     def profile_norm(self, name, logemin=None, logemax=None, reoptimize=False,
                      xvals=None, npts=None, fix_shape=True, savestate=True,
                      **kwargs):
@@ -2595,7 +2751,8 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
 
         # If parameter is fixed temporarily free it
         par.setFree(True)
-        if optimizer['optimizer'] == 'NEWTON':
+        if (optimizer['optimizer'] == 'NEWTON' and
+                optimizer.get('norm_backend', 'pylike') == 'pylike'):
             self._create_fitcache()
 
         if logemin is not None or logemax is not None:
@@ -3028,9 +3185,153 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
 
         return self._fitcache
 
+    def _get_component_ebin_slice(self, c, ebin=None):
+        """Return the slice of the energy planes of an analysis
+        component that are inside the current energy range or inside
+        energy bin ebin of the analysis."""
+        if ebin is None:
+            logemin, logemax = self.loge_bounds
+        else:
+            logemin = self.log_energies[ebin]
+            logemax = self.log_energies[ebin + 1]
+        imin = int(utils.val_to_edge(c.log_energies, logemin)[0])
+        imax = int(utils.val_to_edge(c.log_energies, logemax)[0])
+        return slice(imin, imax)
+
+    def _create_normlike(self, free_norm_params, ebin=None):
+        """Create a NumPy likelihood for a set of free normalization
+        parameters.  The likelihood is reused as long as the free
+        parameters, the energy selection and the values of all fixed
+        parameters are unchanged."""
+
+        params = self.get_params()
+        key = (tuple([p['idx'] for p in free_norm_params]), ebin,
+               tuple(self.loge_bounds),
+               tuple([(p['value'], p['scale']) for p in params
+                      if not p['free']]))
+        if self._normlike is not None and self._normlike[0] == key:
+            return self._normlike[1]
+
+        self.logger.debug('Creating NumPy likelihood')
+        names = [p['src_name'] for p in free_norm_params]
+
+        # Evaluate the templates for a normalization of one
+        for p in free_norm_params:
+            bounds = self.like[p['idx']].getBounds()
+            self.like[p['idx']].setBounds(*utils.update_bounds(1.0, bounds))
+            self.like[p['idx']] = 1.0
+        self.like.syncSrcParams()
+
+        counts, weights, bkg, templates = [], [], [], []
+        for c in self.components:
+            esl = self._get_component_ebin_slice(c, ebin)
+            counts += [np.ravel(c.counts_map().data[esl])]
+            weights += [np.ravel(c.weight_map().data[esl])]
+            bkg += [np.ravel(c.model_counts_map(exclude=names).data[esl])]
+            templates += [np.vstack([np.ravel(c.model_counts_map(name).data[esl])
+                                     for name in names])]
+
+        for p in free_norm_params:
+            self.like[p['idx']] = p['value']
+            self.like[p['idx']].setBounds(p['min'], p['max'])
+        self.like.syncSrcParams()
+
+        normlike = BinnedNormLikelihood(np.concatenate(counts),
+                                        np.hstack(templates),
+                                        np.concatenate(bkg),
+                                        np.concatenate(weights))
+        self._normlike = (key, normlike)
+        return normlike
+
+    def _fit_newton_numpy(self, ebin=None, **kwargs):
+        """Newton fitter for norm-only fits that evaluates the
+        likelihood with NumPy."""
+
+        tol = kwargs.get('tol', self.config['optimizer']['tol'])
+        max_iter = kwargs.get('max_iter',
+                              self.config['optimizer']['max_iter'])
+        init_lambda = kwargs.get('init_lambda',
+                                 self.config['optimizer']['init_lambda'])
+
+        free_norm_params = [p for p in self.get_params(True)
+                            if p['is_norm'] is True]
+        num_free = len(free_norm_params)
+
+        o = {'fit_status': 0,
+             'fit_quality': 3,
+             'fit_success': True,
+             'edm': 0,
+             'loglike': None,
+             'values': np.ones(num_free) * np.nan,
+             'errors': np.ones(num_free) * np.nan,
+             'indices': np.zeros(num_free, dtype=int),
+             'is_norm': np.empty(num_free, dtype=bool),
+             'src_names': num_free * [None],
+             'par_names': num_free * [None],
+             }
+
+        if num_free == 0:
+            return o
+
+        for i, p in enumerate(free_norm_params):
+            o['indices'][i] = p['idx']
+            o['src_names'][i] = p['src_name']
+            o['par_names'][i] = p['par_name']
+            o['is_norm'][i] = p['is_norm']
+
+        loglike0 = -self.like()
+        normlike = self._create_normlike(free_norm_params, ebin)
+        x0 = np.array([p['value'] for p in free_norm_params])
+        bounds = np.array([[p['min'], p['max']] for p in free_norm_params])
+        fit_output = normlike.fit(x0, bounds, tol=tol, max_iter=max_iter,
+                                  init_lambda=init_lambda)
+
+        o['fit_status'] = fit_output['fit_status']
+        o['edm'] = fit_output['edm']
+        o['values'] = fit_output['values']
+        o['errors'] = fit_output['errors']
+        o['covariance'] = fit_output['covariance']
+        errinv = np.zeros_like(o['errors'])
+        m = o['errors'] > 0
+        errinv[m] = 1. / o['errors'][m]
+        o['correlation'] = o['covariance'] * np.outer(errinv, errinv)
+
+        if o['fit_status'] == 0:
+            for idx, val, err in zip(o['indices'], o['values'], o['errors']):
+                self._set_value_bounded(idx, val)
+                self.like[idx].setError(err)
+            self.like.syncSrcParams()
+        else:
+            o['fit_success'] = False
+            self.logger.error('Error in NEWTON fit. Fit Status: %i',
+                              o['fit_status'])
+
+        o['loglike'] = -self.like()
+
+        # Check the change in likelihood against pyLikelihood
+        if ebin is None and o['fit_success']:
+            dloglike = fit_output['loglike'] - normlike.loglike(x0)
+            dloglike_pylike = o['loglike'] - loglike0
+            if not np.isclose(dloglike, dloglike_pylike,
+                              rtol=1E-3, atol=10 * tol):
+                self.logger.warning('Likelihood change of NumPy backend '
+                                    '(%.4f) differs from pyLikelihood '
+                                    '(%.4f).', dloglike, dloglike_pylike)
+
+        return o
+
     def _fit_newton(self, fitcache=None, ebin=None, **kwargs):
         """Fast fitting method using newton fitter."""
 
+        norm_backend = kwargs.get('norm_backend',
+                                  self.config['optimizer']['norm_backend'])
+        if norm_backend == 'numpy' and fitcache is None:
+            prior_vals, prior_errs, has_prior = gtutils.get_priors(self.like)
+            if not np.any(has_prior):
+                return self._fit_newton_numpy(ebin=ebin, **kwargs)
+            self.logger.debug('Found parameter priors.  '
+                              'Reverting to pyLikelihood backend.')
+
         tol = kwargs.get('tol', self.config['optimizer']['tol'])
         max_iter = kwargs.get('max_iter',
                               self.config['optimizer']['max_iter'])
@@ -3179,6 +3480,7 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
             self.update_source(name)
 
         self._fitcache = None
+        self._normlike = None
 
         self.logger.info('Finished Loading XML')
 
@@ -3254,6 +3556,7 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
         """
 
         self._fitcache = None
+        self._normlike = None
 
         if src_dict is None:
             src_dict = {}
@@ -3310,6 +3613,7 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
         self.logger.info('Simulating ROI')
 
         self._fitcache = None
+        self._normlike = None
 
         if restore:
             self.logger.info('Restoring')
@@ -4269,6 +4573,11 @@ class GTBinnedAnalysis(fermipy.config.Configurable):
 
         self._srcmap_cache = {}
         self._srcmap = {}
+        self._kernel_bank = None
+        if (self.config['gtlike']['use_kernel_bank'] or
+                self.config['gtlike']['kernel_bank'] is not None):
+            self._kernel_bank = srcmap_utils.KernelBank(
+                self.config['gtlike']['kernel_bank'])
 
         # Fill dictionary of exposure corrections
         self._src_expscale = {}
@@ -4986,10 +5295,16 @@ class GTBinnedAnalysis(fermipy.config.Configurable):
         self._tmax = self._ltc.tstop
 
         self.logger.debug('Creating PSF model')
+        irf_cache = None
+        if self.config['fileio']['irf_cachedir'] is not None:
+            irf_cache = irfs.IrfCache(
+                self.config['fileio']['irf_cachedir'],
+                max_size=int(self.config['fileio']['irf_cache_size'] * 2**20))
+
         self._psf = irfs.PSFModel.create(self.roi.skydir, self._ltc,
                                          self.config['gtlike']['irfs'],
                                          self.config['selection']['evtype'],
-                                         self.energies)
+                                         self.energies, cache=irf_cache)
 
         # Bin data and create exposure cube
         if not use_external_srcmap:
@@ -5135,8 +5450,11 @@ class GTBinnedAnalysis(fermipy.config.Configurable):
             colnames = ['START', 'STOP', 'LIVETIME',
                         'RA_SCZ', 'DEC_SCZ',
                         'RA_ZENITH', 'DEC_ZENITH']
-            tab_sc = create_sc_table(self.data_files['scfile'],
-                                     colnames=colnames)
+            sc_tables = kwargs.get('sc_tables', None) or {}
+            tab_sc = sc_tables.get(self.data_files['scfile'], None)
+            if tab_sc is None:
+                tab_sc = create_sc_table(self.data_files['scfile'],
+                                         colnames=colnames)
             tab_gti = Table.read(self.files['ft1'], 'GTI')
             radius = self.config['selection']['radius'] + 10.0
             ltc_new = LTCube.create_from_gti(self.roi.skydir, tab_sc, tab_gti,
@@ -5500,12 +5818,71 @@ class GTBinnedAnalysis(fermipy.config.Configurable):
             (skydir, self._bexp.geom.axes[0].center))
         rebin = min(int(np.ceil(self.binsz / 0.01)), 8)
         shape_out = (self.enumbins + 1, self.npix, self.npix)
+        library = None
+        if self.config['gtlike']['srcmap_library'] is not None:
+            library = srcmap_utils.SourceMapLibrary(
+                self.config['gtlike']['srcmap_library'])
+
         cache = SourceMapCache.create(self._psf, exp, spatial_model,
                                       spatial_width, shape_out,
                                       self.config['binning']['binsz'],
-                                      rebin=rebin)
+                                      rebin=rebin, library=library)
+
+        # Precompute the source maps for a list of source positions
+        scan_skydir = kwargs.get('scan_skydir', None)
+        if scan_skydir is not None:
+            xpix, ypix = self.geom.to_image().coord_to_pix(scan_skydir)
+            cache.precompute(np.vstack((ypix, xpix)).T,
+                             nthread=kwargs.get('nthread', None))
+
         self._srcmap_cache[name] = cache
 
+    def _create_model_counts_templates(self, name, scan_skydir):
+        """Generate model counts maps of a source for a sequence of
+        positions from the source map cache.  The maps for all
+        positions are created in one batch and integrated over energy
+        with the current spectrum of the source.  The maps are
+        rescaled such that the counts spectrum at the current source
+        position matches the one of the likelihood model.
+
+        Parameters
+        ----------
+        name : str
+            Source name.
+
+        scan_skydir : `~astropy.coordinates.SkyCoord`
+            Source positions.
+
+        Returns
+        -------
+        templates : `~numpy.ndarray`
+            Array with shape (npos, nebin, npix, npix) of model counts.
+        """
+        cache = self._srcmap_cache[name]
+        src = self.roi[name]
+        scale = self._src_expscale.get(name, 1.0)
+
+        spectrum = self.like.logLike.getSource(str(name)).spectrum()
+        dnde = np.array([spectrum(pyLike.dArg(float(egy)))
+                         for egy in self.energies])
+
+        xpix, ypix = self.geom.to_image().coord_to_pix(scan_skydir)
+        k = cache.create_maps(np.vstack((ypix, xpix)).T)
+        templates = srcmap_utils.integrate_srcmap(k * scale, self.energies,
+                                                  dnde)
+
+        xpix, ypix = self.geom.to_image().coord_to_pix(src.skydir)
+        k0 = cache.create_map([float(ypix), float(xpix)])
+        cs0 = np.sum(srcmap_utils.integrate_srcmap(k0 * scale,
+                                                   self.energies, dnde),
+                     axis=(1, 2))
+        cs = np.sum(self.model_counts_map(name).data, axis=(1, 2))
+        norm = np.ones(len(cs))
+        m = (cs0 > 0) & (cs > 0)
+        norm[m] = cs[m] / cs0[m]
+
+        return templates * norm[None, :, None, None]
+
     def _create_srcmap(self, name, src, **kwargs):
         """Generate the source map for a source."""
 
@@ -5519,6 +5896,14 @@ class GTBinnedAnalysis(fermipy.config.Configurable):
         cache = self._srcmap_cache.get(name, None)
         if cache is not None:
             k = cache.create_map([ypix, xpix])
+        elif (self._kernel_bank is not None and
+              spatial_model in ['PointSource', 'RadialGaussian', 'RadialDisk']):
+            k = self._kernel_bank.get_kernel(self._psf, spatial_model,
+                                             spatial_width, self.npix,
+                                             self.config['binning']['binsz'],
+                                             xpix, ypix,
+                                             psf_scale_fn=psf_scale_fn)
+            k *= exp[:, np.newaxis, np.newaxis]
         else:
             k = srcmap_utils.make_srcmap(self._psf, exp, spatial_model,
                                          spatial_width,
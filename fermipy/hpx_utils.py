@@ -3,7 +3,11 @@
 Utilities for dealing with HEALPix projections and mappings
 """
 from __future__ import absolute_import, division, print_function
+import os
 import re
+import hashlib
+import tempfile
+from collections import OrderedDict
 import healpy as hp
 import numpy as np
 from astropy.io import fits
@@ -137,11 +141,9 @@ def make_hpx_to_wcs_mapping_centers(hpx, wcs):
     ipixs = -1 * np.ones(npix, int).T.flatten()
     pix_index = npix[1] * pix_crds[0:, 0] + pix_crds[0:, 1]
     if hpx._ipix is None:
-        for ipix, pix_crd in enumerate(pix_index):
-            ipixs[pix_crd] = ipix
+        ipixs[pix_index] = np.arange(len(pix_index))
     else:
-        for pix_crd, ipix in zip(pix_index, hpx._ipix):
-            ipixs[pix_crd] = ipix
+        ipixs[pix_index] = hpx._ipix
     ipixs = ipixs.reshape(npix).T.flatten()
     return ipixs, mult_val, npix
 
@@ -183,22 +185,12 @@ def make_hpx_to_wcs_mapping(hpx, wcs):
     ipixs[mask] = hp.pixelfunc.ang2pix(hpx.nside, sky_crds[0:, 1][mask],
                                        sky_crds[0:, 0][mask], hpx.nest)
 
-    # Here we are counting the number of HEALPix pixels each WCS pixel points to;
-    # this could probably be vectorized by filling a histogram.
-    d_count = {}
-    for ipix in ipixs:
-        if ipix in d_count:
-            d_count[ipix] += 1
-        else:
-            d_count[ipix] = 1
-
-    # Here we are getting a multiplicative factor that tells use how to split up
-    # the counts in each HEALPix pixel (by dividing the corresponding WCS pixels
-    # by the number of associated HEALPix pixels).
-    # This could also likely be vectorized.
-    mult_val = np.ones(ipixs.shape)
-    for i, ipix in enumerate(ipixs):
-        mult_val[i] /= d_count[ipix]
+    # Count the number of WCS pixels pointing to each HEALPix pixel and
+    # get the multiplicative factor that splits up the counts in each
+    # HEALPix pixel between the corresponding WCS pixels.
+    _, inv, counts = np.unique(ipixs, return_inverse=True,
+                               return_counts=True)
+    mult_val = 1.0 / counts[np.ravel(inv)]
 
     ipixs = ipixs.reshape(npix).flatten()
     mult_val = mult_val.reshape(npix).flatten()
@@ -214,6 +206,83 @@ def match_hpx_pixel(nside, nest, nside_pix, ipix_ring):
     return ipix_in[pix_match]
 
 
+def hpx_map_pixels(m):
+    """Return the nside, the ordering scheme and the global pixel
+    indices of the spatial pixels of a HEALPix map.  Works with both
+    `~fermipy.skymap.HpxMap` and gammapy HEALPix maps.
+    """
+    if hasattr(m, 'hpx'):
+        hpx = m.hpx
+        if hpx._ipix is None:
+            ipix = np.arange(hpx.npix)
+        else:
+            ipix = np.ravel(hpx._ipix)
+        return hpx.nside, hpx.nest, ipix
+
+    geom = m.geom.to_image()
+    ipix = np.ravel(geom.get_idx(flat=True)[0])
+    return int(np.ravel(geom.nside)[0]), geom.nest, ipix
+
+
+def make_disc_index(nside, nest, ipix, radius, vec=None):
+    """Find the pixels of a partial-sky map that lie within a given
+    angular radius of a set of directions.
+
+    Parameters
+    ----------
+    nside : int
+        HEALPix nside parameter.
+
+    nest : bool
+        True for 'NESTED', False for 'RING'.
+
+    ipix : `~numpy.ndarray`
+        Global indices of the pixels of the map.
+
+    radius : float
+        Disc radius in radians.
+
+    vec : `~numpy.ndarray`
+        Array with shape (n, 3) of unit vectors of the disc centers.
+        If None the discs are centered on the pixels of the map.
+
+    Returns
+    -------
+    idx : `~numpy.ndarray`
+        Array with shape (n, nmax) of the local indices of the pixels
+        in each disc.  Rows are padded with -1.
+
+    theta : `~numpy.ndarray`
+        Array with shape (n, nmax) of the angular distance in radians
+        of each pixel from the disc center.  Padded entries are inf.
+    """
+    ipix = np.ravel(ipix)
+    pvec = np.array(hp.pix2vec(nside, ipix, nest=nest)).T
+    if vec is None:
+        vec = pvec
+    vec = np.array(vec, ndmin=2)
+
+    isort = np.argsort(ipix)
+    ipix_sorted = ipix[isort]
+
+    discs = []
+    for v in vec:
+        gpix = hp.query_disc(nside, v, radius, inclusive=False, nest=nest)
+        i = np.clip(np.searchsorted(ipix_sorted, gpix), 0, len(ipix) - 1)
+        discs += [isort[i[ipix_sorted[i] == gpix]]]
+
+    nmax = max([len(t) for t in discs] + [1])
+    idx = np.empty((len(vec), nmax), dtype=int)
+    idx.fill(-1)
+    for i, t in enumerate(discs):
+        idx[i, :len(t)] = t
+
+    cosdist = np.einsum('ijk,ik->ij', pvec[idx], vec)
+    theta = np.arccos(np.clip(cosdist, -1.0, 1.0))
+    theta[idx < 0] = np.inf
+    return idx, theta
+
+
 def parse_hpxregion(region):
     """Parse the HPX_REG header keyword into a list of tokens."""
 
@@ -887,6 +956,11 @@ class HPX(object):
 class HpxToWcsMapping(object):
     """ Stores the indices need to conver from HEALPix to WCS """
 
+    # Registry of mappings shared by all maps with the same HEALPix
+    # and WCS geometry
+    _registry = OrderedDict()
+    registry_size = 8
+
     def __init__(self, hpx, wcs, mapping_data=None):
         """
         """
@@ -901,6 +975,8 @@ class HpxToWcsMapping(object):
             self._npix = mapping_data['npix']
         self._lmap = self._hpx[self._ipixs]
         self._valid = self._lmap >= 0
+        self._lmap_valid = np.where(self._valid, self._lmap, 0)
+        self._invalid_idx = np.flatnonzero(~self._valid)
 
     @property
     def hpx(self):
@@ -941,37 +1017,143 @@ class HpxToWcsMapping(object):
         HEALPix region"""
         return self._valid
 
+    @staticmethod
+    def make_key(hpx, wcs):
+        """Generate the registry key for a mapping between a HEALPix
+        pixelization and a WCS projection.  The key is built from the
+        nside, ordering, coordinate system and region of the HEALPix
+        pixelization, a hash of its pixel list and a hash of the WCS
+        header.
+        """
+        h = hashlib.sha1(wcs.wcs.to_header_string().encode())
+        hpix = None
+        if hpx._ipix is not None:
+            ipix = np.ascontiguousarray(hpx._ipix, dtype=np.int64)
+            hpix = hashlib.sha1(ipix.tobytes()).hexdigest()
+        return (hpx.nside, hpx.nest, hpx.coordsys, hpx.region, hpix,
+                h.hexdigest())
+
+    @classmethod
+    def create(cls, hpx, wcs, cachedir=None):
+        """Get the mapping between a HEALPix pixelization and a WCS
+        projection.  Mappings are kept in an in-memory registry and
+        are only computed once for a given pair of geometries.
+
+        Parameters
+        ----------
+        hpx : `~fermipy.hpx_utils.HPX`
+            The HEALPix pixelization.
+
+        wcs : `~fermipy.wcs_utils.WCSProj`
+            The WCS projection.
+
+        cachedir : str
+            Directory in which mappings are persisted as FITS files.
+            Mappings found in this directory are loaded instead of
+            being recomputed.  If None mappings are only kept in
+            memory.
+        """
+        key = cls.make_key(hpx, wcs)
+        if key in cls._registry:
+            cls._registry[key] = cls._registry.pop(key)
+            return cls._registry[key]
+
+        path = None
+        if cachedir is not None:
+            cachedir = os.path.abspath(os.path.expandvars(cachedir))
+            keystr = hashlib.sha1(str(key).encode()).hexdigest()
+            path = os.path.join(cachedir, 'hpx2wcs_%s.fits' % keystr)
+
+        if path is not None and os.path.isfile(path):
+            mapping = cls(hpx, wcs, cls.read_mapping_data(path))
+        else:
+            mapping = cls(hpx, wcs)
+            if path is not None:
+                if not os.path.isdir(cachedir):
+                    os.makedirs(cachedir)
+                fd, tmpfile = tempfile.mkstemp(suffix='.fits', prefix='.tmp',
+                                               dir=cachedir)
+                os.close(fd)
+                mapping.write_to_fitsfile(tmpfile, clobber=True)
+                os.rename(tmpfile, path)
+
+        cls._registry[key] = mapping
+        while len(cls._registry) > cls.registry_size:
+            cls._registry.popitem(last=False)
+        return mapping
+
+    @classmethod
+    def clear_registry(cls):
+        """Remove all mappings from the in-memory registry."""
+        cls._registry.clear()
+
     def write_to_fitsfile(self, fitsfile, clobber=True):
         """Write this mapping to a FITS file, to avoid having to recompute it
         """
-        from fermipy.skymap import Map
         hpx_header = self._hpx.make_header()
-        index_map = Map(self.ipixs, self.wcs)
-        mult_map = Map(self.mult_val, self.wcs)
-        prim_hdu = index_map.create_primary_hdu()
-        mult_hdu = index_map.create_image_hdu()
-        for key in ['COORDSYS', 'ORDERING', 'PIXTYPE',
-                    'ORDERING', 'ORDER', 'NSIDE',
-                    'FIRSTPIX', 'LASTPIX']:
+        wcs_header = self.wcs.wcs.to_header()
+        prim_hdu = fits.PrimaryHDU(self.ipixs.reshape(self.npix).T,
+                                   header=wcs_header)
+        mult_hdu = fits.ImageHDU(self.mult_val.reshape(self.npix).T,
+                                 header=wcs_header, name='MULT_VAL')
+        for key in ['COORDSYS', 'ORDERING', 'PIXTYPE', 'ORDER', 'NSIDE',
+                    'FIRSTPIX', 'LASTPIX', 'HPX_CONV', 'HPX_REG',
+                    'INDXSCHM']:
+            if key not in hpx_header:
+                continue
             prim_hdu.header[key] = hpx_header[key]
             mult_hdu.header[key] = hpx_header[key]
 
         hdulist = fits.HDUList([prim_hdu, mult_hdu])
-        hdulist.writeto(fitsfile, clobber=clobber)
+        hdulist.writeto(fitsfile, overwrite=clobber)
+
+    @staticmethod
+    def read_mapping_data(fitsfile):
+        """Read the mapping arrays written by
+        `~fermipy.hpx_utils.HpxToWcsMapping.write_to_fitsfile`."""
+        with fits.open(fitsfile) as hdulist:
+            ipixs = np.array(hdulist[0].data)
+            mult_val = np.array(hdulist[1].data)
+        return dict(ipixs=ipixs.T.flatten(),
+                    mult_val=mult_val.T.flatten(),
+                    npix=ipixs.shape[::-1])
 
     @classmethod
     def create_from_fitsfile(cls, fitsfile):
         """ Read a fits file and use it to make a mapping
         """
-        from fermipy.skymap import Map
-        index_map = Map.create_from_fits(fitsfile)
-        mult_map = Map.create_from_fits(fitsfile, hdu=1)
-        ff = fits.open(fitsfile)
-        hpx = HPX.create_from_hdu(ff[0])
-        mapping_data = dict(ipixs=index_map.counts,
-                            mult_val=mult_map.counts,
-                            npix=mult_map.counts.shape)
-        return cls(hpx, index_map.wcs, mapping_data)
+        mapping_data = cls.read_mapping_data(fitsfile)
+        with fits.open(fitsfile) as hdulist:
+            hpx = HPX.create_from_header(hdulist[0].header)
+            wcs = WCSProj(WCS(hdulist[0].header), mapping_data['npix'])
+        return cls(hpx, wcs, mapping_data)
+
+    def transform(self, hpx_data, normalize=True):
+        """Reproject HEALPix data to the WCS grid.  All planes of the
+        input array are reprojected in a single operation.
+
+        Parameters
+        ----------
+        hpx_data : `~numpy.ndarray`
+            Input HEALPix data with the pixel index as the last
+            dimension, e.g. an array with shape (nebin, npix).
+
+        normalize : bool
+            True -> perserve integral by splitting HEALPix values
+            between bins
+
+        Returns
+        -------
+        wcs_data : `~numpy.ndarray`
+            Array with shape hpx_data.shape[:-1] + (nx, ny).
+        """
+        hpx_data = np.asarray(hpx_data, dtype=float)
+        shape = hpx_data.shape[:-1]
+        wcs_data = np.take(hpx_data, self._lmap_valid, axis=-1)
+        if normalize:
+            wcs_data *= self._mult_val
+        wcs_data[..., self._invalid_idx] = 0.0
+        return wcs_data.reshape(shape + tuple(self.npix))
 
     def fill_wcs_map_from_hpx_data(self, hpx_data, wcs_data, normalize=True):
         """Fills the wcs map from the hpx data using the pre-calculated
@@ -982,8 +1164,6 @@ class HpxToWcsMapping(object):
         normalize : True -> perserve integral by splitting HEALPix values between bins
 
         """
-        # FIXME, there really ought to be a better way to do this
-        
         hpx_naxis = len(hpx_data.shape)
         wcs_naxis = len(wcs_data.shape)
 
@@ -991,24 +1171,11 @@ class HpxToWcsMapping(object):
             raise ValueError("HPX.fill_wcs_map_from_hpx_data: HPX naxis should be 1 less that WCS naxis: %i, %i"%(hpx_naxis, wcs_naxis))
         if hpx_naxis == 2:
             if hpx_data.shape[1] != wcs_data.shape[2]:
-                raise ValueError("HPX.fill_wcs_map_from_hpx_data: size of energy axes don't match: %i, %i"%(hpx_naxis[1], wcs_naxis[2]))
-
-        lmap_valid = self._lmap[self._valid]
-        wcs_layer_shape = wcs_data.shape[0]*wcs_data.shape[1]
-        if hpx_naxis == 2:
-            for i in range(hpx_data.shape[1]):
-                wcs_data_layer = np.zeros(wcs_layer_shape)
-                wcs_data_layer[self._valid] = hpx_data[:,i][lmap_valid]
-                orig_value = wcs_data_layer.sum()
-                if normalize:
-                    wcs_data_layer *= self._mult_val
-                wcs_data[:,:,i].flat = wcs_data_layer
+                raise ValueError("HPX.fill_wcs_map_from_hpx_data: size of energy axes don't match: %i, %i"%(hpx_data.shape[1], wcs_data.shape[2]))
+            wcs_data[...] = np.moveaxis(
+                self.transform(hpx_data.T, normalize), 0, -1)
         else:
-            wcs_data_flat = np.zeros(wcs_layer_shape)
-            wcs_data_flat[self._valid] = hpx_data[lmap_valid]
-            if normalize:
-                wcs_data_flat *= self._mult_val            
-            wcs_data.flat = wcs_data_flat
+            wcs_data.flat = self.transform(hpx_data, normalize)
 
     def make_wcs_data_from_hpx_data(self, hpx_data, wcs, normalize=True):
         """ Creates and fills a wcs map from the hpx data using the pre-calculated
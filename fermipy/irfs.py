@@ -1,7 +1,11 @@
 # Licensed under a 3-clause BSD style license - see LICENSE.rst
 from __future__ import absolute_import, division, print_function
+import os
 import glob
 import re
+import hashlib
+import tempfile
+from collections import OrderedDict
 import numpy as np
 from scipy.interpolate import RegularGridInterpolator
 from scipy.interpolate import UnivariateSpline
@@ -303,6 +307,174 @@ class ExposureMap(HpxMap):
         return cls(exp, hpx)
 
 
+def ltcube_checksum(ltc):
+    """Compute a checksum of the contents of a livetime cube.  The
+    checksum is derived from the livetime and weighted livetime
+    arrays, the incidence angle binning and the HEALPix geometry.
+    The checksum is computed once and stored on the cube.  Methods
+    that modify the livetime (e.g. `LTCube.append_from_gti`) reset
+    it but in-place changes to the ``data`` array are not detected.
+
+    Parameters
+    ----------
+    ltc : `~fermipy.irfs.LTCube`
+
+    Returns
+    -------
+    checksum : str
+        Hexadecimal SHA1 digest.
+    """
+    checksum = getattr(ltc, '_checksum', None)
+    if checksum is not None:
+        return checksum
+
+    h = hashlib.sha1()
+    h.update(('%i %s %s' % (ltc.hpx.nside, ltc.hpx.nest,
+                            ltc.hpx.coordsys)).encode())
+    h.update(np.ascontiguousarray(ltc.costh_edges, dtype=float).tobytes())
+    h.update(np.ascontiguousarray(ltc.data, dtype=float).tobytes())
+    if ltc.data_wt is not None:
+        h.update(np.ascontiguousarray(ltc.data_wt, dtype=float).tobytes())
+    checksum = h.hexdigest()
+    if hasattr(ltc, '_checksum'):
+        ltc._checksum = checksum
+    return checksum
+
+
+class IrfCache(object):
+    """Persistent on-disk cache for exposure-weighted IRF products
+    (PSF, energy dispersion and exposure).  Each entry is stored as a
+    separate npz file in ``cachedir`` and is addressed by a hash of
+    the livetime cube contents, the sky direction rounded to
+    ``skydir_tol``, the event class/types and the evaluation grids.
+    When the total size of the cache exceeds ``max_size`` the least
+    recently used entries are removed.
+
+    Parameters
+    ----------
+    cachedir : str
+        Path to the cache directory.  Will be created if it does not
+        exist.
+
+    max_size : int
+        Maximum size of the cache in bytes.  If None the size of the
+        cache is not limited.
+
+    skydir_tol : float
+        Tolerance in degrees to which sky directions are rounded when
+        generating the cache key.
+    """
+
+    def __init__(self, cachedir, max_size=2**30, skydir_tol=0.01):
+        self._cachedir = os.path.abspath(os.path.expandvars(cachedir))
+        self._max_size = max_size
+        self._skydir_tol = skydir_tol
+        utils.mkdir(self._cachedir)
+
+    @property
+    def cachedir(self):
+        return self._cachedir
+
+    @property
+    def max_size(self):
+        return self._max_size
+
+    def make_key(self, name, skydir, ltc, event_class, event_types,
+                 *args, **kwargs):
+        """Generate the cache key for an IRF product.
+
+        Parameters
+        ----------
+        name : str
+            Name of the IRF product.
+
+        args : list
+            Evaluation grids (e.g. energies or angular offsets).
+
+        kwargs : dict
+            Additional scalar parameters of the calculation.
+        """
+        h = hashlib.sha1()
+        h.update(name.encode())
+        h.update(ltcube_checksum(ltc).encode())
+
+        skydir = skydir.icrs
+        radec = np.round(np.array([skydir.ra.deg, skydir.dec.deg]) /
+                         self._skydir_tol).astype(int)
+        h.update(('%i %i' % tuple(radec)).encode())
+        h.update(('%s %s' % (event_class, list(event_types))).encode())
+        for x in args:
+            x = np.ascontiguousarray(x, dtype=float)
+            h.update(str(x.shape).encode())
+            h.update(x.tobytes())
+        h.update(str(sorted(kwargs.items())).encode())
+        return '%s_%s' % (name, h.hexdigest())
+
+    def get(self, key):
+        """Return the array associated with ``key`` or None if the key
+        is not in the cache."""
+        path = os.path.join(self.cachedir, key + '.npz')
+        try:
+            with np.load(path) as f:
+                val = f['data']
+            os.utime(path, None)
+        except (IOError, OSError, KeyError, ValueError):
+            return None
+        return val
+
+    def put(self, key, val):
+        """Add an array to the cache."""
+        fd, tmpfile = tempfile.mkstemp(suffix='.npz', prefix='.tmp',
+                                       dir=self.cachedir)
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, data=val)
+        os.rename(tmpfile, os.path.join(self.cachedir, key + '.npz'))
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the size of the
+        cache is smaller than ``max_size``."""
+        if self.max_size is None:
+            return
+
+        entries = []
+        for path in glob.glob(os.path.join(self.cachedir, '*.npz')):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries += [(st.st_mtime, st.st_size, path)]
+
+        size = sum([t[1] for t in entries])
+        for mtime, nbytes, path in sorted(entries):
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            size -= nbytes
+
+    def clear(self):
+        """Remove all entries from the cache."""
+        for path in glob.glob(os.path.join(self.cachedir, '*.npz')):
+            os.remove(path)
+
+    def call(self, fn, skydir, ltc, event_class, event_types, *args,
+             **kwargs):
+        """Evaluate the IRF function ``fn`` returning the cached value
+        if one exists.  ``fn`` is called with the signature
+        ``fn(skydir, ltc, event_class, event_types, *args,
+        **kwargs)``."""
+        key = self.make_key(fn.__name__, skydir, ltc, event_class,
+                            event_types, *args, **kwargs)
+        val = self.get(key)
+        if val is None:
+            val = fn(skydir, ltc, event_class, event_types, *args, **kwargs)
+            self.put(key, val)
+        return val
+
+
 class PSFModel(object):
     """Class that stores a pre-computed model of the PSF versus energy.  
 
@@ -355,6 +527,9 @@ class PSFModel(object):
                                                np.log(self._wts),
                                                bounds_error=False,
                                                fill_value=None)
+        self._log10_psf = np.log10(self._psf)
+        self._cache = OrderedDict()
+        self._cache_size = 256
 
     def eval(self, ebin, dtheta, scale_fn=None):
         """Evaluate the PSF at the given energy bin index.
@@ -381,9 +556,75 @@ class PSFModel(object):
             dtheta = dtheta / scale_fn(self.energies[ebin])
             scale_factor = 1. / scale_fn(self.energies[ebin])**2
 
-        vals = 10**np.interp(dtheta, self.dtheta, np.log10(self.val[:, ebin]))
+        vals = 10**np.interp(dtheta, self.dtheta, self._log10_psf[:, ebin])
         return vals * scale_factor
 
+    def eval_ebins(self, dtheta, scale_fn=None):
+        """Evaluate the PSF at all energies of the model in a single
+        call.  This is equivalent to calling
+        `~fermipy.irfs.PSFModel.eval` for each energy bin.
+
+        Parameters
+        ----------
+        dtheta : array_like
+            Array of angular separations in degrees.  The first
+            dimension runs over energy and must have length 1 (the
+            same separations are used for every energy) or the number
+            of energies of the model.
+
+        scale_fn : callable
+            Function that evaluates the PSF scaling function.
+            Argument is energy in MeV.
+
+        Returns
+        -------
+        vals : `~numpy.ndarray`
+            Array of PSF values with energy along the first dimension.
+        """
+        if scale_fn is None and self.scale_fn is not None:
+            scale_fn = self.scale_fn
+
+        dtheta = np.array(dtheta, ndmin=1, dtype=float)
+        negy = len(self.energies)
+        eshape = (negy,) + (1,) * (dtheta.ndim - 1)
+        shape = (negy,) + dtheta.shape[1:]
+
+        # Interpolate log(PSF) on the common angular grid.  When the
+        # separations are the same for every energy the grid indices
+        # are computed once and shared.
+        if scale_fn is None and dtheta.shape[0] == 1:
+            vals = utils.interp_profiles(dtheta[0], self.dtheta,
+                                         self._log10_psf.T)
+            return 10**vals
+
+        scale = np.reshape(scale_fn(self.energies) if scale_fn is not None
+                           else np.ones(negy), eshape)
+        dtheta = np.broadcast_to(dtheta / scale, shape)
+        vals = np.zeros(shape)
+        for i in range(negy):
+            vals[i] = np.interp(dtheta[i], self.dtheta,
+                                self._log10_psf[:, i])
+        return 10**vals / scale**2
+
+    def __getstate__(self):
+        # Cache keys may contain functions that cannot be pickled
+        state = self.__dict__.copy()
+        state['_cache'] = OrderedDict()
+        return state
+
+    def memoize(self, key, fn, *args, **kwargs):
+        """Return the cached result of ``fn(*args, **kwargs)`` stored
+        under ``key``.  Results are kept in a bounded LRU cache attached
+        to this object and are computed on the first request."""
+        try:
+            val = self._cache.pop(key)
+        except KeyError:
+            val = fn(*args, **kwargs)
+            if len(self._cache) >= self._cache_size:
+                self._cache.popitem(last=False)
+        self._cache[key] = val
+        return val
+
     def interp(self, energies, dtheta, scale_fn=None):
         """Evaluate the PSF model at an array of energies and angular
         separations.
@@ -432,6 +673,16 @@ class PSFModel(object):
             Argument is energy in MeV.
         """
 
+        if scale_fn is None and self.scale_fn:
+            scale_fn = self.scale_fn
+
+        key = ('interp_bin', utils.array_key(egy_bins),
+               utils.array_key(dtheta), scale_fn)
+        return self.memoize(key, self._interp_bin, egy_bins, dtheta,
+                            scale_fn).copy()
+
+    def _interp_bin(self, egy_bins, dtheta, scale_fn=None):
+
         npts = 4
         egy_bins = np.exp(utils.split_bin_edges(np.log(egy_bins), npts))
         egy = np.exp(utils.edge_to_center(np.log(egy_bins)))
@@ -453,6 +704,15 @@ class PSFModel(object):
         if energies is None:
             energies = self.energies
 
+        if scale_fn is None and self.scale_fn:
+            scale_fn = self.scale_fn
+
+        key = ('containment_angle', utils.array_key(energies), fraction,
+               scale_fn)
+        return self.memoize(key, self._containment_angle, energies,
+                            fraction, scale_fn).copy()
+
+    def _containment_angle(self, energies, fraction, scale_fn):
         vals = self.interp(energies[np.newaxis, :], self.dtheta[:, np.newaxis],
                            scale_fn=scale_fn)
         dtheta = np.radians(self.dtheta[:, np.newaxis] * np.ones(vals.shape))
@@ -475,13 +735,19 @@ class PSFModel(object):
 
         csum = delta * avg_val * 2 * np.pi
         csum = np.cumsum(csum, axis=0)
-        theta = np.zeros(csum.shape[1])
 
-        for i in range(csum.shape[1]):
-            theta[i] = np.degrees(np.interp(fraction, csum[:, i],
-                                            dtheta[1:, i]))
-
-        return theta
+        # Vectorized version of np.interp applied to each column
+        cols = np.arange(csum.shape[1])
+        n = np.sum(csum <= fraction, axis=0)
+        i0 = np.clip(n - 1, 0, csum.shape[0] - 1)
+        i1 = np.clip(n, 0, csum.shape[0] - 1)
+        c0, c1 = csum[i0, cols], csum[i1, cols]
+        x0, x1 = dtheta[1:][i0, cols], dtheta[1:][i1, cols]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            theta = np.where(c1 > c0,
+                             x0 + (fraction - c0) * (x1 - x0) / (c1 - c0),
+                             x0)
+        return np.degrees(theta)
 
     def set_scale_fn(self, scale_fn):
         self._scale_fn = scale_fn
@@ -512,7 +778,7 @@ class PSFModel(object):
 
     @classmethod
     def create(cls, skydir, ltc, event_class, event_types, energies, cth_bins=None,
-               ndtheta=500, use_edisp=False, fn=None, nbin=64):
+               ndtheta=500, use_edisp=False, fn=None, nbin=64, cache=None):
         """Create a PSFModel object.  This class can be used to evaluate the
         exposure-weighted PSF for a source with a given observing
         profile and energy distribution.
@@ -536,6 +802,10 @@ class PSFModel(object):
         fn : `~fermipy.spectrum.SpectralFunction`
             Model for the spectral energy distribution of the source.
 
+        cache : `~fermipy.irfs.IrfCache`
+            Cache used to store and retrieve the exposure-weighted IRF
+            products.  If None the IRF products are always recomputed.
+
         """
 
         if isinstance(event_types, int):
@@ -554,17 +824,19 @@ class PSFModel(object):
 
         if use_edisp:
             psf = create_wtd_psf(skydir, ltc, event_class, event_types,
-                                 dtheta, egy_bins, cth_bins, fn, nbin=nbin)
+                                 dtheta, egy_bins, cth_bins, fn, nbin=nbin,
+                                 cache=cache)
             wts = calc_counts_edisp(skydir, ltc, event_class, event_types,
-                                    egy_bins, cth_bins, fn, nbin=nbin)
+                                    egy_bins, cth_bins, fn, nbin=nbin,
+                                    cache=cache)
         else:
             psf = create_avg_psf(skydir, ltc, event_class, event_types,
-                                 dtheta, energies, cth_bins)
+                                 dtheta, energies, cth_bins, cache=cache)
             wts = calc_counts(skydir, ltc, event_class, event_types,
-                              egy_bins, cth_bins, fn)
+                              egy_bins, cth_bins, fn, cache=cache)
 
         exp = calc_exp(skydir, ltc, event_class, event_types,
-                       energies, cth_bins)
+                       energies, cth_bins, cache=cache)
 
         return cls(dtheta, energies, cth_bins, np.squeeze(exp), np.squeeze(psf),
                    np.squeeze(wts))
@@ -674,7 +946,7 @@ def create_aeff(event_class, event_type, egy, cth):
 
 
 def calc_exp(skydir, ltc, event_class, event_types,
-             egy, cth_bins, npts=None):
+             egy, cth_bins, npts=None, cache=None):
     """Calculate the exposure on a 2D grid of energy and incidence angle.
 
     Parameters
@@ -685,6 +957,9 @@ def calc_exp(skydir, ltc, event_class, event_types,
         set such that incidence angle is sampled on intervals of <
         0.05 in Cos(Theta).
 
+    cache : `~fermipy.irfs.IrfCache`
+        Cache used to store and retrieve the result.
+
     Returns
     -------
     exp : `~numpy.ndarray`
@@ -692,6 +967,10 @@ def calc_exp(skydir, ltc, event_class, event_types,
 
     """
 
+    if cache is not None:
+        return cache.call(calc_exp, skydir, ltc, event_class, event_types,
+                          egy, cth_bins, npts=npts)
+
     if npts is None:
         npts = int(np.ceil(np.max(cth_bins[1:] - cth_bins[:-1]) / 0.025))
 
@@ -738,7 +1017,7 @@ def create_avg_rsp(rsp_fn, skydir, ltc, event_class, event_types, x,
 
 
 def create_avg_psf(skydir, ltc, event_class, event_types, dtheta,
-                   egy, cth_bins, npts=None):
+                   egy, cth_bins, npts=None, cache=None):
     """Generate model for exposure-weighted PSF averaged over incidence
     angle.
 
@@ -749,7 +1028,13 @@ def create_avg_psf(skydir, ltc, event_class, event_types, dtheta,
 
     cth_bins : `~numpy.ndarray`
         Bin edges in cosine of the incidence angle.
+
+    cache : `~fermipy.irfs.IrfCache`
+        Cache used to store and retrieve the result.
     """
+    if cache is not None:
+        return cache.call(create_avg_psf, skydir, ltc, event_class,
+                          event_types, dtheta, egy, cth_bins, npts=npts)
 
     return create_avg_rsp(create_psf, skydir, ltc,
                           event_class, event_types,
@@ -757,7 +1042,7 @@ def create_avg_psf(skydir, ltc, event_class, event_types, dtheta,
 
 
 def create_avg_edisp(skydir, ltc, event_class, event_types, erec,
-                     egy, cth_bins, npts=None):
+                     egy, cth_bins, npts=None, cache=None):
     """Generate model for exposure-weighted DRM averaged over incidence
     angle.
 
@@ -768,14 +1053,20 @@ def create_avg_edisp(skydir, ltc, event_class, event_types, erec,
 
     cth_bins : `~numpy.ndarray`
         Bin edges in cosine of the incidence angle.
+
+    cache : `~fermipy.irfs.IrfCache`
+        Cache used to store and retrieve the result.
     """
+    if cache is not None:
+        return cache.call(create_avg_edisp, skydir, ltc, event_class,
+                          event_types, erec, egy, cth_bins, npts=npts)
     return create_avg_rsp(create_edisp, skydir, ltc,
                           event_class, event_types,
                           erec, egy,  cth_bins, npts)
 
 
 def create_wtd_psf(skydir, ltc, event_class, event_types, dtheta,
-                   egy_bins, cth_bins, fn, nbin=64, npts=1):
+                   egy_bins, cth_bins, fn, nbin=64, npts=1, cache=None):
     """Create an exposure- and dispersion-weighted PSF model for a source
     with spectral parameterization ``fn``.  The calculation performed
     by this method accounts for the influence of energy dispersion on
@@ -804,11 +1095,11 @@ def create_wtd_psf(skydir, ltc, event_class, event_types, dtheta,
     etrue = 10**utils.edge_to_center(np.log10(etrue_bins))
 
     psf = create_avg_psf(skydir, ltc, event_class, event_types, dtheta,
-                         etrue, cth_bins)
+                         etrue, cth_bins, cache=cache)
     drm = calc_drm(skydir, ltc, event_class, event_types,
-                   egy_bins, cth_bins, nbin=nbin)
+                   egy_bins, cth_bins, nbin=nbin, cache=cache)
     cnts = calc_counts(skydir, ltc, event_class, event_types,
-                       etrue_bins, cth_bins, fn)
+                       etrue_bins, cth_bins, fn, cache=cache)
 
     wts = drm * cnts[None, :, :]
     wts_norm = np.sum(wts, axis=1)
@@ -827,7 +1118,7 @@ def create_wtd_psf(skydir, ltc, event_class, event_types, dtheta,
 
 
 def calc_drm(skydir, ltc, event_class, event_types,
-             egy_bins, cth_bins, nbin=64):
+             egy_bins, cth_bins, nbin=64, cache=None):
     """Calculate the detector response matrix."""
     npts = int(np.ceil(128. / bins_per_dec(egy_bins)))
     egy_bins = np.exp(utils.split_bin_edges(np.log(egy_bins), npts))
@@ -837,14 +1128,14 @@ def calc_drm(skydir, ltc, event_class, event_types,
     egy_width = utils.edge_to_width(egy_bins)
     etrue = 10**utils.edge_to_center(np.log10(etrue_bins))
     edisp = create_avg_edisp(skydir, ltc, event_class, event_types,
-                             egy, etrue, cth_bins)
+                             egy, etrue, cth_bins, cache=cache)
     edisp = edisp * egy_width[:, None, None]
     edisp = sum_bins(edisp, 0, npts)
     return edisp
 
 
 def calc_counts(skydir, ltc, event_class, event_types,
-                egy_bins, cth_bins, fn, npts=1):
+                egy_bins, cth_bins, fn, npts=1, cache=None):
     """Calculate the expected counts vs. true energy and incidence angle
     for a source with spectral parameterization ``fn``.
 
@@ -866,7 +1157,7 @@ def calc_counts(skydir, ltc, event_class, event_types,
     #npts = int(np.ceil(32. / bins_per_dec(egy_bins)))
     egy_bins = np.exp(utils.split_bin_edges(np.log(egy_bins), npts))
     exp = calc_exp(skydir, ltc, event_class, event_types,
-                   egy_bins, cth_bins)
+                   egy_bins, cth_bins, cache=cache)
     dnde = fn.dnde(egy_bins)
     cnts = loglog_quad(egy_bins, exp * dnde[:, None], 0)
     cnts = sum_bins(cnts, 0, npts)
@@ -874,7 +1165,7 @@ def calc_counts(skydir, ltc, event_class, event_types,
 
 
 def calc_counts_edisp(skydir, ltc, event_class, event_types,
-                      egy_bins, cth_bins, fn, nbin=16, npts=1):
+                      egy_bins, cth_bins, fn, nbin=16, npts=1, cache=None):
     """Calculate the expected counts vs. observed energy and true
     incidence angle for a source with spectral parameterization ``fn``.
 
@@ -903,9 +1194,9 @@ def calc_counts_edisp(skydir, ltc, event_class, event_types,
     egy_bins = np.exp(utils.split_bin_edges(np.log(egy_bins), npts))
     etrue_bins = 10**np.linspace(1.0, 6.5, nbin * 5.5 + 1)
     drm = calc_drm(skydir, ltc, event_class, event_types,
-                   egy_bins, cth_bins, nbin=nbin)
+                   egy_bins, cth_bins, nbin=nbin, cache=cache)
     cnts_etrue = calc_counts(skydir, ltc, event_class, event_types,
-                             etrue_bins, cth_bins, fn)
+                             etrue_bins, cth_bins, fn, cache=cache)
 
     cnts = np.sum(cnts_etrue[None, :, :] * drm[:, :, :], axis=1)
     cnts = sum_bins(cnts, 0, npts)
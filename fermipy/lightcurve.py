@@ -7,9 +7,11 @@ import shutil
 import logging
 import yaml
 import json
+import hashlib
+import tempfile
+import traceback
 from collections import OrderedDict
 from multiprocessing import Pool
-from functools import partial
 import sys
 
 import numpy as np
@@ -31,6 +33,8 @@ from astropy.table import Table, Column
 
 import pyLikelihood as pyLike
 
+logger = logging.getLogger(__name__)
+
 
 def _fit_lc(gta, name, **kwargs):
 
@@ -130,6 +134,7 @@ def _fit_lc(gta, name, **kwargs):
 def _process_lc_bin(itime, name, config, basedir, workdir, diff_sources, const_spectrum, roi,
                     **kwargs):
     i, time = itime
+    sc_tables = kwargs.pop('sc_tables', None)
 
     roi = copy.deepcopy(roi)
 
@@ -155,7 +160,7 @@ def _process_lc_bin(itime, name, config, basedir, workdir, diff_sources, const_s
         from fermipy.gtanalysis import GTAnalysis
         gta = GTAnalysis(config, roi, loglevel=logging.DEBUG)
         gta.logger.info('Fitting time range %i %i' % (time[0], time[1]))
-        gta.setup()
+        gta.setup(sc_tables=sc_tables)
         # gta.load_roi(workdir+'/_lc_%s.npy'%name)
     except:
         print('Analysis failed in time range %i %i' %
@@ -208,6 +213,149 @@ def _process_lc_bin(itime, name, config, basedir, workdir, diff_sources, const_s
     return o
 
 
+_lc_worker_data = {}
+
+
+def _init_lc_worker(data):
+    """Initialize the data shared by all light curve bins.  When
+    called as the initializer of a process pool the (read-only)
+    contents of ``data`` such as the spacecraft tables are inherited
+    by the worker processes and are not copied for every bin."""
+    _lc_worker_data.clear()
+    _lc_worker_data.update(data)
+
+
+def _process_lc_task(itime):
+    """Process a single light curve bin with the setup shared through
+    `_init_lc_worker` and write the result to disk as soon as it is
+    available.  Exceptions are caught and logged such that the failure
+    of one bin does not abort the processing of the remaining bins."""
+
+    i, time = itime
+    kwargs = dict(_lc_worker_data['kwargs'])
+    kwargs.update(_lc_worker_data['args'])
+
+    try:
+        o = _process_lc_bin(itime, **kwargs)
+    except Exception:
+        o = {'fit_success': False,
+             'fit_quality': 0,
+             'fit_status': -1,
+             'error': traceback.format_exc()}
+        logger.error('Analysis failed in time range %i %i\n%s',
+                     time[0], time[1], o['error'])
+
+    outfile = _lc_worker_data.get('outfiles', {}).get(i, None)
+    if outfile is not None:
+        _write_lc_bin(o, outfile)
+
+    return i, o
+
+
+def _write_lc_bin(o, outfile):
+    """Write the result dictionary of a light curve bin to a npy file.
+    The file is first written under a temporary name such that an
+    interrupted write never leaves a partial result."""
+
+    fd, tmpfile = tempfile.mkstemp(suffix='.npy', prefix='.tmp',
+                                   dir=os.path.dirname(outfile))
+    with os.fdopen(fd, 'wb') as f:
+        np.save(f, o)
+    os.rename(tmpfile, outfile)
+
+
+def _calc_lc_bin_cost(times, sc_tables=None):
+    """Estimate the relative computational cost of each light curve
+    bin.  The cost is taken to be proportional to the livetime
+    accumulated in the bin if spacecraft tables are available and to
+    the bin duration otherwise.  The livetime is summed over all
+    spacecraft tables such that components with separate FT2 files
+    covering different time ranges all contribute."""
+
+    tmin = np.asarray(times[:-1])
+    tmax = np.asarray(times[1:])
+
+    if not sc_tables:
+        return tmax - tmin
+
+    cost = np.zeros(len(tmin))
+    for tab_sc in sc_tables:
+        start = np.asarray(tab_sc['START'])
+        live = np.cumsum(np.concatenate(([0.0], tab_sc['LIVETIME'])))
+        idx0 = np.searchsorted(start, tmin)
+        idx1 = np.searchsorted(start, tmax)
+        cost += live[idx1] - live[idx0]
+    return cost
+
+
+def _hash_lc_config(config, kwargs, const_spectrum):
+    """Compute a hash of the configuration of a light curve analysis.
+    Options that only affect the scheduling of the time bins or the
+    output of the light curve are excluded from the hash."""
+
+    skip_keys = ['multithread', 'nthread', 'resume', 'save_bin_data',
+                 'write_fits', 'write_npy', 'make_plots', 'prefix',
+                 'time_bins', 'nbins', 'binsz', 'systematic']
+    kwargs = {k: v for k, v in kwargs.items() if k not in skip_keys}
+
+    def _default(x):
+        if isinstance(x, (np.ndarray, np.generic)):
+            return x.tolist()
+        return str(x)
+
+    s = json.dumps([config, kwargs, const_spectrum], sort_keys=True,
+                   default=_default)
+    return hashlib.md5(s.encode()).hexdigest()
+
+
+class LightCurveStore(object):
+    """Checkpoint store for the results of individual light curve
+    bins.  The result of each bin is saved to a separate npy file
+    keyed by the source name, the time range of the bin and a hash of
+    the analysis configuration.
+
+    Parameters
+    ----------
+    path : str
+        Path to the directory in which results are stored.
+
+    name : str
+        Name of the source.
+
+    config_hash : str
+        Hash of the light curve configuration.
+    """
+
+    def __init__(self, path, name, config_hash):
+        self._path = utils.mkdir(path)
+        self._name = name.lower().replace(' ', '_')
+        self._config_hash = config_hash
+
+    @property
+    def path(self):
+        return self._path
+
+    def get_filename(self, tmin, tmax):
+        """Get the path to the result file of a time bin."""
+        return os.path.join(self.path, 'lightcurve_%s_%.0f_%.0f_%s.npy' %
+                            (self._name, tmin, tmax, self._config_hash[:12]))
+
+    def load(self, tmin, tmax):
+        """Load the result of a time bin.  Returns None if no result
+        exists for this bin."""
+        filename = self.get_filename(tmin, tmax)
+        if not os.path.isfile(filename):
+            return None
+        try:
+            return np.load(filename, allow_pickle=True).flat[0]
+        except (IOError, OSError, ValueError, EOFError):
+            return None
+
+    def save(self, tmin, tmax, o):
+        """Save the result of a time bin."""
+        _write_lc_bin(o, self.get_filename(tmin, tmax))
+
+
 def calcTS_var(loglike, loglike_const, flux_err, flux_const, systematic):
     # calculates variability according to Eq. 4 in 2FGL
     # including correction using non-numbered Eq. following Eq. 4
@@ -397,20 +545,79 @@ class LightCurve(object):
 
         outdir = kwargs.get('outdir', None)
         basedir = outdir + '/' if outdir is not None else ''
-        wrap = partial(_process_lc_bin, name=name, config=config,
-                       basedir=basedir, workdir=self.workdir, diff_sources=diff_sources,
-                       const_spectrum=const_spectrum, roi=self.roi, **kwargs)
-        itimes = enumerate(zip(times[:-1], times[1:]))
+        utils.mkdir(os.path.join(self.workdir, basedir))
+
+        # Load the spacecraft tables once and share them with all bins
+        sc_tables = {}
+        if kwargs['use_local_ltcube']:
+            colnames = ['START', 'STOP', 'LIVETIME',
+                        'RA_SCZ', 'DEC_SCZ',
+                        'RA_ZENITH', 'DEC_ZENITH']
+            for c in self.components:
+                scfile = c.data_files['scfile']
+                if scfile not in sc_tables:
+                    sc_tables[scfile] = \
+                        fermipy.gtanalysis.create_sc_table(scfile,
+                                                           colnames=colnames)
+
+        store = LightCurveStore(os.path.join(self.workdir, basedir), name,
+                                _hash_lc_config(config, kwargs,
+                                                const_spectrum))
+
+        itimes = list(enumerate(zip(times[:-1], times[1:])))
+        outfiles = {}
+        for i, time in itimes:
+            outfiles[i] = store.get_filename(time[0], time[1])
+
+        # Skip bins that were successfully completed in a previous run
+        mapo = [None] * (len(times) - 1)
+        if kwargs.get('resume', False):
+            for i, time in itimes:
+                m = store.load(time[0], time[1])
+                if m is not None and m.get('fit_success', False):
+                    mapo[i] = m
+            self.logger.info('Resuming light curve: %i of %i time bins '
+                             'already completed.',
+                             len([m for m in mapo if m is not None]),
+                             len(mapo))
+
+        # Schedule the most expensive bins first
+        cost = _calc_lc_bin_cost(times, list(sc_tables.values()))
+        itimes = [itimes[i] for i in np.argsort(-cost, kind='mergesort')
+                  if mapo[i] is None]
+
+        data = {'args': dict(name=name, config=config, basedir=basedir,
+                             workdir=self.workdir, diff_sources=diff_sources,
+                             const_spectrum=const_spectrum, roi=self.roi,
+                             sc_tables=sc_tables),
+                'kwargs': kwargs,
+                'outfiles': outfiles}
+
         if kwargs.get('multithread', False):
-            p = Pool(processes=kwargs.get('nthread', None))
-            mapo = p.map(wrap, itimes)
+            p = Pool(processes=kwargs.get('nthread', None),
+                     initializer=_init_lc_worker, initargs=(data,))
+            for i, m in p.imap_unordered(_process_lc_task, itimes):
+                mapo[i] = m
             p.close()
+            p.join()
         else:
-            mapo = map(wrap, itimes)
+            _init_lc_worker(data)
+            for i, m in map(_process_lc_task, itimes):
+                mapo[i] = m
+            _init_lc_worker({})
+
+        # Assemble the light curve from the checkpoint store
+        for i, time in enumerate(zip(times[:-1], times[1:])):
+            m = store.load(time[0], time[1])
+            if m is not None:
+                mapo[i] = m
 
         if not kwargs.get('save_bin_data', False):
             for m in mapo:
-                shutil.rmtree(m['config']['fileio']['outdir'])
+                if 'config' not in m:
+                    continue
+                if os.path.isdir(m['config']['fileio']['outdir']):
+                    shutil.rmtree(m['config']['fileio']['outdir'])
 
         o = self._create_lc_dict(name, times)
         o['config'] = kwargs
@@ -418,7 +625,7 @@ class LightCurve(object):
         itimes = enumerate(zip(times[:-1], times[1:]))
         for i, time in itimes:
 
-            if not mapo[i]['fit_success']:
+            if not mapo[i].get('fit_success', False):
                 self.logger.error(
                     'Fit failed in bin %d in range %i %i.' % (i, time[0], time[1]))
                 continue
@@ -443,10 +650,12 @@ class LightCurve(object):
         #o = utils.merge_dict(o, merged, add_new_keys=True)
         systematic = kwargs.get('systematic', 0.02)
 
+        flux_const = [m['flux_const'] for m in mapo if 'flux_const' in m]
+        flux_const = flux_const[0] if flux_const else np.nan
         o['ts_var'] = calcTS_var(loglike=o['loglike'],
                                  loglike_const=o['loglike_const'],
                                  flux_err=o['flux_err'],
-                                 flux_const=mapo[0]['flux_const'],
+                                 flux_const=flux_const,
                                  systematic=systematic)
 
         return o
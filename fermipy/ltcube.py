@@ -3,11 +3,12 @@ from __future__ import absolute_import, division, print_function
 import glob
 import re
 import copy
+from multiprocessing import Pool
 import numpy as np
 import healpy as hp
 from astropy.io import fits
 from astropy.coordinates import SkyCoord
-from astropy.table import Table, Column
+from astropy.table import Table, Column, vstack
 
 from fermipy import utils
 from fermipy.utils import edge_to_center
@@ -17,7 +18,80 @@ from fermipy.skymap import HpxMap
 from fermipy.hpx_utils import HPX
 
 
-def fill_livetime_hist(skydir, tab_sc, tab_gti, zmax, costh_edges):
+_lthist_worker_data = {}
+
+
+def _init_lthist_worker(data):
+    """Initialize a livetime worker process with the spacecraft
+    arrays shared by all direction chunks."""
+    _lthist_worker_data.clear()
+    _lthist_worker_data.update(data)
+
+
+def _fill_livetime_chunk(xyz):
+    """Worker function for `fill_livetime_hist` that accumulates the
+    livetime histograms for a chunk of sky directions."""
+    return _fill_livetime_block(xyz, **_lthist_worker_data)
+
+
+def _fill_livetime_block(xyz, sc_xyz, zn_xyz, sc_live, sc_live_wt,
+                         cos_zmax, costh_edges, max_nelem):
+    """Accumulate livetime histograms for a block of sky directions.
+    The spacecraft rows are processed in chunks such that at most
+    ``max_nelem`` direction/row pairs are evaluated at a time.
+
+    Parameters
+    ----------
+    xyz : `~numpy.ndarray`
+        Cartesian unit vectors (N x 3) of the sky directions.
+
+    sc_xyz : `~numpy.ndarray`
+        Cartesian unit vectors (M x 3) of the spacecraft z-axis.
+
+    zn_xyz : `~numpy.ndarray`
+        Cartesian unit vectors (M x 3) of the zenith.
+
+    sc_live : `~numpy.ndarray`
+        Livetime of each spacecraft row.
+
+    sc_live_wt : `~numpy.ndarray`
+        Weighted livetime (livetime x livetime fraction) of each
+        spacecraft row.
+
+    Returns
+    -------
+    lt : `~numpy.ndarray`
+        NxK array of livetime histograms.
+
+    lt_wt : `~numpy.ndarray`
+        NxK array of weighted livetime histograms.
+    """
+    nbin = len(costh_edges) - 1
+    ndir = len(xyz)
+    nrow = max(max_nelem // max(ndir, 1), 1)
+
+    lt = np.zeros(ndir * nbin)
+    lt_wt = np.zeros(ndir * nbin)
+
+    for i in range(0, len(sc_live), nrow):
+
+        s = slice(i, i + nrow)
+        cos_sep = np.dot(xyz, sc_xyz[s].T)
+        cos_zn = np.dot(xyz, zn_xyz[s].T)
+        idir, isc = np.nonzero((cos_zn > cos_zmax) & (cos_sep > 0.0))
+        bins = np.searchsorted(costh_edges, cos_sep[idir, isc],
+                               side='right') - 1
+        bins = np.clip(bins, 0, nbin - 1) + idir * nbin
+        lt += np.bincount(bins, weights=sc_live[s][isc],
+                          minlength=ndir * nbin)
+        lt_wt += np.bincount(bins, weights=sc_live_wt[s][isc],
+                             minlength=ndir * nbin)
+
+    return lt.reshape(ndir, nbin), lt_wt.reshape(ndir, nbin)
+
+
+def fill_livetime_hist(skydir, tab_sc, tab_gti, zmax, costh_edges,
+                       **kwargs):
     """Generate a sequence of livetime distributions at the sky
     positions given by ``skydir``.  The output of the method are two
     NxM arrays containing a sequence of histograms for N sky positions
@@ -26,6 +100,11 @@ def fill_livetime_hist(skydir, tab_sc, tab_gti, zmax, costh_edges):
     `gtltcube` with the exception that SC time intervals are assumed
     to be aligned with GTIs.
 
+    The calculation is vectorized over blocks of sky directions and
+    spacecraft rows.  The size of each block is bounded by
+    ``max_nelem`` and blocks of sky directions can optionally be
+    distributed over several processes.
+
     Parameters
     ----------
     skydir : `~astropy.coordinates.SkyCoord`    
@@ -45,6 +124,15 @@ def fill_livetime_hist(skydir, tab_sc, tab_gti, zmax, costh_edges):
     costh_edges : `~numpy.ndarray`
         Incidence angle bin edges in cos(angle).
 
+    max_nelem : int
+        Maximum number of sky direction/spacecraft row pairs that
+        will be evaluated in a single block.
+
+    nthread : int
+        Number of processes across which blocks of sky directions
+        will be distributed.  If None or 1 the calculation is run
+        in the current process.
+
     Returns
     -------
     lt : `~numpy.ndarray`
@@ -54,6 +142,8 @@ def fill_livetime_hist(skydir, tab_sc, tab_gti, zmax, costh_edges):
         Array of histograms of weighted livetime (livetime x livetime
         fraction).
     """
+    max_nelem = kwargs.get('max_nelem', 2**21)
+    nthread = kwargs.get('nthread', None)
 
     if len(tab_gti) == 0:
         shape = (len(costh_edges) - 1, len(skydir))
@@ -86,26 +176,86 @@ def fill_livetime_hist(skydir, tab_sc, tab_gti, zmax, costh_edges):
     gti_t0[idx >= 0] = tab_gti_t0[idx[idx >= 0]]
     gti_t1[idx >= 0] = tab_gti_t1[idx[idx >= 0]]
 
+    m0 = (idx >= 0) & (sc_t0 >= gti_t0) & (sc_t1 <= gti_t1)
+
+    data = dict(sc_xyz=sc_xyz[m0], zn_xyz=zn_xyz[m0],
+                sc_live=sc_live[m0], sc_live_wt=sc_live[m0] * sc_lfrac[m0],
+                cos_zmax=cos_zmax, costh_edges=costh_edges,
+                max_nelem=max_nelem)
+
+    xyz = angle_to_cartesian(skydir.ra.rad, skydir.dec.rad)
+    xyz = xyz.reshape(-1, 3)
+    ndir = max(min(len(xyz), int(np.sqrt(max_nelem))), 1)
+    chunks = [xyz[i:i + ndir] for i in range(0, len(xyz), ndir)]
+
+    if nthread is not None and nthread > 1 and len(chunks) > 1:
+        pool = Pool(processes=min(nthread, len(chunks)),
+                    initializer=_init_lthist_worker, initargs=(data,))
+        try:
+            results = pool.map(_fill_livetime_chunk, chunks, chunksize=1)
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+    else:
+        results = [_fill_livetime_block(t, **data) for t in chunks]
+
     nbin = len(costh_edges) - 1
+    if len(results):
+        lt = np.concatenate([r[0] for r in results]).T
+        lt_wt = np.concatenate([r[1] for r in results]).T
+    else:
+        lt = np.zeros((nbin, 0))
+        lt_wt = np.zeros((nbin, 0))
 
-    lt = np.zeros((nbin,) + skydir.shape)
-    lt_wt = np.zeros((nbin,) + skydir.shape)
+    return (lt.reshape((nbin,) + skydir.shape),
+            lt_wt.reshape((nbin,) + skydir.shape))
 
-    m0 = (idx >= 0) & (sc_t0 >= gti_t0) & (sc_t1 <= gti_t1)
 
-    xyz = angle_to_cartesian(skydir.ra.rad, skydir.dec.rad)
+def gti_difference(tab_gti, tab_gti_ref):
+    """Return the time intervals in ``tab_gti`` that are not covered
+    by any interval in ``tab_gti_ref``.  Overlapping or adjacent
+    intervals in the output are merged.
 
-    for i, t in enumerate(xyz):
-        cos_sep = utils.dot_prod(t, sc_xyz)
-        cos_zn = utils.dot_prod(t, zn_xyz)
-        m = m0 & (cos_zn > cos_zmax) & (cos_sep > 0.0)
-        bins = np.digitize(cos_sep[m], bins=costh_edges) - 1
-        bins = np.clip(bins, 0, nbin - 1)
-        lt[:, i] = np.bincount(bins, weights=sc_live[m], minlength=nbin)
-        lt_wt[:, i] = np.bincount(bins, weights=sc_live[m] * sc_lfrac[m],
-                                  minlength=nbin)
+    Parameters
+    ----------
+    tab_gti : `~astropy.table.Table`
+        Table of GTIs with START and STOP columns.
 
-    return lt, lt_wt
+    tab_gti_ref : `~astropy.table.Table`
+        Table of GTIs that will be subtracted from ``tab_gti``.
+
+    Returns
+    -------
+    tab_gti : `~astropy.table.Table`
+        Table of GTIs sorted by START.
+    """
+    t0 = np.array(tab_gti['START'], dtype=float)
+    t1 = np.array(tab_gti['STOP'], dtype=float)
+    t0_ref = np.array(tab_gti_ref['START'], dtype=float)
+    t1_ref = np.array(tab_gti_ref['STOP'], dtype=float)
+
+    # Split the time axis into elementary segments bounded by the
+    # edges of all intervals
+    edges = np.unique(np.concatenate((t0, t1, t0_ref, t1_ref)))
+    mid = 0.5 * (edges[1:] + edges[:-1])
+
+    def _covered(mid, t0, t1):
+        return (np.searchsorted(np.sort(t0), mid, side='right') -
+                np.searchsorted(np.sort(t1), mid, side='right')) > 0
+
+    keep = _covered(mid, t0, t1) & ~_covered(mid, t0_ref, t1_ref)
+
+    # Merge runs of adjacent segments
+    keep = np.concatenate(([False], keep, [False])).astype(int)
+    istart = np.nonzero(np.diff(keep) == 1)[0]
+    istop = np.nonzero(np.diff(keep) == -1)[0]
+
+    cols = [Column(name='START', dtype='f8', unit='s', data=edges[istart]),
+            Column(name='STOP', dtype='f8', unit='s', data=edges[istop])]
+    return Table(cols)
 
 
 class LTCube(HpxMap):
@@ -127,6 +277,7 @@ class LTCube(HpxMap):
         self._tab_gti = kwargs.get('tab_gti', None)
         self._header = kwargs.get('header', None)
         self._data_wt = kwargs.get('data_wt', None)
+        self._checksum = None
 
         if self._data_wt is None:
             self._data_wt = np.zeros_like(self.data)
@@ -251,35 +402,86 @@ class LTCube(HpxMap):
         tstop = tstart + obs_time
         ltc = cls.create_empty(tstart, tstop, obs_time, nside)
         ltc._counts *= ltc.domega[:, np.newaxis] / (4. * np.pi)
+        ltc._checksum = None
         return ltc
 
     @classmethod
     def create_from_gti(cls, skydir, tab_sc, tab_gti, zmax, **kwargs):
+        """Create a livetime cube from a spacecraft table and a table
+        of GTIs.  Livetime histograms are accumulated on a HEALPix
+        grid with NSIDE ``nside`` and interpolated onto the NSIDE=64
+        grid of the output cube.
 
+        Parameters
+        ----------
+        skydir : `~astropy.coordinates.SkyCoord`
+            Center of the region in which the livetime will be
+            computed.
+
+        tab_sc : `~astropy.table.Table`
+            Spacecraft (FT2) table.
+
+        tab_gti : `~astropy.table.Table`
+            Table of GTIs.
+
+        zmax : float
+            Zenith angle cut.
+
+        radius : float
+            Radius in degrees of the region around ``skydir``.
+
+        cth_edges : `~numpy.ndarray`
+            Incidence angle bin edges in cos(angle).
+
+        nside : int
+            NSIDE of the grid on which livetime histograms are
+            accumulated.  If equal to 64 the histograms are computed
+            directly on the pixels of the output cube.
+
+        nthread : int
+            Number of processes used by `fill_livetime_hist`.
+
+        max_nelem : int
+            Memory bound passed to `fill_livetime_hist`.
+        """
         radius = kwargs.get('radius', 180.0)
         cth_edges = kwargs.get('cth_edges', None)
+        nside = kwargs.get('nside', 2**4)
+        lt_kwargs = dict(nthread=kwargs.get('nthread', None),
+                         max_nelem=kwargs.get('max_nelem', 2**21))
         if cth_edges is None:
             cth_edges = 1.0 - np.linspace(0, 1.0, 41)**2
             cth_edges = cth_edges[::-1]
 
-        hpx = HPX(2**4, True, 'CEL', ebins=cth_edges)
+        hpx2 = HPX(2**6, True, 'CEL', ebins=cth_edges)
 
-        hpx_skydir = hpx.get_sky_dirs()
+        tab_gti = Table([tab_gti['START'], tab_gti['STOP']])
+        tstart = np.min(tab_gti['START']) if len(tab_gti) else None
+        tstop = np.max(tab_gti['STOP']) if len(tab_gti) else None
+        ltc = cls(np.zeros((len(cth_edges) - 1, hpx2.npix)), hpx2, cth_edges,
+                  tstart=tstart, tstop=tstop, zmax=zmax, tab_gti=tab_gti)
+        ltc_skydir = ltc.hpx.get_sky_dirs()
+        m = skydir.separation(ltc_skydir).deg < radius
 
-        m = skydir.separation(hpx_skydir).deg < radius
-        map_lt = HpxMap(np.zeros((40, hpx.npix)), hpx)
-        map_lt_wt = HpxMap(np.zeros((40, hpx.npix)), hpx)
+        if nside == hpx2.nside:
+            lt, lt_wt = fill_livetime_hist(ltc_skydir[m], tab_sc, tab_gti,
+                                           zmax, cth_edges, **lt_kwargs)
+            ltc.data[:, m] = lt
+            ltc.data_wt[:, m] = lt_wt
+            return ltc
 
-        lt, lt_wt = fill_livetime_hist(
-            hpx_skydir[m], tab_sc, tab_gti, zmax, cth_edges)
-        map_lt.data[:, m] = lt
-        map_lt_wt.data[:, m] = lt_wt
+        hpx = HPX(nside, True, 'CEL', ebins=cth_edges)
 
-        hpx2 = HPX(2**6, True, 'CEL', ebins=cth_edges)
+        hpx_skydir = hpx.get_sky_dirs()
 
-        ltc = cls(np.zeros((len(cth_edges) - 1, hpx2.npix)), hpx2, cth_edges)
-        ltc_skydir = ltc.hpx.get_sky_dirs()
-        m = skydir.separation(ltc_skydir).deg < radius
+        mh = skydir.separation(hpx_skydir).deg < radius
+        map_lt = HpxMap(np.zeros((len(cth_edges) - 1, hpx.npix)), hpx)
+        map_lt_wt = HpxMap(np.zeros((len(cth_edges) - 1, hpx.npix)), hpx)
+
+        lt, lt_wt = fill_livetime_hist(
+            hpx_skydir[mh], tab_sc, tab_gti, zmax, cth_edges, **lt_kwargs)
+        map_lt.data[:, mh] = lt
+        map_lt_wt.data[:, mh] = lt_wt
 
         ltc.data[:, m] = map_lt.interpolate(ltc_skydir[m].ra.deg,
                                             ltc_skydir[m].dec.deg,
@@ -289,6 +491,75 @@ class LTCube(HpxMap):
                                                   interp_log=False)
         return ltc
 
+    def append_from_gti(self, tab_sc, tab_gti, **kwargs):
+        """Add the livetime accumulated in new spacecraft data to this
+        livetime cube.  Time intervals in ``tab_gti`` that are
+        already covered by the GTIs of this cube are excluded such
+        that appending the same data more than once has no effect.
+        The livetime is computed directly on the pixels of this cube.
+        The GTI table and TSTART/TSTOP of the cube are updated.
+
+        Parameters
+        ----------
+        tab_sc : `~astropy.table.Table`
+            Spacecraft (FT2) table.
+
+        tab_gti : `~astropy.table.Table`
+            Table of GTIs.
+
+        skydir : `~astropy.coordinates.SkyCoord`
+            Center of the region in which the livetime will be
+            updated.  If None then all pixels will be updated.
+
+        radius : float
+            Radius in degrees of the region around ``skydir``.
+
+        nthread : int
+            Number of processes used by `fill_livetime_hist`.
+
+        max_nelem : int
+            Memory bound passed to `fill_livetime_hist`.
+
+        Returns
+        -------
+        tab_gti : `~astropy.table.Table`
+            Table of the GTIs that were added to the cube.
+        """
+        skydir = kwargs.get('skydir', None)
+        radius = kwargs.get('radius', 180.0)
+        lt_kwargs = dict(nthread=kwargs.get('nthread', None),
+                         max_nelem=kwargs.get('max_nelem', 2**21))
+
+        tab_gti_new = gti_difference(tab_gti, self._tab_gti)
+        if len(tab_gti_new) == 0:
+            return tab_gti_new
+
+        ltc_skydir = self.hpx.get_sky_dirs()
+        if skydir is None:
+            m = np.ones(len(ltc_skydir), dtype=bool)
+        else:
+            m = skydir.separation(ltc_skydir).deg < radius
+
+        lt, lt_wt = fill_livetime_hist(ltc_skydir[m], tab_sc, tab_gti_new,
+                                       self.zmax, self.costh_edges,
+                                       **lt_kwargs)
+        self._counts[:, m] += lt
+        self._data_wt[:, m] += lt_wt
+        self._checksum = None
+
+        tab_gti = vstack([Table([self._tab_gti['START'],
+                                 self._tab_gti['STOP']]), tab_gti_new])
+        tab_gti.sort('START')
+        self._tab_gti = tab_gti
+
+        tstart = np.min(tab_gti_new['START'])
+        tstop = np.max(tab_gti_new['STOP'])
+        self._tstart = tstart if self._tstart is None else min(self._tstart,
+                                                               tstart)
+        self._tstop = tstop if self._tstop is None else max(self._tstop,
+                                                            tstop)
+        return tab_gti_new
+
     def load_ltfile(self, ltfile):
 
         ltc = LTCube.create_from_fits(ltfile)
@@ -297,6 +568,7 @@ class LTCube(HpxMap):
     def load(self, ltc):
 
         self._counts += ltc.data
+        self._checksum = None
 
         if self._tstart is not None:
             self._tstart = min(self.tstart, ltc.tstart)
@@ -5,9 +5,12 @@ from __future__ import absolute_import, division, print_function
 
 import sys
 import argparse
+import tempfile
+from collections import deque
+from multiprocessing.pool import ThreadPool
 import numpy as np
 from astropy.io import fits
-from fermipy.hpx_utils import HPX
+from fermipy.hpx_utils import HPX, HPX_FITS_CONVENTIONS
 from fermipy.skymap import HpxMap
 
 def update_null_primary(hdu_in, hdu=None):
@@ -159,103 +162,285 @@ def update_hpx_skymap_allsky(map_in, map_out):
     return map_out
 
 
-def merge_wcs_counts_cubes(filelist):
+def iter_prefetch(fn, items, nthread=None, prefetch=1):
+    """Apply a loader function to a sequence of items with a pool of
+    I/O threads.  Results are yielded in the order of the input
+    sequence and at most ``prefetch`` items are loaded ahead of the
+    item being consumed, such that reading the next files overlaps
+    with processing the current one while the memory footprint stays
+    bounded to ``prefetch + 1`` loaded items.
+
+    Parameters
+    ----------
+    fn : callable
+        Function that is applied to each item.
+
+    items : list
+        Sequence of items (e.g. file names).
+
+    nthread : int
+        Number of I/O threads.  If None or 1 the items are loaded
+        sequentially in the calling thread.
+
+    prefetch : int
+        Maximum number of items that are loaded ahead of the item
+        being consumed.
+    """
+    if nthread is None or nthread <= 1 or prefetch < 1:
+        for item in items:
+            yield fn(item)
+        return
+
+    pool = ThreadPool(min(nthread, prefetch))
+    try:
+        pending = deque()
+        for item in items:
+            pending.append(pool.apply_async(fn, (item,)))
+            if len(pending) > prefetch:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def make_accumulator(shape, dtype, tmpdir=None):
+    """Create a zero-initialized array backed by an anonymous temporary
+    file that is used to accumulate the coadded data.
+
+    Parameters
+    ----------
+    tmpdir : str
+        Directory of the temporary file.  If None the default
+        temporary directory is used.
+    """
+    return np.memmap(tempfile.TemporaryFile(dir=tmpdir), dtype=dtype,
+                     mode='w+', shape=tuple(shape))
+
+
+def _load_common(hdulist, out):
+    """Extract the HDUs and header data needed to merge a file."""
+    out['primary'] = hdulist[0].copy()
+    out['gti'] = hdulist["GTI"].copy() if "GTI" in hdulist else None
+    if 'EBOUNDS' in hdulist:
+        out['ebounds'] = hdulist["EBOUNDS"].copy()
+    elif 'ENERGIES' in hdulist:
+        out['ebounds'] = hdulist["ENERGIES"].copy()
+    else:
+        out['ebounds'] = None
+    out['date_end'] = hdulist[0].header.get('DATE-END', None)
+    return out
+
+
+def load_wcs_counts_cube(filename):
+    """Read the data needed to coadd a WCS counts cube.  The file is
+    memory-mapped and only the primary image is read."""
+    with fits.open(filename, memmap=True) as hdulist:
+        out = dict(filename=filename, data=np.array(hdulist[0].data))
+        return _load_common(hdulist, out)
+
+
+def load_hpx_counts_cube(filename, hdu=1):
+    """Read the data needed to coadd a HEALPix counts cube.  Sparse
+    maps are returned as lists of (channel, pixel, value) entries and
+    are not expanded.  The pixel indices of partial-sky maps are only
+    read if they are stored explicitly in the file."""
+    with fits.open(filename, memmap=True) as hdulist:
+        hdu_in = hdulist[hdu]
+        header = hdu_in.header
+        conv = HPX_FITS_CONVENTIONS[HPX.identify_HPX_convention(header)]
+        order = header.get('ORDER', -1)
+        out = dict(filename=filename, name=hdu_in.name, conv=conv,
+                   nside=header['NSIDE'] if order < 0 else 2**order,
+                   nest=header['ORDERING'] == 'NESTED',
+                   coordsys=header.get(conv.coordsys,
+                                       header.get('COORDSYS', None)),
+                   region=header.get('HPX_REG',
+                                     header.get('HPXREGION', None)))
+
+        names = hdu_in.columns.names
+        if conv.convname == 'FGST_SRCMAP_SPARSE':
+            out['sparse'] = True
+            out['pixels'] = np.array(hdu_in.data.field('PIX'), dtype=int)
+            out['channels'] = np.array(hdu_in.data.field('CHANNEL'),
+                                       dtype=int)
+            out['data'] = np.array(hdu_in.data.field('VALUE'))
+        else:
+            out['sparse'] = False
+            cnames = [c for c in names if c.find(conv.colstring) == 0]
+            out['data'] = np.vstack([hdu_in.data.field(c) for c in cnames])
+            out['pixels'] = None
+            if conv.idxstring in names:
+                out['pixels'] = np.array(hdu_in.data.field(conv.idxstring),
+                                         dtype=int)
+
+        return _load_common(hdulist, out)
+
+
+def _finalize_gti(datalist_gti, template, exposure_sum, tstop):
+    ngti = np.array([len(gti_data) for gti_data in datalist_gti], int)
+    out_gti = merge_all_gti_data(datalist_gti, ngti, template)
+    out_gti.header['EXPOSURE'] = exposure_sum
+    out_gti.header['TSTOP'] = tstop
+    return out_gti
+
+
+def merge_wcs_counts_cubes(filelist, nthread=4, tmpdir=None, prefetch=1):
     """ Merge all the files in filelist, assuming that they WCS counts cubes
+
+    The counts are accumulated in a memory-mapped array while the next
+    input files are read by a pool of I/O threads.
+
+    Parameters
+    ----------
+    filelist : list
+        List of input files.
+
+    nthread : int
+        Number of threads used to read the input files.
+
+    tmpdir : str
+        Directory of the temporary file that backs the output array.
+
+    prefetch : int
+        Number of input files that are read ahead of the file being
+        accumulated.  Each prefetched file is held in memory.
     """
+    out_data = None
     out_prim = None
     out_ebounds = None
-
     datalist_gti = []
     exposure_sum = 0.
-    nfiles = len(filelist)
-    ngti = np.zeros(nfiles, int)
+    tstop = None
+    date_end = None
 
-    for i, filename in enumerate(filelist):
-        fin = fits.open(filename)
+    for i, data_in in enumerate(iter_prefetch(load_wcs_counts_cube,
+                                              filelist, nthread,
+                                              prefetch)):
         sys.stdout.write('.')
         sys.stdout.flush()
         if i == 0:
-            out_prim = update_primary(fin[0], out_prim)
-            out_ebounds = update_ebounds(fin["EBOUNDS"], out_ebounds)
-        (gti_data, exposure, tstop) = extract_gti_data(fin["GTI"])
+            out_prim = fits.PrimaryHDU(header=data_in['primary'].header)
+            out_ebounds = update_ebounds(data_in['ebounds'])
+            gti_template = data_in['gti']
+            out_data = make_accumulator(data_in['data'].shape,
+                                        data_in['data'].dtype, tmpdir)
+        else:
+            update_ebounds(data_in['ebounds'], out_ebounds)
+
+        out_data += data_in['data']
+        gti_data, exposure, tstop = extract_gti_data(data_in['gti'])
         datalist_gti.append(gti_data)
         exposure_sum += exposure
-        ngti[i] = len(gti_data)
-        if i == 0:
-            first = fin
-        elif i == nfiles - 1:
-            date_end = fin[0].header['DATE-END']
-        else:
-            fin.close()
+        date_end = data_in['date_end']
 
-    out_gti = merge_all_gti_data(datalist_gti, ngti, first['GTI'])
-    out_gti.header['EXPOSURE'] = exposure_sum
-    out_gti.header['TSTOP'] = tstop
+    out_prim.data = out_data
+    out_gti = _finalize_gti(datalist_gti, gti_template, exposure_sum, tstop)
 
     hdulist = [out_prim, out_ebounds, out_gti]
     for hdu in hdulist:
-        hdu.header['DATE-END'] = date_end
+        if date_end:
+            hdu.header['DATE-END'] = date_end
 
     out_prim.update_header()
     sys.stdout.write("!\n")
     return fits.HDUList(hdulist)
 
 
-def merge_hpx_counts_cubes(filelist):
+def merge_hpx_counts_cubes(filelist, nthread=4, tmpdir=None, prefetch=1):
     """ Merge all the files in filelist, assuming that they HEALPix counts cubes
+
+    The counts are accumulated in a memory-mapped all-sky array while
+    the next input files are read by a pool of I/O threads.  Sparse
+    and partial-sky inputs are added directly to the pixels they
+    contain without being expanded to all-sky maps.
+
+    Parameters
+    ----------
+    filelist : list
+        List of input files.
+
+    nthread : int
+        Number of threads used to read the input files.
+
+    tmpdir : str
+        Directory of the temporary file that backs the output array.
+
+    prefetch : int
+        Number of input files that are read ahead of the file being
+        accumulated.  Each prefetched file is held in memory.
     """
     out_prim = None
-    out_skymap = None
+    out_hpx = None
+    out_data = None
     out_ebounds = None
-
+    out_name = None
     datalist_gti = []
     exposure_sum = 0.
-    nfiles = len(filelist)
-    ngti = np.zeros(nfiles, int)
-
-    out_name = None
-
-    for i, filename in enumerate(filelist):
-        fin = fits.open(filename)
+    tstop = None
+    date_end = None
+    gti_template = None
+    region_pixels = {}
+
+    for i, data_in in enumerate(iter_prefetch(load_hpx_counts_cube,
+                                              filelist, nthread,
+                                              prefetch)):
         sys.stdout.write('.')
         sys.stdout.flush()
         if i == 0:
-            out_prim = update_null_primary(fin[0], out_prim)
-            out_name = fin[1].name
-
-        map_in = HpxMap.create_from_hdulist(fin)
-        out_skymap = update_hpx_skymap_allsky(map_in, out_skymap)
-        if i == 0:
-            try:
-                out_ebounds = update_ebounds(fin["EBOUNDS"], out_ebounds)
-            except KeyError:
-                out_ebounds = update_energies(fin["ENERGIES"], out_ebounds)
-        try:
-            (gti_data, exposure, tstop) = extract_gti_data(fin["GTI"])
+            out_prim = update_null_primary(data_in['primary'])
+            out_name = data_in['name']
+            out_ebounds = data_in['ebounds']
+            out_hpx = HPX.create_hpx(data_in['nside'], data_in['nest'],
+                                     data_in['coordsys'], -1, None, None,
+                                     data_in['conv'], None)
+            nebin = len(out_ebounds.data)
+            out_data = make_accumulator((nebin, out_hpx.npix), float,
+                                        tmpdir)
+        else:
+            for key in ['nside', 'nest', 'coordsys']:
+                if data_in[key] != getattr(out_hpx, key):
+                    raise ValueError("HEALPix %s does not match : %s %s" %
+                                     (key, getattr(out_hpx, key),
+                                      data_in[key]))
+            if out_ebounds.name == 'EBOUNDS':
+                update_ebounds(data_in['ebounds'], out_ebounds)
+            else:
+                update_energies(data_in['ebounds'], out_ebounds)
+
+        pixels = data_in['pixels']
+        if data_in['sparse']:
+            np.add.at(out_data, (data_in['channels'], pixels),
+                      data_in['data'])
+        else:
+            if pixels is None and data_in['region'] is not None:
+                region = data_in['region']
+                if region not in region_pixels:
+                    region_pixels[region] = HPX.get_index_list(
+                        out_hpx.nside, out_hpx.nest, region)
+                pixels = region_pixels[region]
+            if pixels is None:
+                out_data += data_in['data']
+            else:
+                out_data[:, pixels] += data_in['data']
+
+        if data_in['gti'] is not None:
+            gti_data, exposure, tstop = extract_gti_data(data_in['gti'])
+            if gti_template is None:
+                gti_template = data_in['gti']
             datalist_gti.append(gti_data)
             exposure_sum += exposure
-            ngti[i] = len(gti_data)
-        except KeyError:
-            pass
-
-        if i == 0:
-            first = fin
-        elif i == nfiles - 1:
-            try:
-                date_end = fin[0].header['DATE-END']
-            except KeyError:
-                date_end = None
-        else:
-            fin.close()
+        date_end = data_in['date_end']
 
+    out_skymap = HpxMap(out_data, out_hpx)
     out_skymap_hdu = out_skymap.create_image_hdu("SKYMAP")
 
     hdulist = [out_prim, out_skymap_hdu, out_ebounds]
 
     if len(datalist_gti) > 0:
-        out_gti = merge_all_gti_data(datalist_gti, ngti, first['GTI'])
-        out_gti.header['EXPOSURE'] = exposure_sum
-        out_gti.header['TSTOP'] = tstop
+        out_gti = _finalize_gti(datalist_gti, gti_template, exposure_sum,
+                                tstop)
         hdulist.append(out_gti)
 
     for hdu in hdulist:
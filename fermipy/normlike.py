@@ -0,0 +1,188 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""
+Binned Poisson likelihood for fits in which only the normalizations
+of the model components vary.
+"""
+from __future__ import absolute_import, division, print_function
+import numpy as np
+
+
+class BinnedNormLikelihood(object):
+    """Binned Poisson likelihood of a model that is the sum of a fixed
+    background and a linear combination of fixed templates:
+
+    m = b + sum_k x_k t_k
+
+    The log-likelihood and its gradient and Hessian with respect to the
+    template normalizations x are computed with matrix operations on
+    the stacked templates.  Only pixels with counts contribute to the
+    data term of the likelihood, the predicted counts term is
+    precomputed for every template.
+    """
+
+    def __init__(self, counts, templates, bkg=None, weights=None,
+                 dtype=np.float32):
+        """
+        Parameters
+        ----------
+        counts : `~numpy.ndarray`
+            Counts data.
+
+        templates : `~numpy.ndarray`
+            Array of templates with shape (ntemplate,) + counts.shape.
+            Each template is the model counts of a component for a
+            normalization of one.
+
+        bkg : `~numpy.ndarray`
+            Model counts of the fixed components.
+
+        weights : `~numpy.ndarray`
+            Likelihood weights.  Pixels with weights <= 0 are excluded.
+
+        dtype : `~numpy.dtype`
+            Type of the stacked templates.
+        """
+        counts = np.ravel(counts).astype(float)
+        templates = np.array(templates, ndmin=2)
+        templates = templates.reshape((templates.shape[0], -1))
+        if bkg is None:
+            bkg = np.zeros_like(counts)
+        bkg = np.ravel(bkg).astype(float)
+        if weights is None:
+            weights = np.ones_like(counts)
+        weights = np.ravel(weights).astype(float)
+
+        m = weights > 0
+        counts, bkg, weights = counts[m], bkg[m], weights[m]
+        templates = templates[:, m]
+
+        # Predicted counts term
+        self._npred_tmpl = np.dot(templates, weights)
+        self._npred_bkg = np.sum(weights * bkg)
+
+        # Data term
+        nz = counts > 0
+        self._counts = counts[nz]
+        self._wcounts = weights[nz] * counts[nz]
+        self._bkg = bkg[nz]
+        self._templates = np.ascontiguousarray(templates[:, nz], dtype=dtype)
+
+    @property
+    def ntemplate(self):
+        return self._templates.shape[0]
+
+    def _model(self, x):
+        x = np.array(x, ndmin=1)
+        m = self._bkg + np.dot(x.astype(self._templates.dtype),
+                               self._templates)
+        return np.maximum(m, np.finfo(float).tiny)
+
+    def npred(self, x):
+        """Return the total weighted model counts."""
+        return self._npred_bkg + np.dot(x, self._npred_tmpl)
+
+    def loglike(self, x):
+        """Return the log-likelihood for a vector of normalizations."""
+        m = self._model(x)
+        return np.sum(self._wcounts * np.log(m)) - self.npred(x)
+
+    def gradient(self, x):
+        """Return the gradient of the log-likelihood."""
+        m = self._model(x)
+        r = (self._wcounts / m).astype(self._templates.dtype)
+        return np.dot(self._templates, r) - self._npred_tmpl
+
+    def hessian(self, x):
+        """Return the Hessian matrix of the log-likelihood."""
+        m = self._model(x)
+        r = (self._wcounts / m**2).astype(self._templates.dtype)
+        return -np.dot(self._templates * r, self._templates.T)
+
+    def fit(self, x0=None, bounds=None, tol=1E-3, max_iter=100,
+            init_lambda=1E-4):
+        """Maximize the log-likelihood with a damped Newton method.
+
+        Parameters
+        ----------
+        x0 : `~numpy.ndarray`
+            Initial normalizations.  If None all normalizations start
+            at one.
+
+        bounds : `~numpy.ndarray`
+            Array with shape (ntemplate, 2) with the lower and upper
+            bound of each normalization.  If None normalizations are
+            bounded to be non-negative.
+
+        tol : float
+            Convergence threshold on the estimated distance to the
+            maximum.
+
+        max_iter : int
+            Maximum number of iterations.
+
+        init_lambda : float
+            Initial value of the damping parameter.
+
+        Returns
+        -------
+        o : dict
+            Dictionary with the best-fit values, errors, covariance,
+            log-likelihood, EDM and fit status (0 = converged).
+        """
+        n = self.ntemplate
+        x = np.ones(n) if x0 is None else np.array(x0, dtype=float, ndmin=1)
+        if bounds is None:
+            bounds = np.array([[0.0, np.inf]] * n)
+        bounds = np.array(bounds, dtype=float)
+        x = np.clip(x, bounds[:, 0], bounds[:, 1])
+
+        lam = init_lambda
+        loglike = self.loglike(x)
+        fit_status = 1
+        edm = np.inf
+        for niter in range(max_iter):
+
+            g = self.gradient(x)
+            h = -self.hessian(x)
+
+            # Parameters at a bound with a gradient pointing outside
+            # of the allowed range are kept fixed
+            free = ~(((x <= bounds[:, 0]) & (g < 0)) |
+                     ((x >= bounds[:, 1]) & (g > 0)))
+            if not np.any(free):
+                edm = 0.0
+                fit_status = 0
+                break
+
+            hf = h[np.ix_(free, free)]
+            gf = g[free]
+            try:
+                step = np.linalg.solve(hf + lam * np.diag(np.diag(hf)), gf)
+                edm = 0.5 * np.dot(gf, np.linalg.solve(hf, gf))
+            except np.linalg.LinAlgError:
+                step = gf / np.maximum(np.diag(hf), 1E-10)
+                edm = np.inf
+
+            if edm < tol:
+                fit_status = 0
+                break
+
+            xnew = x.copy()
+            xnew[free] = np.clip(x[free] + step, bounds[free, 0],
+                                 bounds[free, 1])
+            loglike_new = self.loglike(xnew)
+            if loglike_new >= loglike:
+                x, loglike = xnew, loglike_new
+                lam = lam / 10.
+            else:
+                lam = max(lam, 1E-4) * 10.
+
+        h = -self.hessian(x)
+        try:
+            cov = np.linalg.inv(h)
+        except np.linalg.LinAlgError:
+            cov = np.linalg.pinv(h)
+        errors = np.sqrt(np.clip(np.diag(cov), 0.0, None))
+
+        return {'values': x, 'errors': errors, 'covariance': cov,
+                'loglike': loglike, 'edm': edm, 'fit_status': fit_status}
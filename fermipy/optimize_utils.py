@@ -0,0 +1,171 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""
+Utilities for the block-structured optimization of the ROI model.
+"""
+from __future__ import absolute_import, division, print_function
+import numpy as np
+from fermipy import utils
+
+
+def find_source_blocks(lon, lat, radius, max_size=None):
+    """Group sources into blocks of spatially coupled sources.  Two
+    sources are coupled when their separation is smaller than the sum
+    of their coupling radii.  The blocks are the connected components
+    of the graph of coupled sources.  Components with more than
+    ``max_size`` sources are split into consecutive blocks in index
+    order, so sources should be sorted by priority (e.g. npred).
+
+    Parameters
+    ----------
+    lon : `~numpy.ndarray`
+        Source longitudes in deg.
+
+    lat : `~numpy.ndarray`
+        Source latitudes in deg.
+
+    radius : `~numpy.ndarray`
+        Coupling radius of each source in deg.
+
+    max_size : int
+        Maximum number of sources in a block.  If None the size of
+        blocks is not limited.
+
+    Returns
+    -------
+    blocks : list
+        List of index arrays of the sources in each block.  Indices
+        are sorted within each block and blocks are sorted by their
+        first index.
+    """
+    lon = np.radians(np.array(lon, ndmin=1))
+    lat = np.radians(np.array(lat, ndmin=1))
+    radius = np.array(radius, ndmin=1) * np.ones(lon.shape)
+    nsrc = len(lon)
+
+    cosdist = utils.separation_cos_angle(lon[:, None], lat[:, None],
+                                         lon[None, :], lat[None, :])
+    dist = np.degrees(np.arccos(np.clip(cosdist, -1.0, 1.0)))
+    coupled = dist < (radius[:, None] + radius[None, :])
+    coupled[np.diag_indices(nsrc)] = True
+
+    # Label propagation over the coupling graph
+    labels = np.arange(nsrc)
+    while True:
+        labels_new = np.min(np.where(coupled, labels[None, :], nsrc), axis=1)
+        labels_new = labels_new[labels_new]
+        if np.all(labels_new == labels):
+            break
+        labels = labels_new
+
+    blocks = [np.flatnonzero(labels == l) for l in np.unique(labels)]
+    if max_size is None:
+        return blocks
+
+    return [b[i:i + max_size] for b in blocks
+            for i in range(0, len(b), max_size)]
+
+
+def _poisson_loglike(counts, model, weights):
+    m = model > 0
+    return np.sum(weights[m] * (counts[m] * np.log(model[m]) - model[m]))
+
+
+def fit_norms_sweep(counts, templates, model, weights=None, nsweep=10,
+                    tol=1E-3, max_iter=10, norm_bounds=None):
+    """Fit the normalization scale factors of a set of model components
+    with coordinate-descent sweeps of a binned Poisson likelihood.
+    Each sweep maximizes the likelihood with respect to the scale factor
+    of one component at a time while keeping the others fixed.  Only
+    the pixels in the support of each template are used to update its
+    scale factor.
+
+    Parameters
+    ----------
+    counts : `~numpy.ndarray`
+        Flattened counts data.
+
+    templates : list
+        List of tuples of the pixel indices and the model counts of
+        each component at its current normalization.
+
+    model : `~numpy.ndarray`
+        Flattened total model counts including all components.
+
+    weights : `~numpy.ndarray`
+        Likelihood weights.  If None all weights are one.
+
+    nsweep : int
+        Maximum number of sweeps.
+
+    tol : float
+        Sweeps stop once the log-likelihood improves by less than this
+        value.
+
+    max_iter : int
+        Maximum number of Newton iterations for each component.
+
+    norm_bounds : `~numpy.ndarray`
+        Array with shape (ncomp, 2) with the bounds of each scale
+        factor.  If None scale factors are bounded to be non-negative.
+
+    Returns
+    -------
+    norms : `~numpy.ndarray`
+        Best-fit scale factors.
+
+    ts : `~numpy.ndarray`
+        TS of each component at the best-fit scale factors.
+
+    loglike : float
+        Log-likelihood at the best-fit scale factors.
+    """
+    if weights is None:
+        weights = np.ones_like(counts)
+    model = np.array(model, dtype=float)
+    ncomp = len(templates)
+    norms = np.ones(ncomp)
+    if norm_bounds is None:
+        norm_bounds = np.array([[0.0, np.inf]] * ncomp)
+
+    loglike = _poisson_loglike(counts, model, weights)
+    for isweep in range(nsweep):
+
+        loglike0 = loglike
+        for i, (idx, t) in enumerate(templates):
+
+            c = counts[idx]
+            w = weights[idx]
+            bkg = np.clip(model[idx] - norms[i] * t, 0.0, None)
+            norm = norms[i]
+            for j in range(max_iter):
+                m = bkg + norm * t
+                mpos = m > 0
+                grad = np.sum(w * t * (c * mpos / np.where(mpos, m, 1.0) - 1.0))
+                hess = np.sum(w * c * mpos * (t / np.where(mpos, m, 1.0))**2)
+                if hess <= 0:
+                    break
+                step = grad / hess
+                # Halve the step until the model stays positive
+                while np.any((bkg + (norm + step) * t) <= 0) and \
+                        step < 0 and abs(step) > 1E-12:
+                    step *= 0.5
+                norm_new = np.clip(norm + step, *norm_bounds[i])
+                converged = abs(norm_new - norm) < 1E-4 * max(norm, 1E-4)
+                norm = norm_new
+                if converged:
+                    break
+
+            model[idx] = bkg + norm * t
+            norms[i] = norm
+
+        loglike = _poisson_loglike(counts, model, weights)
+        if abs(loglike - loglike0) < tol:
+            break
+
+    ts = np.zeros(ncomp)
+    for i, (idx, t) in enumerate(templates):
+        c, w, m = counts[idx], weights[idx], model[idx]
+        m0 = np.clip(m - norms[i] * t, 0.0, None)
+        ts[i] = 2.0 * (_poisson_loglike(c, m, w) - _poisson_loglike(c, m0, w))
+
+    return norms, ts, loglike
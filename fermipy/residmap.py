@@ -3,18 +3,26 @@ from __future__ import absolute_import, division, print_function
 import copy
 import os
 import json
+import hashlib
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 import numpy as np
-import scipy.signal
+from scipy.fftpack import next_fast_len
 import healpy as hp
 from astropy.io import fits
 from gammapy.maps import WcsNDMap, HpxNDMap
 import fermipy.utils as utils
 import fermipy.wcs_utils as wcs_utils
+import fermipy.hpx_utils as hpx_utils
 import fermipy.fits_utils as fits_utils
 import fermipy.plotting as plotting
+from fermipy.skymap import HpxMap
 from fermipy.config import ConfigSchema
 from fermipy.timing import Timer
 
+# Maximum number of cached convolvers in ResidMapGenerator
+MAX_CONVOLVER_CACHE = 32
+
 
 def poisson_lnl(nc, mu):
     nc = np.array(nc, ndmin=1)
@@ -33,6 +41,191 @@ def poisson_lnl(nc, mu):
     return lnl
 
 
+def _truncate_kernel(ks, cpix, shape, threshold=0.001):
+    """Truncate a 2-D kernel to the region around the reference pixel
+    where its amplitude is above ``threshold`` times the amplitude at
+    the reference pixel."""
+    ix = int(cpix[0])
+    iy = int(cpix[1])
+
+    mx = ks[ix, :] > ks[ix, iy] * threshold
+    my = ks[:, iy] > ks[ix, iy] * threshold
+
+    nx = int(max(3, np.round(np.sum(mx) / 2.)))
+    ny = int(max(3, np.round(np.sum(my) / 2.)))
+
+    # Ensure that there is an odd number of pixels in the kernel
+    # array
+    if ix + nx + 1 >= shape[0] or ix - nx < 0:
+        nx -= 1
+        ny -= 1
+
+    sx = slice(ix - nx, ix + nx + 1)
+    sy = slice(iy - ny, iy + ny + 1)
+
+    return ks[sx, sy]
+
+
+def _array_hash(x):
+    x = np.ascontiguousarray(x)
+    return hashlib.md5(x.view(np.uint8)).hexdigest() + str(x.shape)
+
+
+class _PlaneConvolver(object):
+    """Base class for convolvers that convolve each energy plane of a
+    sequence of maps independently.  Subclasses set the energy slice,
+    the spatial shape of the maps and implement `_convolve_plane`.
+    The convolution of a map of ones is cached for each weight map."""
+
+    def __init__(self, islice, shape):
+        self._islice = islice
+        self._shape = tuple(shape)
+        self._ones = {}
+
+    @property
+    def islice(self):
+        return self._islice
+
+    def _prepare(self):
+        """Precompute quantities shared by all energy planes before
+        the planes are distributed to threads."""
+        pass
+
+    def _convolve_plane(self, i, planes):
+        raise NotImplementedError
+
+    def convolve(self, maps, wmap=None, nthread=None):
+        """Convolve a list of maps.
+
+        Parameters
+        ----------
+        maps : list
+           List of maps.  First dimension should be energy.
+
+        wmap : `~numpy.ndarray`
+           Map of weights that multiplies the convolved maps.
+
+        nthread : int
+           Number of threads used to convolve the energy planes.  If
+           None the planes are convolved sequentially.
+
+        Returns
+        -------
+        o : list
+           List of convolved maps restricted to the energy range of
+           the convolver.
+        """
+        maps = [np.asarray(m)[self._islice, ...] for m in maps]
+        o = self._convolve(maps, nthread)
+        if wmap is not None:
+            w = wmap[self._islice, ...]
+            for j in range(len(o)):
+                o[j] *= w
+        return o
+
+    def _convolve(self, maps, nthread=None):
+
+        self._prepare()
+
+        def _fn(i):
+            return self._convolve_plane(i, [m[i] for m in maps])
+
+        if nthread is not None and nthread > 1 and self.nplane > 1:
+            pool = ThreadPool(min(nthread, self.nplane))
+            try:
+                planes = pool.map(_fn, range(self.nplane))
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            planes = [_fn(i) for i in range(self.nplane)]
+
+        o = [np.zeros((self.nplane,) + self._shape) for m in maps]
+        for i, p in enumerate(planes):
+            for j in range(len(maps)):
+                o[j][i] = p[j]
+        return o
+
+    def convolve_ones(self, wmap=None, nthread=None):
+        """Return the convolution of a map of ones.  The result is
+        cached for each weight map."""
+        if None not in self._ones:
+            ones = np.ones((self.nplane,) + self._shape)
+            self._ones[None] = self._convolve([ones], nthread=nthread)[0]
+        if wmap is None:
+            return self._ones[None]
+
+        key = _array_hash(wmap)
+        if key not in self._ones:
+            self._ones[key] = self._ones[None] * wmap[self._islice, ...]
+        return self._ones[key]
+
+
+class MapConvolver(_PlaneConvolver):
+    """Energy-dependent convolution of a sequence of 2-D spatial maps
+    with a fixed sequence of kernels.  The kernels are truncated and
+    transformed once when the object is created and the transforms
+    are shared by all maps convolved with it.  Two maps are convolved
+    with a single complex FFT by packing them into the real and
+    imaginary parts of the input."""
+
+    def __init__(self, k, cpix, shape, threshold=0.001, imin=0, imax=None):
+        """
+        Parameters
+        ----------
+        k : `~numpy.ndarray`
+           3-D map containing a sequence of convolution kernels.  First
+           dimension should be energy.
+
+        cpix : list
+           Indices of kernel reference pixel in the two spatial
+           dimensions.
+
+        shape : tuple
+           Spatial shape of the maps that will be convolved.
+
+        threshold : float
+           Kernel amplitude relative to the reference pixel below
+           which the kernel is truncated.
+
+        imin : int
+           Minimum index in energy dimension.
+
+        imax : int
+           Maximum index in energy dimension.
+        """
+        super(MapConvolver, self).__init__(slice(imin, imax), shape)
+        self._kernels = []
+        self._kernel_ffts = []
+        self._slices = []
+        for ks in k[self._islice, ...]:
+            ks = _truncate_kernel(ks, cpix, self._shape, threshold)
+            fshape = tuple(next_fast_len(n + m - 1)
+                           for n, m in zip(self._shape, ks.shape))
+            self._kernels += [ks]
+            self._kernel_ffts += [np.fft.fftn(ks, fshape)]
+            self._slices += [tuple(slice((m - 1) // 2, (m - 1) // 2 + n)
+                                   for n, m in zip(self._shape, ks.shape))]
+
+    @property
+    def nplane(self):
+        return len(self._kernels)
+
+    def _convolve_plane(self, i, planes):
+        kf = self._kernel_ffts[i]
+        s = self._slices[i]
+        o = []
+        for j in range(0, len(planes), 2):
+            z = planes[j].astype(complex)
+            if j + 1 < len(planes):
+                z.imag = planes[j + 1]
+            z = np.fft.ifftn(np.fft.fftn(z, kf.shape) * kf)[s]
+            o += [z.real]
+            if j + 1 < len(planes):
+                o += [z.imag]
+        return o
+
+
 def convolve_map(m, k, cpix, threshold=0.001, imin=0, imax=None, wmap=None):
     """
     Perform an energy-dependent convolution on a sequence of 2-D spatial maps.
@@ -65,63 +258,251 @@ def convolve_map(m, k, cpix, threshold=0.001, imin=0, imax=None, wmap=None):
        dimension should be energy. This map should have the same dimension as m.
 
     """
-    islice = slice(imin, imax)
+    convolver = MapConvolver(k, cpix, m.shape[1:], threshold=threshold,
+                             imin=imin, imax=imax)
+    return convolver.convolve([m], wmap=wmap)[0]
+
+
+def _map_data(m):
+    """Return the data array of a map or the input if it is an array."""
+    if m is None or isinstance(m, np.ndarray):
+        return m
+    return m.data
+
+
+def _make_hpx_map(m, data):
+    """Create a HEALPix map with the same geometry and type as m."""
+    if hasattr(m, 'hpx'):
+        return HpxMap(data, m.hpx)
+    return HpxNDMap(m.geom, data)
+
+
+def _radial_profile(theta, values, binsz):
+    """Average a kernel sampled at angular distances theta in annuli
+    of width binsz.  Returns the mean distance and mean value of each
+    non-empty annulus."""
+    ibin = np.floor(theta / binsz).astype(int)
+    n = np.bincount(ibin)
+    m = n > 0
+    return (np.bincount(ibin, theta)[m] / n[m],
+            np.bincount(ibin, values)[m] / n[m])
+
+
+def _smooth_hpx(data, nside, ring_ipix, bl):
+    """Convolve a partial-sky HEALPix map with the beam window function
+    bl.  The map is embedded in an all-sky map in the RING scheme which
+    is zero outside of the map pixels."""
+    lmax = len(bl) - 1
+    full = np.zeros(hp.nside2npix(nside))
+    full[ring_ipix] = data
+    alm = hp.almxfl(hp.map2alm(full, lmax=lmax), bl)
+    return hp.alm2map(alm, nside, lmax=lmax)[ring_ipix]
+
+
+def _resample_hpx(data, nside_in, nest_in, ipix_in, nside_out, nest_out,
+                  ipix_out):
+    """Resample a partial-sky HEALPix map to a different nside and
+    ordering scheme preserving the sum of the map."""
+    full = np.zeros(hp.nside2npix(nside_in))
+    full[ipix_in] = data
+    full = hp.ud_grade(full, nside_out, power=-2,
+                       order_in='NESTED' if nest_in else 'RING',
+                       order_out='NESTED' if nest_out else 'RING')
+    return full[ipix_out]
+
+
+class HpxConvolver(_PlaneConvolver):
+    """Energy-dependent convolution of a sequence of partial-sky
+    HEALPix maps with radial kernels.  The radial profile of each
+    kernel is measured once from a kernel map centered on a reference
+    pixel.  Maps are convolved either by summing over precomputed
+    lists of the pixels within the kernel radius of each pixel
+    ('disc') or by multiplying the spherical harmonic coefficients
+    with the beam window function of the kernel ('harmonic')."""
+
+    def __init__(self, nside, nest, ipix, k, cpix, threshold=0.001,
+                 imin=0, imax=None, method='auto', max_radius=None,
+                 max_nelem=2**24):
+        """
+        Parameters
+        ----------
+        nside : int
+           HEALPix nside parameter.
 
-    o = np.zeros(m[islice, ...].shape)
-    ix = int(cpix[0])
-    iy = int(cpix[1])
+        nest : bool
+           True for 'NESTED', False for 'RING'.
 
-    # Loop over energy
-    for i in range(m[islice, ...].shape[0]):
+        ipix : `~numpy.ndarray`
+           Global indices of the map pixels.
 
-        ks = k[islice, ...][i, ...]
-        ms = m[islice, ...][i, ...]
+        k : `~numpy.ndarray`
+           2-D map containing a sequence of convolution kernels.  First
+           dimension should be energy.
 
-        mx = ks[ix, :] > ks[ix, iy] * threshold
-        my = ks[:, iy] > ks[ix, iy] * threshold
+        cpix : int
+           Local index of the kernel reference pixel.
 
-        nx = int(max(3, np.round(np.sum(mx) / 2.)))
-        ny = int(max(3, np.round(np.sum(my) / 2.)))
+        threshold : float
+           Kernel amplitude relative to the reference pixel below
+           which the kernel is truncated.
 
-        # Ensure that there is an odd number of pixels in the kernel
-        # array
-        if ix + nx + 1 >= ms.shape[0] or ix - nx < 0:
-            nx -= 1
-            ny -= 1
+        imin : int
+           Minimum index in energy dimension.
 
-        sx = slice(ix - nx, ix + nx + 1)
-        sy = slice(iy - ny, iy + ny + 1)
+        imax : int
+           Maximum index in energy dimension.
 
-        ks = ks[sx, sy]
+        method : str
+           Convolution method ('disc', 'harmonic' or 'auto').  With
+           'auto' the disc method is used when the number of elements
+           of the disc index lists is smaller than ``max_nelem``.
 
-#        origin = [0, 0]
-#        if ks.shape[0] % 2 == 0: origin[0] += 1
-#        if ks.shape[1] % 2 == 0: origin[1] += 1
-#        o[i,...] = ndimage.convolve(ms, ks, mode='constant',
-#                                     origin=origin, cval=0.0)
+        max_radius : float
+           Maximum kernel radius in radians.
+        """
+        self._nside = nside
+        self._nest = nest
+        self._ipix = np.ravel(ipix)
+        self._ring_ipix = (hp.nest2ring(nside, self._ipix) if nest
+                           else self._ipix)
+        super(HpxConvolver, self).__init__(slice(imin, imax),
+                                           (len(self._ipix),))
+
+        pvec = np.array(hp.pix2vec(nside, self._ipix, nest=nest)).T
+        theta = np.arccos(np.clip(np.dot(pvec, pvec[cpix]), -1.0, 1.0))
+        binsz = 0.5 * hp.nside2resol(nside)
+
+        self._profiles = []
+        self._radii = []
+        for ks in k[self._islice, ...]:
+            m = ks > ks[cpix] * threshold
+            radius = np.max(theta[m]) + binsz if np.any(m) else binsz
+            if max_radius is not None:
+                radius = min(radius, max_radius)
+            self._profiles += [_radial_profile(theta, ks, binsz)]
+            self._radii += [radius]
+        self._radius = max(self._radii + [binsz])
+
+        if method == 'auto':
+            method = ('disc' if self.ndisc * self.npix <= max_nelem
+                      else 'harmonic')
+        elif method not in ['disc', 'harmonic']:
+            raise ValueError('Unrecognized convolution method: %s' % method)
+
+        self._method = method
+        self._disc = None
+        self._bl = {}
+
+    @property
+    def nplane(self):
+        return len(self._profiles)
+
+    @property
+    def npix(self):
+        return len(self._ipix)
+
+    @property
+    def method(self):
+        return self._method
+
+    @property
+    def radius(self):
+        return self._radius
+
+    @property
+    def ndisc(self):
+        """Approximate number of pixels within the kernel radius."""
+        return (2 * np.pi * (1 - np.cos(self._radius)) /
+                hp.nside2pixarea(self._nside))
+
+    def kernel(self, i, theta):
+        """Evaluate the radial kernel of energy plane i at angular
+        distance theta in radians."""
+        t, v = self._profiles[i]
+        return np.where(theta <= self._radii[i],
+                        np.interp(theta, t, v, right=0.0), 0.0)
+
+    def footprints(self, vec):
+        """Return the pixels and kernel values of the kernel centered
+        on each of the given directions.
 
-        o[i, ...] = scipy.signal.fftconvolve(ms, ks, mode='same')
-        if wmap is not None:
-            o[i, ...] *= wmap[islice, ...][i, ...]
+        Parameters
+        ----------
+        vec : `~numpy.ndarray`
+           Array with shape (n, 3) of unit vectors.
 
-    return o
+        Returns
+        -------
+        idx : `~numpy.ndarray`
+           Array with shape (n, nmax) of local pixel indices padded
+           with -1.
+
+        model : `~numpy.ndarray`
+           Array with shape (n, nplane, nmax) of kernel values.
+        """
+        idx, theta = hpx_utils.make_disc_index(self._nside, self._nest,
+                                               self._ipix, self._radius,
+                                               vec)
+        model = np.stack([self.kernel(i, theta) for i in range(self.nplane)],
+                         axis=1)
+        return idx, model
+
+    def _get_disc(self):
+        if self._disc is None:
+            self._disc = hpx_utils.make_disc_index(self._nside, self._nest,
+                                                   self._ipix, self._radius)
+        return self._disc
+
+    def _get_beam_window(self, i):
+        if i not in self._bl:
+            lmax = 3 * self._nside - 1
+            nstep = max(int(20 * self._radii[i] /
+                            hp.nside2resol(self._nside)), 100)
+            t = np.linspace(0.0, self._radii[i], nstep)
+            b = self.kernel(i, t) / hp.nside2pixarea(self._nside)
+            self._bl[i] = hp.beam2bl(b, t, lmax)
+        return self._bl[i]
+
+    def _prepare(self):
+        if self._method == 'disc':
+            self._get_disc()
+        else:
+            for i in range(self.nplane):
+                self._get_beam_window(i)
+
+    def _convolve_plane(self, i, planes):
+        if self._method == 'disc':
+            idx, theta = self._get_disc()
+            w = self.kernel(i, theta)
+            return [np.sum(w * np.append(p, 0.0)[idx], axis=1)
+                    for p in planes]
+        else:
+            bl = self._get_beam_window(i)
+            return [_smooth_hpx(p, self._nside, self._ring_ipix, bl)
+                    for p in planes]
 
 
-def convolve_map_hpx(m, k, cpix, threshold=0.001, imin=0, imax=None, wmap=None):
+def convolve_map_hpx(m, k, cpix, threshold=0.001, imin=0, imax=None,
+                     wmap=None, method='auto'):
     """
-    Perform an energy-dependent convolution on a sequence of 2-D spatial maps.
+    Perform an energy-dependent convolution on a sequence of 1-D
+    HEALPix maps with radial kernels.
 
     Parameters
     ----------
 
-    m : `~numpy.ndarray`
+    m : `~fermipy.skymap.HpxMap` or `~gammapy.maps.HpxNDMap`
        2-D map containing a sequence of 1-D HEALPix maps.  First
-       dimension should be energy.
+       dimension should be energy.  The map may cover a part of the
+       sky.
 
     k : `~numpy.ndarray`
        2-D map containing a sequence of convolution kernels (PSF) for
        each slice in m.  This map should have the same dimension as m.
 
+    cpix : int
+       Index of the kernel reference pixel.
+
     threshold : float
        Kernel amplitude 
 
@@ -134,8 +515,18 @@ def convolve_map_hpx(m, k, cpix, threshold=0.001, imin=0, imax=None, wmap=None):
     wmap :  `~numpy.ndarray`
        2-D map containing a sequence of 1-D HEALPix maps of weights.  First
        dimension should be energy. This map should have the same dimension as m.
+
+    method : str
+       Convolution method.  See `HpxConvolver`.
     """
-    raise NotImplementedError('convolve_map_hpx')
+    nside, nest, ipix = hpx_utils.hpx_map_pixels(m)
+    convolver = HpxConvolver(nside, nest, ipix, _map_data(k), cpix,
+                             threshold=threshold, imin=imin, imax=imax,
+                             method=method)
+    o = np.zeros(m.data.shape)
+    o[convolver.islice, ...] = convolver.convolve([m.data],
+                                                  wmap=_map_data(wmap))[0]
+    return _make_hpx_map(m, o)
 
 
 def convolve_map_hpx_gauss(m, sigmas, imin=0, imax=None, wmap=None):
@@ -167,24 +558,21 @@ def convolve_map_hpx_gauss(m, sigmas, imin=0, imax=None, wmap=None):
 
     o = np.zeros(m.data.shape)
 
-    nside = m.hpx.nside
-    nest = m.hpx.nest
+    nside, nest, ipix = hpx_utils.hpx_map_pixels(m)
+    # Pixel indices in the RING scheme used for the harmonic transform
+    ring_ipix = hp.nest2ring(nside, ipix) if nest else ipix
+    lmax = 3 * nside - 1
+    wmap = _map_data(wmap)
 
     # Loop over energy
     for i, ms in enumerate(m.data[islice, ...]):
-        sigma = sigmas[islice][i]
-        # Need to be in RING scheme
-        if nest:
-            ms = hp.pixelfunc.reorder(ms, n2r=True)
-
-        o[islice, ...][i] = hp.sphtfunc.smoothing(ms, sigma=sigma)
-        if nest:
-            o[islice, ...][i] = hp.pixelfunc.reorder(
-                o[islice, ...][i], r2n=True)
+        fwhm = sigmas[islice][i] * np.sqrt(8. * np.log(2.))
+        o[islice, ...][i] = _smooth_hpx(ms, nside, ring_ipix,
+                                        hp.gauss_beam(fwhm, lmax))
         if wmap is not None:
-            o[islice, ...][i] *= wmap.data[islice, ...][i]
+            o[islice, ...][i] *= wmap[islice, ...][i]
 
-    return HpxNDMap(m.geom, o)
+    return _make_hpx_map(m, o)
 
 
 def get_source_kernel(gta, name, kernel=None):
@@ -311,11 +699,46 @@ class ResidMapGenerator(object):
             raise Exception(
                 "Did not recognize projection type %s", self.projtype)
 
+    def _get_convolver(self, key, create_fn):
+        """Return a cached convolver or create it with ``create_fn``.
+        Convolvers are cached so that the kernel transforms and the
+        convolved exposure maps are reused by subsequent calls with
+        the same kernel."""
+        cache = self._residmap_cache
+        if key not in cache:
+            if len(cache) >= MAX_CONVOLVER_CACHE:
+                cache.clear()
+            cache[key] = create_fn()
+        return cache[key]
+
+    def _get_map_convolver(self, icomp, kernel, cpix, shape, imin, imax):
+        """Return the `MapConvolver` for a component and kernel."""
+        key = ('WCS', icomp, _array_hash(kernel),
+               tuple(int(x) for x in cpix), tuple(shape), imin, imax)
+        return self._get_convolver(
+            key, lambda: MapConvolver(kernel, cpix, shape,
+                                      imin=imin, imax=imax))
+
+    def _get_hpx_convolver(self, icomp, kernel, cpix, nside, nest, ipix,
+                           imin, imax):
+        """Return the `HpxConvolver` for a component and kernel."""
+        key = ('HPX', icomp, _array_hash(kernel), cpix, nside, nest,
+               _array_hash(ipix), imin, imax)
+        return self._get_convolver(
+            key, lambda: HpxConvolver(nside, nest, ipix, kernel, cpix,
+                                      imin=imin, imax=imax))
+
     def _make_residual_map_wcs(self, prefix, **kwargs):
         src_dict = copy.deepcopy(kwargs.setdefault('model', {}))
         exclude = kwargs.setdefault('exclude', None)
         loge_bounds = kwargs.setdefault('loge_bounds', None)
         use_weights = kwargs.setdefault('use_weights', False)
+        multithread = kwargs.setdefault('multithread', False)
+        nthread = kwargs.setdefault('nthread', None)
+        if multithread:
+            nthread = nthread if nthread is not None else cpu_count()
+        else:
+            nthread = None
 
         if loge_bounds:
             if len(loge_bounds) != 2:
@@ -378,7 +801,6 @@ class ResidMapGenerator(object):
 
             mc = c.model_counts_map(exclude=exclude).data.astype('float')
             cc = c.counts_map().data.astype('float')
-            ec = np.ones(mc.shape)
 
             if use_weights:
                 wmap = c.weight_map().data
@@ -387,12 +809,11 @@ class ResidMapGenerator(object):
                 wmap = None
                 mask = None
 
-            ccs = convolve_map(
-                cc, sm[i], cpix, imin=imin, imax=imax, wmap=wmap)
-            mcs = convolve_map(
-                mc, sm[i], cpix, imin=imin, imax=imax, wmap=wmap)
-            ecs = convolve_map(
-                ec, sm[i], cpix, imin=imin, imax=imax, wmap=wmap)
+            convolver = self._get_map_convolver(i, sm[i], cpix, cc.shape[1:],
+                                                imin, imax)
+            ccs, mcs = convolver.convolve([cc, mc], wmap=wmap,
+                                          nthread=nthread)
+            ecs = convolver.convolve_ones(wmap=wmap, nthread=nthread)
 
             cms = np.sum(ccs, axis=0)
             mms = np.sum(mcs, axis=0)
@@ -432,6 +853,12 @@ class ResidMapGenerator(object):
         exclude = kwargs.setdefault('exclude', None)
         loge_bounds = kwargs.setdefault('loge_bounds', None)
         use_weights = kwargs.setdefault('use_weights', False)
+        multithread = kwargs.setdefault('multithread', False)
+        nthread = kwargs.setdefault('nthread', None)
+        if multithread:
+            nthread = nthread if nthread is not None else cpu_count()
+        else:
+            nthread = None
 
         if loge_bounds:
             if len(loge_bounds) != 2:
@@ -443,18 +870,34 @@ class ResidMapGenerator(object):
         else:
             loge_bounds = [self.log_energies[0], self.log_energies[-1]]
 
-        kernel = None
+        # Put the test source at the ROI center
+        skydir = self.roi.skydir.transform_to('icrs')
 
-        gauss_width = np.radians(0.3)
+        if src_dict is None:
+            src_dict = {}
+        src_dict['ra'] = skydir.ra.deg
+        src_dict['dec'] = skydir.dec.deg
+        src_dict.setdefault('SpatialModel', 'PointSource')
+        src_dict.setdefault('SpatialWidth', 0.3)
+        src_dict.setdefault('Index', 2.0)
 
-        hpxsky = self.counts_map().geom.to_image()
+        self.add_source('residmap_testsource', src_dict, free=True,
+                        init_source=False, save_source_maps=False)
+        src = self.roi.get_source_by_name('residmap_testsource')
+
+        modelname = utils.create_model_name(src)
+        sm = get_source_kernel(self, 'residmap_testsource')
 
-        mmst = HpxNDMap.from_geom(hpxsky)
-        cmst = HpxNDMap.from_geom(hpxsky)
-        emst = HpxNDMap.from_geom(hpxsky)
-        ts = HpxNDMap.from_geom(hpxsky)
-        sigma = HpxNDMap.from_geom(hpxsky)
-        excess = HpxNDMap.from_geom(hpxsky)
+        self.delete_source('residmap_testsource')
+
+        cmap = self.counts_map()
+        hpxsky = cmap.geom.to_image()
+        nside, nest, ipix = hpx_utils.hpx_map_pixels(cmap)
+
+        mmst = np.zeros(len(ipix))
+        cmst = np.zeros(len(ipix))
+        emst = np.zeros(len(ipix))
+        excess = np.zeros(len(ipix))
 
         for i, c in enumerate(self.components):
 
@@ -463,50 +906,57 @@ class ResidMapGenerator(object):
 
             cc = c.counts_map()
             mc = c.model_counts_map(exclude=exclude)
-            ec = HpxNDMap(cc.geom, cc.data - mc.data)
 
             if use_weights:
                 wmap = c.weight_map()
                 mask = wmap.sum_over_energy()
                 mask.data = np.where(mask.data > 0., 1., 0.)
+                wmap = wmap.data
             else:
                 wmap = None
                 mask = None
 
-            sigmas = gauss_width * np.ones(cc.data.shape[0])
-            ccs = convolve_map_hpx_gauss(
-                cc, sigmas, imin=imin, imax=imax, wmap=wmap)
-            mcs = convolve_map_hpx_gauss(
-                mc, sigmas, imin=imin, imax=imax, wmap=wmap)
-            ecs = convolve_map_hpx_gauss(
-                ec, sigmas, imin=imin, imax=imax, wmap=wmap)
-
-            cms = ccs.sum_over_energy()
-            mms = mcs.sum_over_energy()
-            ems = ecs.sum_over_energy()
-
-            if cms.hpx.order != hpxsky.order:
-                cms = cms.ud_grade(hpxsky.order, preserve_counts=True)
-                mms = mms.ud_grade(hpxsky.order, preserve_counts=True)
-                ems = ems.ud_grade(hpxsky.order, preserve_counts=True)
-
-            cmst.data += cms.data
-            mmst.data += mms.data
-            emst.data += ems.data
-
-        ts.data = 2.0 * (poisson_lnl(cmst.data, cmst.data) -
-                         poisson_lnl(cmst.data, mmst.data))
-        sigma.data = np.sqrt(ts.data)
-        sigma.data[emst.data < 0] *= -1
-        modelname = 'gauss_0p3'
+            cnside, cnest, cipix = hpx_utils.hpx_map_pixels(cc)
+            cpix = int(np.argmax(np.sum(sm[i], axis=0)))
+            convolver = self._get_hpx_convolver(i, sm[i], cpix, cnside,
+                                                cnest, cipix, imin, imax)
+            ccs, mcs = convolver.convolve([cc.data.astype('float'),
+                                           mc.data.astype('float')],
+                                          wmap=wmap, nthread=nthread)
+            ecs = convolver.convolve_ones(wmap=wmap, nthread=nthread)
+
+            cms = np.sum(ccs, axis=0)
+            mms = np.sum(mcs, axis=0)
+            ems = np.sum(ecs, axis=0)
+
+            if cnside != nside or cnest != nest:
+                cms, mms, ems = [_resample_hpx(t, cnside, cnest, cipix,
+                                               nside, nest, ipix)
+                                 for t in (cms, mms, ems)]
+
+            cmst += cms
+            mmst += mms
+            emst += ems
+
+            excess += cms - mms
+
+        ts = 2.0 * (poisson_lnl(cmst, cmst) - poisson_lnl(cmst, mmst))
+        sigma = np.sqrt(ts)
+        sigma[excess < 0] *= -1
+        emst /= np.max(emst)
+
+        sigma_map = HpxNDMap(hpxsky, sigma)
+        model_map = HpxNDMap(hpxsky, mmst / emst)
+        data_map = HpxNDMap(hpxsky, cmst / emst)
+        excess_map = HpxNDMap(hpxsky, excess / emst)
 
         o = {'name': utils.join_strings([prefix, modelname]),
              'projtype': 'HPX',
              'file': None,
-             'sigma': sigma,
-             'model': mmst,
-             'data': cmst,
-             'excess': emst,
+             'sigma': sigma_map,
+             'model': model_map,
+             'data': data_map,
+             'excess': excess_map,
              'mask': mask,
              'config': kwargs}
 
@@ -75,7 +75,7 @@ def main():
     if args.ebin == "ALL":
         wcsproj = hpxmap.hpx.make_wcs(
             naxis=2, proj='MOL', energies=None, oversample=2)
-        mapping = HpxToWcsMapping(hpxmap.hpx, wcsproj)
+        mapping = HpxToWcsMapping.create(hpxmap.hpx, wcsproj)
 
         for i, data in enumerate(hpxmap.counts):
             ip = ImagePlotter(data=data, proj=hpxmap.hpx, mapping=mapping)
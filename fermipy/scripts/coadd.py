@@ -19,6 +19,14 @@ def main():
                         help='Output file.')
     parser.add_argument('--clobber', default=False, action='store_true',
                         help='Overwrite output file.')
+    parser.add_argument('--nthread', default=4, type=int,
+                        help='Number of threads used to read the input files.')
+    parser.add_argument('--prefetch', default=1, type=int,
+                        help='Number of input files that are read ahead of '
+                        'the file being accumulated.')
+    parser.add_argument('--tmpdir', default=None, type=str,
+                        help='Directory of the temporary file in which the '
+                        'output is accumulated.')
     parser.add_argument('files', nargs='+', default=None,
                         help='List of input files.')
 
@@ -26,15 +34,22 @@ def main():
 
     proj, f, hdu = fits_utils.read_projection_from_fits(args.files[0])
     if isinstance(proj, WCS):
-        hdulist = merge_utils.merge_wcs_counts_cubes(args.files)
+        hdulist = merge_utils.merge_wcs_counts_cubes(args.files,
+                                                     nthread=args.nthread,
+                                                     tmpdir=args.tmpdir,
+                                                     prefetch=args.prefetch)
     elif isinstance(proj, HPX):
-        hdulist = merge_utils.merge_hpx_counts_cubes(args.files)
+        hdulist = merge_utils.merge_hpx_counts_cubes(args.files,
+                                                     nthread=args.nthread,
+                                                     tmpdir=args.tmpdir,
+                                                     prefetch=args.prefetch)
     else:
         raise TypeError("Could not read projection from file %s" %
                         args.files[0])
 
     if args.output:
-        hdulist.writeto(args.output, clobber=args.clobber, output_verify='silentfix')
+        hdulist.writeto(args.output, overwrite=args.clobber,
+                        output_verify='silentfix')
 
 if __name__ == '__main__':
     main()
@@ -10,10 +10,14 @@ import logging
 import re
 import shutil
 import pprint
+import numpy as np
+from astropy.table import Table, vstack
+from astropy.coordinates import SkyCoord
 from fermipy.utils import mkdir
 from fermipy.batch import dispatch_job, add_lsf_args, submit_jobs
 from fermipy.logger import Logger
-from fermipy.gtanalysis import run_gtapp
+from fermipy.gtanalysis import run_gtapp, create_sc_table
+from fermipy.ltcube import LTCube
 
 
 def create_filelist(filelist, outfile):
@@ -23,6 +27,63 @@ def create_filelist(filelist, outfile):
             fd.write(s + '\n')
 
 
+def get_ltcube_nside(binsz):
+    """Return the NSIDE that gtltcube uses for a given pixel size in
+    deg.  This is the smallest power of 2 for which the HEALPix pixel
+    area is not larger than ``binsz**2``."""
+    npix = 4. * np.pi * np.degrees(1.0)**2 / binsz**2
+    return int(2**np.ceil(np.log2(np.sqrt(npix / 12.))))
+
+
+def make_local_ltcube(infiles, outfile, scfile, zmax, dcostheta,
+                      nthread=None, append_file=None, binsz=1.0):
+    """Generate an all-sky livetime cube with
+    `~fermipy.ltcube.LTCube.create_from_gti` using the GTIs of the
+    input FT1 files.  If ``append_file`` is set the livetime of any
+    GTIs not already contained in that livetime cube is added to
+    it.  The zenith angle cut and incidence angle binning must match
+    those of the existing livetime cube."""
+
+    nside = get_ltcube_nside(binsz)
+    if nside != 2**6:
+        raise ValueError('Local livetime cubes are generated with '
+                         'NSIDE=64 but binsz=%s corresponds to NSIDE=%i.' %
+                         (binsz, nside))
+
+    nbin = int(np.round(1.0 / dcostheta))
+    cth_edges = (1.0 - np.linspace(0, 1.0, nbin + 1)**2)[::-1]
+
+    colnames = ['START', 'STOP', 'LIVETIME',
+                'RA_SCZ', 'DEC_SCZ',
+                'RA_ZENITH', 'DEC_ZENITH']
+
+    if append_file is not None:
+        ltc = LTCube.create_from_fits(append_file)
+        if not np.isclose(ltc.zmax, zmax):
+            raise ValueError('zmax=%s does not match the zenith angle cut '
+                             'of %s (%s).' % (zmax, append_file, ltc.zmax))
+        if (len(ltc.costh_edges) != len(cth_edges) or
+                not np.allclose(ltc.costh_edges, cth_edges)):
+            raise ValueError('dcostheta=%s does not match the incidence '
+                             'angle binning of %s.' % (dcostheta,
+                                                       append_file))
+
+    tab_sc = create_sc_table(scfile, colnames=colnames)
+    tab_gti = vstack([Table.read(f, 'GTI') for f in infiles])
+    tab_gti.sort('START')
+
+    if append_file is not None:
+        ltc.append_from_gti(tab_sc, tab_gti, nthread=nthread)
+        ltc.write(outfile)
+        return
+
+    ltc = LTCube.create_from_gti(SkyCoord(0.0, 0.0, unit='deg'),
+                                 tab_sc, tab_gti, zmax,
+                                 cth_edges=cth_edges, nside=nside,
+                                 nthread=nthread)
+    ltc.write(outfile)
+
+
 def main():
 
     usage = "usage: %(prog)s [options] "
@@ -45,6 +106,17 @@ def main():
     parser.add_argument('--overwrite', default=False, action='store_true')
     parser.add_argument('--merge', default=False, action='store_true',
                         help='Merge input FT1 files into a single file.')
+    parser.add_argument('--local', default=False, action='store_true',
+                        help='Generate the livetime cube with fermipy '
+                        'instead of gtltcube.')
+    parser.add_argument('--nthread', default=None, type=int,
+                        help='Number of processes used to generate the '
+                        'livetime cube when local=True.')
+    parser.add_argument('--append', default=False, action='store_true',
+                        help='Add the livetime of new GTIs to an existing '
+                        'output livetime cube.  GTIs that are already '
+                        'included in the output file are skipped.  Implies '
+                        'local=True.')
 
     parser.add_argument('files', nargs='+', default=None,
                         help='List of directories in which the analysis will '
@@ -92,7 +164,16 @@ def main():
 
         create_filelist(infiles, 'list.txt')
         staged_outfile = kw['outfile']
-        run_gtapp('gtltcube', logger, kw)
+        if args.append and os.path.isfile(outfile):
+            make_local_ltcube(infiles, staged_outfile, args.scfile,
+                              args.zmax, args.dcostheta, args.nthread,
+                              append_file=outfile, binsz=args.binsz)
+        elif args.local or args.append:
+            make_local_ltcube(infiles, staged_outfile, args.scfile,
+                              args.zmax, args.dcostheta, args.nthread,
+                              binsz=args.binsz)
+        else:
+            run_gtapp('gtltcube', logger, kw)
         logger.info('cp %s %s', staged_outfile, outfile)
         shutil.copy(staged_outfile, outfile)
 
@@ -405,6 +405,7 @@ class SEDGenerator(object):
             o['correlation'][p['src_name']] = np.zeros(nbins) * np.nan
 
         self._fitcache = None
+        self._normlike = None
 
         for i, (logemin, logemax) in enumerate(zip(loge_bins[:-1],
                                                    loge_bins[1:])):
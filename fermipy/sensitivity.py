@@ -41,11 +41,15 @@ class SensitivityCalc(object):
         [['FRONT','BACK']].  A selection for joint FRONT/BACK analysis
         is defined with [['FRONT'],['BACK']].
 
+    irf_cache : `~fermipy.irfs.IrfCache`
+        Cache used to store and retrieve the exposure-weighted PSF
+        models.
+
     """
 
     def __init__(self, gdiff, iso, ltc, ebins, event_class, event_types=None,
                  gdiff_fit=None, iso_fit=None, spatial_model='PointSource',
-                 spatial_size=None):
+                 spatial_size=None, irf_cache=None):
 
         self._gdiff = gdiff
         self._gdiff_fit = gdiff_fit
@@ -71,7 +75,7 @@ class SensitivityCalc(object):
         for et in self._event_types:
             self._psf += [irfs.PSFModel.create(skydir.icrs, self._ltc,
                                                self._event_class, et,
-                                               ebins)]
+                                               ebins, cache=irf_cache)]
             self._exp += [irfs.ExposureMap.create(self._ltc,
                                                   self._event_class, et,
                                                   ebins)]
@@ -17,6 +17,10 @@ import fermipy.hpx_utils as hpx_utils
 import fermipy.fits_utils as fits_utils
 from fermipy.hpx_utils import HPX, HpxToWcsMapping
 
+# Gaps of up to this many table rows between requested pixels are
+# read rather than starting a new run in read_hpx_data
+HPX_READ_MAX_GAP = 64
+
 
 def coadd_maps(geom, maps, preserve_counts=True):
     """Coadd a sequence of `~gammapy.maps.Map` objects."""
@@ -84,6 +88,98 @@ def read_map_from_fits(fitsfile, extname=None):
     return m
 
 
+def _plane_range(planes, nplane):
+    """Return the first and last+1 index of a contiguous slice of
+    energy planes."""
+    i0, i1, step = planes.indices(nplane)
+    if step != 1:
+        raise ValueError('Energy planes must be a contiguous slice.')
+    return i0, i1
+
+
+def _skydir_to_lonlat(skydir, coordsys):
+    if coordsys in ['CEL', 'EQU']:
+        skydir = skydir.transform_to('icrs')
+        return skydir.ra.deg, skydir.dec.deg
+    else:
+        skydir = skydir.transform_to('galactic')
+        return skydir.l.deg, skydir.b.deg
+
+
+def read_hpx_data(hdu, hpx, planes=None, pixels=None):
+    """Read the data of a HEALPix HDU.  When the HDU is memory-mapped
+    only the requested energy planes and the runs of table rows that
+    contain the requested pixels are read from disk.
+
+    Parameters
+    ----------
+    hdu : `~astropy.io.fits.BinTableHDU`
+        The HDU with the map data.
+
+    hpx : `~fermipy.hpx_utils.HPX`
+        HEALPix geometry of the full HDU.
+
+    planes : slice
+        Contiguous range of energy planes to read.  None -> all planes.
+
+    pixels : `~numpy.ndarray`
+        Local indices of the pixels to read.  None -> all pixels.
+
+    Returns
+    -------
+    data : `~numpy.ndarray`
+        Array with shape (nplane, npix).
+    """
+    if hpx.conv.convname == 'FGST_SRCMAP_SPARSE':
+        if hpx.ebins is not None:
+            nebin = len(hpx.ebins)
+        else:
+            nebin = int(np.max(hdu.data.field('CHANNEL'))) + 1
+        i0, i1 = (0, nebin) if planes is None else _plane_range(planes,
+                                                                  nebin)
+        if pixels is None:
+            pixels = np.arange(hpx.npix)
+        lut = np.empty(hpx.npix, dtype=int)
+        lut.fill(-1)
+        lut[pixels] = np.arange(len(pixels))
+
+        chans = hdu.data.field('CHANNEL')
+        pixs = lut[hdu.data.field('PIX')]
+        m = (chans >= i0) & (chans < i1) & (pixs >= 0)
+        data = np.zeros((i1 - i0, len(pixels)))
+        data[chans[m] - i0, pixs[m]] = hdu.data.field('VALUE')[m]
+        return data
+
+    cnames = [c for c in hdu.columns.names
+              if c.find(hpx.conv.colstring) == 0]
+    if planes is not None:
+        i0, i1 = _plane_range(planes, len(cnames))
+        cnames = cnames[i0:i1]
+
+    if pixels is None:
+        data = np.ndarray((len(cnames), len(hdu.data)))
+        for i, cname in enumerate(cnames):
+            data[i] = hdu.data.field(cname)
+        return data
+
+    # Read the rows in runs of nearby pixels and scatter them back
+    # into the requested order
+    pixels = np.asarray(pixels)
+    data = np.ndarray((len(cnames), len(pixels)))
+    if len(pixels) == 0:
+        return data
+
+    isort = np.argsort(pixels, kind='mergesort')
+    spix = pixels[isort]
+    brk = np.where(np.diff(spix) > HPX_READ_MAX_GAP)[0] + 1
+    for k0, k1 in zip(np.append(0, brk), np.append(brk, len(spix))):
+        r0 = spix[k0]
+        tab = hdu.data[r0:spix[k1 - 1] + 1]
+        for i, cname in enumerate(cnames):
+            data[i, isort[k0:k1]] = tab.field(cname)[spix[k0:k1] - r0]
+    return data
+
+
 class Map_Base(object):
     """ Abstract representation of a 2D or 3D counts map."""
 
@@ -96,7 +192,7 @@ class Map_Base(object):
 
     @property
     def data(self):
-        return self._counts
+        return self.counts
 
     @data.setter
     def data(self, val):
@@ -124,6 +220,10 @@ class Map_Base(object):
         """Return the interpolated map values corresponding to a set of coordinates. """
         raise NotImplementedError("MapBase.interpolate()")
 
+    def cutout(self, skydir, radius):
+        """Return a map of the region within radius of a sky coordinate. """
+        raise NotImplementedError("MapBase.cutout()")
+
 
 class Map(Map_Base):
     """ Representation of a 2D or 3D counts map using WCS. """
@@ -202,9 +302,22 @@ class Map(Map_Base):
 
     @classmethod
     def create_from_fits(cls, fitsfile, **kwargs):
+        """Create a map from a FITS file.  The image data is
+        memory-mapped and is only read from disk when it is accessed.
+
+        Parameters
+        ----------
+        hdu : int or str
+            Index or name of the image HDU.
+
+        planes : slice
+            Contiguous range of energy planes to load.  None -> all
+            planes.
+        """
         hdu = kwargs.get('hdu', 0)
+        planes = kwargs.get('planes', None)
 
-        with fits.open(fitsfile) as hdulist:
+        with fits.open(fitsfile, memmap=True) as hdulist:
             header = hdulist[hdu].header
             data = hdulist[hdu].data
             header = fits.Header.fromstring(header.tostring())
@@ -221,6 +334,13 @@ class Map(Map_Base):
                 emax = np.array(tab['E_MAX']) / 1E3
                 ebins = np.append(emin, emax[-1])
 
+        if planes is not None and data.ndim == 3:
+            i0, i1 = _plane_range(planes, data.shape[0])
+            data = data[i0:i1]
+            wcs = wcs.slice((slice(i0, i1), slice(None), slice(None)))
+            if ebins is not None:
+                ebins = ebins[i0:i1 + 1]
+
         return cls(data, wcs, ebins)
 
     @classmethod
@@ -249,6 +369,34 @@ class Map(Map_Base):
     def create_primary_hdu(self):
         return fits.PrimaryHDU(self.counts, header=self.wcs.to_header())
 
+    def cutout(self, skydir, radius):
+        """Return the rectangular part of the map that contains the
+        circle of a given radius around a sky coordinate.  If the map
+        is memory-mapped only the rows of the cutout are read.
+
+        Parameters
+        ----------
+        skydir : `~astropy.coordinates.SkyCoord`
+            Center of the cutout.
+
+        radius : float
+            Radius of the cutout in degrees.
+        """
+        xpix, ypix = skydir.to_pixel(self.wcs.celestial)
+        dx, dy = radius / self.pix_size
+        x0 = max(int(np.floor(xpix - dx)), 0)
+        x1 = min(int(np.ceil(xpix + dx)) + 1, self.npix[0])
+        y0 = max(int(np.floor(ypix - dy)), 0)
+        y1 = min(int(np.ceil(ypix + dy)) + 1, self.npix[1])
+        if x0 >= x1 or y0 >= y1:
+            raise ValueError('Cutout does not overlap the map.')
+
+        view = (slice(y0, y1), slice(x0, x1))
+        if self.counts.ndim == 3:
+            view = (slice(None),) + view
+        return Map(np.array(self.counts[view]), self.wcs.slice(view),
+                   ebins=self._ebins)
+
     def sum_over_energy(self):
         """ Reduce a 3D counts cube to a 2D counts map
         """
@@ -415,10 +563,16 @@ class Map(Map_Base):
 class HpxMap(Map_Base):
     """ Representation of a 2D or 3D counts map using HEALPix. """
 
-    def __init__(self, counts, hpx):
-        """ C'tor, fill with a counts vector and a HPX object """
+    def __init__(self, counts, hpx, source=None):
+        """ C'tor, fill with a counts vector and a HPX object
+
+        If counts is None the data are read on first access from
+        source, a tuple of the HDU, the HPX object of the full HDU
+        and the slice of energy planes to read.
+        """
         super(HpxMap, self).__init__(counts)
         self._hpx = hpx
+        self._source = source
         self._wcs2d = None
         self._hpx2wcs = None
 
@@ -426,49 +580,55 @@ class HpxMap(Map_Base):
     def hpx(self):
         return self._hpx
 
+    @property
+    def counts(self):
+        if self._counts is None:
+            hdu, hpx, planes = self._source
+            self._counts = read_hpx_data(hdu, hpx, planes)
+            self._source = None
+        return self._counts
+
+    @property
+    def loaded(self):
+        """True if the map data have been read."""
+        return self._counts is not None
+
     @classmethod
-    def create_from_hdu(cls, hdu, ebins):
+    def create_from_hdu(cls, hdu, ebins, planes=None, lazy=False):
         """ Creates and returns an HpxMap object from a FITS HDU.
 
         hdu    : The FITS
         ebins  : Energy bin edges [optional]
+        planes : Contiguous slice of energy planes to read [optional]
+        lazy   : Defer reading the data until they are accessed
         """
         hpx = HPX.create_from_hdu(hdu, ebins)
-        colnames = hdu.columns.names
-        cnames = []
-        if hpx.conv.convname == 'FGST_SRCMAP_SPARSE':
-            pixs = hdu.data.field('PIX')
-            chans = hdu.data.field('CHANNEL')
-            keys = chans * hpx.npix + pixs
-            vals = hdu.data.field('VALUE')
-            nebin = len(ebins)
-            data = np.zeros((nebin, hpx.npix))
-            data.flat[keys] = vals
-        else:
-            for c in colnames:
-                if c.find(hpx.conv.colstring) == 0:
-                    cnames.append(c)
-            nebin = len(cnames)
-            data = np.ndarray((nebin, hpx.npix))
-            for i, cname in enumerate(cnames):
-                data[i, 0:] = hdu.data.field(cname)
+        hpx_out = hpx
+        if planes is not None and ebins is not None:
+            i0, i1 = _plane_range(planes, len(ebins))
+            hpx_out = HPX.create_from_hdu(hdu, ebins[i0:i1 + 1])
 
-        return cls(data, hpx)
+        if lazy:
+            return cls(None, hpx_out, source=(hdu, hpx, planes))
+        return cls(read_hpx_data(hdu, hpx, planes), hpx_out)
 
     @classmethod
     def create_from_hdulist(cls, hdulist, **kwargs):
         """ Creates and returns an HpxMap object from a FITS HDUList
 
-        extname : The name of the HDU with the map data
-        ebounds : The name of the HDU with the energy bin data
+        hdu    : The name of the HDU with the map data
+        planes : Contiguous slice of energy planes to read
+        lazy   : Defer reading the data until they are accessed
         """
         extname = kwargs.get('hdu', hdulist[1].name)
         ebins = fits_utils.find_and_read_ebins(hdulist)
-        return cls.create_from_hdu(hdulist[extname], ebins)
+        return cls.create_from_hdu(hdulist[extname], ebins,
+                                   planes=kwargs.get('planes', None),
+                                   lazy=kwargs.get('lazy', False))
 
     @classmethod
     def create_from_fits(cls, fitsfile, **kwargs):
-        hdulist = fits.open(fitsfile)
+        hdulist = fits.open(fitsfile, memmap=True)
         return cls.create_from_hdulist(hdulist, **kwargs)
 
     def create_image_hdu(self, name=None, **kwargs):
@@ -476,12 +636,13 @@ class HpxMap(Map_Base):
         return self.hpx.make_hdu(self.counts, **kwargs)
 
     def make_wcs_from_hpx(self, sum_ebins=False, proj='CAR', oversample=2,
-                          normalize=True):
+                          normalize=True, cachedir=None):
         """Make a WCS object and convert HEALPix data into WCS projection
 
-        NOTE: this re-calculates the mapping, if you have already
-        calculated the mapping it is much faster to use
-        convert_to_cached_wcs() instead
+        NOTE: the mapping is shared by all maps with the same HEALPix
+        and WCS geometry and is only calculated on the first call.
+        Once the mapping has been made convert_to_cached_wcs() can be
+        used to reproject other data with the same geometry.
 
         Parameters
         ----------
@@ -497,13 +658,18 @@ class HpxMap(Map_Base):
         normalize  : bool
            True -> perserve integral by splitting HEALPix values between bins
 
+        cachedir   : str
+           Directory in which the mapping is persisted.  If None the
+           mapping is only cached in memory.
+
         returns (WCS object, np.ndarray() with reprojected data)
 
         """
         self._wcs_proj = proj
         self._wcs_oversample = oversample
         self._wcs_2d = self.hpx.make_wcs(2, proj=proj, oversample=oversample)
-        self._hpx2wcs = HpxToWcsMapping(self.hpx, self._wcs_2d)
+        self._hpx2wcs = HpxToWcsMapping.create(self.hpx, self._wcs_2d,
+                                               cachedir=cachedir)
         wcs, wcs_data = self.convert_to_cached_wcs(self.counts, sum_ebins,
                                                    normalize)
         return wcs, wcs_data
@@ -527,39 +693,27 @@ class HpxMap(Map_Base):
                             'before make_wcs_from_hpx()')
 
         if len(hpx_in.shape) == 1:
-            wcs_data = np.ndarray(self._hpx2wcs.npix)
-            loop_ebins = False
             hpx_data = hpx_in
+            loop_ebins = False
         elif len(hpx_in.shape) == 2:
             if sum_ebins:
-                wcs_data = np.ndarray(self._hpx2wcs.npix)
                 hpx_data = hpx_in.sum(0)
                 loop_ebins = False
             else:
-                wcs_data = np.ndarray((self.counts.shape[0],
-                                       self._hpx2wcs.npix[0],
-                                       self._hpx2wcs.npix[1]))
                 hpx_data = hpx_in
                 loop_ebins = True
         else:
             raise Exception('Wrong dimension for HpxMap %i' %
                             len(hpx_in.shape))
 
+        # All energy planes are reprojected in a single operation
+        wcs_data = self._hpx2wcs.transform(hpx_data, normalize)
         if loop_ebins:
-            for i in range(hpx_data.shape[0]):
-                self._hpx2wcs.fill_wcs_map_from_hpx_data(
-                    hpx_data[i], wcs_data[i], normalize)
-                pass
-            wcs_data.reshape((self.counts.shape[0], self._hpx2wcs.npix[
-                             0], self._hpx2wcs.npix[1]))
             # replace the WCS with a 3D one
             wcs = self.hpx.make_wcs(3, proj=self._wcs_proj,
                                     energies=np.log10(self.hpx.ebins),
                                     oversample=self._wcs_oversample)
         else:
-            self._hpx2wcs.fill_wcs_map_from_hpx_data(
-                hpx_data, wcs_data, normalize)
-            wcs_data.reshape(self._hpx2wcs.npix)
             wcs = self._wcs_2d
 
         return wcs, wcs_data
@@ -666,6 +820,39 @@ class HpxMap(Map_Base):
                             order=1)
         return v.reshape(shape)
 
+    def cutout(self, skydir, radius):
+        """Return a partial-sky map with the pixels whose centers are
+        within a radius of a sky coordinate.  If the data of this map
+        have not been read yet only the table rows that contain these
+        pixels are read.
+
+        Parameters
+        ----------
+        skydir : `~astropy.coordinates.SkyCoord`
+            Center of the cutout.
+
+        radius : float
+            Radius of the cutout in degrees.
+        """
+        lon, lat = _skydir_to_lonlat(skydir, self.hpx.coordsys)
+        vec = hpx_utils.coords_to_vec(lon, lat)
+        ipix = np.sort(hp.query_disc(self.hpx.nside, vec[0],
+                                     np.radians(radius), nest=self.hpx.nest))
+        local = self.hpx[ipix]
+        ipix, local = ipix[local >= 0], local[local >= 0]
+        if len(ipix) == 0:
+            raise ValueError('Cutout does not overlap the map.')
+
+        if self._counts is None:
+            hdu, hpx, planes = self._source
+            data = read_hpx_data(hdu, hpx, planes, local)
+        else:
+            data = self.counts[..., local]
+
+        hpx_out = HPX(self.hpx.nside, self.hpx.nest, self.hpx.coordsys,
+                      ebins=self.hpx.ebins, conv=self.hpx.conv, pixels=ipix)
+        return HpxMap(data, hpx_out)
+
     def swap_scheme(self):
         """
         """
@@ -689,10 +876,9 @@ class HpxMap(Map_Base):
         if self.hpx._ipix is None:
             return self.counts
 
-        output = np.zeros(
-            (self.counts.shape[0], self.hpx._maxpix), self.counts.dtype)
-        for i in range(self.counts.shape[0]):
-            output[i][self.hpx._ipix] = self.counts[i]
+        output = np.zeros(self.counts.shape[:-1] + (self.hpx._maxpix,),
+                          self.counts.dtype)
+        output[..., self.hpx._ipix] = self.counts
         return output
 
     def explicit_counts_map(self, pixels=None):
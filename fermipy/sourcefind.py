@@ -15,6 +15,7 @@ from fermipy import utils
 from fermipy import defaults
 from fermipy import wcs_utils
 from fermipy import fits_utils
+from fermipy import sourcefind_utils
 from fermipy.sourcefind_utils import fit_error_ellipse
 from fermipy.sourcefind_utils import find_peaks
 from fermipy.skymap import Map
@@ -592,6 +593,24 @@ class SourceFind(object):
         use_cache = kwargs.get('use_cache', True)
         use_pylike = kwargs.get('use_pylike', False)
         optimizer = kwargs.get('optimizer', {})
+        scan_method = kwargs.get('scan_method', 'cache')
+        nrefine = kwargs.get('nrefine', 0)
+
+        if scan_method not in ['cache', 'fit']:
+            raise ValueError('Unrecognized scan method: %s' % scan_method)
+
+        # The cached scan requires source maps generated by fermipy
+        if use_pylike or not use_cache:
+            scan_method = 'fit'
+
+        # The cached scan only profiles normalization parameters
+        free_shape = ['%s:%s' % (p['src_name'], p['par_name'])
+                      for p in self.get_params(True) if not p['is_norm']]
+        if scan_method == 'cache' and free_shape:
+            self.logger.info('Using scan_method = fit since parameters '
+                             'other than normalizations are free: %s',
+                             ', '.join(free_shape))
+            scan_method = 'fit'
 
         # Fit without source
         self.zero_source(name, loglevel=logging.DEBUG)
@@ -601,31 +620,51 @@ class SourceFind(object):
         saved_state.restore()
         self.free_norm(name, loglevel=logging.DEBUG)
 
-        lnlmap = WcsNDMap.create(skydir=skydir, binsz=scan_cdelt, npix=(nstep, nstep),
-                                 coordsys=wcs_utils.get_coordsys(self.geom.wcs))
-
         src = self.roi.copy_source(name)
-
-        if use_cache and not use_pylike:
+        if scan_method == 'cache':
             self._create_srcmap_cache(src.name, src)
 
-        coord = MapCoord.create(lnlmap.geom.get_coord(flat=True),
-                                coordsys=lnlmap.geom.coordsys)
-        scan_skydir = coord.skycoord.icrs
-        for lon, lat, ra, dec in zip(coord.lon, coord.lat,
-                                     scan_skydir.ra.deg, scan_skydir.dec.deg):
+        for i in range(nrefine + 1):
 
-            spatial_pars = {'ra': ra, 'dec': dec}
-            self.set_source_morphology(name,
-                                       spatial_pars=spatial_pars,
-                                       use_pylike=use_pylike)
-            fit_output = self._fit(loglevel=logging.DEBUG,
-                                   **optimizer)
-            lnlmap.set_by_coord((lon, lat), fit_output['loglike'])
+            if i > 0:
+                # Recenter the scan on the peak of the previous step
+                # and halve its pixel size
+                vals = lnlmap.get_by_coord((coord.lon, coord.lat))
+                skydir = scan_skydir[np.argmax(vals)]
+                scan_cdelt *= 0.5
 
-        self.set_source_morphology(name, spatial_pars=src.spatial_pars,
-                                   use_pylike=use_pylike)
-        saved_state.restore()
+            lnlmap = WcsNDMap.create(skydir=skydir, binsz=scan_cdelt,
+                                     npix=(nstep, nstep),
+                                     coordsys=wcs_utils.get_coordsys(self.geom.wcs))
+
+            coord = MapCoord.create(lnlmap.geom.get_coord(flat=True),
+                                    coordsys=lnlmap.geom.coordsys)
+            scan_skydir = coord.skycoord.icrs
+
+            if scan_method == 'cache':
+                dloglike = self._scan_norm_loglike(name, scan_skydir)
+                lnlmap.set_by_coord((coord.lon, coord.lat),
+                                    dloglike + fit_output_nosrc['loglike'])
+                continue
+
+            if use_cache and not use_pylike:
+                self._create_srcmap_cache(src.name, src,
+                                          scan_skydir=scan_skydir)
+            for lon, lat, ra, dec in zip(coord.lon, coord.lat,
+                                         scan_skydir.ra.deg,
+                                         scan_skydir.dec.deg):
+
+                spatial_pars = {'ra': ra, 'dec': dec}
+                self.set_source_morphology(name,
+                                           spatial_pars=spatial_pars,
+                                           use_pylike=use_pylike)
+                fit_output = self._fit(loglevel=logging.DEBUG,
+                                       **optimizer)
+                lnlmap.set_by_coord((lon, lat), fit_output['loglike'])
+
+            self.set_source_morphology(name, spatial_pars=src.spatial_pars,
+                                       use_pylike=use_pylike)
+            saved_state.restore()
 
         lnlmap.data -= fit_output_nosrc['loglike']
         tsmap = WcsNDMap(lnlmap.geom, 2.0 * lnlmap.data)
@@ -633,6 +672,47 @@ class SourceFind(object):
         self._clear_srcmap_cache()
         return tsmap, fit_output_nosrc['loglike']
 
+    def _scan_norm_loglike(self, name, scan_skydir):
+        """Compute the profile log-likelihood of a source at a set of
+        positions by fitting the normalizations of the source and of
+        the free background components to the cached model counts
+        maps of every position.  The spectral shape of the source and
+        all other parameters are fixed at their current values."""
+
+        params = [p for p in self.get_params(True)
+                  if p['is_norm'] and p['src_name'] != name]
+        bkg_names = [p['src_name'] for p in params]
+        bkg_bounds = None
+        if bkg_names:
+            bkg_bounds = np.array([[p['min'], p['max']] for p in params])
+            bkg_bounds /= np.array([[max(p['value'], 1E-10)]
+                                    for p in params])
+
+        counts, weights, bkg = [], [], []
+        templates, bkg_templates = [], []
+        npos = len(scan_skydir)
+        for c in self.components:
+            esl = self._get_component_ebin_slice(c)
+            counts += [np.ravel(c.counts_map().data[esl])]
+            weights += [np.ravel(c.weight_map().data[esl])]
+            bkg += [np.ravel(c.model_counts_map(
+                exclude=[name] + bkg_names).data[esl])]
+            t = c._create_model_counts_templates(name, scan_skydir)
+            templates += [t[:, esl].reshape((npos, -1))]
+            bkg_templates += [[np.ravel(c.model_counts_map(k).data[esl])
+                               for k in bkg_names]]
+
+        if bkg_names:
+            bkg_templates = np.hstack([np.vstack(t) for t in bkg_templates])
+        else:
+            bkg_templates = None
+
+        dloglike, norms = sourcefind_utils.scan_norm_loglike(
+            np.concatenate(counts), np.concatenate(bkg),
+            np.hstack(templates), np.concatenate(weights),
+            bkg_templates=bkg_templates, bkg_bounds=bkg_bounds)
+        return dloglike
+
     def _fit_position_opt(self, name, use_cache=True):
 
         state = SourceMapState(self.like, [name])
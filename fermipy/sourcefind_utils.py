@@ -7,6 +7,7 @@ from astropy.coordinates import SkyCoord
 from fermipy import utils
 from fermipy import wcs_utils
 from fermipy.utils import get_region_mask
+from fermipy.normlike import BinnedNormLikelihood
 
 
 def fit_error_ellipse(tsmap, xy=None, dpix=3, zmin=None):
@@ -261,3 +262,90 @@ def refine_peak(tsmap, pix):
         yval += float(pix[1])
 
     return (xval, yval), (xerr, yerr)
+
+
+def scan_norm_loglike(counts, bkg, templates, weights=None,
+                      bkg_templates=None, bkg_bounds=None, tol=1E-3,
+                      max_iter=100):
+    """Compute the profile log-likelihood of a source at a set of
+    positions.  At each position the normalization of the source
+    template is fit together with the normalizations of the
+    background templates while all other model components are kept
+    fixed.
+
+    Parameters
+    ----------
+    counts : `~numpy.ndarray`
+        Counts data.
+
+    bkg : `~numpy.ndarray`
+        Model counts of the fixed components.
+
+    templates : `~numpy.ndarray`
+        Array with shape (npos,) + counts.shape of the model counts
+        of the source at each position.
+
+    weights : `~numpy.ndarray`
+        Likelihood weights.
+
+    bkg_templates : `~numpy.ndarray`
+        Array with shape (nbkg,) + counts.shape of the model counts
+        of background components with free normalizations.  The
+        templates are scaled by the fit normalizations.
+
+    bkg_bounds : `~numpy.ndarray`
+        Array with shape (nbkg, 2) with the bounds of the background
+        normalizations.
+
+    Returns
+    -------
+    dloglike : `~numpy.ndarray`
+        Log-likelihood at each position relative to the fit without
+        the source.
+
+    norms : `~numpy.ndarray`
+        Best-fit normalization of the source template at each
+        position.
+    """
+    counts = np.ravel(counts)
+    bkg = np.ravel(bkg)
+    templates = np.asarray(templates).reshape((len(templates), -1))
+    weights = np.ones_like(counts) if weights is None else np.ravel(weights)
+
+    if bkg_templates is None:
+        bkg_templates = np.zeros((0, len(counts)))
+    bkg_templates = np.asarray(bkg_templates).reshape((len(bkg_templates),
+                                                       len(counts)))
+    nbkg = len(bkg_templates)
+    if bkg_bounds is None:
+        bkg_bounds = np.array([[0.0, np.inf]] * nbkg)
+    bkg_bounds = np.array(bkg_bounds, dtype=float).reshape((nbkg, 2))
+
+    # Pixels outside of the support of the source templates only
+    # contribute a constant to the likelihood when the background is
+    # fixed
+    if nbkg == 0:
+        m = np.any(templates > 0, axis=0)
+        counts, bkg, weights = counts[m], bkg[m], weights[m]
+        templates = templates[:, m]
+        bkg_templates = bkg_templates[:, m]
+        loglike0 = BinnedNormLikelihood(counts, np.zeros((1, len(counts))),
+                                        bkg, weights).loglike(np.zeros(1))
+    else:
+        loglike0 = BinnedNormLikelihood(counts, bkg_templates, bkg,
+                                        weights).fit(
+            x0=np.ones(nbkg), bounds=bkg_bounds, tol=tol,
+            max_iter=max_iter)['loglike']
+
+    bounds = np.vstack(([[0.0, np.inf]], bkg_bounds))
+    dloglike = np.zeros(len(templates))
+    norms = np.zeros(len(templates))
+    for i, t in enumerate(templates):
+        like = BinnedNormLikelihood(counts, np.vstack((t, bkg_templates)),
+                                    bkg, weights)
+        fit = like.fit(x0=np.ones(nbkg + 1), bounds=bounds, tol=tol,
+                       max_iter=max_iter)
+        dloglike[i] = fit['loglike'] - loglike0
+        norms[i] = fit['values'][0]
+
+    return dloglike, norms
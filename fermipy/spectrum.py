@@ -2,6 +2,8 @@
 from __future__ import absolute_import, division, print_function
 import os
 import copy
+import hashlib
+import tempfile
 import numpy as np
 from scipy.interpolate import RegularGridInterpolator
 
@@ -552,6 +554,9 @@ class DMFitFunction(SpectralFunction):
     channel_rev_map = {vv: k for k, v in channel_name_mapping.items()
                        for vv in v}
 
+    # Lookup tables that have already been loaded keyed by path
+    _dndx_tables = {}
+
     def __init__(self, params, chan='bb', jfactor=1E19, tablepath=None):
         """Constructor.
 
@@ -574,10 +579,7 @@ class DMFitFunction(SpectralFunction):
 
         """
 
-        if tablepath is None:
-            tablepath = os.path.join('$FERMIPY_DATA_DIR',
-                                     'gammamc_dif.dat')
-        data = np.loadtxt(os.path.expandvars(tablepath))
+        data = DMFitFunction.load_table(tablepath)
 
         # Number of decades in x = log10(E/M)
         ndec = 10.0
@@ -594,7 +596,7 @@ class DMFitFunction(SpectralFunction):
                                25.0, 50.0, 80.3, 91.2, 100.0,
                                150.0, 176.0, 200.0, 250.0, 350.0, 500.0, 750.0,
                                1000.0, 1500.0, 2000.0, 3000.0, 5000.0, 7000.0, 1E4])
-        self._dndx = data.reshape((12, 24, 250))
+        self._dndx = data
         self._dndx_interp = RegularGridInterpolator([self._mass, self._x],
                                                     self._dndx[ichan, :, :],
                                                     bounds_error=False,
@@ -623,6 +625,22 @@ class DMFitFunction(SpectralFunction):
         """ Return all available DMFit channel strings """
         return DMFitFunction.channel_rev_map.keys()
 
+    @staticmethod
+    def load_table(tablepath=None):
+        """Load the lookup table of DM spectra as an array with shape
+        (channel, mass, x).  Tables are only read from disk the first
+        time they are requested and the returned array is shared
+        between all instances and is therefore read-only."""
+        if tablepath is None:
+            tablepath = os.path.join('$FERMIPY_DATA_DIR',
+                                     'gammamc_dif.dat')
+        tablepath = os.path.expandvars(tablepath)
+        if tablepath not in DMFitFunction._dndx_tables:
+            data = np.loadtxt(tablepath).reshape((12, 24, 250))
+            data.setflags(write=False)
+            DMFitFunction._dndx_tables[tablepath] = data
+        return DMFitFunction._dndx_tables[tablepath]
+
     @staticmethod
     def _eval_dnde(x, params, scale=1.0, extra_params=None):
 
@@ -651,3 +669,150 @@ class DMFitFunction(SpectralFunction):
                                                     fill_value=None)
         self.extra_params['dndx_interp'] = self._dndx_interp
         self.extra_params['chan'] = chan
+
+
+class DMChannelTable(object):
+    """Table of the flux or energy flux of a DM annihilation spectrum
+    in a sequence of energy bins evaluated on a grid of masses and
+    channels for unit cross section and J-factor.  Because the
+    spectrum scales linearly with both quantities the integrals for
+    any value of sigmav and J-factor are obtained by rescaling the
+    table.  Tables can optionally be cached to disk.
+    """
+
+    def __init__(self, emin, emax, masses, channels=None,
+                 func_type='eflux', tablepath=None, cachedir=None):
+        """Constructor.
+
+        Parameters
+        ----------
+        emin : `~numpy.ndarray`
+            Lower edges of the energy bins in MeV.
+
+        emax : `~numpy.ndarray`
+            Upper edges of the energy bins in MeV.
+
+        masses : `~numpy.ndarray`
+            DM masses in GeV.
+
+        channels : list
+            List of channel strings.  If None all channels are used.
+
+        func_type : str
+            Quantity evaluated in each energy bin (flux or eflux).
+
+        tablepath : str
+            Path to lookup table with pre-computed DM spectra.
+
+        cachedir : str
+            Directory in which the table will be cached.  If None the
+            table is always recomputed.
+        """
+        if channels is None:
+            channels = ['ee', 'mumu', 'tautau', 'bb', 'tt', 'gg', 'ww',
+                        'zz', 'cc', 'uu', 'dd', 'ss']
+
+        self._emin = np.array(emin, ndmin=1, dtype=float)
+        self._emax = np.array(emax, ndmin=1, dtype=float)
+        self._masses = np.array(masses, ndmin=1, dtype=float)
+        self._channels = list(channels)
+        self._func_type = func_type.lower()
+        if self._func_type not in ['flux', 'eflux']:
+            raise Exception("Did not recognize func_type: %s" % func_type)
+
+        self._table = None
+        if cachedir is not None:
+            cachefile = os.path.join(cachedir,
+                                     self._make_key(tablepath) + '.npy')
+            try:
+                self._table = np.load(cachefile)
+            except (IOError, OSError, ValueError):
+                pass
+
+        if self._table is None:
+            self._table = self._compute_table(tablepath)
+            if cachedir is not None:
+                fd, tmpfile = tempfile.mkstemp(suffix='.npy',
+                                               prefix='.tmp', dir=cachedir)
+                with os.fdopen(fd, 'wb') as f:
+                    np.save(f, self._table)
+                os.rename(tmpfile, cachefile)
+
+    @property
+    def emin(self):
+        return self._emin
+
+    @property
+    def emax(self):
+        return self._emax
+
+    @property
+    def masses(self):
+        return self._masses
+
+    @property
+    def channels(self):
+        return self._channels
+
+    @property
+    def func_type(self):
+        return self._func_type
+
+    @property
+    def table(self):
+        """Array with shape (channel, mass, energy) of the integrated
+        spectrum for sigmav = 1 and J = 1."""
+        return self._table
+
+    def __call__(self, sigmav, jfactor=1.0):
+        """Evaluate the flux or energy flux in each energy bin.
+
+        Parameters
+        ----------
+        sigmav : `~numpy.ndarray`
+            Array of cross section values.  The output is broadcast
+            over the trailing dimensions of this array.
+
+        jfactor : float
+            J-factor.
+
+        Returns
+        -------
+        vals : `~numpy.ndarray`
+            Array with shape (channel, mass, energy) + sigmav.shape.
+        """
+        sigmav = np.asarray(sigmav, dtype=float)
+        t = self._table.reshape(self._table.shape + (1,) * sigmav.ndim)
+        return t * sigmav * jfactor
+
+    def _make_key(self, tablepath):
+        if tablepath is None:
+            tablepath = os.path.join('$FERMIPY_DATA_DIR', 'gammamc_dif.dat')
+        tablepath = os.path.expandvars(tablepath)
+        h = hashlib.sha1()
+        h.update(('%s %s %s' % (os.path.abspath(tablepath),
+                                os.path.getmtime(tablepath),
+                                self._func_type)).encode())
+        h.update(str(self._channels).encode())
+        for x in [self._emin, self._emax, self._masses]:
+            h.update(str(x.shape).encode())
+            h.update(x.tobytes())
+        return 'dmtable_%s' % h.hexdigest()
+
+    def _compute_table(self, tablepath):
+
+        emin = np.expand_dims(self._emin, 1)
+        emax = np.expand_dims(self._emax, 1)
+        params = [np.ones((1, len(self._masses))),
+                  self._masses[np.newaxis, :]]
+        table = np.zeros((len(self._channels), len(self._masses),
+                          len(self._emin)))
+        for i, chan in enumerate(self._channels):
+            fn = DMFitFunction(params, chan=chan, jfactor=1.0,
+                               tablepath=tablepath)
+            if self._func_type == 'flux':
+                v = fn.eval_flux(emin, emax, params, 1.0, fn.extra_params)
+            else:
+                v = fn.eval_eflux(emin, emax, params, 1.0, fn.extra_params)
+            table[i] = v.T
+        return table
@@ -1,6 +1,11 @@
 # Licensed under a 3-clause BSD style license - see LICENSE.rst
 from __future__ import absolute_import, division, print_function
+import os
 import copy
+import hashlib
+import tempfile
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 import numpy as np
 from scipy.ndimage import map_coordinates
 from scipy.ndimage.interpolation import spline_filter
@@ -10,16 +15,114 @@ import fermipy.utils as utils
 import fermipy.wcs_utils as wcs_utils
 
 
+_thread_pools = {}
+
+
+def _get_thread_pool(nthread):
+    """Return a thread pool with ``nthread`` threads.  Pools are
+    created on first use and shared between calls."""
+    pool = _thread_pools.get(nthread, None)
+    if pool is None:
+        pool = ThreadPool(nthread)
+        _thread_pools[nthread] = pool
+    return pool
+
+
+def _spline_taps(dpix, offset, npix, nout, rebin):
+    """Compute the taps of the filter that shifts one spatial dimension
+    of an array of second-order spline coefficients, sums it into bins
+    of ``rebin`` pixels and places it in an output array.  Because the
+    shift is the same for every pixel the spline interpolation reduces
+    to a three-tap filter whose weights depend only on the subpixel
+    part of the shift.  The taps of all positions are computed at
+    once.
+
+    Parameters
+    ----------
+    dpix : `~numpy.ndarray`
+        Shift in pixels of the input array for each position.
+
+    offset : `~numpy.ndarray`
+        Index of the first pixel of the rebinned shifted array in the
+        output array for each position.
+
+    npix : int
+        Number of pixels of the input array without padding.
+
+    nout : int
+        Number of pixels of the output array.
+
+    rebin : int
+        Number of input pixels summed into one output pixel.
+
+    Returns
+    -------
+    idx : `~numpy.ndarray`
+        Array with shape (npos, nout, 3 * rebin) of the pixel indices
+        in the input array padded by one pixel.
+
+    wts : `~numpy.ndarray`
+        Tap weights with the same shape as ``idx``.  The weights of
+        pixels that are not covered by the shifted array are NaN.
+
+    covered : `~numpy.ndarray`
+        Boolean array with shape (npos, nout) that is True for output
+        pixels that overlap with the rebinned shifted array.
+    """
+    dpix = np.asarray(dpix, dtype=float)[:, None, None]
+    n = np.floor(0.5 - dpix).astype(int)
+    t = -dpix - n
+    w = np.stack([0.5 * (0.5 - t)**2, 0.75 - t**2, 0.5 * (0.5 + t)**2],
+                 axis=-1)
+
+    y = np.arange(nout)[None, :] - np.asarray(offset)[:, None]
+    covered = (y >= 0) & (y < npix // rebin)
+
+    # Pixels of the shifted array summed into each output pixel
+    q = rebin * y[:, :, None] + np.arange(rebin)[None, None, :]
+    x = q - dpix
+    valid = (q + n >= 0) & (q + n < npix) & (x >= 0) & (x <= npix - 1)
+
+    idx = np.clip(q[..., None] + n[..., None] + np.arange(3), 0, npix + 1)
+    wts = np.where(valid[..., None], w, np.nan)
+    shape = idx.shape[:2] + (-1,)
+    return idx.reshape(shape), wts.reshape(shape), covered
+
+
 class MapInterpolator(object):
     """Object that can efficiently generate source maps by
-    interpolation of a map object."""
+    interpolation of a map object.
 
-    def __init__(self, data, pix_ref, shape_out, rebin):
+    Parameters
+    ----------
+    data : `~numpy.ndarray`
+        3D array of map values.
+
+    pix_ref : `~numpy.ndarray`
+        Reference pixel coordinates of the map.
+
+    shape_out : tuple
+        Shape of the output map.
+
+    rebin : int
+        Factor by which the map is oversampled with respect to the
+        output map.
+
+    prefilter : bool
+        Apply the spline filter to ``data``.  Set this to False if
+        ``data`` has already been spline filtered (e.g. a template
+        loaded from a `~fermipy.srcmap_utils.SourceMapLibrary`).
+    """
+
+    def __init__(self, data, pix_ref, shape_out, rebin, prefilter=True):
 
         self._data = data
-        self._data_spline = []
-        for i in range(data.shape[0]):
-            self._data_spline += [spline_filter(self._data[i], order=2)]
+        if prefilter:
+            self._data_spline = np.empty(data.shape)
+            for i in range(data.shape[0]):
+                self._data_spline[i] = spline_filter(self._data[i], order=2)
+        else:
+            self._data_spline = data
 
         self._axes = []
         for i in range(data.ndim):
@@ -39,6 +142,10 @@ class MapInterpolator(object):
         # Reference pixel coordinates
         self._pix_ref = pix_ref
 
+        # Work array for the shifted map
+        self._work = None
+        self._data_spline_pad = None
+
     @property
     def data(self):
         return self._data
@@ -81,9 +188,27 @@ class MapInterpolator(object):
 
         return idx
 
-    def shift_to_coords(self, pix, fill_value=np.nan):
+    def shift_to_coords(self, pix, fill_value=np.nan, out=None):
         """Create a new map that is shifted to the pixel coordinates
-        ``pix``."""
+        ``pix``.
+
+        Parameters
+        ----------
+        pix : `~numpy.ndarray`
+            Pixel coordinates in the global coordinate system.
+
+        fill_value : float
+            Value assigned to pixels of the output map that are not
+            covered by the shifted map.
+
+        out : `~numpy.ndarray`
+            Output array with shape ``shape_out``.  If None a new
+            array will be allocated.
+        """
+
+        if np.ndim(pix) == 2:
+            return self.shift_to_coords_batch(pix, fill_value=fill_value,
+                                              out=out)
 
         pix_offset = self.get_offsets(pix)
         dpix = np.zeros(len(self.shape) - 1)
@@ -96,31 +221,170 @@ class MapInterpolator(object):
                for i in range(self.data.ndim)]
         s0, s1 = utils.overlap_slices(self.shape_out, self.shape, pos)
 
-        k = np.zeros(self.data.shape)
+        if self._work is None:
+            self._work = np.empty(self.data.shape)
+
+        k = self._work
         for i in range(k.shape[0]):
-            k[i] = shift(self._data_spline[i], dpix, cval=np.nan,
-                         order=2, prefilter=False)
+            shift(self._data_spline[i], dpix, output=k[i], cval=np.nan,
+                  order=2, prefilter=False)
 
         for i in range(1, len(self.shape)):
             k = utils.sum_bins(k, i, self.rebin)
 
-        k0 = np.ones(self.shape_out) * fill_value
+        if out is None:
+            out = np.empty(self.shape_out)
+        out.fill(fill_value)
 
-        if k[s1].size == 0 or k0[s0].size == 0:
-            return k0
-        k0[s0] = k[s1]
-        return k0
+        if k[s1].size == 0 or out[s0].size == 0:
+            return out
+        out[s0] = k[s1]
+        return out
+
+    def shift_to_coords_batch(self, pix, fill_value=np.nan, out=None,
+                              nthread=None, chunk_size=None):
+        """Create a stack of maps shifted to each of the pixel
+        coordinates in ``pix``.  The shift, rebinning and placement in
+        the output map are combined into a separable filter whose taps
+        are gathered with array operations on all positions of a chunk
+        at once.  The result is identical to
+        `~fermipy.srcmap_utils.MapInterpolator.shift_to_coords`.
+
+        Parameters
+        ----------
+        pix : `~numpy.ndarray`
+            2D array of pixel coordinates in the global coordinate
+            system with shape (npos, ndim - 1).
+
+        fill_value : float
+            Value assigned to pixels of the output maps that are not
+            covered by the shifted map.
+
+        out : `~numpy.ndarray`
+            Output array with shape (npos,) + ``shape_out``.  If None
+            a new array will be allocated.
+
+        nthread : int
+            Number of threads used to evaluate chunks of positions in
+            parallel.  If None the chunks are evaluated in the calling
+            thread.
+
+        chunk_size : int
+            Number of positions evaluated at once.  If None the chunk
+            size is chosen such that the work arrays of a chunk use
+            about 64 MB.
+
+        Returns
+        -------
+        out : `~numpy.ndarray`
+            Array of shifted maps with shape (npos,) + ``shape_out``.
+        """
+
+        pix = np.array(pix, ndmin=2, dtype=float)
+        npos = len(pix)
+        shape = np.array(self.shape[1:])
+        nplane, ny, nx = self.shape_out
+
+        pix_offset = np.trunc(pix).astype(int) - shape[None, :] // 2
+        dpix = (self.rebin * (pix - pix_offset) +
+                (self.rebin - 1.0) / 2. - np.asarray(self._pix_ref)[None, :])
+
+        if self._data_spline_pad is None:
+            pad = [(0, 0)] + [(1, 1)] * (self.ndim - 1)
+            self._data_spline_pad = np.pad(self._data_spline, pad,
+                                           mode='reflect')
+        data = self._data_spline_pad
+        nx_pad = data.shape[2]
+
+        if out is None:
+            out = np.empty((npos,) + tuple(self.shape_out))
+
+        if chunk_size is None:
+            nbytes = 8 * nplane * ny * max(nx_pad, nx)
+            chunk_size = max(1, int(2**26 // nbytes))
+            if nthread is not None and nthread > 1:
+                chunk_size = min(chunk_size, -(-npos // nthread))
+
+        def _shift_chunk(sl):
+            iy, wy, cy = _spline_taps(dpix[sl, 0], pix_offset[sl, 0],
+                                      self.data.shape[1], ny, self.rebin)
+            ix, wx, cx = _spline_taps(dpix[sl, 1], pix_offset[sl, 1],
+                                      self.data.shape[2], nx, self.rebin)
+            n = len(iy)
+
+            # Only the columns used by the column filter are needed
+            c0, c1 = np.min(ix), np.max(ix) + 1
+            ix = ix - c0
+            ncol = c1 - c0
+
+            # Filter rows of the input planes
+            k = None
+            for i in range(iy.shape[-1]):
+                v = np.take(data[:, :, c0:c1], iy[..., i].ravel(), axis=1)
+                v = v.reshape((nplane, n, ny, ncol))
+                v *= wy[None, :, :, i, None]
+                k = v if k is None else np.add(k, v, out=k)
+
+            # Filter columns by gathering rows of the transposed planes
+            k = np.ascontiguousarray(k.transpose((0, 1, 3, 2)))
+            k = k.reshape((nplane, n * ncol, ny))
+            ix = ix + ncol * np.arange(n)[:, None, None]
+            kt = None
+            for i in range(ix.shape[-1]):
+                v = np.take(k, ix[..., i].ravel(), axis=1)
+                v = v.reshape((nplane, n, nx, ny))
+                v *= wx[None, :, :, i, None]
+                kt = v if kt is None else np.add(kt, v, out=kt)
+
+            covered = cy[:, None, :, None] & cx[:, None, None, :]
+            out[sl] = np.where(covered, kt.transpose((1, 0, 3, 2)),
+                               fill_value)
+
+        chunks = [slice(i, min(i + chunk_size, npos))
+                  for i in range(0, npos, chunk_size)]
+        if nthread is not None and nthread > 1 and len(chunks) > 1:
+            _get_thread_pool(nthread).map(_shift_chunk, chunks)
+        else:
+            for sl in chunks:
+                _shift_chunk(sl)
+
+        return out
+
+
+def _hash_psf(psf):
+    h = hashlib.sha1()
+    for x in [psf.dtheta, psf.energies, psf.val]:
+        h.update(np.ascontiguousarray(x, dtype=float).tobytes())
+    return h.hexdigest()
 
 
 class SourceMapCache(object):
     """Object generates source maps by interpolation of map
-    templates."""
+    templates.
+
+    Parameters
+    ----------
+    m0 : `~fermipy.srcmap_utils.MapInterpolator`
+        Interpolator for the template covering the full output map.
+
+    m1 : `~fermipy.srcmap_utils.MapInterpolator`
+        Interpolator for the oversampled template of the core of the
+        source.
+
+    exp : `~numpy.ndarray`
+        Array of exposures vs. energy by which the templates are
+        scaled.  If None the templates are not rescaled.
+    """
 
-    def __init__(self, m0, m1):
+    def __init__(self, m0, m1, exp=None):
         self._m0 = m0
         self._m1 = m1
+        self._exp = exp
+        self._buf = None
+        self._maps = None
+        self._maps_pix = None
 
-    def create_map(self, pix):
+    def create_map(self, pix, out=None):
         """Create a new map with reference pixel coordinates shifted
         to the pixel coordinates ``pix``.
 
@@ -129,21 +393,110 @@ class SourceMapCache(object):
         pix : `~numpy.ndarray`
             Reference pixel of new map.
 
+        out : `~numpy.ndarray`
+            Output array.  If None a new array will be allocated.
+
         Returns
         -------
         out_map : `~numpy.ndarray`
             The shifted map.        
         """
-        k0 = self._m0.shift_to_coords(pix)
-        k1 = self._m1.shift_to_coords(pix)
+        if self._maps is not None:
+            dpix = np.max(np.abs(self._maps_pix - np.asarray(pix)[None, :]),
+                          axis=1)
+            idx = np.argmin(dpix)
+            if dpix[idx] < 1E-4:
+                if out is None:
+                    return self._maps[idx].copy()
+                out[...] = self._maps[idx]
+                return out
+
+        if self._buf is None:
+            self._buf = np.empty(self._m1.shape_out)
+
+        k0 = self._m0.shift_to_coords(pix, out=out)
+        k1 = self._m1.shift_to_coords(pix, out=self._buf)
+
+        m = np.isfinite(k1)
+        k0[m] = k1[m]
+        k0[~np.isfinite(k0)] = 0
+        if self._exp is not None:
+            k0 *= self._exp.reshape((-1,) + (1,) * (k0.ndim - 1))
+        return k0
+
+    def create_maps(self, pix, nthread=None):
+        """Create maps for a sequence of reference pixel coordinates.
+
+        Parameters
+        ----------
+        pix : `~numpy.ndarray`
+            2D array of reference pixel coordinates with shape (npos,
+            2).
+
+        nthread : int
+            Number of threads used to evaluate the energy planes in
+            parallel.
+
+        Returns
+        -------
+        out_maps : `~numpy.ndarray`
+            Array of shifted maps with shape (npos,) + ``shape_out``.
+        """
+        pix = np.array(pix, ndmin=2, dtype=float)
+        k0 = self._m0.shift_to_coords_batch(pix, nthread=nthread)
+        k1 = self._m1.shift_to_coords_batch(pix, nthread=nthread)
 
-        k0[np.isfinite(k1)] = k1[np.isfinite(k1)]
+        m = np.isfinite(k1)
+        k0[m] = k1[m]
         k0[~np.isfinite(k0)] = 0
+        if self._exp is not None:
+            k0 *= self._exp.reshape((1, -1) + (1,) * (k0.ndim - 2))
         return k0
 
+    def precompute(self, pix, nthread=None, max_bytes=2**28):
+        """Precompute the maps for a sequence of reference pixel
+        coordinates.  Subsequent calls to
+        `~fermipy.srcmap_utils.SourceMapCache.create_map` for any of
+        these coordinates will return the precomputed map.
+
+        Parameters
+        ----------
+        pix : `~numpy.ndarray`
+            2D array of reference pixel coordinates with shape (npos,
+            2).
+
+        max_bytes : int
+            Maximum size of the precomputed maps in bytes.  Only the
+            maps of the leading positions that fit within this limit
+            are precomputed.  Maps for the remaining positions are
+            created on demand.  If None the size is not limited.
+        """
+        pix = np.array(pix, ndmin=2, dtype=float)
+        if max_bytes is not None:
+            nbytes = 8 * int(np.prod(self._m0.shape_out))
+            pix = pix[:max(int(max_bytes // nbytes), 0)]
+        if len(pix) == 0:
+            self._maps, self._maps_pix = None, None
+            return
+        self._maps_pix = pix
+        self._maps = self.create_maps(self._maps_pix, nthread=nthread)
+
     @classmethod
     def create(cls, psf, exp, spatial_model, spatial_width, shape_out, cdelt,
-               rebin=4):
+               rebin=4, library=None):
+        """Create a source map cache.
+
+        Parameters
+        ----------
+        psf : `~fermipy.irfs.PSFModel`
+
+        exp : `~numpy.ndarray`
+            Array of exposures vs. energy.
+
+        library : `~fermipy.srcmap_utils.SourceMapLibrary`
+            Library from which the templates will be loaded.  If None
+            the templates will be computed.
+        """
 
         npix = shape_out[1]
         pad_pix = npix // 2
@@ -152,26 +505,274 @@ class SourceMapCache(object):
         ypix = (npix + pad_pix - 1.0) / 2.
         pix_ref = np.array([ypix, xpix])
 
-        k0 = make_srcmap(psf, exp, spatial_model, spatial_width,
-                         npix=npix + pad_pix,
-                         xpix=xpix, ypix=ypix,
-                         cdelt=cdelt)
-
-        m0 = MapInterpolator(k0, pix_ref, shape_out, 1)
+        if library is None:
+            k0 = make_srcmap(psf, np.ones(len(exp)), spatial_model,
+                             spatial_width, npix=npix + pad_pix,
+                             xpix=xpix, ypix=ypix, cdelt=cdelt)
+            m0 = MapInterpolator(k0, pix_ref, shape_out, 1)
+        else:
+            k0 = library.get_template(psf, spatial_model, spatial_width,
+                                      npix + pad_pix, cdelt)
+            m0 = MapInterpolator(k0, pix_ref, shape_out, 1, prefilter=False)
 
         npix1 = max(10, int(0.5 / cdelt)) * rebin
         xpix1 = (npix1 - 1.0) / 2.
         ypix1 = (npix1 - 1.0) / 2.
         pix_ref = np.array([ypix1, xpix1])
 
-        k1 = make_srcmap(psf, exp, spatial_model, spatial_width,
-                         npix=npix1,
-                         xpix=xpix1, ypix=ypix1,
-                         cdelt=cdelt / rebin)
+        if library is None:
+            k1 = make_srcmap(psf, np.ones(len(exp)), spatial_model,
+                             spatial_width, npix=npix1,
+                             xpix=xpix1, ypix=ypix1, cdelt=cdelt / rebin)
+            m1 = MapInterpolator(k1, pix_ref, shape_out, rebin)
+        else:
+            k1 = library.get_template(psf, spatial_model, spatial_width,
+                                      npix1, cdelt / rebin)
+            m1 = MapInterpolator(k1, pix_ref, shape_out, rebin,
+                                 prefilter=False)
+
+        return cls(m0, m1, np.asarray(exp))
 
-        m1 = MapInterpolator(k1, pix_ref, shape_out, rebin)
 
-        return cls(m0, m1)
+class SourceMapLibrary(object):
+    """Persistent library of spline-filtered source map templates.
+    Templates are computed with unit exposure for a given PSF model,
+    spatial model and spatial width and are stored as npy files in the
+    library directory.  Templates are loaded as read-only memory-mapped
+    arrays such that they can be shared between analyses and processes.
+
+    Parameters
+    ----------
+    path : str
+        Path to the library directory.  Will be created if it does
+        not exist.
+    """
+
+    def __init__(self, path):
+        self._path = os.path.abspath(os.path.expandvars(path))
+        utils.mkdir(self._path)
+
+    @property
+    def path(self):
+        return self._path
+
+    @staticmethod
+    def make_key(psf, spatial_model, spatial_width, npix, cdelt):
+        """Generate the key of a template."""
+        h = hashlib.sha1()
+        for x in [psf.dtheta, psf.energies, psf.val]:
+            h.update(np.ascontiguousarray(x, dtype=float).tobytes())
+        h.update(('%s %.8g %i %.8g' % (spatial_model, spatial_width or 0.0,
+                                       npix, cdelt)).encode())
+        return '%s_%s' % (spatial_model.lower(), h.hexdigest())
+
+    def get_template(self, psf, spatial_model, spatial_width, npix, cdelt):
+        """Get the spline-filtered template for a source centered in a
+        map with ``npix`` x ``npix`` pixels.  The template is computed
+        and added to the library if it does not already exist.
+
+        Returns
+        -------
+        data : `~numpy.memmap`
+            Read-only array with the spline-filtered template.
+        """
+        key = self.make_key(psf, spatial_model, spatial_width, npix, cdelt)
+        path = os.path.join(self.path, key + '.npy')
+
+        if not os.path.isfile(path):
+            xpix = (npix - 1.0) / 2.
+            ypix = (npix - 1.0) / 2.
+            k = make_srcmap(psf, np.ones(len(psf.energies)), spatial_model,
+                            spatial_width, npix=npix, xpix=xpix, ypix=ypix,
+                            cdelt=cdelt)
+            for i in range(k.shape[0]):
+                k[i] = spline_filter(k[i], order=2)
+
+            fd, tmpfile = tempfile.mkstemp(suffix='.npy', prefix='.tmp',
+                                           dir=self.path)
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, k)
+            os.rename(tmpfile, path)
+
+        return np.load(path, mmap_mode='r')
+
+
+class KernelBank(object):
+    """Bank of unit-exposure source kernels for radially symmetric
+    spatial models.  Kernels are tabulated on a square grid centered
+    on the source that extends to the radius at which
+    `~fermipy.srcmap_utils.make_srcmap` truncates the kernel.  They
+    are keyed by the PSF model, spatial model, spatial width, pixel
+    size and the subpixel offset of the source.  A source map for a
+    source at an arbitrary pixel position is extracted from the kernel
+    with the same subpixel offset, so kernels are shared by all
+    sources in the same pixel phase.
+
+    Kernels are kept in an in-memory LRU cache and optionally in an
+    on-disk store such that they can be reused between analyses that
+    share the same IRFs.
+
+    Parameters
+    ----------
+    path : str
+        Path to the directory of the on-disk store.  If None kernels
+        are only cached in memory.
+
+    cache_size : int
+        Maximum number of kernels kept in memory.
+
+    widths : `~numpy.ndarray`
+        Grid of tabulated spatial widths in degrees.  If defined the
+        kernel for an extended source with a width between two grid
+        points is interpolated linearly in log(width) from the kernels
+        of the bracketing widths.
+    """
+
+    sigma_scale = {'RadialGaussian': 1.5095921854516636,
+                   'RadialDisk': 0.8246211251235321}
+
+    def __init__(self, path=None, cache_size=64, widths=None):
+        self._path = None
+        if path is not None:
+            self._path = os.path.abspath(os.path.expandvars(path))
+            utils.mkdir(self._path)
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self._widths = None
+        if widths is not None:
+            self._widths = np.unique(np.asarray(widths, dtype=float))
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def widths(self):
+        return self._widths
+
+    def clear(self):
+        """Clear the in-memory cache."""
+        self._cache.clear()
+
+    @staticmethod
+    def make_key(psf, spatial_model, spatial_width, npix, cdelt, offset):
+        """Generate the key of a kernel."""
+        h = hashlib.sha1(psf.memoize(('psf_hash',), _hash_psf, psf).encode())
+        h.update(('%s %.8g %i %.8g %.6f %.6f' % (spatial_model,
+                                                 spatial_width or 0.0,
+                                                 npix, cdelt,
+                                                 offset[0], offset[1])).encode())
+        return '%s_%s' % (spatial_model.lower(), h.hexdigest())
+
+    def get_kernel_npix(self, psf, spatial_model, spatial_width, npix, cdelt):
+        """Get the half-width in pixels of the kernel grid."""
+        sigma = None
+        if spatial_model in self.sigma_scale:
+            sigma = spatial_width / self.sigma_scale[spatial_model]
+        _, rmax = utils.get_radial_kernel_extent(psf, sigma)
+        return int(min(np.ceil(np.max(rmax) / cdelt) + 1, npix))
+
+    def get_template(self, psf, spatial_model, spatial_width, npix, cdelt,
+                     offset, psf_scale_fn=None):
+        """Get the kernel of a source with the given subpixel offset.
+
+        Parameters
+        ----------
+        npix : int
+            Half-width of the kernel grid in pixels.  The kernel has
+            2 x ``npix`` + 1 pixels in each spatial dimension and the
+            source is located at ``npix`` + ``offset``.
+
+        offset : tuple
+            Subpixel offset of the source in the X and Y dimensions.
+
+        Returns
+        -------
+        data : `~numpy.ndarray`
+            Read-only kernel array.
+        """
+        offset = (float(offset[0]), float(offset[1]))
+        key = self.make_key(psf, spatial_model, spatial_width, npix, cdelt,
+                            offset)
+        cache_key = (key, psf_scale_fn)
+
+        if cache_key in self._cache:
+            self._cache[cache_key] = self._cache.pop(cache_key)
+            return self._cache[cache_key]
+
+        # Kernels computed with a PSF scaling function are only cached
+        # in memory
+        path = None
+        if self.path is not None and psf_scale_fn is None:
+            path = os.path.join(self.path, key + '.npy')
+
+        if path is not None and os.path.isfile(path):
+            k = np.load(path, mmap_mode='r')
+        else:
+            k = make_srcmap(psf, np.ones(len(psf.energies)), spatial_model,
+                            spatial_width, npix=2 * npix + 1,
+                            xpix=npix + offset[0], ypix=npix + offset[1],
+                            cdelt=cdelt, psf_scale_fn=psf_scale_fn,
+                            sparse=True)
+            k.setflags(write=False)
+            if path is not None:
+                fd, tmpfile = tempfile.mkstemp(suffix='.npy', prefix='.tmp',
+                                               dir=self.path)
+                with os.fdopen(fd, 'wb') as f:
+                    np.save(f, k)
+                os.rename(tmpfile, path)
+
+        self._cache[cache_key] = k
+        while len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+        return k
+
+    def get_kernel(self, psf, spatial_model, spatial_width, npix, cdelt,
+                   xpix, ypix, psf_scale_fn=None):
+        """Generate the unit-exposure source map of a source at pixel
+        coordinates (``xpix``, ``ypix``) in a map with ``npix`` x
+        ``npix`` pixels.  This is equivalent to calling
+        `~fermipy.srcmap_utils.make_srcmap` with unit exposure and
+        ``sparse=True``.  Sources outside the map are computed
+        directly without using the bank.
+
+        Returns
+        -------
+        k : `~numpy.ndarray`
+            Source map array with shape (nebin, npix, npix).
+        """
+        if (self.widths is not None and spatial_model in self.sigma_scale
+                and self.widths[0] < spatial_width < self.widths[-1]):
+
+            i = np.searchsorted(self.widths, spatial_width)
+            w0, w1 = self.widths[i - 1], self.widths[i]
+            if not np.isclose(spatial_width, w1, rtol=1E-6, atol=0.0):
+                a = np.log(spatial_width / w0) / np.log(w1 / w0)
+                k0 = self.get_kernel(psf, spatial_model, w0, npix, cdelt,
+                                     xpix, ypix, psf_scale_fn)
+                k1 = self.get_kernel(psf, spatial_model, w1, npix, cdelt,
+                                     xpix, ypix, psf_scale_fn)
+                return (1.0 - a) * k0 + a * k1
+            spatial_width = w1
+
+        ix, iy = int(np.floor(xpix)), int(np.floor(ypix))
+        if not (0 <= ix < npix and 0 <= iy < npix):
+            return make_srcmap(psf, np.ones(len(psf.energies)),
+                               spatial_model, spatial_width, npix=npix,
+                               xpix=xpix, ypix=ypix, cdelt=cdelt,
+                               psf_scale_fn=psf_scale_fn, sparse=True)
+
+        nk = self.get_kernel_npix(psf, spatial_model, spatial_width, npix,
+                                  cdelt)
+        t = self.get_template(psf, spatial_model, spatial_width, nk, cdelt,
+                              (xpix - ix, ypix - iy), psf_scale_fn)
+
+        k = np.zeros((t.shape[0], npix, npix))
+        x0, x1 = max(ix - nk, 0), min(ix + nk + 1, npix)
+        y0, y1 = max(iy - nk, 0), min(iy + nk + 1, npix)
+        k[:, y0:y1, x0:x1] = t[:, y0 - iy + nk:y1 - iy + nk,
+                               x0 - ix + nk:x1 - ix + nk]
+        return k
 
 
 def make_srcmap_old(psf, spatial_model, sigma, npix=500, xpix=0.0, ypix=0.0,
@@ -280,6 +881,37 @@ def make_srcmap(psf, exp, spatial_model, sigma, npix=500, xpix=0.0, ypix=0.0,
     return k
 
 
+def integrate_srcmap(k, energies, dnde):
+    """Compute the model counts in each energy bin from a source map
+    evaluated at the energy bin edges.  The product of the source map
+    and the differential flux is integrated over each energy bin with
+    the trapezoidal rule in log(E).
+
+    Parameters
+    ----------
+    k : `~numpy.ndarray`
+        Source map or stack of source maps.  The third to last
+        dimension should be energy with one plane for each bin edge.
+
+    energies : `~numpy.ndarray`
+        Energy bin edges in MeV.
+
+    dnde : `~numpy.ndarray`
+        Differential flux evaluated at the energy bin edges.
+
+    Returns
+    -------
+    counts : `~numpy.ndarray`
+        Model counts with one plane for each energy bin.
+    """
+    energies = np.asarray(energies)
+    w = 0.5 * np.asarray(dnde) * energies
+    log_ratio = np.log(energies[1:] / energies[:-1])
+    w0 = (w[:-1] * log_ratio)[:, None, None]
+    w1 = (w[1:] * log_ratio)[:, None, None]
+    return k[..., :-1, :, :] * w0 + k[..., 1:, :, :] * w1
+
+
 def make_cgauss_mapcube(skydir, psf, sigma, outfile, npix=500, cdelt=0.01,
                         rebin=1):
     energies = psf.energies
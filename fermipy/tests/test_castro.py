@@ -5,7 +5,7 @@ import numpy as np
 from numpy.testing import assert_allclose
 from astropy.tests.helper import pytest
 from fermipy import castro
-from fermipy.spectrum import DMFitFunction
+from fermipy.spectrum import DMFitFunction, PowerLaw
 
 
 @pytest.fixture(scope='module')
@@ -80,3 +80,154 @@ def test_fit_dmfitfunction(sedfile):
 
     assert_allclose(fit_out['ts_spec'], 17.14991598, atol=0.01)
     assert_allclose(fit_out['params'][0], 2.98000000e-25, rtol=0.05)
+
+
+def test_castro_base_vectorized():
+
+    rs = np.random.RandomState(1)
+    nx, ny = 6, 25
+    norm_vals = np.zeros((nx, ny))
+    nll_vals = np.zeros((nx, ny))
+    for i in range(nx):
+        norm_vals[i] = np.concatenate(([0.0], np.logspace(-14, -9, ny - 1)))
+        mu, sigma = 10**rs.uniform(-13, -10), 10**rs.uniform(-13, -11)
+        nll_vals[i] = 0.5 * ((norm_vals[i] - mu) / sigma)**2
+    nll_vals[2, 4] = np.inf
+
+    cd = castro.CastroData_Base(norm_vals, nll_vals, 'norm')
+    lnlfns = [castro.LnLFn(norm_vals[i], nll_vals[i]) for i in range(nx)]
+
+    x = 10**rs.uniform(-14, -9, nx)
+    assert_allclose(cd.mles(), np.ravel([fn.mle() for fn in lnlfns]),
+                    rtol=1E-8)
+    assert_allclose(cd.ts_vals(), np.ravel([fn.TS() for fn in lnlfns]),
+                    rtol=1E-8)
+    assert_allclose(cd.getLimits(0.05),
+                    np.ravel([fn.getLimit(0.05) for fn in lnlfns]), rtol=1E-8)
+    assert_allclose(cd(x), np.sum([fn.interp(xx) for fn, xx in
+                                   zip(lnlfns, x)]), rtol=1E-8)
+    assert_allclose(cd.derivative(x),
+                    np.sum([fn.interp.derivative(xx) for fn, xx in
+                            zip(lnlfns, x)]), rtol=1E-8)
+
+
+def test_tscube_fit_spectra_all():
+
+    from gammapy.maps import WcsGeom, WcsNDMap, MapAxis
+
+    rs = np.random.RandomState(2)
+    nx, ny, ne, nscan = 4, 3, 8, 30
+    npix = nx * ny
+    ebins = np.logspace(2, 5, ne + 1)
+    emin, emax = ebins[:-1], ebins[1:]
+    ones = np.ones(ne)
+    ref_spec = castro.ReferenceSpec(emin, emax, ones, ones, ones, ones)
+
+    params = [10**rs.uniform(-12.5, -11.5, (1, npix)),
+              rs.uniform(-2.6, -1.6, (1, npix))]
+    flux = PowerLaw.eval_flux(emin[:, None], emax[:, None], params, 1E3).T
+    sigma = 0.2 * flux + 1E-12
+    norm_vals = np.zeros((npix, ne, nscan))
+    norm_vals[:, :, 1:] = ((flux + 3. * sigma)[:, :, None] *
+                           np.logspace(-3, 1, nscan - 1)[None, None, :])
+    nll_vals = 0.5 * ((norm_vals - flux[:, :, None]) / sigma[:, :, None])**2
+    nll_vals -= np.min(nll_vals, axis=2)[:, :, None]
+
+    geom = WcsGeom.create(npix=(nx, ny), binsz=0.1)
+    axis = MapAxis.from_edges(ebins, interp='log')
+    tsmap = WcsNDMap(geom)
+    tscube = WcsNDMap(geom.to_cube([axis]))
+    tc = castro.TSCube(tsmap, tsmap, tscube, tscube, norm_vals, nll_vals,
+                       ref_spec, 'flux')
+
+    mask = np.ones(tsmap.data.shape, dtype=bool)
+    mask[0, 0] = False
+    fit_maps = tc.fit_spectra_all('PowerLaw', mask=mask, chunk_size=5)
+
+    ts = fit_maps['ts'].data.ravel()
+    prefactor = fit_maps['Prefactor'].data.ravel()
+    index = fit_maps['Index'].data.ravel()
+    assert np.isnan(ts[0])
+    assert np.all(fit_maps['fit_success'].data.ravel()[1:] == 1)
+
+    for i in range(1, npix):
+        cd = tc.castroData_from_ipix(i)
+        fn = cd.create_functor('PowerLaw')
+        fit_out = cd.fit_spectrum(fn, fn.params)
+        assert_allclose(ts[i], fit_out['ts_spec'], atol=0.05)
+        assert_allclose(prefactor[i], fit_out['params'][0], rtol=0.02)
+        assert_allclose(index[i], fit_out['params'][1], atol=0.01)
+
+
+def test_castro_stack_nll(tmpdir):
+
+    rs = np.random.RandomState(3)
+    nx, ny = 4, 20
+    components = []
+    for k in range(7):
+        norm_vals = np.zeros((nx, ny + k % 2))
+        norm_vals[:, 1:] = np.logspace(-14, -9, ny + k % 2 - 1)[None, :]
+        mu = 10**rs.uniform(-13, -10, (nx, 1))
+        sigma = 10**rs.uniform(-13, -11, (nx, 1))
+        nll_vals = 0.5 * ((norm_vals - mu) / sigma)**2
+        components += [castro.CastroData_Base(norm_vals, nll_vals, 'norm')]
+    weights = rs.uniform(0.5, 2.0, len(components))
+
+    shape = (nx, 30)
+    ylims = (1E-14, 1E-9)
+    norm_vals, nll_vals = castro.CastroData_Base.stack_nll(
+        shape, components, ylims, weights, chunk_size=3)
+
+    nll_sum = np.zeros(shape)
+    for c, w in zip(components, weights):
+        for i in range(nx):
+            nll_sum[i] += w * c[i].interp(norm_vals[i])
+    nll_sum -= np.min(nll_sum, axis=1)[:, np.newaxis]
+    assert_allclose(nll_vals, nll_sum, rtol=1E-8, atol=1E-6)
+
+    stackfile = str(tmpdir.join('stack.npy'))
+    castro.write_castro_stack(stackfile, components)
+    _, nll_vals_file = castro.CastroData_Base.stack_nll(
+        shape, stackfile, ylims, weights, chunk_size=2)
+    assert_allclose(nll_vals_file, nll_vals)
+
+
+def test_castro_dm_scan():
+
+    from fermipy.spectrum import DMChannelTable
+
+    nebins = 12
+    ebins = np.logspace(2.5, 5.5, nebins + 1)
+    emin, emax = ebins[:-1], ebins[1:]
+    masses = np.logspace(1, 4, 7)
+    dm_table = DMChannelTable(emin, emax, masses, ['bb', 'tautau'])
+    ones = np.ones(nebins)
+    ref_spec = castro.ReferenceSpec(emin, emax, ones, ones, ones, ones)
+
+    jfactor = 1E19
+    eflux = dm_table(5E-25, jfactor)[0, 3]
+    sigma = 0.3 * eflux + 1E-8
+    norm_vals = np.zeros((nebins, 30))
+    norm_vals[:, 1:] = np.logspace(-10, -5, 29)[None, :]
+    nll_vals = 0.5 * ((norm_vals - eflux[:, None]) / sigma[:, None])**2
+    nll_vals -= np.min(nll_vals, axis=1)[:, None]
+    cd = castro.CastroData(norm_vals, nll_vals, ref_spec, 'eflux')
+
+    tab = cd.dm_scan(dm_table, jfactor)
+    assert len(tab) == 2 * len(masses)
+
+    # Tables computed for different energy bins are rejected
+    dm_table_shifted = DMChannelTable(1.1 * emin, 1.1 * emax, masses, ['bb'])
+    with pytest.raises(Exception):
+        cd.dm_scan(dm_table_shifted, jfactor)
+
+    for row in tab[::3]:
+        dmfn = DMFitFunction([row['sigmav'], row['mass']],
+                             chan=row['channel'], jfactor=jfactor)
+        init_pars = np.array([row['sigmav'], row['mass']])
+        spec_func = cd.create_functor(dmfn, init_pars)
+        fit_out = cd.fit_spectrum(spec_func, init_pars,
+                                  freePars=[True, False])
+        assert_allclose(row['ts'], fit_out['ts_spec'], atol=0.02)
+        assert_allclose(row['sigmav'], fit_out['params'][0], rtol=0.02)
+        assert row['sigmav_ul'] > row['sigmav']
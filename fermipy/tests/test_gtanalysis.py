@@ -124,6 +124,17 @@ def test_gtanalysis_optimize(create_draco_analysis):
     gta.optimize()
 
 
+def test_gtanalysis_optimize_norm_fit(create_draco_analysis):
+    gta = create_draco_analysis
+    gta.load_roi('fit0')
+    o0 = gta.optimize(norm_fit='source')
+    for norm_fit in ['block', 'sweep']:
+        gta.load_roi('fit0')
+        o1 = gta.optimize(norm_fit=norm_fit, max_free_sources=3)
+        assert all(len(b) <= 3 for b in o1['blocks'])
+        assert np.abs(o1['loglike1'] - o0['loglike1']) < 1.0
+
+
 def test_gtanalysis_fit(create_draco_analysis):
     gta = create_draco_analysis
     gta.load_roi('fit0')
@@ -146,3 +146,47 @@ def test_ltcube():
     lthist0 = ltc.get_skydir_lthist(c, cth_edges)
     lthist1 = ltc.get_skydir_lthist(c, ltc.costh_edges)
     assert_allclose(np.sum(lthist0), np.sum(lthist1))
+
+
+def test_irf_cache(tmpdir):
+
+    ltc = irfs.LTCube.create_from_obs_time(3.1536E8)
+    c = SkyCoord(10.0, 10.0, unit='deg')
+    egy = 10**np.linspace(1.0, 6.0, 6)
+    cth_bins = np.array([0.2, 0.6, 1.0])
+    dtheta = np.array([0.0, 1.0])
+
+    cache = irfs.IrfCache(str(tmpdir), max_size=None)
+    exp0 = irfs.calc_exp(c, ltc, 'P8R2_SOURCE_V6', ['FRONT', 'BACK'],
+                         egy, cth_bins)
+    exp1 = irfs.calc_exp(c, ltc, 'P8R2_SOURCE_V6', ['FRONT', 'BACK'],
+                         egy, cth_bins, cache=cache)
+    assert_allclose(exp0, exp1)
+    assert len(tmpdir.listdir()) == 1
+
+    # Sky directions within the tolerance map to the same entry
+    c1 = SkyCoord(10.001, 10.001, unit='deg')
+    exp2 = irfs.calc_exp(c1, ltc, 'P8R2_SOURCE_V6', ['FRONT', 'BACK'],
+                         egy, cth_bins, cache=cache)
+    assert_allclose(exp0, exp2)
+    assert len(tmpdir.listdir()) == 1
+
+    psf0 = irfs.create_avg_psf(c, ltc, 'P8R2_SOURCE_V6', ['FRONT', 'BACK'],
+                               dtheta, egy, cth_bins)
+    psf1 = irfs.create_avg_psf(c, ltc, 'P8R2_SOURCE_V6', ['FRONT', 'BACK'],
+                               dtheta, egy, cth_bins, cache=cache)
+    assert_allclose(psf0, psf1)
+    assert len(tmpdir.listdir()) == 2
+
+    # Changing the livetime cube invalidates the cached entries
+    ltc.load(irfs.LTCube.create_from_obs_time(3.1536E8))
+    exp3 = irfs.calc_exp(c, ltc, 'P8R2_SOURCE_V6', ['FRONT', 'BACK'],
+                         egy, cth_bins, cache=cache)
+    assert_allclose(exp3, 2.0 * exp0)
+    assert len(tmpdir.listdir()) == 3
+
+    # Only the most recently used entry fits in the cache
+    cache = irfs.IrfCache(str(tmpdir),
+                          max_size=max([p.size() for p in tmpdir.listdir()]))
+    cache.evict()
+    assert len(tmpdir.listdir()) == 1
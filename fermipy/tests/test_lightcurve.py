@@ -0,0 +1,64 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+from __future__ import absolute_import, division, print_function
+import numpy as np
+from numpy.testing import assert_allclose
+from fermipy.tests.utils import requires_dependency
+
+try:
+    from fermipy import gtanalysis
+    from fermipy import lightcurve
+except ImportError:
+    pass
+
+# Skip tests in this file if Fermi ST aren't available
+pytestmark = requires_dependency('Fermi ST')
+
+
+def test_lightcurve_store(tmpdir):
+
+    config = {'selection': {'emin': 100., 'emax': 1E5}}
+    kwargs = {'free_radius': 1.0, 'multithread': False}
+    const_spectrum = ('PowerLaw', {'Index': {'value': 2.0}})
+
+    h0 = lightcurve._hash_lc_config(config, kwargs, const_spectrum)
+    kwargs['multithread'] = True
+    kwargs['nthread'] = 4
+    assert lightcurve._hash_lc_config(config, kwargs, const_spectrum) == h0
+    kwargs['free_radius'] = 2.0
+    assert lightcurve._hash_lc_config(config, kwargs, const_spectrum) != h0
+
+    store = lightcurve.LightCurveStore(str(tmpdir), 'Source A', h0)
+    assert store.load(0.0, 86400.) is None
+
+    o = {'fit_success': True, 'flux': 1E-8,
+         'dnde': np.array([1.0, 2.0]), 'config': config}
+    store.save(0.0, 86400., o)
+    o1 = store.load(0.0, 86400.)
+    assert o1['fit_success']
+    assert_allclose(o1['dnde'], o['dnde'])
+    assert o1['config'] == config
+    assert store.load(86400., 2 * 86400.) is None
+    assert len(tmpdir.listdir()) == 1
+
+    # Results are keyed to the configuration hash
+    store = lightcurve.LightCurveStore(str(tmpdir), 'Source A', h0[::-1])
+    assert store.load(0.0, 86400.) is None
+
+
+def test_calc_lc_bin_cost():
+
+    times = np.array([0.0, 100.0, 300.0, 600.0])
+    assert_allclose(lightcurve._calc_lc_bin_cost(times),
+                    [100.0, 200.0, 300.0])
+
+    tab_sc = {'START': np.arange(0.0, 600.0, 30.0),
+              'LIVETIME': np.ones(20) * 25.0}
+    tab_sc['LIVETIME'][10:] = 0.0
+    assert_allclose(lightcurve._calc_lc_bin_cost(times, [tab_sc]),
+                    [100.0, 150.0, 0.0])
+
+    # Livetime is summed over the tables of all components
+    tab_sc2 = {'START': np.arange(300.0, 600.0, 30.0),
+               'LIVETIME': np.ones(10) * 20.0}
+    assert_allclose(lightcurve._calc_lc_bin_cost(times, [tab_sc, tab_sc2]),
+                    [100.0, 150.0, 200.0])
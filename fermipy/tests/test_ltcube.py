@@ -0,0 +1,100 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+from __future__ import absolute_import, division, print_function
+import numpy as np
+from numpy.testing import assert_allclose
+from astropy.table import Table
+from astropy.coordinates import SkyCoord
+from fermipy import utils
+from fermipy.ltcube import LTCube, fill_livetime_hist, gti_difference
+
+
+def make_sc_table(nrow=2000, seed=0):
+
+    rs = np.random.RandomState(seed)
+    t0 = np.arange(nrow) * 30.
+    tab_sc = Table(dict(START=t0, STOP=t0 + 30.,
+                        LIVETIME=rs.uniform(20., 30., nrow),
+                        RA_SCZ=rs.uniform(0., 360., nrow),
+                        DEC_SCZ=rs.uniform(-90., 90., nrow),
+                        RA_ZENITH=rs.uniform(0., 360., nrow),
+                        DEC_ZENITH=rs.uniform(-90., 90., nrow)))
+    tab_gti = Table(dict(START=np.array([0., 3000., 9000.]),
+                         STOP=np.array([2400., 8000., 60000.])))
+    return tab_sc, tab_gti
+
+
+def test_fill_livetime_hist():
+
+    tab_sc, tab_gti = make_sc_table()
+    rs = np.random.RandomState(1)
+    skydir = SkyCoord(rs.uniform(0., 360., 50), rs.uniform(-90., 90., 50),
+                      unit='deg')
+    cth_edges = (1.0 - np.linspace(0, 1.0, 41)**2)[::-1]
+    zmax = 100.
+
+    # Reference calculation looping over sky directions
+    t0, t1 = tab_sc['START'], tab_sc['STOP']
+    live = np.array(tab_sc['LIVETIME'])
+    m0 = np.zeros(len(tab_sc), dtype=bool)
+    for row in tab_gti:
+        m0 |= (t0 >= row['START']) & (t1 <= row['STOP'])
+
+    sc_xyz = utils.angle_to_cartesian(np.radians(tab_sc['RA_SCZ']),
+                                      np.radians(tab_sc['DEC_SCZ']))
+    zn_xyz = utils.angle_to_cartesian(np.radians(tab_sc['RA_ZENITH']),
+                                      np.radians(tab_sc['DEC_ZENITH']))
+    xyz = utils.angle_to_cartesian(skydir.ra.rad, skydir.dec.rad)
+    lt_ref = np.zeros((40, len(skydir)))
+    lt_wt_ref = np.zeros((40, len(skydir)))
+    for i, t in enumerate(xyz):
+        cos_sep = utils.dot_prod(t, sc_xyz)
+        cos_zn = utils.dot_prod(t, zn_xyz)
+        m = m0 & (cos_zn > np.cos(np.radians(zmax))) & (cos_sep > 0.0)
+        lt_ref[:, i] = np.histogram(cos_sep[m], bins=cth_edges,
+                                    weights=live[m])[0]
+        lt_wt_ref[:, i] = np.histogram(cos_sep[m], bins=cth_edges,
+                                       weights=live[m]**2 / 30.)[0]
+
+    lt, lt_wt = fill_livetime_hist(skydir, tab_sc, tab_gti, zmax, cth_edges,
+                                   max_nelem=1000)
+    assert_allclose(lt, lt_ref, rtol=1E-10, atol=1E-8)
+    assert_allclose(lt_wt, lt_wt_ref, rtol=1E-10, atol=1E-8)
+
+    lt2, lt_wt2 = fill_livetime_hist(skydir, tab_sc, tab_gti, zmax,
+                                     cth_edges, max_nelem=1000, nthread=2)
+    assert_allclose(lt2, lt)
+    assert_allclose(lt_wt2, lt_wt)
+
+
+def test_gti_difference():
+
+    tab_gti = Table(dict(START=np.array([0., 10., 30.]),
+                         STOP=np.array([5., 25., 40.])))
+    tab_gti_ref = Table(dict(START=np.array([2., 12.]),
+                             STOP=np.array([4., 30.])))
+    tab = gti_difference(tab_gti, tab_gti_ref)
+    assert_allclose(tab['START'], [0., 4., 10., 30.])
+    assert_allclose(tab['STOP'], [2., 5., 12., 40.])
+    assert len(gti_difference(tab_gti, tab_gti)) == 0
+
+
+def test_ltcube_append_from_gti():
+
+    tab_sc, tab_gti = make_sc_table()
+    skydir = SkyCoord(30.0, 20.0, unit='deg')
+    kw = dict(nside=64, radius=10.0)
+
+    ltc = LTCube.create_from_gti(skydir, tab_sc, tab_gti, 100., **kw)
+    ltc_append = LTCube.create_from_gti(skydir, tab_sc, tab_gti[:2], 100.,
+                                        **kw)
+    assert_allclose(ltc_append.tstop, 8000.)
+
+    for i in range(2):
+        ltc_append.append_from_gti(tab_sc, tab_gti, skydir=skydir,
+                                   radius=10.0)
+
+    assert_allclose(ltc_append.data, ltc.data)
+    assert_allclose(ltc_append.data_wt, ltc.data_wt)
+    assert_allclose(ltc_append.tstart, 0.)
+    assert_allclose(ltc_append.tstop, 60000.)
+    assert len(ltc_append._tab_gti) == len(tab_gti)
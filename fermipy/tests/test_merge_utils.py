@@ -0,0 +1,105 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+from __future__ import absolute_import, division, print_function
+import numpy as np
+from numpy.testing import assert_allclose
+from astropy.io import fits
+from fermipy.hpx_utils import HPX, HPX_FITS_CONVENTIONS
+from fermipy import merge_utils
+
+
+def make_gti_hdu(tstart, tstop):
+    cols = [fits.Column('START', 'D', array=[tstart]),
+            fits.Column('STOP', 'D', array=[tstop])]
+    hdu = fits.BinTableHDU.from_columns(cols, name='GTI')
+    hdu.header['EXPOSURE'] = tstop - tstart
+    hdu.header['TSTOP'] = tstop
+    return hdu
+
+
+def make_ebounds_hdu(ebins):
+    cols = [fits.Column('CHANNEL', 'I', array=np.arange(1, len(ebins))),
+            fits.Column('E_MIN', 'E', array=1E3 * ebins[:-1]),
+            fits.Column('E_MAX', 'E', array=1E3 * ebins[1:])]
+    return fits.BinTableHDU.from_columns(cols, name='EBOUNDS')
+
+
+def test_iter_prefetch():
+
+    import threading
+    lock = threading.Lock()
+    state = dict(loaded=0, consumed=0, max_ahead=0)
+
+    def load(item):
+        with lock:
+            state['loaded'] += 1
+            state['max_ahead'] = max(state['max_ahead'],
+                                     state['loaded'] - state['consumed'])
+        return item
+
+    for prefetch in [1, 2]:
+        state.update(loaded=0, consumed=0, max_ahead=0)
+        out = []
+        for item in merge_utils.iter_prefetch(load, list(range(8)),
+                                              nthread=4, prefetch=prefetch):
+            out += [item]
+            with lock:
+                state['consumed'] += 1
+        assert out == list(range(8))
+        assert state['max_ahead'] <= prefetch + 1
+
+
+def test_merge_wcs_counts_cubes(tmpdir):
+
+    ebins = np.logspace(2, 4, 5)
+    data = np.random.poisson(3.0, size=(3, 4, 10, 12)).astype(np.int32)
+    filelist = []
+    for i in range(3):
+        prim = fits.PrimaryHDU(data[i])
+        prim.header['DATE-END'] = '2010-01-0%i' % (i + 1)
+        filename = str(tmpdir.join('ccube_%i.fits' % i))
+        fits.HDUList([prim, make_ebounds_hdu(ebins),
+                      make_gti_hdu(100. * i, 100. * i + 50.)]).writeto(filename)
+        filelist += [filename]
+
+    for nthread, prefetch in [(None, 1), (2, 1), (2, 2)]:
+        hdulist = merge_utils.merge_wcs_counts_cubes(filelist,
+                                                     nthread=nthread,
+                                                     tmpdir=str(tmpdir),
+                                                     prefetch=prefetch)
+        assert_allclose(hdulist[0].data, np.sum(data, axis=0))
+        assert_allclose(hdulist['GTI'].data['START'], [0., 100., 200.])
+        assert_allclose(hdulist['GTI'].header['EXPOSURE'], 150.)
+        assert hdulist[0].header['DATE-END'] == '2010-01-03'
+
+
+def test_merge_hpx_counts_cubes(tmpdir):
+
+    ebins = np.logspace(2, 4, 5)
+    hpx_allsky = HPX(4, False, 'GAL', ebins=ebins)
+    hpx_region = HPX(4, False, 'GAL', region='DISK(110.,75.,30.)',
+                     ebins=ebins)
+    hpx_sparse = HPX(4, False, 'GAL', ebins=ebins,
+                     conv=HPX_FITS_CONVENTIONS['FGST_SRCMAP_SPARSE'])
+
+    expected = np.zeros((4, hpx_allsky.npix))
+    filelist = []
+    for i, hpx in enumerate([hpx_allsky, hpx_region, hpx_sparse]):
+        data = np.random.poisson(0.5, size=(4, hpx.npix)).astype(float)
+        if hpx is hpx_region:
+            expected[:, hpx._ipix] += data
+        else:
+            expected += data
+        filename = str(tmpdir.join('hpx_ccube_%i.fits' % i))
+        fits.HDUList([fits.PrimaryHDU(),
+                      hpx.make_hdu(data, extname='SKYMAP'),
+                      make_ebounds_hdu(ebins),
+                      make_gti_hdu(100. * i, 100. * i + 50.)]).writeto(filename)
+        filelist += [filename]
+
+    hdulist = merge_utils.merge_hpx_counts_cubes(filelist, nthread=2,
+                                                 tmpdir=str(tmpdir))
+    assert_allclose(hdulist['GTI'].header['EXPOSURE'], 150.)
+    hdu = hdulist['SKYMAP']
+    data = np.vstack([hdu.data.field('CHANNEL%i' % (i + 1))
+                      for i in range(4)])
+    assert_allclose(data, expected)
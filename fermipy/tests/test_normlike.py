@@ -0,0 +1,64 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+from __future__ import absolute_import, division, print_function
+import numpy as np
+from numpy.testing import assert_allclose
+from fermipy.normlike import BinnedNormLikelihood
+
+
+def _make_data():
+    np.random.seed(1)
+    x = np.linspace(-5.0, 5.0, 200)
+    bkg = 2.0 * np.ones((4, 200))
+    t0 = 20.0 * np.exp(-0.5 * (x / 0.5)**2) * np.ones((4, 1))
+    t1 = 10.0 * np.exp(-0.5 * ((x - 1.0) / 0.5)**2) * np.ones((4, 1))
+    templates = np.array([t0, t1])
+    counts = np.random.poisson(bkg + 1.5 * t0 + 0.7 * t1)
+    return counts, templates, bkg
+
+
+def test_normlike_derivatives():
+
+    counts, templates, bkg = _make_data()
+    weights = np.ones(counts.shape)
+    weights[:, :10] = 0.0
+    like = BinnedNormLikelihood(counts, templates, bkg, weights,
+                                dtype=np.float64)
+
+    xnorm = np.array([1.2, 0.8])
+    m = bkg + np.tensordot(xnorm, templates, axes=1)
+    w = weights > 0
+    assert_allclose(like.loglike(xnorm),
+                    np.sum(counts[w] * np.log(m[w]) - m[w]))
+
+    eps = 1E-6
+    grad = like.gradient(xnorm)
+    hess = like.hessian(xnorm)
+    for i in range(2):
+        dx = np.zeros(2)
+        dx[i] = eps
+        assert_allclose(grad[i], (like.loglike(xnorm + dx) -
+                                  like.loglike(xnorm - dx)) / (2 * eps),
+                        rtol=1E-4)
+        assert_allclose(hess[i], (like.gradient(xnorm + dx) -
+                                  like.gradient(xnorm - dx)) / (2 * eps),
+                        rtol=1E-4)
+
+
+def test_normlike_fit():
+
+    counts, templates, bkg = _make_data()
+    like = BinnedNormLikelihood(counts, templates, bkg)
+    o = like.fit(tol=1E-6)
+    assert o['fit_status'] == 0
+    assert_allclose(like.gradient(o['values']), np.zeros(2), atol=1E-2)
+    assert_allclose(o['values'], [1.5, 0.7], atol=5 * np.max(o['errors']))
+
+    # Errors from the Hessian correspond to a change of 0.5 in loglike
+    dx = np.array([o['errors'][0], 0.0])
+    dloglike = o['loglike'] - like.loglike(o['values'] + dx)
+    assert 0.3 < dloglike < 0.7
+
+    # Bounds are respected
+    o = like.fit(bounds=[[0.0, 1.0], [0.0, 10.0]])
+    assert o['values'][0] == 1.0
+    assert o['fit_status'] == 0
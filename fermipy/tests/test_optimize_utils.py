@@ -0,0 +1,63 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+from __future__ import absolute_import, division, print_function
+import numpy as np
+from numpy.testing import assert_allclose
+from fermipy import optimize_utils
+
+
+def test_find_source_blocks():
+
+    lon = np.array([0.0, 0.5, 1.0, 10.0, 10.3, 20.0])
+    lat = np.zeros(6)
+    blocks = optimize_utils.find_source_blocks(lon, lat, 0.3)
+    assert [list(b) for b in blocks] == [[0, 1, 2], [3, 4], [5]]
+
+    blocks = optimize_utils.find_source_blocks(lon, lat, 0.1)
+    assert [list(b) for b in blocks] == [[0], [1], [2], [3], [4], [5]]
+
+    blocks = optimize_utils.find_source_blocks(lon, lat, 0.3, max_size=2)
+    assert [list(b) for b in blocks] == [[0, 1], [2], [3, 4], [5]]
+
+    # Every source is in its own block for a zero coupling radius
+    blocks = optimize_utils.find_source_blocks(lon, lat, 0.0)
+    assert [list(b) for b in blocks] == [[0], [1], [2], [3], [4], [5]]
+
+
+def test_fit_norms_sweep():
+
+    np.random.seed(1)
+    npix = 400
+    x = np.arange(npix)
+    bkg = 5.0 * np.ones(npix)
+    t0 = 50.0 * np.exp(-0.5 * ((x - 100.) / 5.)**2)
+    t1 = 30.0 * np.exp(-0.5 * ((x - 110.) / 5.)**2)
+    t2 = 40.0 * np.exp(-0.5 * ((x - 300.) / 5.)**2)
+    counts = np.random.poisson(bkg + 2.0 * t0 + 0.5 * t1 + 1.5 * t2)
+
+    templates = []
+    for t in [t0, t1, t2]:
+        idx = np.flatnonzero(t > 1E-3)
+        templates += [(idx, t[idx])]
+    model = bkg + t0 + t1 + t2
+
+    norms, ts, loglike = optimize_utils.fit_norms_sweep(
+        counts, templates, model, nsweep=50, tol=1E-6)
+
+    # Compare with a brute-force maximization on a grid
+    def fn(n):
+        m = bkg + n[0] * t0 + n[1] * t1 + n[2] * t2
+        return np.sum(counts * np.log(m) - m)
+
+    assert_allclose(loglike, fn(norms))
+    for i in range(3):
+        for d in [-0.02, 0.02]:
+            n = norms.copy()
+            n[i] += d
+            assert fn(n) < loglike
+    assert np.all(ts > 0)
+
+    # Bounds are respected
+    bounds = np.array([[0.0, 1.5], [0.0, 10.0], [0.0, 10.0]])
+    norms, ts, loglike = optimize_utils.fit_norms_sweep(
+        counts, templates, model, norm_bounds=bounds)
+    assert norms[0] <= 1.5
@@ -0,0 +1,142 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+from __future__ import absolute_import, division, print_function
+import numpy as np
+from numpy.testing import assert_allclose
+from fermipy.tests.utils import requires_dependency
+
+try:
+    import healpy as hp
+    from fermipy import residmap
+    from fermipy.hpx_utils import HPX, make_disc_index
+    from fermipy.skymap import HpxMap
+except ImportError:
+    pass
+
+pytestmark = requires_dependency('healpy')
+
+
+def convolve_direct(m, k):
+    """Reference implementation of a 2-D convolution with the output
+    centered on the input map."""
+    nx, ny = k.shape
+    ox, oy = (nx - 1) // 2, (ny - 1) // 2
+    mp = np.zeros((m.shape[0] + nx - 1, m.shape[1] + ny - 1))
+    mp[nx - 1 - ox:nx - 1 - ox + m.shape[0],
+       ny - 1 - oy:ny - 1 - oy + m.shape[1]] = m
+    o = np.zeros(m.shape)
+    for i in range(m.shape[0]):
+        for j in range(m.shape[1]):
+            o[i, j] = np.sum(mp[i:i + nx, j:j + ny] * k[::-1, ::-1])
+    return o
+
+
+def make_kernel(shape, cpix, sigmas):
+    x, y = np.meshgrid(np.arange(shape[0]) - cpix[0],
+                       np.arange(shape[1]) - cpix[1], indexing='ij')
+    return np.exp(-0.5 * (x**2 + y**2) /
+                  np.array(sigmas)[:, None, None]**2)
+
+
+def test_map_convolver():
+
+    rs = np.random.RandomState(1)
+    shape = (4, 15, 17)
+    cpix = [7, 8]
+    k = make_kernel(shape[1:], cpix, [2.0, 1.5, 1.0, 0.5])
+    cc = rs.poisson(2.0, shape).astype(float)
+    mc = rs.uniform(1.0, 3.0, shape)
+    wmap = rs.uniform(0.0, 1.0, shape)
+
+    convolver = residmap.MapConvolver(k, cpix, shape[1:], imin=1)
+    assert convolver.nplane == 3
+
+    for nthread in [None, 2]:
+        ccs, mcs = convolver.convolve([cc, mc], wmap=wmap, nthread=nthread)
+        ecs = convolver.convolve_ones(wmap=wmap, nthread=nthread)
+        assert ccs.shape == (3,) + shape[1:]
+        for i in range(3):
+            ks = residmap._truncate_kernel(k[i + 1], cpix, shape[1:])
+            w = wmap[i + 1]
+            assert_allclose(ccs[i], convolve_direct(cc[i + 1], ks) * w,
+                            atol=1E-10)
+            assert_allclose(mcs[i], convolve_direct(mc[i + 1], ks) * w,
+                            atol=1E-10)
+            assert_allclose(ecs[i], convolve_direct(np.ones(shape[1:]), ks) * w,
+                            atol=1E-10)
+
+    assert convolver.convolve_ones(wmap=wmap) is ecs
+    assert_allclose(residmap.convolve_map(cc, k, cpix, imin=1, wmap=wmap),
+                    ccs, atol=1E-10)
+
+
+def make_hpx_test_maps(nside=32, nest=True, sigmas=(0.06, 0.04), seed=0):
+
+    hpx = HPX.create_hpx(nside, nest, 'GAL', region='DISK(30.0,20.0,25.0)')
+    ipix = hpx._ipix
+    vec = np.array(hp.pix2vec(nside, ipix, nest=nest)).T
+    vc = hp.ang2vec(30.0, 20.0, lonlat=True)
+    cpix = np.argmax(np.dot(vec, vc))
+    theta = np.arccos(np.clip(np.dot(vec, vec[cpix]), -1.0, 1.0))
+    k = np.exp(-0.5 * theta[None, :]**2 /
+               np.array(sigmas)[:, None]**2)
+    k /= np.sum(k, axis=1)[:, None]
+
+    rs = np.random.RandomState(seed)
+    data = rs.poisson(5.0, (len(sigmas), len(ipix))).astype(float)
+    return hpx, vec, cpix, k, data
+
+
+def test_make_disc_index():
+
+    hpx, vec, cpix, k, data = make_hpx_test_maps()
+    idx, theta = make_disc_index(hpx.nside, hpx.nest, hpx._ipix,
+                                 np.radians(5.0))
+    assert idx.shape == (len(vec), theta.shape[1])
+    for i in [0, cpix, len(vec) - 1]:
+        cosdist = np.dot(vec, vec[i])
+        assert_allclose(np.sort(idx[i][idx[i] >= 0]),
+                        np.flatnonzero(cosdist > np.cos(np.radians(5.0))))
+    assert np.all(np.isinf(theta[idx < 0]))
+
+
+def test_hpx_convolver():
+
+    hpx, vec, cpix, k, data = make_hpx_test_maps()
+
+    disc = residmap.HpxConvolver(hpx.nside, hpx.nest, hpx._ipix, k, cpix,
+                                 threshold=1E-4, method='disc')
+    harmonic = residmap.HpxConvolver(hpx.nside, hpx.nest, hpx._ipix, k, cpix,
+                                     threshold=1E-4, method='harmonic')
+    assert disc.nplane == 2
+
+    o_disc = disc.convolve([data])[0]
+    o_harmonic = harmonic.convolve([data], nthread=2)[0]
+
+    cosdist = np.dot(vec, vec.T)
+    theta = np.arccos(np.clip(cosdist, -1.0, 1.0))
+    inner = np.dot(vec, vec[cpix]) > np.cos(np.radians(15.0))
+    for i in range(2):
+        w = disc.kernel(i, theta)
+        assert_allclose(disc.kernel(i, 0.0), k[i, cpix])
+        assert_allclose(o_disc[i], np.dot(w, data[i]))
+        assert_allclose(o_harmonic[i][inner], o_disc[i][inner], rtol=5E-2)
+
+    ones = disc.convolve_ones()
+    assert disc.convolve_ones() is ones
+    assert_allclose(ones[:, inner], 1.0, rtol=5E-2)
+
+
+def test_convolve_map_hpx_gauss():
+
+    nside = 32
+    sigmas = np.array([0.05, 0.03])
+    hpx, vec, cpix, k, data = make_hpx_test_maps(nside=nside)
+    m = HpxMap(data, hpx)
+    o = residmap.convolve_map_hpx_gauss(m, sigmas)
+
+    for i in range(2):
+        full = np.zeros(hp.nside2npix(nside))
+        full[hp.nest2ring(nside, hpx._ipix)] = data[i]
+        full = hp.smoothing(full, sigma=sigmas[i])
+        assert_allclose(o.counts[i], full[hp.nest2ring(nside, hpx._ipix)],
+                        atol=1E-8)
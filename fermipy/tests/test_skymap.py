@@ -2,7 +2,7 @@
 from __future__ import absolute_import, division, print_function
 import numpy as np
 from numpy.testing import assert_allclose
-from fermipy.hpx_utils import HPX
+from fermipy.hpx_utils import HPX, HpxToWcsMapping
 from fermipy.fits_utils import write_fits_image
 from fermipy.skymap import HpxMap
 
@@ -43,3 +43,116 @@ def test_hpx():
     ebins = np.logspace(2, 5, 8)
     hpx1 = HPX(2**3, False, 'GAL', region='DISK(110.,75.,10.)', ebins=ebins)
     assert_allclose(hpx1[hpx1._ipix], np.arange(len(hpx1._ipix)))
+
+
+def test_hpx_to_wcs_mapping(tmpdir):
+
+    ebins = np.logspace(2, 5, 4)
+    hpx = HPX(64, False, 'GAL', region='DISK(110.,75.,10.)', ebins=ebins)
+    wcs = hpx.make_wcs(2)
+    data = np.random.uniform(size=(3, hpx.npix))
+
+    HpxToWcsMapping.clear_registry()
+    m0 = HpxToWcsMapping.create(hpx, wcs, cachedir=str(tmpdir))
+    assert HpxToWcsMapping.create(hpx, wcs) is m0
+
+    # Each HEALPix pixel is split evenly between its WCS pixels
+    m = m0.valid
+    assert_allclose(np.bincount(m0.lmap[m], weights=m0.mult_val[m]),
+                    np.ones(hpx.npix))
+
+    # Batched reprojection matches reprojection of each plane
+    wcs_data = m0.transform(data)
+    for i in range(3):
+        wcs_plane = np.zeros(m0.npix)
+        m0.fill_wcs_map_from_hpx_data(data[i], wcs_plane)
+        assert_allclose(wcs_data[i], wcs_plane)
+
+    # Mapping is reloaded from the on-disk store
+    HpxToWcsMapping.clear_registry()
+    m1 = HpxToWcsMapping.create(hpx, wcs, cachedir=str(tmpdir))
+    assert m1 is not m0
+    assert_allclose(m1.ipixs, m0.ipixs)
+    assert_allclose(m1.mult_val, m0.mult_val)
+    assert_allclose(m1.transform(data), wcs_data)
+
+
+def test_hpx_to_wcs_mapping_pixels():
+
+    HpxToWcsMapping.clear_registry()
+    for pixels in [np.arange(0, 500), np.arange(1000, 1200)]:
+        hpx = HPX(16, True, 'GAL', pixels=pixels)
+        data = np.random.uniform(size=hpx.npix)
+        hpx_map = HpxMap(data, hpx)
+        wcs, wcs_data = hpx_map.make_wcs_from_hpx(normalize=False)
+        m = HpxToWcsMapping.create(hpx, hpx_map._wcs_2d)
+        assert np.all(m.lmap[m.valid] < hpx.npix)
+    assert len(HpxToWcsMapping._registry) == 2
+
+
+def test_hpxmap_lazy_cutout(tmpdir):
+
+    from astropy.coordinates import SkyCoord
+
+    ebins = np.logspace(2, 5, 5)
+    hpx = HPX(16, False, 'GAL', ebins=ebins)
+    data = np.random.uniform(size=(4, hpx.npix))
+    filename = str(tmpdir / 'test_hpx_cutout.fits')
+    hpx.write_fits(data, filename, clobber=True)
+
+    m = HpxMap.create_from_fits(filename, lazy=True, planes=slice(1, 3))
+    assert not m.loaded
+    assert_allclose(m.hpx.ebins, ebins[1:4], rtol=1E-6)
+
+    skydir = SkyCoord(30.0, 20.0, unit='deg', frame='galactic')
+    mc = m.cutout(skydir, 10.0)
+    assert not m.loaded
+    assert_allclose(mc.counts, data[1:3, mc.hpx._ipix], rtol=1E-6)
+
+    # Cutout of a loaded map is identical
+    assert_allclose(m.counts, data[1:3], rtol=1E-6)
+    assert m.loaded
+    assert_allclose(m.cutout(skydir, 10.0).counts, mc.counts)
+    assert_allclose(mc.expanded_counts_map()[:, mc.hpx._ipix], mc.counts)
+
+
+def test_read_hpx_data_unsorted(tmpdir):
+
+    from astropy.io import fits
+    from fermipy.skymap import read_hpx_data
+
+    hpx = HPX(16, False, 'GAL', ebins=np.logspace(2, 5, 5))
+    data = np.random.uniform(size=(4, hpx.npix))
+    filename = str(tmpdir / 'test_hpx_read.fits')
+    hpx.write_fits(data, filename, clobber=True)
+
+    pixels = np.random.permutation(hpx.npix)[:500]
+    pixels = np.concatenate((pixels, np.arange(1000, 1100)[::-1]))
+    with fits.open(filename, memmap=True) as hdulist:
+        vals = read_hpx_data(hdulist[1], hpx, slice(1, 3), pixels)
+    assert_allclose(vals, data[1:3, pixels], rtol=1E-6)
+
+
+def test_map_cutout(tmpdir):
+
+    from astropy.coordinates import SkyCoord
+    from fermipy.skymap import Map
+
+    skydir = SkyCoord(0.0, 0.0, unit='deg', frame='galactic')
+    m = Map.create(skydir, 0.5, (40, 30), coordsys='GAL', projection='CAR',
+                   ebins=np.logspace(2, 5, 4))
+    m.data[...] = np.random.uniform(size=m.data.shape)
+    filename = str(tmpdir / 'test_map_cutout.fits')
+    write_fits_image(m.counts, m.wcs, filename)
+
+    m = Map.create_from_fits(filename, planes=slice(1, 3))
+    assert m.counts.shape == (2, 30, 40)
+
+    mc = m.cutout(SkyCoord(2.0, 1.0, unit='deg', frame='galactic'), 2.0)
+    assert mc.counts.shape[0] == 2
+    assert mc.counts.shape[1] < 30 and mc.counts.shape[2] < 40
+    lon, lat = mc.wcs.celestial.wcs_pix2world(0, 0, 0)
+    x0, y0 = m.wcs.celestial.wcs_world2pix(lon, lat, 0)
+    x0, y0 = int(np.round(x0)), int(np.round(y0))
+    ny, nx = mc.counts.shape[1:]
+    assert_allclose(mc.counts, m.counts[:, y0:y0 + ny, x0:x0 + nx])
@@ -0,0 +1,42 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+from __future__ import absolute_import, division, print_function
+import numpy as np
+from numpy.testing import assert_allclose
+from fermipy import sourcefind_utils
+from fermipy.normlike import BinnedNormLikelihood
+
+
+def test_scan_norm_loglike():
+
+    np.random.seed(1)
+    x = np.linspace(-5.0, 5.0, 100)
+    bkg = 2.0 * np.ones((3, 100))
+    bkg_tmpl = np.array([0.5 * (1.0 + 0.1 * x) * np.ones((3, 1))])
+    xpos = np.linspace(-1.0, 1.0, 9)
+    templates = np.array([20.0 * np.exp(-0.5 * ((x - x0) / 0.5)**2) *
+                          np.ones((3, 1)) for x0 in xpos])
+    counts = np.random.poisson(bkg + 1.2 * bkg_tmpl[0] + 0.8 * templates[6])
+
+    # Fixed background
+    dloglike, norms = sourcefind_utils.scan_norm_loglike(
+        counts, bkg + bkg_tmpl[0], templates)
+    assert np.argmax(dloglike) == 6
+    like0 = BinnedNormLikelihood(counts, templates[:1], bkg + bkg_tmpl[0],
+                                 dtype=np.float64)
+    fit = like0.fit(tol=1E-6)
+    assert_allclose(norms[0], fit['values'][0], rtol=1E-2)
+    assert_allclose(dloglike[0], fit['loglike'] - like0.loglike(0.0),
+                    atol=1E-2)
+
+    # Free background normalization
+    bounds = np.array([[0.1, 10.0]])
+    dloglike, norms = sourcefind_utils.scan_norm_loglike(
+        counts, bkg, templates, bkg_templates=bkg_tmpl, bkg_bounds=bounds)
+    assert np.argmax(dloglike) == 6
+    assert np.all(dloglike >= -1E-3)
+    like1 = BinnedNormLikelihood(counts, np.vstack((templates[6:7],
+                                                    bkg_tmpl)), bkg,
+                                 dtype=np.float64)
+    fit1 = like1.fit(tol=1E-6, bounds=np.vstack(([[0.0, np.inf]],
+                                                 bounds)))
+    assert_allclose(norms[6], fit1['values'][0], rtol=1E-2)
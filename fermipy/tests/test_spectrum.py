@@ -67,3 +67,28 @@ def test_dmfitfunction_spectrum():
     assert_allclose(dnde0[:, 1], fn0.dnde(10**loge, params=[sigmav, 200E3]))
     assert_allclose(dnde1[:, 0], fn1.dnde(10**loge, params=[sigmav, 100E3]))
     assert_allclose(dnde1[:, 1], fn1.dnde(10**loge, params=[sigmav, 200E3]))
+
+
+def test_dm_channel_table(tmpdir):
+
+    emin = np.logspace(2, 4, 5)[:-1]
+    emax = np.logspace(2, 4, 5)[1:]
+    masses = np.array([10., 100., 1000.])
+    sigmav, jfactor = 3E-26, 1E19
+
+    tab = spectrum.DMChannelTable(emin, emax, masses, ['bb', 'tautau'],
+                                  func_type='flux', cachedir=str(tmpdir))
+    vals = tab(sigmav, jfactor)
+    assert vals.shape == (2, 3, 4)
+
+    for i, chan in enumerate(['bb', 'tautau']):
+        for j, mass in enumerate(masses):
+            fn = spectrum.DMFitFunction([sigmav, mass], chan=chan,
+                                        jfactor=jfactor)
+            assert_allclose(vals[i, j], fn.flux(emin, emax), rtol=1E-8)
+
+    assert len(tmpdir.listdir()) == 1
+    tab_cached = spectrum.DMChannelTable(emin, emax, masses,
+                                         ['bb', 'tautau'], func_type='flux',
+                                         cachedir=str(tmpdir))
+    assert_allclose(tab_cached.table, tab.table)
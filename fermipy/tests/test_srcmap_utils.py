@@ -0,0 +1,224 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+from __future__ import absolute_import, division, print_function
+import numpy as np
+from numpy.testing import assert_allclose
+from astropy.tests.helper import pytest
+from fermipy.tests.utils import requires_dependency
+
+try:
+    from fermipy import irfs
+    from fermipy import srcmap_utils
+except ImportError:
+    pass
+
+# Skip tests in this file if Fermi ST aren't available
+pytestmark = requires_dependency('Fermi ST')
+
+
+def make_psf_model():
+
+    energies = 10**np.linspace(2.0, 4.0, 5)
+    dtheta = np.insert(np.logspace(-4, 1.75, 200), 0, [0])
+    sigma = 2.0 * (energies / 100.)**-0.8
+    sigma = np.maximum(sigma, 0.1)
+    psf = np.exp(-0.5 * dtheta[:, None]**2 / sigma[None, :]**2)
+    psf /= 2 * np.pi * np.radians(sigma[None, :])**2
+    return irfs.PSFModel(dtheta, energies, np.array([0.2, 1.0]),
+                         np.ones(len(energies)), psf + 1E-10,
+                         energies**-2.0)
+
+
+def test_srcmap_library(tmpdir):
+
+    psf = make_psf_model()
+    exp = 10**np.linspace(10.0, 11.0, 5)
+    shape_out = (5, 20, 20)
+    pix = np.array([[9.2, 10.4], [3.6, 15.1], [12.0, 12.0]])
+
+    cache0 = srcmap_utils.SourceMapCache.create(psf, exp, 'RadialGaussian',
+                                                0.3, shape_out, 0.2, rebin=2)
+
+    library = srcmap_utils.SourceMapLibrary(str(tmpdir))
+    cache1 = srcmap_utils.SourceMapCache.create(psf, exp, 'RadialGaussian',
+                                                0.3, shape_out, 0.2, rebin=2,
+                                                library=library)
+    assert len(tmpdir.listdir()) == 2
+
+    cache2 = srcmap_utils.SourceMapCache.create(psf, 2.0 * exp,
+                                                'RadialGaussian', 0.3,
+                                                shape_out, 0.2, rebin=2,
+                                                library=library)
+    assert len(tmpdir.listdir()) == 2
+
+    k0 = cache0.create_maps(pix)
+    k1 = cache1.create_maps(pix)
+    k2 = cache2.create_maps(pix)
+    assert k0.shape == (3,) + shape_out
+    assert_allclose(k0, k1, rtol=1E-8, atol=1E-20)
+    assert_allclose(2.0 * k0, k2, rtol=1E-8, atol=1E-20)
+
+    for i, p in enumerate(pix):
+        assert_allclose(cache0.create_map(p), k0[i])
+
+    # Compare with a direct evaluation of the source map
+    k = srcmap_utils.make_srcmap(psf, exp, 'RadialGaussian', 0.3,
+                                 npix=20, xpix=pix[0, 1], ypix=pix[0, 0],
+                                 cdelt=0.2)
+    assert_allclose(np.sum(k0[0], axis=(1, 2)), np.sum(k, axis=(1, 2)),
+                    rtol=1E-2)
+
+
+def test_map_interpolator_batch():
+
+    psf = make_psf_model()
+    exp = 10**np.linspace(10.0, 11.0, 5)
+    shape_out = (5, 30, 30)
+    rs = np.random.RandomState(0)
+    pix = rs.uniform(-3.0, 33.0, (20, 2))
+
+    cache = srcmap_utils.SourceMapCache.create(psf, exp, 'RadialDisk',
+                                               0.4, shape_out, 0.1, rebin=4)
+
+    for m in [cache._m0, cache._m1]:
+        k0 = np.array([m.shift_to_coords(p) for p in pix])
+        k1 = m.shift_to_coords(pix)
+        k2 = m.shift_to_coords_batch(pix, nthread=2)
+        assert k1.shape == (20,) + shape_out
+        assert np.all(np.isnan(k0) == np.isnan(k1))
+        assert_allclose(k1, k0, rtol=1E-10, atol=1E-16)
+        assert_allclose(k2, k1, rtol=1E-10, atol=1E-16)
+
+    k0 = np.array([cache.create_map(p) for p in pix])
+    cache.precompute(pix[:5])
+    assert_allclose(cache.create_maps(pix), k0, rtol=1E-10, atol=1E-16)
+    assert_allclose(cache.create_map(pix[3]), k0[3])
+    assert_allclose(cache.create_map(pix[7]), k0[7])
+
+    # Precomputed maps are limited in size
+    cache.precompute(pix, max_bytes=3 * 8 * np.prod(shape_out))
+    assert len(cache._maps) == 3
+    assert_allclose(cache.create_map(pix[7]), k0[7])
+    k1 = cache._m0.shift_to_coords_batch(pix, chunk_size=3)
+    assert_allclose(k1, cache._m0.shift_to_coords(pix), rtol=1E-10,
+                    atol=1E-16)
+
+
+def test_psf_kernel_memoize():
+
+    from fermipy import utils
+
+    psf = make_psf_model()
+    x = utils.make_pixel_distance(21, 10.0, 10.0) * 0.1
+
+    # Batched evaluation must match the per-energy profiles
+    k = psf.eval_ebins(x[np.newaxis, ...])
+    for i in range(len(psf.energies)):
+        assert_allclose(k[i], psf.eval(i, x), rtol=1E-10)
+
+    fn = lambda t: (t / 1E3)**-0.1
+    k = psf.eval_ebins(x[np.newaxis, ...], scale_fn=fn)
+    for i in range(len(psf.energies)):
+        assert_allclose(k[i], psf.eval(i, x, scale_fn=fn), rtol=1E-10)
+
+    # Repeated kernel evaluations are served from the PSF cache
+    k0 = utils.make_cdisk_kernel(psf, 0.5, 21, 0.1, 10.0, 10.0)
+    ncache = len(psf._cache)
+    k1 = utils.make_cdisk_kernel(psf, 0.5, 21, 0.1, 10.0, 10.0)
+    assert len(psf._cache) == ncache
+    assert_allclose(k0, k1)
+
+    cth0 = psf.containment_angle(fraction=0.68)
+    cth1 = psf.containment_angle(fraction=0.68)
+    assert_allclose(cth0, cth1)
+
+
+def test_convolved_kernels():
+
+    from fermipy import utils
+
+    psf = make_psf_model()
+    npix, cdelt = 21, 0.1
+    x = utils.make_pixel_distance(npix, 10.0, 10.0) * cdelt
+
+    # Reference kernels evaluated separately for each energy
+    for kfn, cfn, r68 in [(utils.make_cdisk_kernel, utils.convolve2d_disk,
+                           0.8246211251235321),
+                          (utils.make_cgauss_kernel, utils.convolve2d_gauss,
+                           1.5095921854516636)]:
+        k0 = np.zeros((len(psf.energies), npix, npix))
+        for i in range(len(psf.energies)):
+            psfc = cfn(lambda t: psf.eval(i, t), psf.dtheta, 0.5 / r68)
+            k0[i] = np.interp(np.ravel(x), psf.dtheta,
+                              psfc).reshape(x.shape)
+        k1 = kfn(psf, 0.5, npix, cdelt, 10.0, 10.0)
+        assert_allclose(k1, k0, rtol=1E-6)
+
+    # Profiles are selected by energy
+    z = utils.create_kernel_function_lookup(psf, utils.convolve2d_disk, 0.5,
+                                            psf.energies, psf.dtheta, None)
+    z1 = utils.create_kernel_function_lookup(psf, utils.convolve2d_disk, 0.5,
+                                             psf.energies[2:4], psf.dtheta,
+                                             None)
+    assert_allclose(z1, z[2:4])
+    with pytest.raises(ValueError):
+        utils.create_kernel_function_lookup(psf, utils.convolve2d_disk, 0.5,
+                                            [150.], psf.dtheta, None)
+
+
+def test_kernel_bank(tmpdir):
+
+    psf = make_psf_model()
+    exp = np.ones(len(psf.energies))
+    npix, cdelt = 40, 0.1
+
+    bank = srcmap_utils.KernelBank(str(tmpdir))
+    for spatial_model, width in [('PointSource', None),
+                                 ('RadialGaussian', 0.3),
+                                 ('RadialDisk', 0.5)]:
+        for xpix, ypix in [(19.3, 20.6), (2.3, 35.6), (-3.7, 41.6)]:
+            k0 = srcmap_utils.make_srcmap(psf, exp, spatial_model, width,
+                                          npix=npix, xpix=xpix, ypix=ypix,
+                                          cdelt=cdelt, sparse=True)
+            k1 = bank.get_kernel(psf, spatial_model, width, npix, cdelt,
+                                 xpix, ypix)
+            assert_allclose(k1, k0, rtol=1E-3, atol=1E-4 * np.max(k0))
+
+    # Sources with the same subpixel offset share the same kernel
+    ncache = len(bank._cache)
+    bank.get_kernel(psf, 'RadialDisk', 0.5, npix, cdelt, 10.3, 25.6)
+    assert len(bank._cache) == ncache
+
+    # Kernels are reloaded from the on-disk store
+    bank2 = srcmap_utils.KernelBank(str(tmpdir))
+    k1 = bank2.get_kernel(psf, 'RadialDisk', 0.5, npix, cdelt, 10.3, 25.6)
+    k0 = bank.get_kernel(psf, 'RadialDisk', 0.5, npix, cdelt, 10.3, 25.6)
+    assert_allclose(k1, k0)
+    assert isinstance(bank2._cache[list(bank2._cache.keys())[0]], np.memmap)
+
+    # Interpolation between tabulated widths
+    bank3 = srcmap_utils.KernelBank(widths=np.logspace(-1, 0, 21))
+    k0 = srcmap_utils.make_srcmap(psf, exp, 'RadialGaussian', 0.33,
+                                  npix=npix, xpix=19.3, ypix=20.6,
+                                  cdelt=cdelt, sparse=True)
+    k1 = bank3.get_kernel(psf, 'RadialGaussian', 0.33, npix, cdelt,
+                          19.3, 20.6)
+    assert_allclose(np.sum(k1, axis=(1, 2)), np.sum(k0, axis=(1, 2)),
+                    rtol=1E-2)
+    assert_allclose(k1, k0, rtol=5E-2, atol=1E-2 * np.max(k0))
+
+
+def test_integrate_srcmap():
+
+    energies = 10**np.linspace(2.0, 4.0, 9)
+    k = np.random.uniform(size=(3, 9, 4, 4))
+    dnde = 1E-9 * (energies / 1000.)**-2.0
+    counts = srcmap_utils.integrate_srcmap(k, energies, dnde)
+    assert counts.shape == (3, 8, 4, 4)
+
+    # Compare with an explicit trapezoidal rule in log(E)
+    loge = np.log(energies)
+    y = k * (dnde * energies)[:, None, None]
+    for i in range(8):
+        assert_allclose(counts[:, i],
+                        0.5 * (y[:, i] + y[:, i + 1]) *
+                        (loge[i + 1] - loge[i]))
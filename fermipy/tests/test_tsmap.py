@@ -0,0 +1,153 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+from __future__ import absolute_import, division, print_function
+import itertools
+import numpy as np
+from numpy.testing import assert_allclose
+from fermipy.tests.utils import requires_dependency
+
+try:
+    import healpy as hp
+    from fermipy import tsmap
+    from fermipy.residmap import HpxConvolver
+    from fermipy.hpx_utils import HPX
+except ImportError:
+    pass
+
+# Skip tests in this file if Fermi ST aren't available
+pytestmark = requires_dependency('Fermi ST')
+
+
+def make_test_maps(shape=(4, 21, 23), kshape=(4, 7, 7), seed=0):
+
+    rs = np.random.RandomState(seed)
+    x, y = np.meshgrid(np.arange(kshape[1]) - kshape[1] // 2,
+                       np.arange(kshape[2]) - kshape[2] // 2,
+                       indexing='ij')
+    sigma = np.linspace(1.5, 0.8, kshape[0])[:, None, None]
+    model = np.exp(-0.5 * (x**2 + y**2) / sigma**2)
+    model *= 2.0 / np.sum(model, axis=(1, 2))[:, None, None]
+
+    bkg = 0.5 + rs.uniform(0.0, 1.0, shape)
+    src = np.zeros(shape)
+    src[:, shape[1] // 2, shape[2] // 3] = 20.
+    counts = rs.poisson(bkg + src).astype(float)
+    c0 = tsmap.cash(counts, bkg)
+    return counts, bkg, model, c0
+
+
+def test_ts_values_newton_batch():
+
+    counts, bkg, model, c0 = make_test_maps()
+    counts = [counts, counts[:2]]
+    bkg = [bkg, bkg[:2]]
+    model = [model, model[:2, 1:-1, 1:-1]]
+    c0 = [c0, c0[:2]]
+
+    positions = np.array(list(itertools.product(range(counts[0].shape[1]),
+                                                range(counts[0].shape[2]))))
+
+    ts = np.zeros(len(positions))
+    amp = np.zeros(len(positions))
+    for i, p in enumerate(positions):
+        pos = [[t.shape[0] // 2, p[0], p[1]] for t in counts]
+        ts[i], amp[i], _ = tsmap._ts_value_newton(pos, counts, bkg,
+                                                  model, c0)
+
+    ts_batch, amp_batch, _ = tsmap._ts_values_newton_batch(positions, counts,
+                                                           bkg, model, c0,
+                                                           max_nelem=1000)
+
+    assert_allclose(ts_batch, ts, atol=1E-6, rtol=1E-6)
+    assert_allclose(amp_batch, amp, atol=1E-8, rtol=1E-6)
+    assert np.max(ts_batch) > 25.
+
+
+def test_grad_newton_fft():
+
+    counts, bkg, model, c0 = make_test_maps()
+    kshape = model.shape
+    positions = np.array(list(itertools.product(range(counts.shape[1]),
+                                                range(counts.shape[2]))))
+
+    grad, grad_scale = tsmap._grad_newton_fft([counts], [bkg], [model])
+
+    msum = np.zeros(len(positions))
+    cw = np.zeros(len(positions))
+    for i, p in enumerate(positions):
+        pos = [kshape[0] // 2, p[0], p[1]]
+        c = tsmap.extract_large_array(counts, model, pos)
+        b = tsmap.extract_large_array(bkg, model, pos)
+        m = tsmap.extract_small_array(model, counts, pos)
+        msum[i] = np.sum(m)
+        cw[i] = np.sum(c * m / b)
+
+    assert_allclose(grad[positions[:, 0], positions[:, 1]], msum - cw,
+                    atol=1E-10, rtol=1E-8)
+
+    ts, amp, _ = tsmap._ts_values_newton_batch(positions, [counts], [bkg],
+                                               [model], [c0])
+    assert_allclose(grad_scale[positions[:, 0], positions[:, 1]], msum + cw,
+                    atol=1E-10, rtol=1E-8)
+    m = (grad > tsmap.FFT_GRAD_RTOL * grad_scale)[positions[:, 0],
+                                                   positions[:, 1]]
+    assert np.all(ts[m] == 0)
+    assert np.all(amp[m] == 0)
+
+
+def test_ts_values_parallel(tmpdir):
+
+    counts, bkg, model, c0 = make_test_maps()
+    positions = np.array(list(itertools.product(range(counts.shape[1]),
+                                                range(counts.shape[2]))))
+    ts, amp, _ = tsmap._ts_values_newton_batch(positions, [counts], [bkg],
+                                               [model], [c0])
+
+    fit_mask = np.ones(counts.shape[1:], dtype=bool)
+    fit_mask[:3] = False
+    ts_par, amp_par = tsmap._ts_values_parallel(fit_mask, [counts], [bkg],
+                                                [model], [c0], nthread=2,
+                                                tile_size=5,
+                                                scratchdir=str(tmpdir))
+
+    m = fit_mask[positions[:, 0], positions[:, 1]]
+    assert_allclose(ts_par[positions[m, 0], positions[m, 1]], ts[m],
+                    atol=1E-8, rtol=1E-8)
+    assert_allclose(amp_par[positions[m, 0], positions[m, 1]], amp[m],
+                    atol=1E-8, rtol=1E-8)
+    assert np.all(ts_par[~fit_mask] == 0)
+    assert len(tmpdir.listdir()) == 0
+
+
+def test_ts_values_newton_hpx():
+
+    nside, nest = 32, True
+    hpx = HPX.create_hpx(nside, nest, 'GAL', region='DISK(30.0,20.0,15.0)')
+    ipix = hpx._ipix
+    vec = np.array(hp.pix2vec(nside, ipix, nest=nest)).T
+    cpix = np.argmax(np.dot(vec, hp.ang2vec(30.0, 20.0, lonlat=True)))
+    theta = np.arccos(np.clip(np.dot(vec, vec[cpix]), -1.0, 1.0))
+    sigma = np.array([0.08, 0.05, 0.03])[:, None]
+    model = 2.0 * np.exp(-0.5 * theta[None, :]**2 / sigma**2)
+
+    rs = np.random.RandomState(0)
+    bkg = 0.5 + rs.uniform(0.0, 1.0, model.shape)
+    counts = rs.poisson(bkg + 5.0 * model / np.max(model)).astype(float)
+    c0 = tsmap.cash(counts, bkg)
+
+    cv = HpxConvolver(nside, nest, ipix, model, cpix, threshold=1E-2,
+                      imin=1, method='disc')
+    ts_batch, amp_batch, _ = tsmap._ts_values_newton_hpx(vec, [counts],
+                                                         [bkg], [cv], [c0],
+                                                         max_nelem=1000)
+
+    for i in range(0, len(vec), 7):
+        idx, mm = cv.footprints(vec[i])
+        idx, mm = idx[0][idx[0] >= 0], mm[0][:, idx[0] >= 0]
+        c, b = counts[1:, idx], bkg[1:, idx]
+        amp, _ = tsmap._fit_amplitude_newton(c, b, mm)
+        ts = (np.sum(c0[1:, idx]) -
+              np.sum(tsmap.f_cash(amp, c, b, mm))) * np.sign(amp)
+        assert_allclose(amp_batch[i], amp, atol=1E-8, rtol=1E-6)
+        assert_allclose(ts_batch[i], ts, atol=1E-6, rtol=1E-6)
+
+    assert ts_batch[cpix] > 25.
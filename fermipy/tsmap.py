@@ -4,11 +4,14 @@ import os
 import copy
 import logging
 import itertools
-import functools
 import json
-from multiprocessing import Pool
+import shutil
+import tempfile
+from multiprocessing import Pool, cpu_count
 import numpy as np
 import warnings
+import scipy.signal
+import healpy as hp
 import pyLikelihood as pyLike
 from scipy.optimize import brentq
 import astropy
@@ -17,13 +20,15 @@ from astropy.table import Table
 from astropy.coordinates import SkyCoord
 import astropy.wcs as pywcs
 from gammapy.maps.geom import coordsys_to_frame
-from gammapy.maps import WcsNDMap, WcsGeom
+from gammapy.maps import WcsNDMap, WcsGeom, HpxNDMap
 import fermipy.utils as utils
 import fermipy.wcs_utils as wcs_utils
+import fermipy.hpx_utils as hpx_utils
 import fermipy.fits_utils as fits_utils
 import fermipy.plotting as plotting
 import fermipy.castro as castro
 from fermipy.roi_model import Source
+from fermipy.residmap import HpxConvolver
 from fermipy.spectrum import PowerLaw
 from fermipy.config import ConfigSchema
 from fermipy.timing import Timer
@@ -31,6 +36,10 @@ from LikelihoodState import LikelihoodState
 
 MAX_NITER = 100
 
+# Tolerance relative to the magnitude of the gradient terms below which
+# the sign of a gradient computed with FFT correlations is not trusted
+FFT_GRAD_RTOL = 1E-6
+
 
 def extract_images_from_tscube(infile, outfile):
     """ Extract data from table HDUs in TSCube file and convert them to FITS images
@@ -643,6 +652,580 @@ def _ts_value_newton(position, counts, bkg, model, C_0_map):
     return (C_0 - C_1) * np.sign(amplitude), amplitude, niter
 
 
+def _pad_footprint_map(m, kernel_shape, value=0.0):
+    """Pad the spatial dimensions of a 3D map with a constant value
+    such that a kernel with shape ``kernel_shape`` centered on any
+    pixel of the input map is fully contained in the padded map."""
+    kx, ky = kernel_shape[1:]
+    return np.pad(m, [(0, 0), (kx // 2, kx - 1 - kx // 2),
+                      (ky // 2, ky - 1 - ky // 2)], mode='constant',
+                  constant_values=value)
+
+
+def _extract_footprints(padded_map, kernel_shape, positions):
+    """Extract the footprint of a kernel centered on each of the
+    given pixel positions from a map that has been padded with
+    `_pad_footprint_map`.
+
+    Parameters
+    ----------
+    padded_map : `~numpy.ndarray`
+        Padded 3D array (energy, x, y).
+
+    kernel_shape : tuple
+        Shape of the kernel (energy, x, y).
+
+    positions : `~numpy.ndarray`
+        Array of pixel positions in the unpadded map with shape
+        (npos, 2).
+
+    Returns
+    -------
+    footprints : `~numpy.ndarray`
+        2D array with shape (npos, nenergy * nx * ny).
+    """
+    ne, kx, ky = kernel_shape
+    ie = np.arange(ne)[None, :, None, None]
+    ix = positions[:, 0, None, None, None] + np.arange(kx)[None, None, :, None]
+    iy = positions[:, 1, None, None, None] + np.arange(ky)[None, None, None, :]
+    return padded_map[ie, ix, iy].reshape(len(positions), -1)
+
+
+def _box_sum(padded_map, kernel_shape, positions):
+    """Compute the sum of a map padded with `_pad_footprint_map` over
+    the footprint of a kernel centered on each of the given pixel
+    positions.  The sums are evaluated from the summed-area table of
+    the map."""
+    kx, ky = kernel_shape[1:]
+    s = np.zeros((padded_map.shape[1] + 1, padded_map.shape[2] + 1))
+    s[1:, 1:] = np.cumsum(np.cumsum(np.sum(padded_map, axis=0), axis=0),
+                          axis=1)
+    ix, iy = positions[:, 0], positions[:, 1]
+    return (s[ix + kx, iy + ky] - s[ix, iy + ky] -
+            s[ix + kx, iy] + s[ix, iy])
+
+
+def _fit_amplitude_newton_batch(counts, bkg, model, msum, tol=1E-4):
+    """Vectorized version of `_fit_amplitude_newton` that fits the
+    test source amplitude for a set of footprints simultaneously.
+    Each footprint is iterated until it satisfies the same
+    convergence criteria as the single-position fit.  Footprints
+    that have converged are removed from subsequent iterations.
+
+    Parameters
+    ----------
+    counts : `~numpy.ndarray`
+        2D array (npos, npix) of counts.
+
+    bkg : `~numpy.ndarray`
+        2D array (npos, npix) of background model counts.  Pixels
+        with zero counts may contain any positive value.
+
+    model : `~numpy.ndarray`
+        2D array (npos, npix) of test source model counts.
+
+    msum : `~numpy.ndarray`
+        Sum of the test source model counts in each footprint.
+
+    Returns
+    -------
+    norm : `~numpy.ndarray`
+        Best-fit amplitude for each footprint.
+
+    niter : `~numpy.ndarray`
+        Number of fit iterations for each footprint.
+    """
+    npos = counts.shape[0]
+    norm = np.zeros(npos)
+    niter = np.zeros(npos, dtype=int)
+    active = np.arange(npos)
+
+    for iiter in range(1, MAX_NITER):
+
+        niter[active] = iiter
+        n = norm[active]
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            w = n[:, None] * model
+            w += bkg
+            np.divide(model, w, out=w)
+            cw = w * counts
+            grad = msum[active] - np.sum(cw, axis=1)
+            cw *= w
+            hess = np.sum(cw, axis=1)
+            delta = grad / hess
+            edm = delta * grad
+
+        norm[active] = np.fmax(0, n - delta)
+        if iiter == 1:
+            norm[active[grad > 0]] = 0.0
+            done = (grad > 0) | (edm < tol)
+        else:
+            done = edm < tol
+
+        if np.all(done):
+            break
+        elif np.any(done):
+            keep = ~done
+            active = active[keep]
+            counts, bkg, model = counts[keep], bkg[keep], model[keep]
+
+    return norm, niter
+
+
+def _correlate_kernel(m, kernel):
+    """Correlate each energy plane of a 3D map with the corresponding
+    plane of a kernel and sum over energy.  The value of the output at
+    a given pixel is the sum of ``m * kernel`` over the footprint of
+    the kernel centered on that pixel.  Pixels outside of the map are
+    treated as zero.  The correlation is evaluated with FFTs.
+
+    Parameters
+    ----------
+    m : `~numpy.ndarray`
+        3D array (energy, x, y).
+
+    kernel : `~numpy.ndarray`
+        3D kernel array (energy, x, y).
+
+    Returns
+    -------
+    corr : `~numpy.ndarray`
+        2D array with the spatial shape of ``m``.
+    """
+    kx, ky = kernel.shape[1:]
+    ox, oy = kx - 1 - kx // 2, ky - 1 - ky // 2
+    xslice = slice(ox, ox + m.shape[1])
+    yslice = slice(oy, oy + m.shape[2])
+
+    o = np.zeros(m.shape[1:])
+    for ms, ks in zip(m, kernel):
+        o += scipy.signal.fftconvolve(ms, ks[::-1, ::-1],
+                                      mode='full')[xslice, yslice]
+    return o
+
+
+def _grad_newton_fft(counts, bkg, model):
+    """
+    Compute the gradient of the first iteration of the newton method
+    (test source amplitude of zero) at every pixel of the map using
+    FFT correlations.  Pixels with a positive gradient have a
+    best-fit amplitude of zero and a TS of zero.
+
+    Parameters
+    ----------
+    counts : list of `~numpy.ndarray`
+        Count maps for each analysis component.
+
+    bkg : list of `~numpy.ndarray`
+        Background maps for each analysis component.
+
+    model : list of `~numpy.ndarray`
+        Source model kernels for each analysis component.
+
+    Returns
+    -------
+    grad : `~numpy.ndarray`
+        2D array of gradients.
+
+    grad_scale : `~numpy.ndarray`
+        2D array with the sum of the absolute values of the terms of
+        the gradient.  The round-off error of the FFT correlations is
+        a small fraction of this value.
+    """
+    grad = 0
+    grad_scale = 0
+    for cm, bm, mm in zip(counts, bkg, model):
+        m = cm > 0
+        w = np.zeros(cm.shape)
+        w[m] = cm[m] / bm[m]
+        msum = _correlate_kernel(np.ones(cm.shape), mm)
+        cw = _correlate_kernel(w, mm)
+        grad += msum - cw
+        grad_scale += np.abs(msum) + np.abs(cw)
+    return grad, grad_scale
+
+
+def _ts_values_newton_batch(positions, counts, bkg, model, C_0_map,
+                            max_nelem=2**16):
+    """
+    Compute TS values at a set of pixel positions using a vectorized
+    implementation of the newton method.  This function is equivalent
+    to calling `_ts_value_newton` for each position but processes
+    blocks of positions with array operations.
+
+    Parameters
+    ----------
+    positions : `~numpy.ndarray`
+        Array of pixel positions with shape (npos, 2).
+
+    counts : list of `~numpy.ndarray`
+        Count maps for each analysis component.
+
+    bkg : list of `~numpy.ndarray`
+        Background maps for each analysis component.
+
+    model : list of `~numpy.ndarray`
+        Source model kernels for each analysis component.
+
+    C_0_map : list of `~numpy.ndarray`
+        Null hypothesis cash maps for each analysis component.
+
+    max_nelem : int
+        Maximum number of footprint elements that will be evaluated
+        in a single block.  This bounds the memory footprint of the
+        calculation.
+
+    Returns
+    -------
+    TS : `~numpy.ndarray`
+        TS values at the given pixel positions.
+
+    amp : `~numpy.ndarray`
+        Best-fit amplitude of the test source.
+
+    niter : `~numpy.ndarray`
+        Number of fit iterations.
+    """
+    positions = np.array(positions, ndmin=2, dtype=int)
+    npos = len(positions)
+    ts = np.zeros(npos)
+    amp = np.zeros(npos)
+    niter = np.zeros(npos, dtype=int)
+
+    # Sums of C_0 and the background over each footprint
+    C_0 = np.zeros(npos)
+    bkg_sum = np.zeros(npos)
+    padded = []
+    for cm, bm, mm, c0 in zip(counts, bkg, model, C_0_map):
+        C_0 += _box_sum(_pad_footprint_map(c0, mm.shape), mm.shape,
+                        positions)
+        bkg_sum += _box_sum(_pad_footprint_map(bm, mm.shape), mm.shape,
+                            positions)
+        # The background in pixels with zero counts is replaced with
+        # a placeholder value since it does not enter the fit
+        bm = np.where(cm > 0, bm, 1.0)
+        valid = np.ones((1,) + cm.shape[1:])
+        padded += [(_pad_footprint_map(cm, mm.shape),
+                    _pad_footprint_map(bm, mm.shape, 1.0),
+                    _pad_footprint_map(valid, mm.shape))]
+
+    nelem = max(sum([mm.size for mm in model]), 1)
+    block_size = max(max_nelem // nelem, 1)
+
+    for i in range(0, npos, block_size):
+
+        pos = positions[i:i + block_size]
+        s = slice(i, i + len(pos))
+        counts_, bkg_, model_ = [], [], []
+        for (cm, bm, valid), mm in zip(padded, model):
+            counts_ += [_extract_footprints(cm, mm.shape, pos)]
+            bkg_ += [_extract_footprints(bm, mm.shape, pos)]
+            valid = _extract_footprints(valid, (1,) + mm.shape[1:], pos)
+            model_ += [(valid.reshape((len(pos), 1) + mm.shape[1:]) *
+                        mm[None, ...]).reshape(len(pos), -1)]
+
+        counts_ = np.hstack(counts_) if len(counts_) > 1 else counts_[0]
+        bkg_ = np.hstack(bkg_) if len(bkg_) > 1 else bkg_[0]
+        model_ = np.hstack(model_) if len(model_) > 1 else model_[0]
+
+        ts[s], amp[s], niter[s] = _ts_values_footprints(counts_, bkg_, model_,
+                                                        C_0[s], bkg_sum[s])
+
+    return ts, amp, niter
+
+
+def _ts_values_footprints(counts, bkg, model, C_0, bkg_sum):
+    """Fit the test source amplitude and compute the TS for a set of
+    footprints.
+
+    Parameters
+    ----------
+    counts : `~numpy.ndarray`
+        2D array (npos, npix) of counts.
+
+    bkg : `~numpy.ndarray`
+        2D array (npos, npix) of background model counts.  Pixels
+        with zero counts may contain any positive value.
+
+    model : `~numpy.ndarray`
+        2D array (npos, npix) of test source model counts.
+
+    C_0 : `~numpy.ndarray`
+        Sum of the null hypothesis cash values over each footprint.
+
+    bkg_sum : `~numpy.ndarray`
+        Sum of the background model counts over each footprint.
+
+    Returns
+    -------
+    TS : `~numpy.ndarray`
+        TS values of the footprints.
+
+    amp : `~numpy.ndarray`
+        Best-fit amplitude of the test source.
+
+    niter : `~numpy.ndarray`
+        Number of fit iterations.
+    """
+    model_sum = np.sum(model, axis=1)
+    amplitude, niter = _fit_amplitude_newton_batch(counts, bkg, model,
+                                                   model_sum)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mu = amplitude[:, None] * model
+        mu += bkg
+        C_1 = 2.0 * (bkg_sum + amplitude * model_sum -
+                     np.sum(counts * np.log(mu), axis=1))
+
+    return (C_0 - C_1) * np.sign(amplitude), amplitude, niter
+
+
+def _ts_values_newton_hpx(vec, counts, bkg, convolvers, C_0_map,
+                          max_nelem=2**16):
+    """
+    Compute TS values at a set of directions on HEALPix maps.  The
+    footprint of the test source at each direction is the disc
+    within the kernel radius of each `~fermipy.residmap.HpxConvolver`.
+    The footprints are padded to a common size and fit with the same
+    vectorized newton method as `_ts_values_newton_batch`.
+
+    Parameters
+    ----------
+    vec : `~numpy.ndarray`
+        Array with shape (npos, 3) of unit vectors of the test source
+        positions.
+
+    counts : list of `~numpy.ndarray`
+        2D count maps (energy, pixel) for each analysis component.
+
+    bkg : list of `~numpy.ndarray`
+        2D background maps for each analysis component.
+
+    convolvers : list of `~fermipy.residmap.HpxConvolver`
+        Radial test source kernels for each analysis component.
+
+    C_0_map : list of `~numpy.ndarray`
+        Null hypothesis cash maps for each analysis component.
+
+    max_nelem : int
+        Maximum number of footprint elements that will be evaluated
+        in a single block.
+
+    Returns
+    -------
+    TS : `~numpy.ndarray`
+        TS values at the given directions.
+
+    amp : `~numpy.ndarray`
+        Best-fit amplitude of the test source.
+
+    niter : `~numpy.ndarray`
+        Number of fit iterations.
+    """
+    vec = np.array(vec, ndmin=2)
+    npos = len(vec)
+    ts = np.zeros(npos)
+    amp = np.zeros(npos)
+    niter = np.zeros(npos, dtype=int)
+
+    # Maps are padded with one pixel that is referenced by the padded
+    # entries of the footprints
+    padded = []
+    nelem = 1
+    for cm, bm, c0, cv in zip(counts, bkg, C_0_map, convolvers):
+        bm_fit = np.where(cm > 0, bm, 1.0)
+        pad = np.zeros((cm.shape[0], 1))
+        padded += [(np.hstack((cm, pad)), np.hstack((bm_fit, pad + 1.0)),
+                    np.hstack((bm, pad)), np.hstack((c0, pad)))]
+        nelem += int(cv.nplane * cv.ndisc)
+
+    block_size = max(max_nelem // nelem, 1)
+
+    for i in range(0, npos, block_size):
+
+        s = slice(i, min(i + block_size, npos))
+        counts_, bkg_, model_ = [], [], []
+        C_0 = 0
+        bkg_sum = 0
+        for (cm, bm_fit, bm, c0), cv in zip(padded, convolvers):
+            idx, mm = cv.footprints(vec[s])
+            ie = np.arange(cm.shape[0])[cv.islice]
+            ix = (ie[None, :, None], idx[:, None, :])
+            counts_ += [cm[ix].reshape(len(idx), -1)]
+            bkg_ += [bm_fit[ix].reshape(len(idx), -1)]
+            model_ += [mm.reshape(len(idx), -1)]
+            C_0 += np.sum(c0[ix].reshape(len(idx), -1), axis=1)
+            bkg_sum += np.sum(bm[ix].reshape(len(idx), -1), axis=1)
+
+        counts_ = np.hstack(counts_) if len(counts_) > 1 else counts_[0]
+        bkg_ = np.hstack(bkg_) if len(bkg_) > 1 else bkg_[0]
+        model_ = np.hstack(model_) if len(model_) > 1 else model_[0]
+
+        ts[s], amp[s], niter[s] = _ts_values_footprints(counts_, bkg_, model_,
+                                                        C_0, bkg_sum)
+
+    return ts, amp, niter
+
+
+def _make_tiles(fit_mask, tile_size):
+    """Split a 2D mask into square tiles with side length
+    ``tile_size`` and return the bounds (xmin, xmax, ymin, ymax) of
+    every tile that contains at least one unmasked pixel."""
+    tiles = []
+    nx, ny = fit_mask.shape
+    for xmin, ymin in itertools.product(range(0, nx, tile_size),
+                                        range(0, ny, tile_size)):
+        xmax = min(xmin + tile_size, nx)
+        ymax = min(ymin + tile_size, ny)
+        if np.any(fit_mask[xmin:xmax, ymin:ymax]):
+            tiles += [(xmin, xmax, ymin, ymax)]
+    return tiles
+
+
+_tsmap_worker_data = {}
+
+
+def _init_tsmap_worker(filenames):
+    """Initialize a TS map worker process by memory-mapping the input
+    and output arrays written by `_ts_values_parallel`."""
+    _tsmap_worker_data.clear()
+    for k, v in filenames.items():
+        if k in ['ts', 'amp']:
+            _tsmap_worker_data[k] = np.load(v, mmap_mode='r+')
+        elif isinstance(v, list):
+            _tsmap_worker_data[k] = [np.load(t, mmap_mode='r') for t in v]
+        else:
+            _tsmap_worker_data[k] = np.load(v, mmap_mode='r')
+
+
+def _ts_values_tile(tile):
+    """Compute TS values for all unmasked pixels in a spatial tile
+    and write them into the shared output arrays.  Only the region of
+    each input map overlapping with the tile and the kernel footprint
+    is read from disk."""
+    xmin, xmax, ymin, ymax = tile
+    d = _tsmap_worker_data
+
+    ix, iy = np.nonzero(d['fit_mask'][xmin:xmax, ymin:ymax])
+    if len(ix) == 0:
+        return 0
+
+    shape = d['fit_mask'].shape
+    kx = max([mm.shape[1] for mm in d['model']])
+    ky = max([mm.shape[2] for mm in d['model']])
+    x0, x1 = max(xmin - kx // 2, 0), min(xmax + kx - 1 - kx // 2, shape[0])
+    y0, y1 = max(ymin - ky // 2, 0), min(ymax + ky - 1 - ky // 2, shape[1])
+
+    counts = [np.array(t[:, x0:x1, y0:y1]) for t in d['counts']]
+    bkg = [np.array(t[:, x0:x1, y0:y1]) for t in d['bkg']]
+    C_0_map = [np.array(t[:, x0:x1, y0:y1]) for t in d['c0']]
+    model = [np.array(t) for t in d['model']]
+
+    positions = np.vstack((ix + xmin - x0, iy + ymin - y0)).T
+    ts, amp, niter = _ts_values_newton_batch(positions, counts, bkg,
+                                             model, C_0_map)
+
+    d['ts'][ix + xmin, iy + ymin] = ts
+    d['amp'][ix + xmin, iy + ymin] = amp
+    d['ts'].flush()
+    d['amp'].flush()
+    return len(ix)
+
+
+def _ts_values_parallel(fit_mask, counts, bkg, model, C_0_map,
+                        nthread=None, tile_size=None, scratchdir=None):
+    """
+    Compute TS values on a pool of worker processes.  The input maps
+    are written once to memory-mapped scratch files that are shared
+    by all workers.  The map is split into spatial tiles that are
+    dispatched to the workers as they become free and each worker
+    writes its TS and amplitude values directly into shared
+    memory-mapped output arrays.
+
+    Parameters
+    ----------
+    fit_mask : `~numpy.ndarray`
+        2D boolean array that is True for pixels that will be fit.
+
+    counts : list of `~numpy.ndarray`
+        Count maps for each analysis component.
+
+    bkg : list of `~numpy.ndarray`
+        Background maps for each analysis component.
+
+    model : list of `~numpy.ndarray`
+        Source model kernels for each analysis component.
+
+    C_0_map : list of `~numpy.ndarray`
+        Null hypothesis cash maps for each analysis component.
+
+    nthread : int
+        Number of worker processes.  If None then one process will be
+        created for each available core.
+
+    tile_size : int
+        Side length in pixels of the spatial tiles.  If None the tile
+        size is chosen such that there are approximately four tiles
+        per worker.
+
+    scratchdir : str
+        Directory in which the temporary scratch files will be
+        created.
+
+    Returns
+    -------
+    TS : `~numpy.ndarray`
+        2D array of TS values.
+
+    amp : `~numpy.ndarray`
+        2D array of best-fit test source amplitudes.
+    """
+    if nthread is None:
+        nthread = cpu_count()
+
+    if tile_size is None:
+        tile_size = int(np.ceil(max(fit_mask.shape) /
+                                np.sqrt(4.0 * nthread)))
+
+    tiles = _make_tiles(fit_mask, max(int(tile_size), 1))
+    tmpdir = tempfile.mkdtemp(prefix='tsmap_', dir=scratchdir)
+
+    try:
+        filenames = {'fit_mask': os.path.join(tmpdir, 'fit_mask.npy'),
+                     'ts': os.path.join(tmpdir, 'ts.npy'),
+                     'amp': os.path.join(tmpdir, 'amp.npy')}
+        np.save(filenames['fit_mask'], fit_mask)
+        np.save(filenames['ts'], np.zeros(fit_mask.shape))
+        np.save(filenames['amp'], np.zeros(fit_mask.shape))
+
+        for k, maps in zip(['counts', 'bkg', 'model', 'c0'],
+                           [counts, bkg, model, C_0_map]):
+            filenames[k] = []
+            for i, m in enumerate(maps):
+                filenames[k] += [os.path.join(tmpdir, '%s_%02i.npy' % (k, i))]
+                np.save(filenames[k][-1], m)
+
+        pool = Pool(processes=min(nthread, max(len(tiles), 1)),
+                    initializer=_init_tsmap_worker,
+                    initargs=(filenames,))
+        try:
+            pool.map(_ts_values_tile, tiles, chunksize=1)
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+        ts = np.load(filenames['ts'])
+        amp = np.load(filenames['amp'])
+    finally:
+        shutil.rmtree(tmpdir)
+
+    return ts, amp
+
+
 class TSMapGenerator(object):
     """Mixin class for `~fermipy.gtanalysis.GTAnalysis` that
     generates TS maps."""
@@ -694,7 +1277,10 @@ class TSMapGenerator(object):
 
         self.logger.log(config['loglevel'], 'Generating TS map')
 
-        o = self._make_tsmap_fast(prefix, **config)
+        if self.projtype == 'HPX':
+            o = self._make_tsmap_hpx(prefix, **config)
+        else:
+            o = self._make_tsmap_fast(prefix, **config)
 
         if config['make_plots']:
             plotter = plotting.AnalysisPlotter(self.config['plotting'],
@@ -740,8 +1326,12 @@ class TSMapGenerator(object):
         hdu_data = fits.table_to_hdu(tab)
         hdu_data.name = 'TSMAP_DATA'
 
-        hdus = [data['ts'].make_hdu(hdu='PRIMARY'),
-                hdu_data] + hdu_images
+        if isinstance(data['ts'], HpxNDMap):
+            hdus = [fits.PrimaryHDU(), data['ts'].make_hdu(hdu='TS_MAP'),
+                    hdu_data] + hdu_images
+        else:
+            hdus = [data['ts'].make_hdu(hdu='PRIMARY'),
+                    hdu_data] + hdu_images
 
         data['config'].pop('map_skydir', None)
         hdus[0].header['CONFIG'] = json.dumps(data['config'])
@@ -767,24 +1357,10 @@ class TSMapGenerator(object):
         """
         loglevel = kwargs.get('loglevel', self.loglevel)
 
-        src_dict = copy.deepcopy(kwargs.setdefault('model', {}))
-        src_dict = {} if src_dict is None else src_dict
-
         multithread = kwargs.setdefault('multithread', False)
         threshold = kwargs.setdefault('threshold', 1E-2)
         max_kernel_radius = kwargs.get('max_kernel_radius')
-        loge_bounds = kwargs.setdefault('loge_bounds', None)
-        use_pylike = kwargs.setdefault('use_pylike', True)
-
-        if loge_bounds:
-            if len(loge_bounds) != 2:
-                raise Exception('Wrong size of loge_bounds array.')
-            loge_bounds[0] = (loge_bounds[0] if loge_bounds[0] is not None
-                              else self.log_energies[0])
-            loge_bounds[1] = (loge_bounds[1] if loge_bounds[1] is not None
-                              else self.log_energies[-1])
-        else:
-            loge_bounds = [self.log_energies[0], self.log_energies[-1]]
+        method = kwargs.setdefault('method', 'newton')
 
         # Put the test source at the pixel closest to the ROI center
         xpix, ypix = (np.round((self.npix - 1.0) / 2.),
@@ -795,52 +1371,11 @@ class TSMapGenerator(object):
         frame = coordsys_to_frame(map_geom.coordsys)
         skydir = SkyCoord(*map_geom.pix_to_coord((cpix[0], cpix[1])),
                           frame=frame, unit='deg')
-        skydir = skydir.transform_to('icrs')
-
-        src_dict['ra'] = skydir.ra.deg
-        src_dict['dec'] = skydir.dec.deg
-        src_dict.setdefault('SpatialModel', 'PointSource')
-        src_dict.setdefault('SpatialWidth', 0.3)
-        src_dict.setdefault('Index', 2.0)
-        src_dict.setdefault('Prefactor', 1E-13)
-
-        counts = []
-        bkg = []
-        model = []
-        c0_map = []
-        eslices = []
-        enumbins = []
-        model_npred = 0
-        for c in self.components:
-
-            imin = utils.val_to_edge(c.log_energies, loge_bounds[0])[0]
-            imax = utils.val_to_edge(c.log_energies, loge_bounds[1])[0]
-
-            eslice = slice(imin, imax)
-            bm = c.model_counts_map(exclude=kwargs['exclude']).data.astype('float')[
-                eslice, ...]
-            cm = c.counts_map().data.astype('float')[eslice, ...]
-
-            bkg += [bm]
-            counts += [cm]
-            c0_map += [cash(cm, bm)]
-            eslices += [eslice]
-            enumbins += [cm.shape[0]]
 
-        self.add_source('tsmap_testsource', src_dict, free=True,
-                        init_source=False, use_single_psf=True,
-                        use_pylike=use_pylike,
-                        loglevel=logging.DEBUG)
-        src = self.roi['tsmap_testsource']
-        # self.logger.info(str(src_dict))
+        src_dict, src, counts, bkg, model, c0_map = \
+            self._make_tsmap_inputs(skydir, kwargs)
         modelname = utils.create_model_name(src)
-        for c, eslice in zip(self.components, eslices):
-            mm = c.model_counts_map('tsmap_testsource').data.astype('float')[
-                eslice, ...]
-            model_npred += np.sum(mm)
-            model += [mm]
-
-        self.delete_source('tsmap_testsource', loglevel=logging.DEBUG)
+        model_npred = np.sum([np.sum(mm) for mm in model])
 
         for i, mm in enumerate(model):
 
@@ -866,10 +1401,6 @@ class TSMapGenerator(object):
         ts_values = np.zeros((self.npix, self.npix))
         amp_values = np.zeros((self.npix, self.npix))
 
-        wrap = functools.partial(_ts_value_newton, counts=counts,
-                                 bkg=bkg, model=model,
-                                 C_0_map=c0_map)
-
         if kwargs['map_skydir'] is not None:
 
             map_offset = wcs_utils.skydir_to_pix(kwargs['map_skydir'],
@@ -898,25 +1429,34 @@ class TSMapGenerator(object):
             xslice = slice(0, self.npix)
             yslice = slice(0, self.npix)
 
-        positions = []
-        for i, j in itertools.product(xyrange[0], xyrange[1]):
-            p = [[k // 2, i, j] for k in enumbins]
-            positions += [p]
+        positions = np.array(list(itertools.product(xyrange[0],
+                                                    xyrange[1])), ndmin=2)
+
+        if method == 'fft':
+            # Pixels with a positive gradient at zero amplitude have
+            # TS = 0 and can be skipped in the fit.  Pixels with a
+            # gradient within the FFT round-off error of zero are fit.
+            self.logger.log(loglevel, 'Computing FFT correlations.')
+            grad, grad_scale = _grad_newton_fft(counts, bkg, model)
+            skip = grad > FFT_GRAD_RTOL * grad_scale
+            positions = positions[~skip[positions[:, 0], positions[:, 1]]]
+        elif method != 'newton':
+            raise ValueError('Unrecognized TS map method: %s' % method)
 
         self.logger.log(loglevel, 'Fitting test source.')
         if multithread:
-            pool = Pool()
-            results = pool.map(wrap, positions)
-            pool.close()
-            pool.join()
+            fit_mask = np.zeros(ts_values.shape, dtype=bool)
+            fit_mask[positions[:, 0], positions[:, 1]] = True
+            ts_values, amp_values = \
+                _ts_values_parallel(fit_mask, counts, bkg, model, c0_map,
+                                    nthread=kwargs.get('nthread', None),
+                                    tile_size=kwargs.get('tile_size', None),
+                                    scratchdir=self.workdir)
         else:
-            results = map(wrap, positions)
-
-        for i, r in enumerate(results):
-            ix = positions[i][0][1]
-            iy = positions[i][0][2]
-            ts_values[ix, iy] = r[0]
-            amp_values[ix, iy] = r[1]
+            results = _ts_values_newton_batch(positions, counts, bkg,
+                                              model, c0_map)
+            ts_values[positions[:, 0], positions[:, 1]] = results[0]
+            amp_values[positions[:, 0], positions[:, 1]] = results[1]
 
         ts_values = ts_values[xslice, yslice]
         amp_values = amp_values[xslice, yslice]
@@ -939,6 +1479,171 @@ class TSMapGenerator(object):
 
         return o
 
+    def _make_tsmap_inputs(self, skydir, kwargs):
+        """
+        Prepare the maps used by the fast TS map methods.  The test
+        source is temporarily added to the model at ``skydir`` to
+        compute its model counts maps.
+
+        Parameters
+        ----------
+        skydir : `~astropy.coordinates.SkyCoord`
+            Position of the test source.
+
+        kwargs : dict
+            TS map options.  Defaults for the options used here are
+            set in this dictionary.
+
+        Returns
+        -------
+        src_dict : dict
+            Dictionary defining the test source.
+
+        src : `~fermipy.roi_model.Source`
+            The test source.
+
+        counts, bkg, model, c0_map : list
+            Counts, background, test source model and null
+            log-likelihood maps of each component restricted to the
+            energy range of the TS map.
+        """
+        src_dict = copy.deepcopy(kwargs.setdefault('model', {}))
+        src_dict = {} if src_dict is None else src_dict
+        loge_bounds = kwargs.setdefault('loge_bounds', None)
+        use_pylike = kwargs.setdefault('use_pylike', True)
+
+        if loge_bounds:
+            if len(loge_bounds) != 2:
+                raise Exception('Wrong size of loge_bounds array.')
+            loge_bounds[0] = (loge_bounds[0] if loge_bounds[0] is not None
+                              else self.log_energies[0])
+            loge_bounds[1] = (loge_bounds[1] if loge_bounds[1] is not None
+                              else self.log_energies[-1])
+        else:
+            loge_bounds = [self.log_energies[0], self.log_energies[-1]]
+
+        skydir = skydir.transform_to('icrs')
+        src_dict['ra'] = skydir.ra.deg
+        src_dict['dec'] = skydir.dec.deg
+        src_dict.setdefault('SpatialModel', 'PointSource')
+        src_dict.setdefault('SpatialWidth', 0.3)
+        src_dict.setdefault('Index', 2.0)
+        src_dict.setdefault('Prefactor', 1E-13)
+
+        counts = []
+        bkg = []
+        model = []
+        c0_map = []
+        eslices = []
+        for c in self.components:
+
+            imin = utils.val_to_edge(c.log_energies, loge_bounds[0])[0]
+            imax = utils.val_to_edge(c.log_energies, loge_bounds[1])[0]
+
+            eslice = slice(imin, imax)
+            bm = c.model_counts_map(exclude=kwargs['exclude']).data.astype('float')[
+                eslice, ...]
+            cm = c.counts_map().data.astype('float')[eslice, ...]
+
+            bkg += [bm]
+            counts += [cm]
+            c0_map += [cash(cm, bm)]
+            eslices += [eslice]
+
+        self.add_source('tsmap_testsource', src_dict, free=True,
+                        init_source=False, use_single_psf=True,
+                        use_pylike=use_pylike,
+                        loglevel=logging.DEBUG)
+        src = self.roi['tsmap_testsource']
+        for c, eslice in zip(self.components, eslices):
+            mm = c.model_counts_map('tsmap_testsource').data.astype('float')[
+                eslice, ...]
+            model += [mm]
+
+        self.delete_source('tsmap_testsource', loglevel=logging.DEBUG)
+
+        return src_dict, src, counts, bkg, model, c0_map
+
+    def _make_tsmap_hpx(self, prefix, **kwargs):
+        """
+        Make a TS map for an analysis with a HEALPix geometry.  As in
+        `_make_tsmap_fast` only the normalization of the test source
+        is fit.  The test source kernel of each component is the
+        radial profile of the test source model at the ROI center and
+        the TS is evaluated at the center of every pixel of the ROI.
+        """
+        loglevel = kwargs.get('loglevel', self.loglevel)
+
+        threshold = kwargs.setdefault('threshold', 1E-2)
+        max_kernel_radius = kwargs.get('max_kernel_radius')
+
+        # The HEALPix fit is vectorized over all pixels of the map
+        if kwargs.setdefault('method', 'newton') != 'newton':
+            raise ValueError('TS map method %s is not supported for '
+                             'HEALPix maps.' % kwargs['method'])
+        if kwargs.setdefault('multithread', False):
+            raise ValueError('multithread is not supported for '
+                             'HEALPix TS maps.')
+
+        # Put the test source at the ROI center
+        src_dict, src, counts, bkg, model, c0_map = \
+            self._make_tsmap_inputs(self.roi.skydir, kwargs)
+        modelname = utils.create_model_name(src)
+        model_npred = np.sum([np.sum(mm) for mm in model])
+
+        max_radius = (np.radians(max_kernel_radius)
+                      if max_kernel_radius is not None else None)
+        convolvers = []
+        for c, mm in zip(self.components, model):
+            nside, nest, ipix = hpx_utils.hpx_map_pixels(c.counts_map())
+            cpix = int(np.argmax(np.sum(mm, axis=0)))
+            convolvers += [HpxConvolver(nside, nest, ipix, mm, cpix,
+                                        threshold=threshold,
+                                        max_radius=max_radius,
+                                        method='disc')]
+
+        cmap = self.counts_map()
+        map_geom = cmap.geom.to_image()
+        nside, nest, ipix = hpx_utils.hpx_map_pixels(cmap)
+        vec = np.array(hp.pix2vec(nside, ipix, nest=nest)).T
+
+        if kwargs['map_skydir'] is not None:
+            map_skydir = kwargs['map_skydir']
+            if map_geom.coordsys == 'GAL':
+                lonlat = (map_skydir.galactic.l.deg, map_skydir.galactic.b.deg)
+            else:
+                lonlat = (map_skydir.icrs.ra.deg, map_skydir.icrs.dec.deg)
+            cosdist = np.dot(vec, hp.ang2vec(*lonlat, lonlat=True))
+            fit_mask = cosdist >= np.cos(np.radians(0.5 * kwargs['map_size']))
+        else:
+            fit_mask = np.ones(len(ipix), dtype=bool)
+
+        self.logger.log(loglevel, 'Fitting test source.')
+        ts_values = np.zeros(len(ipix))
+        amp_values = np.zeros(len(ipix))
+        results = _ts_values_newton_hpx(vec[fit_mask], counts, bkg,
+                                        convolvers, c0_map)
+        ts_values[fit_mask] = results[0]
+        amp_values[fit_mask] = results[1]
+
+        ts_map = HpxNDMap(map_geom, ts_values)
+        sqrt_ts_map = HpxNDMap(map_geom, ts_values**0.5)
+        npred_map = HpxNDMap(map_geom, amp_values * model_npred)
+        amp_map = HpxNDMap(map_geom, amp_values * src.get_norm())
+
+        o = {'name': utils.join_strings([prefix, modelname]),
+             'src_dict': copy.deepcopy(src_dict),
+             'file': None,
+             'ts': ts_map,
+             'sqrt_ts': sqrt_ts_map,
+             'npred': npred_map,
+             'amplitude': amp_map,
+             'loglike': -self.like(),
+             'config': kwargs
+             }
+
+        return o
+
 
 class TSCubeGenerator(object):
 
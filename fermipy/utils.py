@@ -5,6 +5,7 @@ import re
 import copy
 import tempfile
 import functools
+import hashlib
 from collections import OrderedDict
 import xml.etree.cElementTree as et
 import yaml
@@ -1602,11 +1603,9 @@ def make_cdisk_kernel(psf, sigma, npix, cdelt, xpix, ypix, psf_scale_fn=None,
     x = make_pixel_distance(npix, xpix, ypix)
     x *= cdelt
 
-    k = np.zeros((len(egy), npix, npix))
-    for i in range(len(egy)):
-        def fn(t): return psf.eval(i, t, scale_fn=psf_scale_fn)
-        psfc = convolve2d_disk(fn, dtheta, sigma)
-        k[i] = np.interp(np.ravel(x), dtheta, psfc).reshape(x.shape)
+    z = create_kernel_function_lookup(psf, convolve2d_disk, sigma, egy,
+                                      dtheta, psf_scale_fn)
+    k = interp_profiles(x, dtheta, z)
 
     if normalize:
         k /= (np.sum(k, axis=0)[np.newaxis, ...] * np.radians(cdelt) ** 2)
@@ -1635,11 +1634,9 @@ def make_cgauss_kernel(psf, sigma, npix, cdelt, xpix, ypix, psf_scale_fn=None,
     x = make_pixel_distance(npix, xpix, ypix)
     x *= cdelt
 
-    k = np.zeros((len(egy), npix, npix))
-    for i in range(len(egy)):
-        def fn(t): return psf.eval(i, t, scale_fn=psf_scale_fn)
-        psfc = convolve2d_gauss(fn, dtheta, sigma)
-        k[i] = np.interp(np.ravel(x), dtheta, psfc).reshape(x.shape)
+    z = create_kernel_function_lookup(psf, convolve2d_gauss, sigma, egy,
+                                      dtheta, psf_scale_fn)
+    k = interp_profiles(x, dtheta, z)
 
     if normalize:
         k /= (np.sum(k, axis=0)[np.newaxis, ...] * np.radians(cdelt) ** 2)
@@ -1647,6 +1644,39 @@ def make_cgauss_kernel(psf, sigma, npix, cdelt, xpix, ypix, psf_scale_fn=None,
     return k
 
 
+def interp_profiles(x, xp, fp):
+    """Evaluate a set of 1D profiles sampled on a common grid.  This
+    is equivalent to calling ``np.interp(x, xp, fp[i])`` for each
+    row of ``fp``.
+
+    Parameters
+    ----------
+    x : `~numpy.ndarray`
+        Evaluation points.
+
+    xp : `~numpy.ndarray`
+        Increasing array of sample points.
+
+    fp : `~numpy.ndarray`
+        N x M array of profile values.
+
+    Returns
+    -------
+    vals : `~numpy.ndarray`
+        Array with shape (N,) + x.shape.
+    """
+    x = np.asarray(x)
+    idx = np.clip(np.searchsorted(xp, x, side='right') - 1, 0, len(xp) - 2)
+    t = np.clip((x - xp[idx]) / (xp[idx + 1] - xp[idx]), 0.0, 1.0)
+    return (1.0 - t) * fp[:, idx] + t * fp[:, idx + 1]
+
+
+def array_key(x):
+    """Create a hashable key from the shape and contents of an array."""
+    x = np.ascontiguousarray(x, dtype=float)
+    return (x.shape, hashlib.sha1(x.tobytes()).hexdigest())
+
+
 def memoize(obj):
     obj.cache = {}
 
@@ -1660,6 +1690,39 @@ def memoize(obj):
     return memoizer
 
 
+def get_radial_kernel_extent(psf, sigma=None):
+    """Get the radial range over which a PSF-convolved radial kernel
+    is evaluated by `~fermipy.utils.make_radial_kernel`.
+
+    Parameters
+    ----------
+    psf : `~fermipy.irfs.PSFModel`
+
+    sigma : float
+        Width parameter of the convolving function in degrees.  None
+        for a point source.
+
+    Returns
+    -------
+    rmin : `~numpy.ndarray`
+        Angular scale vs. energy that sets the oversampling of the
+        kernel.
+
+    rmax : `~numpy.ndarray`
+        Radius vs. energy beyond which the kernel is truncated in
+        sparse mode.
+    """
+    r99 = psf.containment_angle(fraction=0.997)
+    r34 = psf.containment_angle(fraction=0.34)
+
+    rmin = np.maximum(r34 / 4., 0.01)
+    rmax = np.maximum(r99, 0.1)
+    if sigma is not None:
+        rmin = np.maximum(rmin, 0.5 * sigma)
+        rmax = np.maximum(rmax, 2.0 * r34 + 3.0 * sigma)
+    return rmin, rmax
+
+
 def make_radial_kernel(psf, fn, sigma, npix, cdelt, xpix, ypix, psf_scale_fn=None,
                        normalize=False, klims=None, sparse=False):
     """Make a kernel for a general radially symmetric 2D function.
@@ -1677,59 +1740,47 @@ def make_radial_kernel(psf, fn, sigma, npix, cdelt, xpix, ypix, psf_scale_fn=Non
     """
 
     if klims is None:
-        egy = psf.energies
-    else:
-        egy = psf.energies[klims[0]:klims[1] + 1]
+        klims = (0, len(psf.energies) - 1)
+    egy = psf.energies[klims[0]:klims[1] + 1]
     ang_dist = make_pixel_distance(npix, xpix, ypix) * cdelt
     max_ang_dist = np.max(ang_dist) + cdelt
-    #dtheta = np.linspace(0.0, (np.max(ang_dist) * 1.05)**0.5, 200)**2.0
-    # z = create_kernel_function_lookup(psf, fn, sigma, egy,
-    #                                  dtheta, psf_scale_fn)
 
     shape = (len(egy), npix, npix)
     k = np.zeros(shape)
 
-    r99 = psf.containment_angle(energies=egy, fraction=0.997)
-    r34 = psf.containment_angle(energies=egy, fraction=0.34)
-
-    rmin = np.maximum(r34 / 4., 0.01)
-    rmax = np.maximum(r99, 0.1)
-    if sigma is not None:
-        rmin = np.maximum(rmin, 0.5 * sigma)
-        rmax = np.maximum(rmax, 2.0 * r34 + 3.0 * sigma)
+    rmin, rmax = get_radial_kernel_extent(psf, sigma)
     rmax = np.minimum(rmax, max_ang_dist)
 
-    for i in range(len(egy)):
+    # Radial profiles for all energies are evaluated in a single call
+    if sparse:
+        dtheta = np.array([np.linspace(0.0, r**0.5, 100)**2.0
+                           for r in rmax])
+    else:
+        dtheta = np.linspace(0.0, max_ang_dist**0.5, 200)**2.0
+    z = create_kernel_function_lookup(psf, fn, sigma, psf.energies, dtheta,
+                                      psf_scale_fn)
+
+    for i in range(klims[0], klims[1] + 1):
 
         rebin = min(int(np.ceil(cdelt / rmin[i])), 8)
-        if sparse:
-            dtheta = np.linspace(0.0, rmax[i]**0.5, 100)**2.0
-        else:
-            dtheta = np.linspace(0.0, max_ang_dist**0.5, 200)**2.0
-
-        z = eval_radial_kernel(psf, fn, sigma, i, dtheta, psf_scale_fn)
         xdist = make_pixel_distance(npix * rebin,
                                     xpix * rebin + (rebin - 1.0) / 2.,
                                     ypix * rebin + (rebin - 1.0) / 2.)
         xdist *= cdelt / float(rebin)
-        #x = val_to_pix(dtheta, np.ravel(xdist))
 
         if sparse:
             m = np.ravel(xdist) < rmax[i]
             kk = np.zeros(xdist.size)
-            #kk[m] = map_coordinates(z, [x[m]], order=2, prefilter=False)
-            kk[m] = np.interp(np.ravel(xdist)[m], dtheta, z)
+            kk[m] = np.interp(np.ravel(xdist)[m], dtheta[i], z[i])
             kk = kk.reshape(xdist.shape)
         else:
-            kk = np.interp(np.ravel(xdist), dtheta, z).reshape(xdist.shape)
-            # kk = map_coordinates(z, [x], order=2,
-            #                     prefilter=False).reshape(xdist.shape)
+            kk = np.interp(np.ravel(xdist), dtheta, z[i]).reshape(xdist.shape)
 
         if rebin > 1:
             kk = sum_bins(kk, 0, rebin)
             kk = sum_bins(kk, 1, rebin)
 
-        k[i] = kk / float(rebin)**2
+        k[i - klims[0]] = kk / float(rebin)**2
 
     k = k.reshape((len(egy),) + ang_dist.shape)
     if normalize:
@@ -1747,19 +1798,62 @@ def eval_radial_kernel(psf, fn, sigma, idx, dtheta, psf_scale_fn):
                   dtheta, sigma)
 
 
-#@memoize
 def create_kernel_function_lookup(psf, fn, sigma, egy, dtheta, psf_scale_fn):
+    """Evaluate the radial profile of a PSF-convolved kernel for the
+    energies of a PSF model.  All energies are evaluated with a single
+    call to the kernel function and the result is memoized on the PSF
+    model for each combination of kernel function, width, scale
+    function, and radial grid.
 
-    z = np.zeros((len(egy), len(dtheta)))
-    for i in range(len(egy)):
+    Parameters
+    ----------
+    psf : `~fermipy.irfs.PSFModel`
 
-        if fn is None:
-            z[i] = psf.eval(i, dtheta, scale_fn=psf_scale_fn)
-        else:
-            z[i] = fn(lambda t: psf.eval(i, t, scale_fn=psf_scale_fn),
-                      dtheta, sigma)
+    fn : callable
+        Convolution function (e.g. `~fermipy.utils.convolve2d_disk`).
+        If None the profile of the PSF is returned.
+
+    sigma : float
+        Width parameter of the kernel function.
+
+    egy : `~numpy.ndarray`
+        Energies for which the profile is returned.  These must be a
+        subset of the energies of the PSF model.
+
+    dtheta : `~numpy.ndarray`
+        Radial grid in degrees.  This can either be a 1D array or a
+        2D array with a separate grid for each energy of the PSF
+        model.
+
+    psf_scale_fn : callable
+        Function that evaluates the PSF scaling function.
+    """
+    if psf_scale_fn is None:
+        psf_scale_fn = psf.scale_fn
+    key = ('kernel', fn, sigma, array_key(dtheta), psf_scale_fn)
+    z = psf.memoize(key, _eval_kernel_lookup, psf, fn, sigma, dtheta,
+                    psf_scale_fn)
+
+    egy = np.array(egy, ndmin=1)
+    idx = np.clip(np.searchsorted(psf.energies, egy), 0,
+                  len(psf.energies) - 1)
+    if not np.allclose(psf.energies[idx], egy, rtol=1E-6, atol=0.0):
+        raise ValueError('Energies are not a subset of the energies '
+                         'of the PSF model.')
+    return z[idx]
 
-    return z
+
+def _eval_kernel_lookup(psf, fn, sigma, dtheta, psf_scale_fn):
+
+    dtheta = np.array(dtheta, ndmin=1)
+    if dtheta.ndim == 1:
+        dtheta = dtheta[np.newaxis, :]
+
+    if fn is None:
+        return psf.eval_ebins(dtheta, scale_fn=psf_scale_fn)
+    else:
+        return fn(lambda t: psf.eval_ebins(t, scale_fn=psf_scale_fn),
+                  dtheta, sigma)
 
 
 def create_radial_spline(psf, fn, sigma, egy, dtheta, psf_scale_fn):
@@ -1791,13 +1885,10 @@ def make_psf_kernel(psf, npix, cdelt, xpix, ypix, psf_scale_fn=None, normalize=F
 
     """
 
-    egy = psf.energies
     x = make_pixel_distance(npix, xpix, ypix)
     x *= cdelt
 
-    k = np.zeros((len(egy), npix, npix))
-    for i in range(len(egy)):
-        k[i] = psf.eval(i, x, scale_fn=psf_scale_fn)
+    k = psf.eval_ebins(x[np.newaxis, ...], scale_fn=psf_scale_fn)
 
     if normalize:
         k /= (np.sum(k, axis=0)[np.newaxis, ...] * np.radians(cdelt) ** 2)
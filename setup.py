@@ -78,7 +78,7 @@ setup(
         'fermipy-file-archive = fermipy.jobs.file_archive:main_browse',
     ]},
     install_requires=[
-        'numpy >= 1.6.1',
+        'numpy >= 1.11',
         'astropy >= 1.2.1',
         'matplotlib >= 1.5.0',
         'scipy >= 0.14',